@@ -1,9 +1,28 @@
+import asyncio
 import json
+import logging
+import os
+import time
 
 # --- Importações do Projeto ---
-from config import model, generation_config
-from telegram_utils import send_telegram_message
+import cache
+import fast_path
+import function_calling
+import llm_resilience
+import metrics
+import rendering
+import tracing
+from catalog import EXAMES_POR_NOME, normalizar
+from config import generation_config
+from db import run_in_db_thread
+from llm_backends import create_backend
+from llm_resilience import LLMUnavailableError
+from llm_usage import USAGE, TurnUsage, usage_of
+from session_state import SessionState, Step
+from state_store import create_state_store
+from streaming import ReplyFieldStreamer, texto_do_pedaco
 from database_tools import (
+    descrever_itens,
     tool_obter_info_clinica, 
     tool_consultar_horarios_disponiveis, 
     tool_marcar_agendamento,
@@ -13,11 +32,33 @@ from database_tools import (
     tool_consultar_horarios_exames,  
     tool_marcar_exame,
     tool_listar_meus_exames_agendados,
-    tool_cancelar_exame
+    tool_cancelar_exame,
+    tool_proximos_horarios,
+    tool_proximos_horarios_exame
 )
 
-# --- Memória de Curto Prazo (Idêntica) ---
-CONVERSATION_STATE = {}
+logger = logging.getLogger(__name__)
+
+# --- Memória de Curto Prazo ---
+# Armazenamento plugável (memória LRU+TTL ou SQLite), ver state_store.py
+CONVERSATION_STATE = create_state_store()
+
+# --- Cache de Respostas de Perguntas Frequentes ---
+# Para as ferramentas de FAQ (sem efeito no estado da conversa) a resposta
+# final em linguagem natural também vai para o cache, junto com a versão das
+# tabelas lidas: "qual o endereço?" repetido não passa mais pelo Gemini.
+FAQ_TOOLS = {"tool_obter_info_clinica"}
+FAQ_TABELAS = ("info",)
+FAQ_ANSWERS = cache.VersionedCache("respostas_faq")
+
+
+def _consultar_faq(chave) -> tuple[str | None, tuple[int, ...]]:
+    """
+    Resposta de FAQ guardada (ou None) e as versões das tabelas lidas antes
+    dela (para guardar a resposta nova). Lê o banco: rodar com run_in_db_thread.
+    """
+    versoes_lidas = cache.versoes(FAQ_TABELAS)
+    return FAQ_ANSWERS.get(chave, FAQ_TABELAS), versoes_lidas
 
 # --- Mapeamento de Ferramentas (Idêntico) ---
 AVAILABLE_TOOLS = {
@@ -31,7 +72,27 @@ AVAILABLE_TOOLS = {
     "tool_marcar_exame": tool_marcar_exame,
     "tool_listar_meus_exames_agendados": tool_listar_meus_exames_agendados,
     "tool_cancelar_exame": tool_cancelar_exame,
+    "tool_proximos_horarios": tool_proximos_horarios,
+    "tool_proximos_horarios_exame": tool_proximos_horarios_exame,
 }
+# Ferramentas que escrevem no banco (recebem chave de idempotência)
+WRITE_TOOLS = {"tool_marcar_agendamento", "tool_cancelar_agendamento", "tool_marcar_exame", "tool_cancelar_exame"}
+# Próximos horários (availability.py): o "mais" continua pela listagem paginada,
+# que só aceita estes filtros (o cursor vem do resultado)
+FILTROS_DA_CONTINUACAO = {
+    "tool_proximos_horarios": ("especialidade", "medico", "data_fim"),
+    "tool_proximos_horarios_exame": ("tipo_exame", "data_fim"),
+}
+
+# --- Motor do Agente ---
+# "json": a IA responde no envelope JSON do SYSTEM_PROMPT (padrão)
+# "functions": chamadas de função nativas do Gemini (function_calling.py)
+AGENT_ENGINE = os.getenv("AGENT_ENGINE", "json").strip().lower()
+# No motor de funções, as escolhas de horário também são funções
+FUNCTION_TOOLS = {**AVAILABLE_TOOLS, **function_calling.SELECTION_TOOLS}
+# Respostas da IA que não puderam ser lidas (motor JSON; o de funções conta as suas)
+ESTATISTICAS = {"respostas_invalidas": 0}
+
 # --- PROMPT DE SISTEMA (Idêntico) ---
 SYSTEM_PROMPT = """
 [IDENTIDADE E OBJETIVO PRINCIPAL]
@@ -49,12 +110,14 @@ Você é um Agente de IA de processamento de linguagem natural. Seu trabalho é
 
 [FERRAMENTAS DISPONÍVEIS]
 * `tool_obter_info_clinica(topic: str)` (tópicos: 'endereco', 'horario_funcionamento', 'convenios_aceitos')
-* `tool_consultar_horarios_disponiveis(especialidade: str)` (Busca horários vagos por especialidade. Retorna uma lista formatada com [ID_HORARIO ...])
+* `tool_consultar_horarios_disponiveis(especialidade: str, medico: str = None, data_inicio: str = None, data_fim: str = None, cursor: str = None)` (Busca uma página de horários vagos por especialidade; filtros opcionais de médico e período 'AAAA-MM-DD'. Retorna uma lista formatada com [ID_HORARIO ...] e, se houver mais, termina com [MAIS: cursor=...]: para a próxima página, repita a chamada com esse `cursor`.)
+* `tool_proximos_horarios(especialidade: str, medico: str = None, a_partir_de: str = None, data_fim: str = None, quantidade: int = None)` (Próximos horários livres da especialidade a partir de agora ou de `a_partir_de` ('AAAA-MM-DD' ou 'AAAA-MM-DD HH:MM'), até o fim do dia `data_fim`; `quantidade` padrão 1. Use para "primeiro horário livre", "próximo horário depois das 14h", "algum cardiologista esta semana?". Mesmo formato da lista acima; o [MAIS: cursor=...] continua em `tool_consultar_horarios_disponiveis` com a especialidade, o médico, o `data_fim` e esse `cursor`.)
 * `tool_marcar_agendamento(horario_id: int, nome_paciente: str, telegram_chat_id: str)` (Efetiva o agendamento. Retorna "Sucesso" ou "Erro".)
 * `tool_listar_meus_agendamentos(telegram_chat_id: str)` (Busca agendamentos futuros do usuário. Retorna lista com [ID_AGENDAMENTO ...])
 * `tool_cancelar_agendamento(agendamento_id: int, telegram_chat_id: str)` (Cancela um agendamento pelo ID. Retorna "Sucesso" ou "Erro".)
 * `tool_consultar_exames_disponiveis()` (Lista os nomes dos exames simples disponíveis.)
-* `tool_consultar_horarios_exames(tipo_exame: str)` (Busca horários vagos para um exame. Retorna lista com [ID_HORARIO_EXAME ...])
+* `tool_consultar_horarios_exames(tipo_exame: str, data_inicio: str = None, data_fim: str = None, cursor: str = None)` (Busca uma página de horários vagos para um exame; período opcional 'AAAA-MM-DD'. Retorna lista com [ID_HORARIO_EXAME ...] e, se houver mais, [MAIS: cursor=...], como acima.)
+* `tool_proximos_horarios_exame(tipo_exame: str, a_partir_de: str = None, data_fim: str = None, quantidade: int = None)` (Próximos horários livres de um exame, como `tool_proximos_horarios`; o [MAIS: cursor=...] continua em `tool_consultar_horarios_exames`.)
 * `tool_marcar_exame(horario_exame_id: int, nome_paciente: str, telegram_chat_id: str)` (Efetiva o agendamento do exame. Retorna "Sucesso" ou "Erro".)
 * `tool_listar_meus_exames_agendados(telegram_chat_id: str)` (Busca agendamentos de EXAMES futuros do usuário. Retorna lista com [ID_AGENDAMENTO_EXAME ...])
 * `tool_cancelar_exame(agendamento_exame_id: int, telegram_chat_id: str)` (Cancela um agendamento de EXAME pelo ID. Retorna "Sucesso" ou "Erro".)
@@ -62,8 +125,10 @@ Você é um Agente de IA de processamento de linguagem natural. Seu trabalho é
 [FLUXO DE AGENDAMENTO (MULTI-ETAPAS)]
 1.  **Usuário pede para agendar (ex: "Quero marcar cardiologia"):**
     Sua ação: `EXECUTAR_FERRAMENTA` -> `tool_consultar_horarios_disponiveis(especialidade="...")`.
+    Se ele pedir o primeiro/próximo horário livre ou horários depois de uma data/hora: `tool_proximos_horarios(...)`.
 2.  **(RAG) Você recebe a lista de horários (ex: "Resultado: [ID 1: ...], [ID 2: ...]"):**
-    Sua ação: `RESPONDER_AO_USUARIO` -> Liste os horários *exatamente* como vieram, **incluindo os IDs**, e pergunte qual **ID do Horário** o usuário deseja.
+    Sua ação: `RESPONDER_AO_USUARIO` -> Liste os horários *exatamente* como vieram, **incluindo os IDs**, e pergunte qual **ID do Horário** o usuário deseja. Se vier [MAIS: ...], diga que há mais horários (não mostre o cursor).
+    Se o usuário pedir mais horários, outro médico ou outro período: `EXECUTAR_FERRAMENTA` -> a mesma ferramenta com o `cursor` (próxima página) ou os filtros pedidos.
 3.  **Usuário responde com o ID (ex: "ID 2" ou "Quero o horário 2"):**
     Sua ação: `RESPONDER_AO_USUARIO` -> Agradeça pela seleção do ID (extraia o `horario_id`) e pergunte o **nome completo** do paciente.
 4.  **Usuário responde com o nome (ex: "Norian Henrique"):**
@@ -89,7 +154,7 @@ Você é um Agente de IA de processamento de linguagem natural. Seu trabalho é
 3.  **Usuário escolheu o tipo de exame:**
     Sua ação: `EXECUTAR_FERRAMENTA` -> `tool_consultar_horarios_exames(tipo_exame="...")`.
 4.  **(RAG) Você recebe a lista de horários de exame (ex: "Resultado: [ID 10: ...], [ID 11: ...]"):**
-    Sua ação: `RESPONDER_AO_USUARIO` -> Liste os horários *exatamente* como vieram, **incluindo os IDs**, e pergunte qual **ID do Horário de Exame** o usuário deseja.
+    Sua ação: `RESPONDER_AO_USUARIO` -> Liste os horários *exatamente* como vieram, **incluindo os IDs**, e pergunte qual **ID do Horário de Exame** o usuário deseja. Mais horários ([MAIS: ...]): como no fluxo de agendamento.
 5.  **Usuário responde com o ID (ex: "ID 11"):**
     Sua ação: `RESPONDER_AO_USUARIO` -> Agradeça pela seleção do ID (extraia o `horario_exame_id`) e pergunte o **nome completo** do paciente.
 6.  **Usuário responde com o nome (ex: "Maria Souza"):**
@@ -125,82 +190,300 @@ Você é um Agente de IA de processamento de linguagem natural. Seu trabalho é
 }
 """
 
+# --- Modelo (criado UMA vez, com o SYSTEM_PROMPT como system_instruction) ---
+# O prompt de sistema não é mais reenviado no histórico a cada mensagem; com
+# GEMINI_CONTEXT_CACHE=1 ele fica no cache de contexto do Gemini. O backend
+# (Gemini, gravação ou replay local) vem de LLM_BACKEND (llm_backends.py).
+model = create_backend(SYSTEM_PROMPT)
+# Modelo do motor de funções: declarações geradas das assinaturas das ferramentas
+model_funcoes = (create_backend(function_calling.SYSTEM_PROMPT, tools=function_calling.tool_declarations(FUNCTION_TOOLS))
+                 if AGENT_ENGINE == "functions" else None)
+
 # --- FUNÇÃO PRINCIPAL DO AGENTE ---
 
-def handle_message(user_chat_id: str, user_message: str) -> str | None:
+async def handle_message_async(user_chat_id: str, user_message: str, idempotency_scope: str | None = None,
+                               on_delta=None) -> str | None:
     """
     Processa a mensagem do usuário e RETORNA a resposta do bot como string,
     ou None se não houver resposta direta (ex: erro interno).
+    `idempotency_scope` identifica a mensagem de origem (ex: a update_id do
+    Telegram): as reservas/cancelamentos do turno usam chaves derivadas dele,
+    então reprocessar a mesma mensagem não repete a escrita.
+    `on_delta`, se informado, é uma coroutine chamada com cada pedaço da
+    resposta final à medida que o Gemini o gera (streaming). O valor
+    retornado continua sendo a resposta completa e é ele que vale (respostas
+    sem IA, como o caminho rápido e o cache, não passam pelo `on_delta`).
+    Versão assíncrona: as chamadas ao Gemini usam o cliente async e as
+    ferramentas de banco rodam num pool limitado de threads, então uma
+    resposta lenta da IA não trava o event loop para os outros usuários.
+    """
+    # Mensagens simultâneas do MESMO chat são processadas uma de cada vez
+    # (evita que duas respostas leiam/gravem o estado ao mesmo tempo)
+    uso = TurnUsage()
+    fast_path.registrar_turno()
+    with tracing.start_trace("agent.turn", chat_id=str(user_chat_id), motor=AGENT_ENGINE, streaming=on_delta is not None) as turno:
+        async with CONVERSATION_STATE.lock(str(user_chat_id)):
+            try:
+                return await _process_message(user_chat_id, user_message, uso, idempotency_scope, on_delta)
+            finally:
+                turno.set(**uso.as_dict())
+                if uso.calls:
+                    USAGE.record(uso)
+                    logger.info("TOKENS (turno): %s", uso.as_dict())
+
+
+def _pedido_da_proxima_pagina(estado: SessionState, tool_name: str) -> str:
+    """Como pedir a próxima página de horários, se houver (a IA repete os parâmetros com o cursor)."""
+    pagina = estado.parametros_da_proxima_pagina()
+    if not pagina:
+        return ""
+    return f" Se ele pedir mais horários, chame {tool_name} com os parâmetros {json.dumps(pagina, ensure_ascii=False)}."
+
+
+async def _lista_mostrada(estado: SessionState) -> str:
+    """
+    A lista que o usuário viu, no formato da ferramenta, refeita a partir dos
+    IDs do estado (só quando a mensagem vai para a IA; o caminho rápido não precisa dela).
+    """
+    descricoes = await run_in_db_thread(descrever_itens, estado.lista, estado.ids)
+    if estado.lista == "exames":
+        return "; ".join(descricoes.values())
+    return "; ".join(f"[ID {item_id}: {descricao}]" for item_id, descricao in descricoes.items())
+
+
+async def _mensagem_com_contexto(state_key: str, current_state: SessionState | None, user_message: str) -> str:
+    """
+    Acrescenta à mensagem o contexto do estado salvo (IDs já escolhidos, listas
+    mostradas). Estados de um passo só (nome, escolha de cancelamento) são
+    apagados aqui: a IA vai concluir o fluxo neste turno.
+    """
+    augmented_message = user_message
+
+    if current_state:
+        logger.debug("MEMÓRIA: Estado encontrado: %s", current_state.step.name)
+        step = current_state.step
+
+        if step == Step.AWAITING_NAME:
+            horario_id = current_state.escolhido
+            augmented_message = f"[CONTEXTO: O usuário já escolheu o horario_id de consulta: {horario_id}. Esta mensagem é o NOME dele para o agendamento.] MENSAGEM DO USUÁRIO: {user_message}"
+            await CONVERSATION_STATE.delete_async(state_key)
+
+        elif step == Step.AWAITING_SLOT_CHOICE:
+            horarios_mostrados = await _lista_mostrada(current_state)
+            proxima_pagina = _pedido_da_proxima_pagina(current_state, "tool_consultar_horarios_disponiveis")
+            augmented_message = f"[CONTEXTO: O usuário está escolhendo um ID da lista de horários de consulta que você acabou de mostrar: '{horarios_mostrados}'.{proxima_pagina}] MENSAGEM DO USUÁRIO: {user_message}"
+
+        elif step == Step.AWAITING_CANCELLATION_CHOICE:
+            agendamentos_mostrados = await _lista_mostrada(current_state)
+            augmented_message = f"[CONTEXTO: O usuário está escolhendo um ID da lista de agendamentos para cancelar que você acabou de mostrar: '{agendamentos_mostrados}'.] MENSAGEM DO USUÁRIO: {user_message}"
+            await CONVERSATION_STATE.delete_async(state_key)
+
+        elif step == Step.AWAITING_EXAM_TYPE:
+            exames_mostrados = await _lista_mostrada(current_state)
+            augmented_message = f"[CONTEXTO: O usuário está escolhendo um tipo de exame da lista que você acabou de mostrar: '{exames_mostrados}'.] MENSAGEM DO USUÁRIO: {user_message}"
+
+        elif step == Step.AWAITING_EXAM_SLOT_CHOICE:
+            horarios_exame_mostrados = await _lista_mostrada(current_state)
+            tipo_exame_escolhido = current_state.tipo_exame
+            proxima_pagina = _pedido_da_proxima_pagina(current_state, "tool_consultar_horarios_exames")
+            augmented_message = f"[CONTEXTO: O usuário já escolheu o tipo de exame '{tipo_exame_escolhido}' e está escolhendo um ID da lista de horários de exame que você mostrou: '{horarios_exame_mostrados}'.{proxima_pagina}] MENSAGEM DO USUÁRIO: {user_message}"
+
+        elif step == Step.AWAITING_NAME_FOR_EXAM:
+            horario_exame_id = current_state.escolhido
+            tipo_exame_escolhido = current_state.tipo_exame
+            augmented_message = f"[CONTEXTO: O usuário já escolheu o tipo de exame '{tipo_exame_escolhido}' e o horario_exame_id: {horario_exame_id}. Esta mensagem é o NOME dele para o agendamento do exame.] MENSAGEM DO USUÁRIO: {user_message}"
+            await CONVERSATION_STATE.delete_async(state_key)
+
+        elif step == Step.AWAITING_EXAM_CANCELLATION_CHOICE:
+            agendamentos_exames_mostrados = await _lista_mostrada(current_state)
+            augmented_message = f"[CONTEXTO: O usuário está escolhendo um ID da lista de agendamentos de EXAME para cancelar que você acabou de mostrar: '{agendamentos_exames_mostrados}'.] MENSAGEM DO USUÁRIO: {user_message}"
+            await CONVERSATION_STATE.delete_async(state_key)
+
+    return augmented_message
+
+
+def _preparar_parametros(tool_name: str, tool_params: dict, state_key: str, idempotency_scope: str | None) -> dict:
+    """Parâmetros definidos pelo sistema (nunca pela IA): ID do chat e chave de idempotência."""
+    # --- INJEÇÃO DE PARÂMETROS (FINAL) ---
+    if tool_name in ["tool_marcar_agendamento", "tool_listar_meus_agendamentos", 
+                     "tool_cancelar_agendamento", "tool_marcar_exame", 
+                     "tool_listar_meus_exames_agendados", "tool_cancelar_exame"]:
+        tool_params["telegram_chat_id"] = state_key # Usa state_key que pode ser chat_id ou "web_user"
+
+    # Chave de idempotência das escritas: definida pelo sistema, nunca pela IA
+    tool_params.pop("idempotency_key", None)
+    if idempotency_scope and tool_name in WRITE_TOOLS:
+        tool_params["idempotency_key"] = f"{idempotency_scope}:{tool_name}"
+    return tool_params
+
+
+def _parametros_da_listagem(tool_name: str, tool_params: dict) -> dict:
+    """Parâmetros da listagem paginada que continua o resultado (o cursor é acrescentado depois)."""
+    filtros = FILTROS_DA_CONTINUACAO.get(tool_name)
+    if filtros is None:
+        return tool_params
+    return {nome: tool_params[nome] for nome in filtros if nome in tool_params}
+
+
+async def _salvar_estado_pos_ferramenta(state_key: str, tool_name: str, tool_params: dict, db_result) -> None:
+    """Guarda o próximo passo do fluxo conforme a ferramenta que acabou de rodar (só a etapa e os IDs)."""
+    if tool_name in ("tool_consultar_horarios_disponiveis", "tool_proximos_horarios"):
+        await CONVERSATION_STATE.set_async(state_key, fast_path.estado_da_lista(Step.AWAITING_SLOT_CHOICE, db_result,
+                                                                    _parametros_da_listagem(tool_name, tool_params)))
+        logger.debug("MEMÓRIA: Salvo estado 'AWAITING_SLOT_CHOICE'")
+    elif tool_name == "tool_listar_meus_agendamentos":
+        if "Você não possui agendamentos" not in db_result:
+            await CONVERSATION_STATE.set_async(state_key, fast_path.estado_da_lista(Step.AWAITING_CANCELLATION_CHOICE, db_result))
+            logger.debug("MEMÓRIA: Salvo estado 'AWAITING_CANCELLATION_CHOICE'")
+    elif tool_name == "tool_consultar_exames_disponiveis":
+         if "Não há tipos de exames cadastrados" not in db_result:
+            # A lista de exames é de nomes: guarda os IDs deles no catálogo
+            exame_ids = EXAMES_POR_NOME.ids_dos_nomes(db_result.split("; "))
+            await CONVERSATION_STATE.set_async(state_key, SessionState(Step.AWAITING_EXAM_TYPE, exame_ids))
+            logger.debug("MEMÓRIA: Salvo estado 'AWAITING_EXAM_TYPE'")
+    elif tool_name in ("tool_consultar_horarios_exames", "tool_proximos_horarios_exame"):
+         if "não encontramos horários disponíveis" not in db_result:
+            tipo_exame_escolhido = tool_params.get("tipo_exame", "Desconhecido") 
+            await CONVERSATION_STATE.set_async(state_key, fast_path.estado_da_lista(Step.AWAITING_EXAM_SLOT_CHOICE, db_result,
+                                                                        _parametros_da_listagem(tool_name, tool_params),
+                                                                        tipo_exame_escolhido))
+            logger.debug("MEMÓRIA: Salvo estado 'AWAITING_EXAM_SLOT_CHOICE' para o exame '%s'", tipo_exame_escolhido)
+    elif tool_name == "tool_listar_meus_exames_agendados":
+         if "Você não possui agendamentos de exames" not in db_result:
+            await CONVERSATION_STATE.set_async(state_key, fast_path.estado_da_lista(Step.AWAITING_EXAM_CANCELLATION_CHOICE, db_result))
+            logger.debug("MEMÓRIA: Salvo estado 'AWAITING_EXAM_CANCELLATION_CHOICE'")
+    # Motor de funções: a escolha do horário chega como função (no JSON vinha nas entidades)
+    elif tool_name == "tool_registrar_escolha_horario":
+        await CONVERSATION_STATE.set_async(state_key, SessionState(Step.AWAITING_NAME, escolhido=tool_params.get("horario_id")))
+        logger.debug("MEMÓRIA: Salvo estado 'AWAITING_NAME' para ID Consulta: %s", tool_params.get('horario_id'))
+    elif tool_name == "tool_registrar_escolha_horario_exame":
+        estado_atual = await CONVERSATION_STATE.get_async(state_key)
+        tipo_exame_context = estado_atual.tipo_exame if estado_atual else None
+        await CONVERSATION_STATE.set_async(state_key, SessionState(Step.AWAITING_NAME_FOR_EXAM, escolhido=tool_params.get("horario_exame_id"),
+                                                       tipo_exame=tipo_exame_context))
+        logger.debug("MEMÓRIA: Salvo estado 'AWAITING_NAME_FOR_EXAM' para ID Exame: %s", tool_params.get('horario_exame_id'))
+
+
+async def _enviar_ao_modelo(chat, mensagem: str, uso: TurnUsage, on_delta=None, etapa: str = "llm.call_1") -> str:
+    """
+    Envia a mensagem ao Gemini e retorna o JSON de resposta (texto). Com
+    `on_delta`, usa streaming e repassa a `resposta_para_usuario` conforme chega.
+    `etapa` é o nome do span desta chamada (llm.call_1 ou llm.call_2).
+    """
+    inicio = time.perf_counter()
+    with tracing.span(etapa, streaming=on_delta is not None) as registro:
+        try:
+            if on_delta is None:
+                response = await chat.send_message_async(mensagem, generation_config=generation_config)
+            else:
+                response = await chat.send_message_async(mensagem, generation_config=generation_config, stream=True)
+                streamer = ReplyFieldStreamer()
+                async for pedaco in response:
+                    novo = streamer.feed(texto_do_pedaco(pedaco))
+                    if novo:
+                        await on_delta(novo)
+        except Exception as e:
+            metrics.LLM_CALL_ERRORS.inc(etapa, type(e).__name__)
+            raise
+        uso.add(response)
+        uso_da_chamada = usage_of(response)
+        registro.set(**uso_da_chamada)
+        metrics.observe_llm_call(etapa, time.perf_counter() - inicio, uso_da_chamada)
+        return response.text if on_delta is None else streamer.texto
+
+
+async def _executar_ferramenta(tool_name: str, tool_params: dict):
+    """Roda a ferramenta numa thread de banco, dentro do span tool.execute."""
+    logger.debug("Executando Ferramenta: %s com params: %s", tool_name, tool_params)
+    with tracing.span("tool.execute", ferramenta=tool_name):
+        return await run_in_db_thread(FUNCTION_TOOLS[tool_name], **tool_params)
+
+
+async def _responder_com_funcoes(state_key: str, mensagem: str, uso: TurnUsage, idempotency_scope: str | None,
+                                 on_delta=None) -> str:
+    """Turno pelo motor de funções nativas (AGENT_ENGINE=functions)."""
+    async def executar(tool_name, tool_params):
+        tool_params = _preparar_parametros(tool_name, tool_params, state_key, idempotency_scope)
+        return tool_params, await _executar_ferramenta(tool_name, tool_params)
+
+    async def concluir(tool_name, tool_params, db_result):
+        await _salvar_estado_pos_ferramenta(state_key, tool_name, tool_params, db_result)
+        return rendering.render_tool_result(tool_name, tool_params, db_result)
+
+    return await function_calling.run_turn(model_funcoes, mensagem, uso, FUNCTION_TOOLS, executar, concluir, on_delta)
+
+
+async def _responder_sem_ia(state_key: str, current_state: SessionState | None, user_message: str) -> str:
     """
+    Resposta com a IA indisponível (circuito aberto ou prazo esgotado): dica
+    do passo atual do fluxo, pedido simples por palavra-chave (fast_path.py)
+    ou um aviso com o que ainda dá para fazer.
+    """
+    llm_resilience.contar("respostas_degradadas")
+    if current_state:
+        # Nenhuma ferramenta rodou neste turno: o passo do fluxo continua valendo
+        await CONVERSATION_STATE.set_async(state_key, current_state)
+        dica = fast_path.resposta_sem_ia_no_estado(current_state)
+        if dica:
+            return dica
+
+    rota = await run_in_db_thread(fast_path.rota_sem_ia, user_message)
+    if rota is None:
+        return fast_path.RESPOSTA_SEM_IA
+    tool_name, tool_params = rota
+    logger.info("MODO SEM IA: Executando Ferramenta: %s com params: %s", tool_name, tool_params)
+    db_result = await _executar_ferramenta(tool_name, tool_params)
+    await _salvar_estado_pos_ferramenta(state_key, tool_name, tool_params, db_result)
+    return rendering.render_without_llm(tool_name, tool_params, db_result)
+
+
+async def _process_message(user_chat_id: str, user_message: str, uso: TurnUsage, idempotency_scope: str | None = None,
+                           on_delta=None) -> str | None:
     final_bot_reply = None # Variável para guardar a resposta final
     try:
         # --- LÓGICA DE MEMÓRIA (FINAL) ---
         state_key = str(user_chat_id)
-        current_state = CONVERSATION_STATE.get(state_key)
-
-        augmented_message = user_message
-
-        # (Lógica if current_state... para adicionar contexto - IDÊNTICA À ANTERIOR)
-        if current_state:
-            print(f"--- MEMÓRIA: Estado encontrado: {current_state['state']} ---")
-            state = current_state['state']
-            context = current_state.get('context', {})
-
-            if state == 'AWAITING_NAME': 
-                horario_id = context.get('horario_id')
-                augmented_message = f"[CONTEXTO: O usuário já escolheu o horario_id de consulta: {horario_id}. Esta mensagem é o NOME dele para o agendamento.] MENSAGEM DO USUÁRIO: {user_message}"
-                del CONVERSATION_STATE[state_key]
-
-            elif state == 'AWAITING_SLOT_CHOICE':
-                horarios_mostrados = context.get('horarios_mostrados')
-                augmented_message = f"[CONTEXTO: O usuário está escolhendo um ID da lista de horários de consulta que você acabou de mostrar: '{horarios_mostrados}'.] MENSAGEM DO USUÁRIO: {user_message}"
-
-            elif state == 'AWAITING_CANCELLATION_CHOICE':
-                agendamentos_mostrados = context.get('agendamentos_mostrados')
-                augmented_message = f"[CONTEXTO: O usuário está escolhendo um ID da lista de agendamentos para cancelar que você acabou de mostrar: '{agendamentos_mostrados}'.] MENSAGEM DO USUÁRIO: {user_message}"
-                del CONVERSATION_STATE[state_key]
-
-            elif state == 'AWAITING_EXAM_TYPE':
-                exames_mostrados = context.get('exames_mostrados')
-                augmented_message = f"[CONTEXTO: O usuário está escolhendo um tipo de exame da lista que você acabou de mostrar: '{exames_mostrados}'.] MENSAGEM DO USUÁRIO: {user_message}"
-
-            elif state == 'AWAITING_EXAM_SLOT_CHOICE':
-                horarios_exame_mostrados = context.get('horarios_exame_mostrados')
-                tipo_exame_escolhido = context.get('tipo_exame')
-                augmented_message = f"[CONTEXTO: O usuário já escolheu o tipo de exame '{tipo_exame_escolhido}' e está escolhendo um ID da lista de horários de exame que você mostrou: '{horarios_exame_mostrados}'.] MENSAGEM DO USUÁRIO: {user_message}"
-
-            elif state == 'AWAITING_NAME_FOR_EXAM':
-                horario_exame_id = context.get('horario_exame_id')
-                tipo_exame_escolhido = context.get('tipo_exame')
-                augmented_message = f"[CONTEXTO: O usuário já escolheu o tipo de exame '{tipo_exame_escolhido}' e o horario_exame_id: {horario_exame_id}. Esta mensagem é o NOME dele para o agendamento do exame.] MENSAGEM DO USUÁRIO: {user_message}"
-                del CONVERSATION_STATE[state_key]
-
-            elif state == 'AWAITING_EXAM_CANCELLATION_CHOICE':
-                agendamentos_exames_mostrados = context.get('agendamentos_exames_mostrados')
-                augmented_message = f"[CONTEXTO: O usuário está escolhendo um ID da lista de agendamentos de EXAME para cancelar que você acabou de mostrar: '{agendamentos_exames_mostrados}'.] MENSAGEM DO USUÁRIO: {user_message}"
-                del CONVERSATION_STATE[state_key] 
-
-
-        print(f"--- Mensagem do Usuário Extraída (com contexto se houver) ---")
-        print(f"De Chat ID/User: {user_chat_id}") # Mudança pequena no log
-        print(f"Texto: {augmented_message}")
-        print("-----------------------------------")
+        with tracing.span("state.lookup") as registro:
+            current_state = await CONVERSATION_STATE.get_async(state_key)
+            registro.set(estado=current_state.step.name if current_state else None)
+
+        # --- CAMINHO RÁPIDO: escolhas de ID e nomes são resolvidos sem a IA ---
+        with tracing.span("fast_path") as registro:
+            fast_reply = await fast_path.try_fast_path(CONVERSATION_STATE, state_key, current_state, user_message, idempotency_scope)
+            registro.set(respondido=fast_reply is not None)
+        if fast_reply is not None:
+            return fast_reply
+
+        # --- CACHE DE FAQ: mesma pergunta (fora de um fluxo) já respondida ---
+        usar_cache_faq = cache.enabled(FAQ_ANSWERS.nome)
+        chave_mensagem = ("mensagem", " ".join(normalizar(user_message)))
+        if usar_cache_faq and not current_state:
+            resposta_faq = await run_in_db_thread(FAQ_ANSWERS.get, chave_mensagem, FAQ_TABELAS)
+            if resposta_faq is not None:
+                logger.debug("CACHE: Resposta de FAQ reaproveitada (sem IA)")
+                return resposta_faq
+
+        augmented_message = await _mensagem_com_contexto(state_key, current_state, user_message)
+
+        logger.debug("Mensagem do Usuário (com contexto se houver) - Chat ID/User: %s | Texto: %s", user_chat_id, augmented_message)
+
+        # --- MOTOR DE FUNÇÕES NATIVAS ---
+        if AGENT_ENGINE == "functions":
+            if not model_funcoes:
+                logger.error("Modelo do Gemini (motor de funções) não foi carregado.")
+                return "Desculpe, a inteligência artificial não está disponível no momento."
+            return await _responder_com_funcoes(state_key, augmented_message, uso, idempotency_scope, on_delta)
 
         # --- CÉREBRO (IDÊNTICO) ---
         if not model:
-            print("ERRO: Modelo do Gemini não foi carregado.")
+            logger.error("Modelo do Gemini não foi carregado.")
             return "Desculpe, a inteligência artificial não está disponível no momento."
 
-        print("Enviando para o Gemini (Chamada 1)...")
-        chat = model.start_chat(history=[
-            {"role": "user", "parts": [SYSTEM_PROMPT]},
-            {"role": "model", "parts": ["OK. Estou pronto para receber a mensagem do usuário."]}
-        ])
-        response = chat.send_message(augmented_message, generation_config=generation_config)
-        ai_json_response_str = response.text
-        print("--- Resposta JSON (Chamada 1) do Gemini Recebida ---")
-        print(ai_json_response_str)
-        print("--------------------------------------------------")
+        logger.debug("Enviando para o Gemini (Chamada 1)...")
+        # O SYSTEM_PROMPT já está no modelo: o chat começa vazio e só leva a mensagem do turno
+        chat = model.start_chat()
+        ai_json_response_str = await _enviar_ao_modelo(chat, augmented_message, uso, on_delta)
+        logger.debug("Resposta JSON (Chamada 1) do Gemini: %s", ai_json_response_str)
 
         # --- LÓGICA DE AÇÃO (RAG) (MODIFICADA PARA RETORNAR) ---
         try:
@@ -211,97 +494,109 @@ def handle_message(user_chat_id: str, user_message: str) -> str | None:
             resposta_texto = payload_acao.get("resposta_para_usuario")
 
             if action == "RESPONDER_AO_USUARIO":
-                print(f"--- Ação: Responder Diretamente ---")
+                logger.debug("Ação: Responder Diretamente")
                 final_bot_reply = resposta_texto # Guarda a resposta para retornar
 
                 # --- LÓGICA DE MEMÓRIA PÓS-RESPOSTA (FINAL) ---
                 # (Lógica if/elif para salvar estados - IDÊNTICA À ANTERIOR)
-                if "horario_id" in entidades and entidades["horario_id"] is not None and current_state and current_state['state'] == 'AWAITING_SLOT_CHOICE':
+                if "horario_id" in entidades and entidades["horario_id"] is not None and current_state and current_state.step == Step.AWAITING_SLOT_CHOICE:
                     horario_id_selecionado = entidades["horario_id"]
-                    CONVERSATION_STATE[state_key] = {"state": "AWAITING_NAME", "context": { "horario_id": horario_id_selecionado }}
-                    print(f"--- MEMÓRIA: Salvo estado 'AWAITING_NAME' para ID Consulta: {horario_id_selecionado} ---")
-                elif "horario_exame_id" in entidades and entidades["horario_exame_id"] is not None and current_state and current_state['state'] == 'AWAITING_EXAM_SLOT_CHOICE':
+                    await CONVERSATION_STATE.set_async(state_key, SessionState(Step.AWAITING_NAME, escolhido=horario_id_selecionado))
+                    logger.debug("MEMÓRIA: Salvo estado 'AWAITING_NAME' para ID Consulta: %s", horario_id_selecionado)
+                elif "horario_exame_id" in entidades and entidades["horario_exame_id"] is not None and current_state and current_state.step == Step.AWAITING_EXAM_SLOT_CHOICE:
                     horario_exame_id_selecionado = entidades["horario_exame_id"]
-                    tipo_exame_context = current_state.get('context', {}).get('tipo_exame') 
-                    CONVERSATION_STATE[state_key] = {"state": "AWAITING_NAME_FOR_EXAM", "context": { "horario_exame_id": horario_exame_id_selecionado,"tipo_exame": tipo_exame_context }}
-                    print(f"--- MEMÓRIA: Salvo estado 'AWAITING_NAME_FOR_EXAM' para ID Exame: {horario_exame_id_selecionado} ---")
+                    tipo_exame_context = current_state.tipo_exame
+                    await CONVERSATION_STATE.set_async(state_key, SessionState(Step.AWAITING_NAME_FOR_EXAM, escolhido=horario_exame_id_selecionado,
+                                                                   tipo_exame=tipo_exame_context))
+                    logger.debug("MEMÓRIA: Salvo estado 'AWAITING_NAME_FOR_EXAM' para ID Exame: %s", horario_exame_id_selecionado)
 
 
             elif action == "EXECUTAR_FERRAMENTA":
-                print("--- Ação: Executar Ferramenta (RAG) ---")
+                logger.debug("Ação: Executar Ferramenta (RAG)")
                 tool_request = payload_acao.get("ferramenta_solicitada", {})
                 tool_name = tool_request.get("nome")
                 tool_params = tool_request.get("parametros", {})
 
                 if tool_name and tool_name in AVAILABLE_TOOLS:
 
-                    # --- INJEÇÃO DE PARÂMETROS (FINAL) ---
-                    if tool_name in ["tool_marcar_agendamento", "tool_listar_meus_agendamentos", 
-                                     "tool_cancelar_agendamento", "tool_marcar_exame", 
-                                     "tool_listar_meus_exames_agendados", "tool_cancelar_exame"]:
-                        tool_params["telegram_chat_id"] = state_key # Usa state_key que pode ser chat_id ou "web_user"
-
-                    print(f"--- Executando Ferramenta: {tool_name} com params: {tool_params} ---")
-                    tool_function = AVAILABLE_TOOLS[tool_name]
-                    db_result = tool_function(**tool_params)
-
-                    # --- LÓGICA DE MEMÓRIA PÓS-FERRAMENTA (FINAL) ---
-                    # (Lógica if/elif para salvar estados - IDÊNTICA À ANTERIOR)
-                    if tool_name == "tool_consultar_horarios_disponiveis":
-                        CONVERSATION_STATE[state_key] = {"state": "AWAITING_SLOT_CHOICE", "context": { "horarios_mostrados": db_result }}
-                        print(f"--- MEMÓRIA: Salvo estado 'AWAITING_SLOT_CHOICE' ---")
-                    elif tool_name == "tool_listar_meus_agendamentos":
-                        if "Você não possui agendamentos" not in db_result:
-                            CONVERSATION_STATE[state_key] = {"state": "AWAITING_CANCELLATION_CHOICE", "context": { "agendamentos_mostrados": db_result }}
-                            print(f"--- MEMÓRIA: Salvo estado 'AWAITING_CANCELLATION_CHOICE' ---")
-                    elif tool_name == "tool_consultar_exames_disponiveis":
-                         if "Não há tipos de exames cadastrados" not in db_result:
-                            CONVERSATION_STATE[state_key] = {"state": "AWAITING_EXAM_TYPE", "context": { "exames_mostrados": db_result }}
-                            print(f"--- MEMÓRIA: Salvo estado 'AWAITING_EXAM_TYPE' ---")
-                    elif tool_name == "tool_consultar_horarios_exames":
-                         if "não encontramos horários disponíveis" not in db_result:
-                            tipo_exame_escolhido = tool_params.get("tipo_exame", "Desconhecido") 
-                            CONVERSATION_STATE[state_key] = {"state": "AWAITING_EXAM_SLOT_CHOICE", "context": { "horarios_exame_mostrados": db_result, "tipo_exame": tipo_exame_escolhido }}
-                            print(f"--- MEMÓRIA: Salvo estado 'AWAITING_EXAM_SLOT_CHOICE' para o exame '{tipo_exame_escolhido}' ---")
-                    elif tool_name == "tool_listar_meus_exames_agendados":
-                         if "Você não possui agendamentos de exames" not in db_result:
-                            CONVERSATION_STATE[state_key] = {"state": "AWAITING_EXAM_CANCELLATION_CHOICE", "context": { "agendamentos_exames_mostrados": db_result }}
-                            print(f"--- MEMÓRIA: Salvo estado 'AWAITING_EXAM_CANCELLATION_CHOICE' ---")
+                    tool_params = _preparar_parametros(tool_name, tool_params, state_key, idempotency_scope)
+
+                    # Mesma ferramenta de FAQ com os mesmos parâmetros: pula a Chamada 2
+                    eh_faq = usar_cache_faq and tool_name in FAQ_TOOLS
+                    if eh_faq:
+                        chave_ferramenta = ("ferramenta", tool_name, json.dumps(tool_params, sort_keys=True))
+                        resposta_faq, versoes_faq = await run_in_db_thread(_consultar_faq, chave_ferramenta)
+                        if resposta_faq is not None:
+                            logger.debug("CACHE: Resposta de FAQ reaproveitada (sem Chamada 2)")
+                            if not current_state:
+                                FAQ_ANSWERS.set(chave_mensagem, resposta_faq, FAQ_TABELAS, versoes_faq)
+                            return resposta_faq
+
+                    db_result = await _executar_ferramenta(tool_name, tool_params)
+
+                    await _salvar_estado_pos_ferramenta(state_key, tool_name, tool_params, db_result)
+
+                    # --- RESPOSTA POR TEMPLATE: resultado determinístico dispensa a Chamada 2 ---
+                    resposta_local = rendering.render_tool_result(tool_name, tool_params, db_result)
+                    if resposta_local is not None:
+                        logger.debug("RENDER: Resposta montada por template (sem Chamada 2)")
+                        if eh_faq and not current_state:
+                            FAQ_ANSWERS.set(chave_mensagem, resposta_local, FAQ_TABELAS, versoes_faq)
+                        return resposta_local
 
                     # --- CHAMADA 2 RAG (IDÊNTICO) ---
-                    print("--- Enviando para o Gemini (Chamada 2 - RAG)... ---")
+                    logger.debug("Enviando para o Gemini (Chamada 2 - RAG)...")
                     rag_prompt = f"OK, a ferramenta {tool_name} foi executada. O resultado é: '{db_result}'. Com base *apenas* nesse resultado, gere a resposta final para o usuário."
-                    response_rag = chat.send_message(rag_prompt, generation_config=generation_config)
-                    final_ai_json_str = response_rag.text
-                    print("--- Resposta JSON Final (RAG) do Gemini Recebida ---")
-                    print(final_ai_json_str)
-                    print("--------------------------------------------------")
+                    try:
+                        final_ai_json_str = await _enviar_ao_modelo(chat, rag_prompt, uso, on_delta, etapa="llm.call_2")
+                    except LLMUnavailableError as e:
+                        # A ferramenta já rodou: responde com o resultado dela, sem a IA
+                        logger.warning("IA INDISPONÍVEL na Chamada 2 (%s): resposta por template", e)
+                        llm_resilience.contar("respostas_degradadas")
+                        return rendering.render_without_llm(tool_name, tool_params, db_result)
+                    logger.debug("Resposta JSON Final (RAG) do Gemini: %s", final_ai_json_str)
 
                     final_ai_data = json.loads(final_ai_json_str)
 
                     if final_ai_data.get("acao_requerida") == "RESPONDER_AO_USUARIO":
                         final_response_text = final_ai_data["payload_acao"]["resposta_para_usuario"]
-                        print(f"--- Ação: Responder com dados do DB ---")
+                        logger.debug("Ação: Responder com dados do DB")
                         final_bot_reply = final_response_text # Guarda a resposta para retornar
+                        if eh_faq and final_bot_reply:
+                            FAQ_ANSWERS.set(chave_ferramenta, final_bot_reply, FAQ_TABELAS, versoes_faq)
+                            if not current_state:
+                                FAQ_ANSWERS.set(chave_mensagem, final_bot_reply, FAQ_TABELAS, versoes_faq)
                     else:
-                        print("ERRO RAG: A IA não gerou uma resposta final, mesmo após os dados do DB.")
+                        logger.error("RAG: A IA não gerou uma resposta final, mesmo após os dados do DB.")
                         final_bot_reply = "Desculpe, tive um problema ao processar sua solicitação após consultar os dados."
                 else:
-                    print(f"ERRO: A IA solicitou uma ferramenta desconhecida: {tool_name}")
+                    logger.error("A IA solicitou uma ferramenta desconhecida: %s", tool_name)
                     final_bot_reply = "Desculpe, a IA pediu uma ferramenta que eu não conheço."
             else:
-                print(f"Ação desconhecida recebida da IA: {action}")
+                logger.error("Ação desconhecida recebida da IA: %s", action)
                 final_bot_reply = f"Desculpe, recebi uma ação desconhecida ({action}) e não sei o que fazer."
 
         except json.JSONDecodeError:
-            print("ERRO FATAL: Gemini retornou um JSON inválido.")
-            print(ai_json_response_str) 
+            ESTATISTICAS["respostas_invalidas"] += 1
+            logger.error("Gemini retornou um JSON inválido: %s", ai_json_response_str)
             final_bot_reply = "Desculpe, a resposta da IA veio em um formato inválido."
 
         # --- RETORNA A RESPOSTA FINAL ---
         return final_bot_reply
 
+    except LLMUnavailableError as e:
+        logger.warning("IA INDISPONÍVEL (%s): respondendo sem a IA", e)
+        return await _responder_sem_ia(state_key, current_state, user_message)
+
     except Exception as e:
-        print(f"Erro inesperado na função handle_message: {e}")
+        logger.exception("Erro inesperado na função handle_message: %s", e)
         # Retorna uma mensagem de erro genérica
-        return "Desculpe, ocorreu um erro interno grave ao processar sua mensagem."
\ No newline at end of file
+        return "Desculpe, ocorreu um erro interno grave ao processar sua mensagem."
+
+
+def handle_message(user_chat_id: str, user_message: str) -> str | None:
+    """
+    Versão síncrona de `handle_message_async`, para scripts e código fora do
+    event loop (não chame de dentro de uma rota async).
+    """
+    return asyncio.run(handle_message_async(user_chat_id, user_message))
@@ -0,0 +1,206 @@
+import bisect
+import datetime
+import heapq
+import itertools
+import logging
+import os
+import threading
+from array import array
+from zoneinfo import ZoneInfo
+
+import booking
+from cache import versoes
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# --- Motor de Disponibilidade ---
+# Responde "próximos N horários livres a partir de T", "primeiro horário livre
+# com qualquer cardiologista esta semana" e "horários livres num período" sem
+# varrer a tabela. Os horários livres ficam em memória, em ordem de data/hora:
+#   * um array de chaves por recurso (médico/exame) e, nas consultas, um por
+#     especialidade (busca na especialidade inteira = uma busca binária só)
+#   * chave = segundos desde ORIGEM * LIMITE_ID + id do horário: um inteiro de
+#     8 bytes que ordena por (data/hora, id), o mesmo desempate do cursor das
+#     listagens paginadas (database_tools.py)
+# Cada busca é uma bisseção (O(log n)) por array consultado mais os horários
+# devolvidos. Depois que um índice é carregado, reservas e cancelamentos
+# (booking.py) o avisam depois do COMMIT e ele só insere/remove a chave (busca
+# binária + deslocamento do array); com a versão da tabela lida na mesma
+# transação ele percebe se perdeu alguma escrita (outro worker, geração de
+# horários em lote) e se refaz na próxima busca. Antes da primeira busca não
+# há aviso nenhum (nem a leitura extra na transação da reserva).
+# O "agora" é a hora local da clínica (FUSO_HORARIO), não a do servidor.
+
+# Fuso da clínica (ex: America/Sao_Paulo). Vazio: o do servidor
+FUSO_HORARIO = os.getenv("FUSO_HORARIO", "").strip()
+
+ORIGEM = datetime.datetime(2020, 1, 1)
+# IDs de horário até 2^31 cabem na chave junto com os segundos
+LIMITE_ID = 2 ** 31
+
+# Tabela de grupos de cada tipo (consulta: especialidade dos médicos; exame: cada exame é o seu grupo)
+GRUPOS = {
+    "consulta": ("medicos", "SELECT id, especialidade FROM medicos"),
+    "exame": None,
+}
+
+ESTATISTICAS = {"buscas": 0, "reconstrucoes": 0, "atualizacoes": 0, "escritas_perdidas": 0}
+_estatisticas_lock = threading.Lock()
+
+
+def _contar(chave: str) -> None:
+    with _estatisticas_lock:
+        ESTATISTICAS[chave] += 1
+
+
+def metrics() -> dict:
+    with _estatisticas_lock:
+        stats = dict(ESTATISTICAS)
+    stats["horarios_indexados"] = {tipo: len(indice) for tipo, indice in INDICES.items()}
+    return stats
+
+
+def agora() -> datetime.datetime:
+    """Data/hora atual na clínica, sem fuso (como as colunas data_hora_inicio)."""
+    if FUSO_HORARIO:
+        return datetime.datetime.now(ZoneInfo(FUSO_HORARIO)).replace(tzinfo=None, microsecond=0)
+    return datetime.datetime.now().replace(microsecond=0)
+
+
+def _chave(data_hora: datetime.datetime, horario_id: int = 0) -> int:
+    return (data_hora - ORIGEM) // datetime.timedelta(seconds=1) * LIMITE_ID + horario_id
+
+
+def _horario(chave: int) -> tuple[datetime.datetime, int]:
+    """Chave -> (data/hora, id do horário)."""
+    segundos, horario_id = divmod(chave, LIMITE_ID)
+    return ORIGEM + datetime.timedelta(seconds=segundos), horario_id
+
+
+class AvailabilityIndex:
+    """
+    Horários livres de um tipo (consulta/exame), por recurso e por grupo.
+    `buscar()` confere a versão das tabelas antes de responder e refaz o índice
+    se alguém escreveu sem avisar (como o CatalogIndex).
+    """
+
+    def __init__(self, tipo: str):
+        recurso = booking.RECURSOS[tipo]
+        self.tipo = tipo
+        self.tabela = recurso["tabela_horarios"]
+        self.sql_horarios = (
+            f"SELECT {recurso['coluna_recurso']}, data_hora_inicio, id FROM {self.tabela} "
+            f"WHERE status = 'disponivel' AND data_hora_inicio >= ?"
+        )
+        grupos = GRUPOS[tipo]
+        self.tabela_grupos, self.sql_grupos = grupos if grupos else (None, None)
+        self.tabelas = (self.tabela, self.tabela_grupos) if grupos else (self.tabela,)
+        self._por_recurso: dict[int, array] = {}
+        self._por_grupo: dict[str, array] = {}
+        self._grupo_do_recurso: dict[int, str] = {}
+        self._recursos_do_grupo: dict[str, frozenset[int]] = {}
+        self._versoes = None
+        self._lock = threading.Lock()
+
+    def _reconstruir(self, conn, versoes_lidas: tuple[int, ...]) -> None:
+        grupo_do_recurso = dict(conn.execute(self.sql_grupos).fetchall()) if self.sql_grupos else {}
+        chaves_por_recurso: dict[int, list[int]] = {}
+        for recurso_id, data_hora, horario_id in conn.execute(self.sql_horarios, (agora().isoformat(" "),)):
+            chaves_por_recurso.setdefault(recurso_id, []).append(
+                _chave(datetime.datetime.fromisoformat(data_hora), horario_id))
+        self._por_recurso = {recurso_id: array("q", sorted(chaves)) for recurso_id, chaves in chaves_por_recurso.items()}
+
+        recursos_do_grupo: dict[str, set[int]] = {}
+        for recurso_id, grupo in grupo_do_recurso.items():
+            recursos_do_grupo.setdefault(grupo, set()).add(recurso_id)
+        self._por_grupo = {
+            grupo: array("q", sorted(chave for recurso_id in recursos for chave in self._por_recurso.get(recurso_id, ())))
+            for grupo, recursos in recursos_do_grupo.items()
+        }
+        self._grupo_do_recurso = grupo_do_recurso
+        self._recursos_do_grupo = {grupo: frozenset(recursos) for grupo, recursos in recursos_do_grupo.items()}
+        self._versoes = versoes_lidas
+        _observar_reservas()
+        _contar("reconstrucoes")
+        logger.info("DISPONIBILIDADE: Índice de '%s' reconstruído (%s horários livres, versões %s)",
+                    self.tipo, len(self), versoes_lidas)
+
+    def _arrays(self, recurso_ids: list[int]) -> list[array]:
+        """O array do grupo, se os recursos forem exatamente um grupo inteiro; senão, um por recurso."""
+        grupos = {self._grupo_do_recurso.get(recurso_id) for recurso_id in recurso_ids}
+        if len(grupos) == 1:
+            grupo = grupos.pop()
+            if grupo is not None and self._recursos_do_grupo[grupo] == frozenset(recurso_ids):
+                return [self._por_grupo[grupo]]
+        return [self._por_recurso[recurso_id] for recurso_id in recurso_ids if recurso_id in self._por_recurso]
+
+    def buscar(self, recurso_ids: list[int], desde: datetime.datetime | None = None,
+               ate: datetime.datetime | None = None, limite: int = 1) -> list[tuple[datetime.datetime, int]]:
+        """
+        Até `limite` horários livres (data/hora, id) dos recursos, em ordem, de
+        `desde` (nunca antes de agora) até antes de `ate` (sem fim se None).
+        """
+        conn = get_connection()
+        atuais = versoes(self.tabelas)
+        inicio = _chave(max(desde, agora()) if desde else agora())
+        fim = _chave(ate) if ate else None
+        with self._lock:
+            if atuais != self._versoes:
+                self._reconstruir(conn, atuais)
+            fatias = []
+            for chaves in self._arrays(recurso_ids):
+                i = bisect.bisect_left(chaves, inicio)
+                j = len(chaves) if fim is None else bisect.bisect_left(chaves, fim, i)
+                fatias.append(chaves[i:min(j, i + limite)])
+        _contar("buscas")
+        return [_horario(chave) for chave in itertools.islice(heapq.merge(*fatias), limite)]
+
+    def atualizar(self, recurso_id: int, data_hora: str, horario_id: int, disponivel: bool, versao: int) -> None:
+        """Aplica uma reserva (disponivel=False) ou cancelamento já gravados; `versao` é a da tabela depois deles."""
+        with self._lock:
+            if self._versoes is None or versao <= self._versoes[0]:
+                # Nunca carregado, ou já refeito depois dessa escrita
+                return
+            if versao != self._versoes[0] + 1:
+                # Alguém escreveu entre a última versão conhecida e esta: refaz na próxima busca
+                self._versoes = None
+                _contar("escritas_perdidas")
+                return
+            chave = _chave(datetime.datetime.fromisoformat(data_hora), horario_id)
+            grupo = self._grupo_do_recurso.get(recurso_id)
+            arrays = [self._por_recurso.setdefault(recurso_id, array("q"))]
+            if grupo is not None:
+                arrays.append(self._por_grupo[grupo])
+            for chaves in arrays:
+                i = bisect.bisect_left(chaves, chave)
+                presente = i < len(chaves) and chaves[i] == chave
+                if disponivel and not presente:
+                    chaves.insert(i, chave)
+                elif not disponivel and presente:
+                    del chaves[i]
+            self._versoes = (versao,) + self._versoes[1:]
+        _contar("atualizacoes")
+
+    def __len__(self) -> int:
+        return sum(len(chaves) for chaves in self._por_recurso.values())
+
+
+# --- Índices usados pelas ferramentas ---
+CONSULTAS = AvailabilityIndex("consulta")
+EXAMES = AvailabilityIndex("exame")
+INDICES = {"consulta": CONSULTAS, "exame": EXAMES}
+
+
+_observador_lock = threading.Lock()
+
+
+def _ao_mudar_horario(tipo: str, recurso_id: int, data_hora: str, horario_id: int, disponivel: bool, versao: int) -> None:
+    INDICES[tipo].atualizar(recurso_id, data_hora, horario_id, disponivel, versao)
+
+
+def _observar_reservas() -> None:
+    """Passa a receber os avisos do booking.py (uma vez, quando o primeiro índice é carregado)."""
+    with _observador_lock:
+        if _ao_mudar_horario not in booking.OBSERVADORES:
+            booking.OBSERVADORES.append(_ao_mudar_horario)
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import random
+import time
+
+# --- Modelo "falso" para testes de carga ---
+# Imita a interface que o agent.py usa do Gemini (start_chat / send_message_async,
+# inclusive com stream=True) com uma latência configurável, sem rede e sem chave
+# de API. Com `tokens_por_segundo`, a latência sorteada é o tempo até o primeiro
+# token e o resto do texto sai nesse ritmo (~4 caracteres por token).
+# Com `funcoes=True` responde como o motor de funções nativas (function_call /
+# texto puro) em vez do envelope JSON. Cada resposta traz um `usage_metadata`
+# estimado (caracteres / 4), somando `tokens_de_sistema` ao prompt.
+
+CARACTERES_POR_TOKEN = 4
+
+# Entidades que o SYSTEM_PROMPT pede em toda resposta JSON
+ENTIDADES = ("especialidade", "topico", "horario_id", "nome_paciente", "agendamento_id",
+             "tipo_exame", "horario_exame_id", "agendamento_exame_id")
+
+
+def _tokens(texto: str) -> int:
+    return -(-len(texto) // CARACTERES_POR_TOKEN)
+
+
+def _resposta(acao: str, texto: str = "", ferramenta: str | None = None, parametros: dict | None = None) -> str:
+    intencao = "consulta_horarios" if ferramenta else "saudacao"
+    return json.dumps({
+        "status_processamento": "sucesso",
+        "intencao_detectada": intencao,
+        "entidades_extraidas": {entidade: None for entidade in ENTIDADES},
+        "acao_requerida": acao,
+        "payload_acao": {
+            "resposta_para_usuario": texto,
+            "ferramenta_solicitada": {"nome": ferramenta, "parametros": parametros or {}},
+        },
+        "log_para_desenvolvedor": f"Intenção '{intencao}' detectada; ação {acao}.",
+    }, ensure_ascii=False)
+
+
+def _decidir(mensagem: str) -> tuple[str, dict] | None:
+    """(ferramenta, parâmetros) que o modelo pediria para a mensagem, ou None (responde direto)."""
+    texto = mensagem.lower()
+    if "endere" in texto:
+        return "tool_obter_info_clinica", {"topic": "endereco"}
+    if "cancelar" in texto:
+        return ("tool_listar_meus_exames_agendados" if "exame" in texto else "tool_listar_meus_agendamentos"), {}
+    if "marcar exame" in texto:
+        return "tool_consultar_exames_disponiveis", {}
+    if "cardio" in texto:
+        return "tool_consultar_horarios_disponiveis", {"especialidade": "Cardiologia"}
+    return None
+
+
+def _resposta_final(resultado: str) -> str:
+    # Como o modelo real: repete o resultado da ferramenta e pergunta o ID
+    return f"Estes são os horários disponíveis:\n{resultado}\nQual ID você deseja?"
+
+
+class StubUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.cached_content_token_count = 0
+        self.candidates_token_count = candidates_token_count
+
+
+class StubFunctionCall:
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+
+class StubPart:
+    def __init__(self, text: str = "", function_call: StubFunctionCall | None = None):
+        self.text = text
+        self.function_call = function_call
+
+
+class StubResponse:
+    def __init__(self, text: str, parts: list[StubPart] | None = None, usage_metadata: StubUsage | None = None):
+        self.text = text
+        self.parts = parts if parts is not None else [StubPart(text)]
+        self.usage_metadata = usage_metadata
+
+
+class StubStream:
+    """Resposta com stream=True: iterar (async for) entrega os pedaços no ritmo do modelo."""
+
+    def __init__(self, modelo: "StubModel", resposta: StubResponse, gerado: str):
+        self.modelo = modelo
+        self.text = resposta.text
+        self.parts = resposta.parts
+        self.usage_metadata = resposta.usage_metadata
+        self._gerado = gerado
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.modelo.sortear_latencia())
+        if any(parte.function_call for parte in self.parts):
+            # Chamadas de função chegam inteiras, depois de geradas
+            await asyncio.sleep(self.modelo.tempo_de_geracao(self._gerado))
+            yield StubResponse("", self.parts)
+            return
+        for inicio in range(0, len(self.text), CARACTERES_POR_TOKEN):
+            if self.modelo.tokens_por_segundo:
+                await asyncio.sleep(1 / self.modelo.tokens_por_segundo)
+            yield StubResponse(self.text[inicio:inicio + CARACTERES_POR_TOKEN])
+
+
+class StubChat:
+    def __init__(self, modelo: "StubModel"):
+        self.modelo = modelo
+        self._historico = 0  # tokens já no histórico do chat (reenviados a cada chamada)
+
+    def _responder_json(self, mensagem: str) -> str:
+        if mensagem.startswith("OK, a ferramenta"):
+            resultado = mensagem.split("O resultado é: '", 1)[-1].rsplit("'. Com base", 1)[0]
+            return _resposta("RESPONDER_AO_USUARIO", _resposta_final(resultado))
+        pedido = _decidir(mensagem)
+        if pedido:
+            return _resposta("EXECUTAR_FERRAMENTA", ferramenta=pedido[0], parametros=pedido[1])
+        return _resposta("RESPONDER_AO_USUARIO", "Olá! Como posso ajudar?")
+
+    def _responder_funcoes(self, conteudo) -> tuple[StubResponse, str]:
+        if isinstance(conteudo, list):
+            # Resultados das funções: escreve a resposta final
+            resultados = "\n".join(str(p["function_response"]["response"]["resultado"]) for p in conteudo)
+            texto = _resposta_final(resultados)
+            return StubResponse(texto), texto
+        pedido = _decidir(conteudo)
+        if pedido:
+            parte = StubPart(function_call=StubFunctionCall(*pedido))
+            return StubResponse("", [parte]), json.dumps({"name": pedido[0], "args": pedido[1]})
+        texto = "Olá! Como posso ajudar?"
+        return StubResponse(texto), texto
+
+    def _gerar(self, conteudo) -> tuple[StubResponse, str]:
+        if self.modelo.funcoes:
+            resposta, gerado = self._responder_funcoes(conteudo)
+        else:
+            gerado = self._responder_json(conteudo)
+            resposta = StubResponse(gerado)
+        entrada = _tokens(json.dumps(conteudo, ensure_ascii=False) if isinstance(conteudo, list) else conteudo)
+        saida = _tokens(gerado)
+        resposta.usage_metadata = StubUsage(self.modelo.tokens_de_sistema + self._historico + entrada, saida)
+        self._historico += entrada + saida
+        return resposta, gerado
+
+    async def send_message_async(self, conteudo, stream: bool = False, **kwargs):
+        resposta, gerado = self._gerar(conteudo)
+        if stream:
+            return StubStream(self.modelo, resposta, gerado)
+        await asyncio.sleep(self.modelo.sortear_latencia() + self.modelo.tempo_de_geracao(gerado))
+        return resposta
+
+    def send_message(self, conteudo, **kwargs):
+        resposta, gerado = self._gerar(conteudo)
+        time.sleep(self.modelo.sortear_latencia() + self.modelo.tempo_de_geracao(gerado))
+        return resposta
+
+
+class StubModel:
+    """
+    Latência de cada chamada ~ uniforme entre min e max (segundos); com
+    `tokens_por_segundo`, somada ao tempo de gerar o texto nesse ritmo.
+    """
+
+    def __init__(self, latencia_min: float = 0.05, latencia_max: float = 0.15, tokens_por_segundo: float | None = None,
+                 funcoes: bool = False, tokens_de_sistema: int = 0):
+        self.latencia_min = latencia_min
+        self.latencia_max = latencia_max
+        self.tokens_por_segundo = tokens_por_segundo
+        self.funcoes = funcoes
+        self.tokens_de_sistema = tokens_de_sistema
+
+    def sortear_latencia(self) -> float:
+        return random.uniform(self.latencia_min, self.latencia_max)
+
+    def tempo_de_geracao(self, texto: str) -> float:
+        if not self.tokens_por_segundo:
+            return 0.0
+        return _tokens(texto) / self.tokens_por_segundo
+
+    def start_chat(self, history=None):
+        return StubChat(self)
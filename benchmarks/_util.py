@@ -0,0 +1,60 @@
+import contextlib
+import datetime
+import io
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+
+# Banco original do projeto (os benchmarks sempre trabalham numa cópia)
+ORIGINAL_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "clinic.db")
+# Os horários de exemplo do clinic.db são de 24 e 25/11/2025: nas cópias, o "agora"
+# da clínica fica fixo antes deles (os resultados não mudam com a data da execução)
+AGORA_DOS_EXEMPLOS = datetime.datetime(2025, 11, 24, 8, 0)
+
+
+def copiar_banco_temporario() -> str:
+    """
+    Copia o clinic.db para um diretório temporário, aplica as migrações
+    pendentes (como a subida do servidor faz), fixa o "agora" da clínica em
+    AGORA_DOS_EXEMPLOS e retorna o caminho da cópia.
+    """
+    import availability
+    from migrations import run_migrations
+
+    availability.agora = lambda: AGORA_DOS_EXEMPLOS
+
+    destino = os.path.join(tempfile.mkdtemp(prefix="clinic_bench_"), "clinic.db")
+    shutil.copyfile(ORIGINAL_DB, destino)
+    with silenciar():
+        run_migrations(destino)
+    return destino
+
+
+@contextlib.contextmanager
+def silenciar():
+    """Esconde os prints e logs das ferramentas para não distorcer as medições."""
+    nivel_anterior = logging.root.manager.disable
+    logging.disable(logging.CRITICAL)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logging.disable(nivel_anterior)
+
+
+def percentil(valores: list[float], p: float) -> float:
+    """Percentil simples (nearest-rank) de uma lista de valores."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def resumo_ms(amostras_s: list[float]) -> str:
+    """Formata média/p50/p99 de amostras (em segundos) como milissegundos."""
+    ms = [a * 1000 for a in amostras_s]
+    return (f"média {statistics.fmean(ms):.3f} ms | p50 {percentil(ms, 50):.3f} ms | "
+            f"p99 {percentil(ms, 99):.3f} ms")
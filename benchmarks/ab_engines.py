@@ -0,0 +1,109 @@
+"""
+A/B dos motores do agente: envelope JSON (AGENT_ENGINE=json) x chamadas de
+função nativas (AGENT_ENGINE=functions). Roda as mesmas conversas roteirizadas
+do fast_path_report nos dois motores, cada um num banco novo, e compara:
+  * chamadas ao modelo e tokens de prompt/saída (usage_metadata)
+  * latência por turno (p50/p99)
+  * respostas da IA que não puderam ser lidas (falhas de parse)
+
+Com o modelo falso, os tokens são estimados (caracteres / 4) e a saída é
+gerada a TOKENS_POR_SEGUNDO, então um envelope maior custa latência como no
+modelo real; falhas de parse só aparecem com a API de verdade. Com --real
+(e GEMINI_API_KEY no .env) usa o Gemini nos dois motores.
+
+Uso (na raiz do projeto):  python -m benchmarks.ab_engines [--real]
+"""
+import asyncio
+import json
+import sys
+import time
+
+import agent
+import cache
+import db
+import function_calling
+from benchmarks._stub_model import CARACTERES_POR_TOKEN, StubModel
+from benchmarks._util import copiar_banco_temporario, percentil, silenciar
+from benchmarks.fast_path_report import CONVERSAS, _primeiro_id_mostrado
+from config import create_model
+from llm_usage import USAGE
+
+# Mesmo perfil do bench_streaming: ~0,3-0,5 s até o 1º token, ~100 tokens/s
+TTFT_MIN, TTFT_MAX, TOKENS_POR_SEGUNDO = 0.3, 0.5, 100
+
+
+def _modelos_falsos() -> tuple[StubModel, StubModel]:
+    declaracoes = json.dumps(function_calling.tool_declarations(agent.FUNCTION_TOOLS), ensure_ascii=False)
+    json_model = StubModel(TTFT_MIN, TTFT_MAX, TOKENS_POR_SEGUNDO,
+                           tokens_de_sistema=len(agent.SYSTEM_PROMPT) // CARACTERES_POR_TOKEN)
+    funcoes_model = StubModel(TTFT_MIN, TTFT_MAX, TOKENS_POR_SEGUNDO, funcoes=True,
+                              tokens_de_sistema=len(function_calling.SYSTEM_PROMPT + declaracoes) // CARACTERES_POR_TOKEN)
+    return json_model, funcoes_model
+
+
+async def _conversa(indice: int, conversa: list[str], prefixo: str, latencias: list[float]) -> None:
+    session_id = f"{prefixo}_{indice}"
+    for mensagem in conversa + (["Quero cancelar minha consulta", "{id}"] if indice < 2 else []):
+        if "{id}" in mensagem:
+            mensagem = mensagem.replace("{id}", _primeiro_id_mostrado(session_id))
+        inicio = time.perf_counter()
+        await agent.handle_message_async(session_id, mensagem)
+        latencias.append(time.perf_counter() - inicio)
+
+
+def _rodar_motor(motor: str) -> dict:
+    """Roda as conversas (em paralelo, uma sessão cada) num banco novo com o motor dado."""
+    db.set_database_file(copiar_banco_temporario())
+    for cache_de_resultados in cache.CACHES.values():
+        cache_de_resultados.clear()
+    agent.AGENT_ENGINE = motor
+    agent.ESTATISTICAS["respostas_invalidas"] = 0
+    function_calling.ESTATISTICAS.update(turnos=0, chamadas_de_funcao=0, respostas_paralelas=0, respostas_invalidas=0)
+
+    antes = USAGE.summary()
+    latencias = []
+
+    async def todas():
+        await asyncio.gather(*(_conversa(i, c, f"ab_{motor}", latencias) for i, c in enumerate(CONVERSAS)))
+
+    with silenciar():
+        asyncio.run(todas())
+    depois = USAGE.summary()
+
+    invalidas = (function_calling.ESTATISTICAS["respostas_invalidas"] if motor == "functions"
+                 else agent.ESTATISTICAS["respostas_invalidas"])
+    return {
+        "turnos": len(latencias),
+        "chamadas": depois["calls"] - antes["calls"],
+        "prompt_tokens": depois["prompt_tokens"] - antes["prompt_tokens"],
+        "output_tokens": depois["output_tokens"] - antes["output_tokens"],
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+        "invalidas": invalidas,
+    }
+
+
+def main_benchmark(real: bool = False):
+    if real:
+        agent.model = create_model(agent.SYSTEM_PROMPT)
+        agent.model_funcoes = create_model(function_calling.SYSTEM_PROMPT,
+                                           tools=function_calling.tool_declarations(agent.FUNCTION_TOOLS))
+        if not (agent.model and agent.model_funcoes):
+            sys.exit("ERRO: --real precisa da GEMINI_API_KEY no .env.")
+        print("modelo: Gemini (API real)\n")
+    else:
+        agent.model, agent.model_funcoes = _modelos_falsos()
+        print(f"modelo falso: 1º token em {TTFT_MIN}-{TTFT_MAX}s, {TOKENS_POR_SEGUNDO} tokens/s (tokens estimados)\n")
+
+    print(f"{'motor':>9} | {'turnos':>6} | {'chamadas':>8} | {'prompt tok':>10} | {'saída tok':>9} | "
+          f"{'saída/chamada':>13} | {'p50':>7} | {'p99':>7} | {'falhas de parse':>15}")
+    for motor in ("json", "functions"):
+        r = _rodar_motor(motor)
+        por_chamada = r["output_tokens"] / r["chamadas"] if r["chamadas"] else 0.0
+        print(f"{motor:>9} | {r['turnos']:>6} | {r['chamadas']:>8} | {r['prompt_tokens']:>10} | {r['output_tokens']:>9} | "
+              f"{por_chamada:>13.1f} | {r['p50_ms']:>5.0f}ms | {r['p99_ms']:>5.0f}ms | "
+              f"{r['invalidas']:>3} ({r['invalidas'] / r['turnos']:.1%})")
+
+
+if __name__ == "__main__":
+    main_benchmark(real="--real" in sys.argv[1:])
@@ -0,0 +1,122 @@
+"""
+Motor de disponibilidade (availability.py) num calendário grande (muitos
+médicos na mesma especialidade, meses de agenda gerados pelo schedules.py):
+  * buscas: primeiro horário livre da especialidade, próximos 10 depois de uma
+    data/hora no meio do período, primeiro horário de um médico só e os
+    horários de um dia; pelo SQL da listagem paginada (sem cache) e pelo
+    índice em memória (busca pura e a ferramenta inteira, com as descrições)
+  * escala: a mesma busca com calendários de tamanhos diferentes (o índice
+    não deve crescer com o número de horários)
+  * índice: tempo para carregar, bytes por horário e custo de cada
+    reserva/cancelamento aplicado no índice
+
+Uso (na raiz do projeto):  python -m benchmarks.bench_availability [medicos] [dias]
+"""
+import datetime
+import json
+import sys
+import time
+import tracemalloc
+
+import availability
+import database_tools
+import db
+from benchmarks.bench_slot_generation import _banco_com_agendas
+from benchmarks.bench_slot_listing import _medir
+from benchmarks._util import silenciar
+from schedules import gerar_horarios
+
+ESPECIALIDADE = "Clínica Geral"
+ATUALIZACOES = 2_000
+
+
+def _sql(medico_ids: list[int], desde: datetime.datetime, ate: datetime.datetime | None, limite: int):
+    """A mesma busca pela consulta da listagem paginada (SQL_HORARIOS_POR_MEDICOS)."""
+    fim = ate.isoformat(" ") if ate else database_tools.SEM_FIM
+    return db.get_connection().execute(database_tools.SQL_HORARIOS_POR_MEDICOS, (
+        json.dumps(medico_ids), desde.isoformat(" "), desde.isoformat(" "), 0, fim, limite, limite)).fetchall()
+
+
+def _calendario(medicos: int, dias: int) -> None:
+    _banco_com_agendas(medicos)
+    with silenciar():
+        gerar_horarios(dias)
+
+
+def _buscas(medicos: int, dias: int) -> None:
+    _calendario(medicos, dias)
+    medico_ids = database_tools.MEDICOS_POR_ESPECIALIDADE.resolver(ESPECIALIDADE)
+    agora = availability.agora()
+    meio = agora + datetime.timedelta(days=dias // 2, hours=3)
+    fim_da_semana = datetime.datetime.combine(agora.date() + datetime.timedelta(days=7 - agora.weekday()), datetime.time())
+    dia = datetime.datetime.combine(meio.date(), datetime.time())
+    total = db.get_connection().execute("SELECT COUNT(*) FROM horarios_disponiveis").fetchone()[0]
+    print(f"{medicos} médicos de {ESPECIALIDADE}, {dias} dias, {total} horários livres\n")
+
+    casos = {
+        "primeiro da especialidade": (medico_ids, agora, None, 1, {}),
+        "10 depois de T (meio)": (medico_ids, meio, None, 10, {"a_partir_de": meio.isoformat(" "), "quantidade": 10}),
+        "primeiro esta semana, 1 médico": (medico_ids[:1], agora, fim_da_semana, 1,
+                                           {"medico": "Médico 0", "data_fim": (fim_da_semana.date() - datetime.timedelta(days=1)).isoformat()}),
+        "horários de um dia (até 10)": (medico_ids, dia, dia + datetime.timedelta(days=1), 10,
+                                        {"a_partir_de": dia.date().isoformat(), "data_fim": dia.date().isoformat(), "quantidade": 10}),
+    }
+    print(f"{'busca':>32} | {'SQL (ms)':>9} | {'índice (ms)':>11} | {'ferramenta (ms)':>15} | {'iguais':>6}")
+    for nome, (ids, desde, ate, limite, parametros) in casos.items():
+        ms_sql, linhas = _medir(lambda: _sql(ids, desde, ate, limite))
+        ms_indice, horarios = _medir(lambda: availability.CONSULTAS.buscar(ids, desde, ate, limite))
+        ms_ferramenta, _ = _medir(lambda: database_tools.tool_proximos_horarios(ESPECIALIDADE, **parametros))
+        iguais = [horario_id for _, horario_id, *_ in linhas] == [horario_id for _, horario_id in horarios]
+        print(f"{nome:>32} | {ms_sql:>9.3f} | {ms_indice:>11.3f} | {ms_ferramenta:>15.3f} | {'sim' if iguais else 'NÃO':>6}")
+
+
+def _escala(medicos: int) -> None:
+    print(f"\n{'dias':>6} | {'horários':>9} | {'10 depois de T, SQL (ms)':>24} | {'índice (ms)':>11}")
+    for dias in (30, 90, 180, 365):
+        _calendario(medicos, dias)
+        medico_ids = database_tools.MEDICOS_POR_ESPECIALIDADE.resolver(ESPECIALIDADE)
+        meio = availability.agora() + datetime.timedelta(days=dias // 2, hours=3)
+        availability.CONSULTAS.buscar(medico_ids)
+        ms_sql, _ = _medir(lambda: _sql(medico_ids, meio, None, 10))
+        ms_indice, _ = _medir(lambda: availability.CONSULTAS.buscar(medico_ids, meio, None, 10))
+        print(f"{dias:>6} | {len(availability.CONSULTAS):>9} | {ms_sql:>24.3f} | {ms_indice:>11.3f}")
+
+
+def _indice(medicos: int, dias: int) -> None:
+    _calendario(medicos, dias)
+    medico_ids = database_tools.MEDICOS_POR_ESPECIALIDADE.resolver(ESPECIALIDADE)
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    availability.CONSULTAS.buscar(medico_ids)
+    carga = time.perf_counter() - inicio
+    memoria = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    horarios = len(availability.CONSULTAS)
+
+    # Reserva + cancelamento como o booking.py avisa (versão seguinte da tabela a cada um)
+    alvos = availability.CONSULTAS.buscar(medico_ids, None, None, ATUALIZACOES // 2)
+    medico_do_horario = dict(db.get_connection().execute(
+        "SELECT id, medico_id FROM horarios_disponiveis WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps([horario_id for _, horario_id in alvos]),)).fetchall())
+    versao = availability.CONSULTAS._versoes[0]
+    inicio = time.perf_counter()
+    for disponivel in (False, True):
+        for data_hora, horario_id in alvos:
+            versao += 1
+            availability.CONSULTAS.atualizar(medico_do_horario[horario_id], data_hora.isoformat(" "), horario_id,
+                                             disponivel, versao)
+    por_atualizacao = (time.perf_counter() - inicio) / (2 * len(alvos)) * 1_000_000
+    print(f"\níndice: {horarios} horários carregados em {carga * 1000:.0f} ms, "
+          f"{memoria / horarios:.1f} bytes/horário (recurso + especialidade), "
+          f"{por_atualizacao:.1f} µs por reserva/cancelamento aplicado")
+
+
+def main(medicos: int = 50, dias: int = 90):
+    _buscas(medicos, dias)
+    _escala(medicos)
+    _indice(medicos, dias)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 90)
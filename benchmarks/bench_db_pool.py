@@ -0,0 +1,90 @@
+"""
+Compara a latência das ferramentas de leitura abrindo uma conexão nova a cada
+chamada (comportamento antigo) contra o pool de conexões do db.py, com e sem
+o cache versionado (cache.py).
+
+Uso (na raiz do projeto):  python -m benchmarks.bench_db_pool [iteracoes]
+"""
+import sqlite3
+import sys
+import time
+
+import db
+import database_tools
+from benchmarks._util import copiar_banco_temporario, resumo_ms, silenciar
+
+
+# --- Versão "antes": uma conexão por chamada, como as ferramentas faziam ---
+def _antes_info(path: str, topic: str):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM info WHERE topic = ?", (topic,))
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
+
+def _antes_horarios(path: str, especialidade: str):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT h.id, m.nome, h.data_hora_inicio
+        FROM horarios_disponiveis h
+        JOIN medicos m ON h.medico_id = m.id
+        WHERE LOWER(m.especialidade) LIKE LOWER(?) AND h.status = 'disponivel'
+        ORDER BY h.data_hora_inicio;
+        """,
+        ('%' + especialidade + '%',),
+    )
+    resultados = cursor.fetchall()
+    conn.close()
+    return resultados
+
+
+def _medir(funcao, iteracoes: int) -> list[float]:
+    amostras = []
+    for _ in range(iteracoes):
+        inicio = time.perf_counter()
+        funcao()
+        amostras.append(time.perf_counter() - inicio)
+    return amostras
+
+
+def main(iteracoes: int = 2000):
+    path = copiar_banco_temporario()
+    db.set_database_file(path)
+
+    # __wrapped__ é a ferramenta sem o @cached_tool
+    info = database_tools.tool_obter_info_clinica
+    horarios = database_tools.tool_consultar_horarios_disponiveis
+    cenarios = [
+        ("tool_obter_info_clinica",
+         lambda: _antes_info(path, "endereco"),
+         lambda: info.__wrapped__("endereco"),
+         lambda: info("endereco")),
+        ("tool_consultar_horarios_disponiveis",
+         lambda: _antes_horarios(path, "cardio"),
+         lambda: horarios.__wrapped__("cardio"),
+         lambda: horarios("cardio")),
+    ]
+
+    print(f"Banco: {path} | {iteracoes} chamadas por cenário")
+    with silenciar():
+        # Aquece o pool (a primeira chamada abre e configura a conexão)
+        database_tools.tool_obter_info_clinica("endereco")
+        resultados = [(nome, _medir(antes, iteracoes), _medir(depois, iteracoes), _medir(com_cache, iteracoes))
+                      for nome, antes, depois, com_cache in cenarios]
+
+    for nome, antes, depois, com_cache in resultados:
+        print(f"\n{nome}")
+        print(f"  antes (conexão por chamada): {resumo_ms(antes)}")
+        print(f"  depois (pool):               {resumo_ms(depois)}")
+        print(f"  pool + cache:                {resumo_ms(com_cache)}")
+        print(f"  ganho médio: {sum(antes) / sum(depois):.1f}x (pool), {sum(antes) / sum(com_cache):.1f}x (pool + cache)")
+
+    db.close_all()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,151 @@
+"""
+Compara as duas formas de receber atualizações do Telegram, ponta a ponta
+(atualização criada -> resposta entregue no sendMessage), contra o servidor
+falso da Bot API e o agente com o modelo falso:
+  * webhook: o "Telegram" faz POST em /webhook/telegram (uvicorn de verdade),
+    com até 40 conexões como o Telegram real, cada chat sempre na mesma conexão
+  * polling: polling.TelegramPoller busca lotes com getUpdates
+Todas as atualizações são criadas de uma vez (rajada) no início da medição.
+
+Uso (na raiz do projeto):  python -m benchmarks.bench_ingestion [chats] [mensagens_por_chat]
+"""
+import os
+
+# Limites de envio altos: aqui se mede a entrada, não os limites do Telegram
+os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "100000")
+os.environ.setdefault("TELEGRAM_CHAT_RATE", "100000")
+
+import asyncio
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import uvicorn
+
+import agent
+import db
+import main
+from benchmarks._stub_model import StubModel
+from benchmarks._util import copiar_banco_temporario, percentil, silenciar
+from benchmarks.fake_telegram import FakeTelegram
+from polling import TelegramPoller
+
+CONEXOES_WEBHOOK = 40  # max_connections padrão do setWebhook
+PRAZO_SECONDS = 120
+
+
+def _fake(primeiro_update_id: int) -> FakeTelegram:
+    fake = FakeTelegram(limite_chat=10**6, limite_global=10**6, primeiro_update_id=primeiro_update_id)
+    main.DISPATCHER.api_base = fake.api_base
+    main.DISPATCHER.token = "TESTE"
+    return fake
+
+
+def _publicar(fake: FakeTelegram, chats: int, por_chat: int) -> dict[str, list[float]]:
+    """Cria a rajada de atualizações; retorna os instantes de criação por chat."""
+    criadas: dict[str, list[float]] = {f"chat_{c}": [] for c in range(chats)}
+    for i in range(por_chat):
+        for c in range(chats):
+            criadas[f"chat_{c}"].append(time.perf_counter())
+            fake.publicar(f"chat_{c}", f"Olá {i}")
+    return criadas
+
+
+def _entregues(fake: FakeTelegram) -> int:
+    # O despachante pode agrupar várias respostas do mesmo chat num envio
+    return sum(len(texto.split("\n\n")) for _, texto in fake.recebidas)
+
+
+def _latencias(fake: FakeTelegram, criadas: dict[str, list[float]]) -> list[float]:
+    """A k-ésima resposta de um chat corresponde à k-ésima mensagem dele (ordem por chat)."""
+    respostas: dict[str, list[float]] = {chat: [] for chat in criadas}
+    for (chat, texto), instante in zip(fake.recebidas, fake.recebidas_em):
+        respostas[chat].extend([instante] * len(texto.split("\n\n")))
+    return [r - c for chat in criadas for c, r in zip(criadas[chat], respostas[chat])]
+
+
+def _esperar_entregas(fake: FakeTelegram, total: int) -> None:
+    prazo = time.monotonic() + PRAZO_SECONDS
+    while _entregues(fake) < total and time.monotonic() < prazo:
+        time.sleep(0.005)
+
+
+def _via_webhook(chats: int, por_chat: int) -> tuple[float, list[float], int]:
+    total = chats * por_chat
+    with _fake(primeiro_update_id=1) as fake:
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        url = f"http://127.0.0.1:{sock.getsockname()[1]}/webhook/telegram"
+        server = uvicorn.Server(uvicorn.Config(main.app, log_level="warning"))
+        thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.01)
+
+        inicio = time.perf_counter()
+        criadas = _publicar(fake, chats, por_chat)
+        updates = list(fake._updates)
+
+        def conexao(indice: int) -> int:
+            session = requests.Session()
+            enviados = 0
+            for update in updates:
+                if int(update["message"]["chat"]["id"].split("_")[1]) % CONEXOES_WEBHOOK == indice:
+                    session.post(url, json=update).raise_for_status()
+                    enviados += 1
+            return enviados
+
+        with ThreadPoolExecutor(max_workers=CONEXOES_WEBHOOK) as pool:
+            chamadas = sum(pool.map(conexao, range(CONEXOES_WEBHOOK)))
+        _esperar_entregas(fake, total)
+        duracao = time.perf_counter() - inicio
+        server.should_exit = True
+        thread.join()
+        return duracao, _latencias(fake, criadas), chamadas
+
+
+async def _rodar_polling(fake: FakeTelegram, chats: int, por_chat: int):
+    main.DISPATCHER.start()
+    main.WEBHOOK_QUEUE.start()
+    poller = TelegramPoller(main.WEBHOOK_QUEUE, main.UPDATE_DEDUP, token="TESTE", api_base=fake.api_base, timeout=1)
+    poller.start()
+    await asyncio.sleep(0.2)  # o poller já está esperando no getUpdates
+
+    inicio = time.perf_counter()
+    criadas = _publicar(fake, chats, por_chat)
+    await asyncio.to_thread(_esperar_entregas, fake, chats * por_chat)
+    duracao = time.perf_counter() - inicio
+
+    await poller.stop()
+    await main.WEBHOOK_QUEUE.stop()
+    await main.DISPATCHER.stop()
+    return duracao, criadas, poller.metrics()
+
+
+def _via_polling(chats: int, por_chat: int) -> tuple[float, list[float], int]:
+    with _fake(primeiro_update_id=10**6) as fake:
+        duracao, criadas, stats = asyncio.run(_rodar_polling(fake, chats, por_chat))
+        return duracao, _latencias(fake, criadas), stats["chamadas"]
+
+
+def main_benchmark(chats: int = 50, por_chat: int = 4):
+    db.set_database_file(copiar_banco_temporario())
+    agent.model = StubModel(0.02, 0.05)
+    total = chats * por_chat
+    print(f"{total} atualizações de {chats} chats (rajada), {main.WEBHOOK_QUEUE.workers} workers na fila\n")
+    print(f"{'modo':>8} | {'tempo (s)':>9} | {'upd/s':>7} | {'p50 (ms)':>9} | {'p99 (ms)':>9} | {'HTTP de entrada':>15}")
+    for nome, rodar in (("webhook", _via_webhook), ("polling", _via_polling)):
+        with silenciar():
+            duracao, latencias, chamadas = rodar(chats, por_chat)
+        ms = [l * 1000 for l in latencias]
+        completo = "" if len(ms) == total else f"  (só {len(ms)}/{total} respondidas)"
+        print(f"{nome:>8} | {duracao:>9.2f} | {total / duracao:>7.1f} | {percentil(ms, 50):>9.1f} | "
+              f"{percentil(ms, 99):>9.1f} | {chamadas:>15}{completo}")
+
+
+if __name__ == "__main__":
+    argumentos = [int(a) for a in sys.argv[1:3]]
+    main_benchmark(*argumentos)
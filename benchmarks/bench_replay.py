@@ -0,0 +1,120 @@
+"""
+Benchmark do agente (handle_message) totalmente offline, com o backend de
+replay (llm_backends.py): as respostas da IA vêm de um arquivo gravado,
+achadas pelo hash do prompt, com latência sorteada de uma distribuição.
+
+  gravar: roda os roteiros uma vez e grava as respostas da IA. Usa o Gemini
+          se houver GEMINI_API_KEY; sem chave, grava as do modelo falso.
+  (padrão): reproduz as gravações e mede
+    * regressão: as conversas do fast_path_report em sequência; o resumo
+      (hash) das respostas só muda se o comportamento do agente mudar, e
+      "faltas" contam prompts que mudaram desde a gravação
+    * vazão: req/s e p50/p99 com N sessões concorrentes
+
+Uso (na raiz do projeto):
+  python -m benchmarks.bench_replay gravar [arquivo]
+  python -m benchmarks.bench_replay [arquivo] [sessoes] [latencia]   (ex: 100 "lognormal:0.6,0.4")
+"""
+import asyncio
+import hashlib
+import os
+import sys
+import time
+
+import agent
+import cache
+import db
+import llm_backends
+from benchmarks._stub_model import StubModel
+from benchmarks._util import copiar_banco_temporario, percentil, silenciar
+from benchmarks.fast_path_report import CONVERSAS, _primeiro_id_mostrado
+from config import create_model
+from llm_backends import GeminiBackend, LatencyDistribution, RecordingBackend, ReplayBackend
+
+# Sessões da medição de vazão: só leituras, então todas veem os mesmos prompts
+MENSAGENS_VAZAO = ["Olá", "Quero marcar cardiologia", "Qual o endereço da clínica?", "pode ser o 1 ou o 2?"]
+
+
+async def _conversas_em_sequencia(prefixo: str) -> list[str]:
+    respostas = []
+    for indice, conversa in enumerate(CONVERSAS):
+        session_id = f"{prefixo}_{indice}"
+        for mensagem in conversa + (["Quero cancelar minha consulta", "{id}"] if indice < 2 else []):
+            if "{id}" in mensagem:
+                mensagem = mensagem.replace("{id}", _primeiro_id_mostrado(session_id))
+            respostas.append(await agent.handle_message_async(session_id, mensagem))
+    return respostas
+
+
+async def _sessao_de_vazao(session_id: str, latencias: list[float]) -> None:
+    for mensagem in MENSAGENS_VAZAO:
+        inicio = time.perf_counter()
+        await agent.handle_message_async(session_id, mensagem)
+        latencias.append(time.perf_counter() - inicio)
+
+
+def _banco_novo() -> None:
+    db.set_database_file(copiar_banco_temporario())
+    for cache_de_resultados in cache.CACHES.values():
+        cache_de_resultados.clear()
+
+
+def gravar(arquivo: str) -> None:
+    gemini = create_model(agent.SYSTEM_PROMPT)
+    origem = "Gemini" if gemini else "modelo falso (sem GEMINI_API_KEY)"
+    if os.path.exists(arquivo):
+        os.remove(arquivo)
+    agent.model = RecordingBackend(GeminiBackend(gemini or StubModel(0.0, 0.0), agent.SYSTEM_PROMPT), arquivo)
+
+    _banco_novo()
+    with silenciar():
+        asyncio.run(_conversas_em_sequencia("replay"))
+        latencias = []
+        asyncio.run(_sessao_de_vazao("vazao", latencias))
+    print(f"{llm_backends.metrics()['gravadas']} respostas do {origem} gravadas em {arquivo}")
+
+
+def reproduzir(arquivo: str, sessoes: int, latencia: str) -> None:
+    with silenciar():
+        agent.model = ReplayBackend(agent.SYSTEM_PROMPT, arquivo=arquivo, latencia=LatencyDistribution(latencia, seed="0"))
+    if not agent.model.gravacoes:
+        sys.exit(f"ERRO: Nenhuma gravação em {arquivo}. Rode antes: python -m benchmarks.bench_replay gravar")
+    print(f"{len(agent.model.gravacoes)} respostas gravadas ({arquivo}) | latência da IA: {latencia}\n")
+
+    # Regressão: sem latência, em sequência, num banco novo
+    latencia_original = agent.model.latencia
+    agent.model.latencia = LatencyDistribution("fixed:0")
+    _banco_novo()
+    with silenciar():
+        respostas = asyncio.run(_conversas_em_sequencia("replay"))
+    stats = llm_backends.metrics()
+    resumo = hashlib.sha256("\n".join(map(str, respostas)).encode("utf-8")).hexdigest()[:16]
+    print(f"regressão: {len(respostas)} turnos | resumo das respostas {resumo} | "
+          f"gravações usadas {stats['acertos']} | faltas {stats['faltas']}")
+
+    # Vazão: N sessões concorrentes com a latência configurada
+    agent.model.latencia = latencia_original
+    llm_backends.ESTATISTICAS.update(acertos=0, faltas=0)
+    latencias = []
+
+    async def todas():
+        await asyncio.gather(*(_sessao_de_vazao(f"vazao_{i}", latencias) for i in range(sessoes)))
+
+    inicio = time.perf_counter()
+    with silenciar():
+        asyncio.run(todas())
+    duracao = time.perf_counter() - inicio
+    ms = [l * 1000 for l in latencias]
+    stats = llm_backends.metrics()
+    print(f"vazão: {sessoes} sessões | {len(latencias) / duracao:.1f} req/s | p50 {percentil(ms, 50):.0f} ms | "
+          f"p99 {percentil(ms, 99):.0f} ms | faltas {stats['faltas']}")
+
+
+if __name__ == "__main__":
+    argumentos = sys.argv[1:]
+    if argumentos and argumentos[0] == "gravar":
+        gravar(argumentos[1] if len(argumentos) > 1 else llm_backends.LLM_REPLAY_FILE)
+    else:
+        reproduzir(argumentos[0] if argumentos else llm_backends.LLM_REPLAY_FILE,
+                   int(argumentos[1]) if len(argumentos) > 1 else 100,
+                   argumentos[2] if len(argumentos) > 2 else llm_backends.LLM_REPLAY_LATENCY)
@@ -0,0 +1,100 @@
+"""
+Efeito do llm_resilience.py com falhas injetadas no modelo falso:
+  * cauda lenta: 5% das chamadas demoram 8 s (hedge depois do p95)
+  * fora do ar: toda chamada fica pendurada (prazo + circuit breaker)
+Para cada cenário, compara o modelo sem proteção com o ResilientBackend:
+p50/p99 por mensagem, respostas sem IA e estado final do circuito.
+
+Uso (na raiz do projeto):  python -m benchmarks.bench_resilience [mensagens]
+"""
+import asyncio
+import random
+import sys
+import time
+
+import agent
+import db
+import llm_resilience
+from benchmarks._stub_model import StubModel
+from benchmarks._util import copiar_banco_temporario, percentil, silenciar
+
+CENARIOS = {"cauda lenta": (0.05, 8.0), "fora do ar": (1.0, 60.0)}
+# Prazo das mensagens sem proteção (no servidor elas ficariam penduradas)
+PRAZO_SEM_PROTECAO = 10.0
+
+
+class FaultyStubModel(StubModel):
+    """Modelo falso em que uma fração das chamadas demora `atraso` segundos a mais."""
+
+    def __init__(self, fracao_lenta: float, atraso: float):
+        super().__init__(0.2, 0.4)
+        self.fracao_lenta = fracao_lenta
+        self.atraso = atraso
+
+    def start_chat(self, history=None):
+        chat = super().start_chat(history)
+        enviar = chat.send_message_async
+
+        async def send_message_async(conteudo, **kwargs):
+            if random.random() < self.fracao_lenta:
+                await asyncio.sleep(self.atraso)
+            return await enviar(conteudo, **kwargs)
+
+        chat.send_message_async = send_message_async
+        return chat
+
+
+async def _mensagem(indice: int, latencias: list[float], degradadas: list[int]) -> None:
+    inicio = time.perf_counter()
+    try:
+        resposta = await asyncio.wait_for(agent.handle_message_async(f"resiliencia_{indice}", "Olá"), PRAZO_SEM_PROTECAO)
+    except asyncio.TimeoutError:
+        resposta = None
+    latencias.append(time.perf_counter() - inicio)
+    if resposta is None or "instabilidade" in resposta:
+        degradadas.append(indice)
+
+
+def _rodar(modelo, mensagens: int) -> tuple[list[float], int]:
+    agent.model = modelo
+    latencias, degradadas = [], []
+
+    async def todas():
+        # Chegadas espalhadas (~50 msg/s), como usuários reais
+        tarefas = []
+        for indice in range(mensagens):
+            tarefas.append(asyncio.create_task(_mensagem(indice, latencias, degradadas)))
+            await asyncio.sleep(0.02)
+        await asyncio.gather(*tarefas)
+
+    with silenciar():
+        asyncio.run(todas())
+    return latencias, len(degradadas)
+
+
+def main_benchmark(mensagens: int = 300):
+    db.set_database_file(copiar_banco_temporario())
+    llm_resilience.LLM_HEDGE_ENABLED = True
+    llm_resilience.LLM_CALL_TIMEOUT_SECONDS = 2.0
+    llm_resilience.LLM_CALL_DEADLINE_SECONDS = 4.0
+    print(f"{mensagens} mensagens por rodada | sem proteção: corte em {PRAZO_SEM_PROTECAO:.0f}s | com proteção: "
+          f"prazo {llm_resilience.LLM_CALL_TIMEOUT_SECONDS:.0f}s por tentativa, hedge no p95\n")
+    print(f"{'cenário':>11} | {'backend':>13} | {'p50':>7} | {'p99':>7} | {'sem IA / sem resposta':>21} | circuito")
+    for cenario, (fracao, atraso) in CENARIOS.items():
+        for nome in ("sem proteção", "resiliente"):
+            modelo = FaultyStubModel(fracao, atraso)
+            if nome == "resiliente":
+                llm_resilience.BREAKER.registrar_sucesso()
+                llm_resilience.LATENCIAS._amostras.clear()
+                modelo = llm_resilience.ResilientBackend(modelo)
+            latencias, degradadas = _rodar(modelo, mensagens)
+            circuito = llm_resilience.BREAKER.metrics()["estado"] if nome == "resiliente" else "-"
+            print(f"{cenario:>11} | {nome:>13} | {percentil(latencias, 50) * 1000:>5.0f}ms | "
+                  f"{percentil(latencias, 99) * 1000:>5.0f}ms | {degradadas:>21} | {circuito}")
+    stats = llm_resilience.metrics()
+    print(f"\nhedges: {stats['hedges']} ({stats['hedges_vencedores']} venceram) | timeouts: {stats['timeouts']} | "
+          f"rejeitadas pelo circuito: {stats['rejeitadas_pelo_circuito']} | aberturas: {stats['circuito']['aberturas']}")
+
+
+if __name__ == "__main__":
+    main_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
@@ -0,0 +1,166 @@
+"""
+Memória do estado das conversas com muitas sessões ativas ao mesmo tempo
+(MemoryStateStore cheio, etapas misturadas como num dia de atendimento):
+  * texto mostrado: o dicionário de antes, com a lista que o bot mostrou
+    (uma página de horários) guardada como texto
+  * IDs em dicionário: o dicionário com a lista de IDs e a próxima página
+  * SessionState: a etapa e os IDs num objeto com __slots__ (session_state.py)
+Para cada forma: bytes por sessão na memória (tracemalloc, só o estado, sem a
+chave e a entrada do LRU) e bytes por sessão gravados pelo SQLiteStateStore.
+No fim, quanto custa refazer do banco o texto de uma página pelos IDs (o que o
+agente faz quando a mensagem vai para a IA).
+
+Uso (na raiz do projeto):  python -m benchmarks.bench_session_state [sessoes]
+"""
+import gc
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import db
+from benchmarks._util import copiar_banco_temporario, silenciar
+from database_tools import HORARIOS_POR_PAGINA, descrever_itens
+from session_state import SessionState, Step
+from state_store import MemoryStateStore
+
+# Etapas e seu peso na mistura de sessões ativas
+MISTURA = {
+    Step.AWAITING_SLOT_CHOICE: 40,
+    Step.AWAITING_EXAM_SLOT_CHOICE: 15,
+    Step.AWAITING_CANCELLATION_CHOICE: 10,
+    Step.AWAITING_EXAM_CANCELLATION_CHOICE: 5,
+    Step.AWAITING_EXAM_TYPE: 10,
+    Step.AWAITING_NAME: 15,
+    Step.AWAITING_NAME_FOR_EXAM: 5,
+}
+ESPECIALIDADES = ["Cardiologia", "Dermatologia", "Clínica Geral", "Pediatria"]
+EXAMES = ["Exame de Sangue", "Check-up Geral", "Raio-X", "Ultrassom"]
+MEDICOS = ["Dra. Ana Silva", "Dr. Bruno Costa", "Dra. Carla Souza", "Dr. Diego Lima"]
+# Nome da lista no dicionário de antes, por etapa
+CHAVE_DO_TEXTO = {
+    Step.AWAITING_SLOT_CHOICE: "horarios_mostrados",
+    Step.AWAITING_EXAM_SLOT_CHOICE: "horarios_exame_mostrados",
+    Step.AWAITING_CANCELLATION_CHOICE: "agendamentos_mostrados",
+    Step.AWAITING_EXAM_CANCELLATION_CHOICE: "agendamentos_exames_mostrados",
+    Step.AWAITING_EXAM_TYPE: "exames_mostrados",
+}
+REPETICOES_RENDER = 200
+
+
+def _sessao(sorteio: random.Random) -> dict:
+    """O que uma sessão tem guardado, sorteado (a mesma sequência para as três formas)."""
+    step = sorteio.choices(list(MISTURA), weights=list(MISTURA.values()))[0]
+    sessao = {"step": step, "ids": [], "escolhido": None, "tipo_exame": None, "pagina": None}
+    if step in (Step.AWAITING_SLOT_CHOICE, Step.AWAITING_EXAM_SLOT_CHOICE):
+        primeiro = sorteio.randrange(1, 500_000)
+        sessao["ids"] = list(range(primeiro, primeiro + HORARIOS_POR_PAGINA))
+        filtro = ({"especialidade": sorteio.choice(ESPECIALIDADES)} if step == Step.AWAITING_SLOT_CHOICE
+                  else {"tipo_exame": sorteio.choice(EXAMES)})
+        sessao["pagina"] = {**filtro, "cursor": f"2025-12-{sorteio.randrange(1, 29):02d} 10:00:00#{primeiro + 9}"}
+    elif step in (Step.AWAITING_CANCELLATION_CHOICE, Step.AWAITING_EXAM_CANCELLATION_CHOICE):
+        sessao["ids"] = sorted(sorteio.sample(range(1, 200_000), sorteio.randint(1, 3)))
+    elif step == Step.AWAITING_EXAM_TYPE:
+        sessao["ids"] = list(range(1, len(EXAMES) + 1))
+    else:
+        sessao["escolhido"] = sorteio.randrange(1, 500_000)
+    if step in (Step.AWAITING_EXAM_SLOT_CHOICE, Step.AWAITING_NAME_FOR_EXAM):
+        sessao["tipo_exame"] = (sessao["pagina"] or {}).get("tipo_exame") or sorteio.choice(EXAMES)
+    return sessao
+
+
+def _texto(sessao: dict) -> str:
+    """A lista como a ferramenta mostrava ("[ID 1: Dra. Ana Silva - 2025-11-24 09:00:00]; ...")."""
+    if sessao["step"] == Step.AWAITING_EXAM_TYPE:
+        return "; ".join(EXAMES)
+    return "; ".join(f"[ID {item_id}: {MEDICOS[item_id % len(MEDICOS)]} - 2025-12-01 {8 + item_id % 10:02d}:00:00]"
+                     for item_id in sessao["ids"])
+
+
+def _como_texto(sessao: dict):
+    contexto = {}
+    if sessao["ids"]:
+        contexto[CHAVE_DO_TEXTO[sessao["step"]]] = _texto(sessao)
+    if sessao["escolhido"] is not None:
+        contexto["horario_id"] = sessao["escolhido"]
+    if sessao["tipo_exame"]:
+        contexto["tipo_exame"] = sessao["tipo_exame"]
+    return {"state": sessao["step"].name, "context": contexto}
+
+
+def _como_ids_em_dicionario(sessao: dict):
+    contexto = {}
+    if sessao["ids"]:
+        contexto["ids"] = list(sessao["ids"])
+    if sessao["pagina"]:
+        contexto["proxima_pagina"] = dict(sessao["pagina"])
+    if sessao["escolhido"] is not None:
+        contexto["horario_id"] = sessao["escolhido"]
+    if sessao["tipo_exame"]:
+        contexto["tipo_exame"] = sessao["tipo_exame"]
+    return {"state": sessao["step"].name, "context": contexto}
+
+
+def _como_session_state(sessao: dict):
+    return SessionState(sessao["step"], sessao["ids"], sessao["escolhido"], sessao["tipo_exame"], sessao["pagina"])
+
+
+def _serializado(estado) -> str:
+    if isinstance(estado, SessionState):
+        return estado.to_json()
+    return json.dumps(estado, ensure_ascii=False)
+
+
+def _bytes_em_memoria(sessoes: list[dict], fabricar) -> float:
+    """Bytes por sessão só do estado: o store cheio menos o mesmo store com um valor compartilhado."""
+    def encher(valor_de) -> int:
+        gc.collect()
+        tracemalloc.start()
+        store = MemoryStateStore(max_entries=len(sessoes))
+        for indice, sessao in enumerate(sessoes):
+            store.set(f"chat_{indice}", valor_de(sessao))
+        usado = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del store
+        return usado
+
+    compartilhado = object()
+    return (encher(fabricar) - encher(lambda _: compartilhado)) / len(sessoes)
+
+
+def _ms_para_refazer_a_pagina() -> float:
+    with silenciar():
+        db.set_database_file(copiar_banco_temporario())
+    ids = [linha[0] for linha in db.get_connection().execute(
+        "SELECT id FROM horarios_disponiveis ORDER BY id LIMIT ?", (HORARIOS_POR_PAGINA,))]
+    tempos = []
+    for _ in range(REPETICOES_RENDER):
+        inicio = time.perf_counter()
+        descrever_itens("horarios", ids)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos)
+
+
+def main(quantidade: int = 100_000):
+    sorteio = random.Random(42)
+    sessoes = [_sessao(sorteio) for _ in range(quantidade)]
+    formas = {
+        "texto mostrado (antes)": _como_texto,
+        "IDs em dicionário": _como_ids_em_dicionario,
+        "SessionState": _como_session_state,
+    }
+    print(f"{quantidade} sessões ativas, página de {HORARIOS_POR_PAGINA} horários\n")
+    print(f"{'forma':>24} | {'bytes/sessão (memória)':>22} | {'total (MB)':>10} | {'bytes/sessão (gravado)':>22}")
+    for nome, fabricar in formas.items():
+        por_sessao = _bytes_em_memoria(sessoes, fabricar)
+        gravado = statistics.mean(len(_serializado(fabricar(sessao)).encode()) for sessao in sessoes)
+        print(f"{nome:>24} | {por_sessao:>22.0f} | {por_sessao * quantidade / 1024 / 1024:>10.1f} | {gravado:>22.0f}")
+
+    print(f"\nrefazer o texto de uma página pelos IDs (só nos turnos que vão para a IA): "
+          f"{_ms_para_refazer_a_pagina():.3f} ms (mediana)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,94 @@
+"""
+Vazão do gerador de horários (schedules.py) com muitos médicos e meses de agenda:
+  * linha a linha: uma transação por horário (como inserir à mão), numa amostra
+  * em lotes: a geração inteira com lotes de tamanhos diferentes (horários/s e
+    tempo médio de cada transação, que é quanto uma reserva pode esperar)
+  * de novo: a segunda execução não cria nada (idempotente) e quanto ela custa
+  * limpeza: apaga a primeira metade do período como se ela já tivesse passado
+
+Uso (na raiz do projeto):  python -m benchmarks.bench_slot_generation [medicos] [dias]
+"""
+import datetime
+import itertools
+import sys
+import time
+
+import db
+import schedules
+from benchmarks._util import copiar_banco_temporario, silenciar
+
+LOTES = (1_000, 5_000, 20_000, 100_000)
+AMOSTRA_LINHA_A_LINHA = 5_000
+
+
+def _banco_com_agendas(medicos: int) -> None:
+    """Cópia nova do banco com `medicos` médicos atendendo de segunda a sexta, 08-18h, a cada 15 min."""
+    with silenciar():
+        db.set_database_file(copiar_banco_temporario())
+    conn = db.get_connection()
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO medicos (nome, especialidade) VALUES (?, ?)",
+                     [(f"Médico {i}", "Clínica Geral") for i in range(medicos)])
+    conn.execute("""
+        INSERT INTO agendas_medicos (medico_id, dia_semana, hora_inicio, hora_fim, duracao_minutos)
+        SELECT m.id, d.value, '08:00', '18:00', 15 FROM medicos m, json_each('[0, 1, 2, 3, 4]') d
+        WHERE m.especialidade = 'Clínica Geral'
+    """)
+    conn.execute("COMMIT")
+
+
+def _total_de_horarios() -> int:
+    return db.get_connection().execute("SELECT COUNT(*) FROM horarios_disponiveis").fetchone()[0]
+
+
+def _linha_a_linha(dias: int) -> float:
+    conn = db.get_connection()
+    por_dia = schedules._agenda_por_dia_da_semana(conn, "consulta")
+    horarios = schedules._horarios(por_dia, set(), datetime.date.today(), dias, "")
+    amostra = list(itertools.islice(horarios, AMOSTRA_LINHA_A_LINHA))
+    inicio = time.perf_counter()
+    for medico_id, data_hora in amostra:
+        schedules._gravar_lote("horarios_disponiveis",
+                               "INSERT OR IGNORE INTO horarios_disponiveis (medico_id, data_hora_inicio) VALUES (?, ?)",
+                               (medico_id, data_hora))
+    return len(amostra) / (time.perf_counter() - inicio)
+
+
+def main(medicos: int = 200, dias: int = 180):
+    print(f"{medicos} médicos, {dias} dias, seg-sex 08-18h a cada 15 min\n")
+    _banco_com_agendas(medicos)
+    print(f"{'modo':>24} | {'horários':>9} | {'tempo (s)':>9} | {'horários/s':>10} | {'ms/transação':>12}")
+    por_segundo = _linha_a_linha(dias)
+    print(f"{'linha a linha':>24} | {AMOSTRA_LINHA_A_LINHA:>9} | {AMOSTRA_LINHA_A_LINHA / por_segundo:>9.2f} | "
+          f"{por_segundo:>10.0f} | {1000 / por_segundo:>12.3f}")
+
+    for lote in LOTES:
+        _banco_com_agendas(medicos)
+        lotes_antes = schedules.metrics()["lotes"]
+        inicio = time.perf_counter()
+        with silenciar():
+            criados = schedules.gerar_horarios(dias, lote=lote)["consulta"]
+        duracao = time.perf_counter() - inicio
+        transacoes = schedules.metrics()["lotes"] - lotes_antes
+        print(f"{f'lotes de {lote}':>24} | {criados:>9} | {duracao:>9.2f} | {criados / duracao:>10.0f} | "
+              f"{duracao / transacoes * 1000:>12.1f}")
+
+    total = _total_de_horarios()
+    inicio = time.perf_counter()
+    with silenciar():
+        criados = schedules.gerar_horarios(dias)["consulta"]
+    duracao = time.perf_counter() - inicio
+    print(f"{'de novo (idempotente)':>24} | {criados:>9} | {duracao:>9.2f} | {total / duracao:>10.0f} | {'-':>12}"
+          f"   {'OK' if criados == 0 and _total_de_horarios() == total else 'ERRO: duplicou'}")
+
+    metade = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=dias // 2), datetime.time())
+    inicio = time.perf_counter()
+    with silenciar():
+        removidos = schedules.limpar_horarios(metade)["consulta"]
+    duracao = time.perf_counter() - inicio
+    print(f"{'limpeza (metade)':>24} | {removidos:>9} | {duracao:>9.2f} | {removidos / duracao:>10.0f} | {'-':>12}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 180)
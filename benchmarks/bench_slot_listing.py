@@ -0,0 +1,82 @@
+"""
+Listagem de horários com um calendário grande (muitos médicos na mesma
+especialidade, meses de agenda gerados pelo schedules.py):
+  * lista inteira: o que a ferramenta fazia antes (todos os horários livres
+    num único texto, que ia para o prompt e para o estado da conversa)
+  * primeira página / página no fim do período: a ferramenta paginada
+    (keyset), sem cache, e o tamanho do resultado e do estado guardado
+
+Uso (na raiz do projeto):  python -m benchmarks.bench_slot_listing [medicos] [dias]
+"""
+import json
+import statistics
+import sys
+import time
+
+import database_tools
+import db
+import fast_path
+from benchmarks.bench_slot_generation import _banco_com_agendas
+from benchmarks._util import silenciar
+from schedules import gerar_horarios
+from session_state import Step
+
+REPETICOES = 20
+
+# A consulta de antes da paginação (todos os horários livres dos médicos)
+SQL_LISTA_INTEIRA = """
+SELECT h.id, m.nome, h.data_hora_inicio
+FROM json_each(?) AS ids
+CROSS JOIN horarios_disponiveis h ON h.medico_id = ids.value AND h.status = 'disponivel'
+JOIN medicos m ON h.medico_id = m.id
+ORDER BY h.data_hora_inicio;
+"""
+
+
+def _lista_inteira(especialidade: str) -> str:
+    medico_ids = database_tools.MEDICOS_POR_ESPECIALIDADE.resolver(especialidade)
+    linhas = db.get_connection().execute(SQL_LISTA_INTEIRA, (json.dumps(medico_ids),)).fetchall()
+    return "; ".join(f"[ID {id}: {nome} - {data_hora}]" for (id, nome, data_hora) in linhas)
+
+
+def _medir(funcao) -> tuple[float, str]:
+    """(mediana em ms, resultado) de REPETICOES execuções."""
+    tempos = []
+    for _ in range(REPETICOES):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos), resultado
+
+
+def main(medicos: int = 50, dias: int = 90):
+    _banco_com_agendas(medicos)
+    with silenciar():
+        gerar_horarios(dias)
+    especialidade = "Clínica Geral"
+    consultar = database_tools.tool_consultar_horarios_disponiveis.__wrapped__
+    cursor = fast_path.proximo_cursor(consultar(especialidade))
+    fim_do_periodo = db.get_connection().execute("SELECT date(MAX(data_hora_inicio), '-1 day') FROM horarios_disponiveis").fetchone()[0]
+
+    casos = {
+        "lista inteira (antes)": lambda: _lista_inteira(especialidade),
+        "primeira página": lambda: consultar(especialidade),
+        "página no fim do período": lambda: consultar(especialidade, data_inicio=fim_do_periodo),
+        "página seguinte (cursor)": lambda: consultar(especialidade, cursor=cursor),
+    }
+    print(f"{medicos} médicos de {especialidade}, {dias} dias, página de {database_tools.HORARIOS_POR_PAGINA}\n")
+    print(f"{'caso':>26} | {'horários':>8} | {'ms (mediana)':>12} | {'resultado (KB)':>14} | {'estado (bytes)':>14}")
+    for nome, funcao in casos.items():
+        ms, resultado = _medir(funcao)
+        ids = fast_path.itens_listados(resultado)
+        if nome.endswith("(antes)"):
+            estado = json.dumps({"horarios_mostrados": resultado}, ensure_ascii=False)
+        else:
+            estado = fast_path.estado_da_lista(Step.AWAITING_SLOT_CHOICE, resultado, {"especialidade": especialidade}).to_json()
+        tamanho_estado = len(estado.encode())
+        print(f"{nome:>26} | {len(ids):>8} | {ms:>12.2f} | {len(resultado.encode()) / 1024:>14.1f} | {tamanho_estado:>14}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 90)
@@ -0,0 +1,98 @@
+"""
+Compara o /chat (resposta só no final) com o /chat/stream (Server-Sent Events)
+num uvicorn de verdade, com o modelo falso gerando o JSON token a token:
+  * TTFB: primeiro byte do corpo da resposta HTTP
+  * 1º texto: primeiro pedaço da resposta ao usuário na tela
+  * total: resposta completa
+Cenários: resposta direta (1 chamada à IA) e consulta de horários (ferramenta + RAG).
+
+Uso (na raiz do projeto):  python -m benchmarks.bench_streaming [requisicoes_por_cenario] [concorrencia]
+"""
+import json
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import uvicorn
+
+import agent
+import db
+import main
+from benchmarks._stub_model import StubModel
+from benchmarks._util import copiar_banco_temporario, percentil, silenciar
+
+CENARIOS = {"resposta direta": "Olá", "ferramenta + RAG": "Quero marcar cardiologia"}
+# Latência típica de um modelo "flash": ~0,3-0,5 s até o 1º token, ~100 tokens/s depois
+TTFT_MIN, TTFT_MAX, TOKENS_POR_SEGUNDO = 0.3, 0.5, 100
+
+
+def _via_chat(url: str, mensagem: str) -> tuple[float, float, float]:
+    inicio = time.perf_counter()
+    response = requests.post(f"{url}/chat", json={"message": mensagem}, stream=True)
+    primeiro_byte = None
+    for _ in response.iter_content(chunk_size=None):
+        primeiro_byte = primeiro_byte or time.perf_counter()
+    fim = time.perf_counter()
+    # Sem streaming o texto só aparece quando a resposta inteira chega
+    return primeiro_byte - inicio, fim - inicio, fim - inicio
+
+
+def _via_stream(url: str, mensagem: str) -> tuple[float, float, float]:
+    inicio = time.perf_counter()
+    response = requests.post(f"{url}/chat/stream", json={"message": mensagem}, stream=True)
+    primeiro_byte = primeiro_texto = None
+    buffer = ""
+    for pedaco in response.iter_content(chunk_size=None, decode_unicode=True):
+        agora = time.perf_counter()
+        primeiro_byte = primeiro_byte or agora
+        buffer += pedaco
+        while "\n\n" in buffer:
+            evento, buffer = buffer.split("\n\n", 1)
+            nome = evento.split("\n", 1)[0].removeprefix("event: ")
+            if nome in ("delta", "fim") and primeiro_texto is None:
+                primeiro_texto = agora
+            if nome == "fim":
+                json.loads(evento.split("data: ", 1)[1])
+    fim = time.perf_counter()
+    return primeiro_byte - inicio, primeiro_texto - inicio, fim - inicio
+
+
+def _servidor() -> tuple[uvicorn.Server, threading.Thread, str]:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(main.app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def main_benchmark(requisicoes: int = 20, concorrencia: int = 5):
+    db.set_database_file(copiar_banco_temporario())
+    agent.model = StubModel(TTFT_MIN, TTFT_MAX, TOKENS_POR_SEGUNDO)
+    print(f"{requisicoes} requisições por cenário, {concorrencia} concorrentes "
+          f"(modelo falso: 1º token em {TTFT_MIN}-{TTFT_MAX}s, {TOKENS_POR_SEGUNDO} tokens/s)\n")
+    print(f"{'cenário':>17} | {'rota':>12} | {'TTFB p50':>9} | {'1º texto p50':>12} | {'1º texto p99':>12} | {'total p50':>9}")
+
+    with silenciar():
+        server, thread, url = _servidor()
+    try:
+        for cenario, mensagem in CENARIOS.items():
+            for rota, medir in (("/chat", _via_chat), ("/chat/stream", _via_stream)):
+                with silenciar(), ThreadPoolExecutor(max_workers=concorrencia) as pool:
+                    amostras = list(pool.map(lambda _: medir(url, mensagem), range(requisicoes)))
+                ttfb, texto, total = ([a[i] * 1000 for a in amostras] for i in range(3))
+                print(f"{cenario:>17} | {rota:>12} | {percentil(ttfb, 50):>7.0f}ms | {percentil(texto, 50):>10.0f}ms | "
+                      f"{percentil(texto, 99):>10.0f}ms | {percentil(total, 50):>7.0f}ms")
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == "__main__":
+    argumentos = [int(a) for a in sys.argv[1:3]]
+    main_benchmark(*argumentos)
@@ -0,0 +1,82 @@
+"""
+Compara o envio antigo (requests.post sem sessão, sem limite) com o
+despachante (telegram_dispatcher.py) contra um servidor falso do Telegram
+que aplica os limites reais (1 msg/s por chat, 30 msg/s no total).
+
+Uso (na raiz do projeto):  python -m benchmarks.bench_telegram_sender [chats] [mensagens_por_chat]
+"""
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks._util import silenciar
+from benchmarks.fake_telegram import FakeTelegram
+from telegram_dispatcher import TelegramDispatcher
+
+
+def _mensagens(chats: int, por_chat: int) -> list[tuple[str, str]]:
+    return [(f"chat_{c}", f"resposta {i}") for i in range(por_chat) for c in range(chats)]
+
+
+def _ordem_preservada(recebidas: list[tuple[str, str]], chats: int) -> bool:
+    """Confere se cada chat recebeu as mensagens em ordem (os agrupamentos juntam várias)."""
+    for c in range(chats):
+        textos = "\n\n".join(texto for chat, texto in recebidas if chat == f"chat_{c}").split("\n\n")
+        if textos != sorted(textos, key=lambda t: int(t.split()[-1])):
+            return False
+    return True
+
+
+def _antes(api_base: str, mensagens) -> dict:
+    """Comportamento antigo: um requests.post (nova conexão) por mensagem, sem limite nem retentativa."""
+    entregues = 0
+
+    def enviar(item):
+        chat_id, texto = item
+        response = requests.post(f"{api_base}/botTESTE/sendMessage", json={"chat_id": chat_id, "text": texto})
+        return response.status_code == 200
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        entregues = sum(pool.map(enviar, mensagens))
+    return {"entregues": entregues}
+
+
+async def _depois(api_base: str, mensagens) -> dict:
+    dispatcher = TelegramDispatcher(token="TESTE", api_base=api_base)
+    dispatcher.start()
+    for chat_id, texto in mensagens:
+        await dispatcher.send(chat_id, texto)
+    await dispatcher.stop(timeout=120)
+    return dispatcher.metrics()
+
+
+def main(chats: int = 20, por_chat: int = 5):
+    mensagens = _mensagens(chats, por_chat)
+    print(f"{len(mensagens)} mensagens para {chats} chats\n")
+
+    with FakeTelegram() as fake:
+        inicio = time.perf_counter()
+        resultado = _antes(fake.api_base, mensagens)
+        duracao = time.perf_counter() - inicio
+        print("antes (requests.post por mensagem):")
+        print(f"  tempo {duracao:.2f}s | conexões TCP {fake.conexoes} | 429 recebidos {fake.respostas_429} | "
+              f"entregues {resultado['entregues']}/{len(mensagens)}")
+
+    with FakeTelegram() as fake:
+        inicio = time.perf_counter()
+        with silenciar():
+            stats = asyncio.run(_depois(fake.api_base, mensagens))
+        duracao = time.perf_counter() - inicio
+        entregues = sum(len(texto.split("\n\n")) for _, texto in fake.recebidas)
+        print("depois (despachante):")
+        print(f"  tempo {duracao:.2f}s | conexões TCP {fake.conexoes} | 429 recebidos {fake.respostas_429} | "
+              f"entregues {entregues}/{len(mensagens)} em {len(fake.recebidas)} envios "
+              f"({stats['agrupadas']} agrupadas) | ordem por chat {'OK' if _ordem_preservada(fake.recebidas, chats) else 'QUEBRADA'}")
+
+
+if __name__ == "__main__":
+    argumentos = [int(a) for a in sys.argv[1:3]]
+    main(*argumentos)
@@ -0,0 +1,133 @@
+"""
+Custo do rastreamento (tracing.py) por turno do agente e detalhamento por
+etapa a partir dos spans exportados.
+  * custo: o mesmo lote de turnos com o modelo falso sem latência, sem
+    rastreamento, com trace em 100% dos turnos e com trace + logs DEBUG
+    (100% e 10% amostrados); os logs vão para a memória, não para o terminal
+  * etapas: p50/p99 de cada span (state.lookup, llm.call_1, tool.execute...)
+    num lote com latência simulada da IA, lidos do JSON lines exportado
+
+Uso (na raiz do projeto):  python -m benchmarks.bench_tracing [turnos]
+"""
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import agent
+import cache
+import db
+import tracing
+from benchmarks._stub_model import StubModel
+from benchmarks._util import copiar_banco_temporario, percentil, silenciar
+
+MENSAGENS = ["Olá", "Quero marcar cardiologia", "Qual o endereço da clínica?"]
+SESSOES = 20
+# Cada configuração roda algumas vezes e vale a melhor (menos ruído do GC/agendador)
+REPETICOES = 3
+
+# nome -> (trace ligado, amostragem do trace e dos logs, logs DEBUG ligados)
+CONFIGURACOES = {
+    "sem rastreamento": (False, 1.0, False),
+    "trace 100%": (True, 1.0, False),
+    "trace + DEBUG 100%": (True, 1.0, True),
+    "trace + DEBUG 10%": (True, 0.1, True),
+}
+
+
+async def _turnos(total: int, prefixo: str) -> list[float]:
+    # Sessões novas e caches vazios: todas as configurações fazem o mesmo trabalho
+    for cache_de_resultados in cache.CACHES.values():
+        cache_de_resultados.clear()
+    latencias = []
+
+    async def sessao(indice: int):
+        for i in range(total // SESSOES):
+            inicio = time.perf_counter()
+            await agent.handle_message_async(f"{prefixo}_{indice}", MENSAGENS[i % len(MENSAGENS)])
+            latencias.append(time.perf_counter() - inicio)
+
+    await asyncio.gather(*(sessao(indice) for indice in range(SESSOES)))
+    return latencias
+
+
+@contextlib.contextmanager
+def _configuracao(arquivo: str, rastrear: bool, taxa: float, debug: bool):
+    tracing.TRACE_FILE = arquivo
+    tracing.TRACE_SAMPLE_RATE = tracing.LOG_SAMPLE_RATE = taxa
+    tracing.EXPORTER = tracing._Exportador("jsonl") if rastrear else None
+    raiz = logging.getLogger()
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(logging.Formatter(tracing.LOG_FORMAT))
+    handler.addFilter(tracing._LogsAmostrados())
+    nivel_anterior = raiz.level
+    raiz.addHandler(handler)
+    raiz.setLevel(logging.DEBUG if debug else logging.INFO)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        tracing.flush()
+    finally:
+        raiz.removeHandler(handler)
+        raiz.setLevel(nivel_anterior)
+
+
+def _custo(turnos: int, pasta: str) -> None:
+    agent.model = StubModel(0.0, 0.0)
+    print(f"custo: {turnos} turnos, {SESSOES} sessões, modelo falso sem latência (melhor de {REPETICOES})\n")
+    print(f"{'configuração':>18} | {'µs/turno':>9} | {'p99 (ms)':>8} | {'spans':>6} | {'linhas de log':>13}")
+    with _configuracao(os.path.join(pasta, "aquecimento.jsonl"), False, 1.0, False):
+        asyncio.run(_turnos(turnos, "aquecimento"))
+    base = None
+    for indice, (nome, (rastrear, taxa, debug)) in enumerate(CONFIGURACOES.items()):
+        melhor = None
+        for repeticao in range(REPETICOES):
+            arquivo = os.path.join(pasta, f"custo_{indice}_{repeticao}.jsonl")
+            with _configuracao(arquivo, rastrear, taxa, debug):
+                handler = logging.getLogger().handlers[-1]
+                inicio = time.perf_counter()
+                latencias = asyncio.run(_turnos(turnos, f"custo_{indice}_{repeticao}"))
+                duracao = time.perf_counter() - inicio
+                linhas = handler.stream.getvalue().count("\n")
+            if melhor is None or duracao < melhor[0]:
+                spans = sum(1 for _ in open(arquivo, encoding="utf-8")) if os.path.exists(arquivo) else 0
+                melhor = (duracao, latencias, linhas, spans)
+        duracao, latencias, linhas, spans = melhor
+        por_turno = duracao / len(latencias) * 1e6
+        base = base or por_turno
+        print(f"{nome:>18} | {por_turno:>9.0f} | {percentil(latencias, 99) * 1000:>8.2f} | {spans:>6} | {linhas:>13}"
+              f"   ({por_turno / base - 1:+.0%})")
+
+
+def _etapas(turnos: int, pasta: str) -> None:
+    agent.model = StubModel(0.05, 0.15)
+    arquivo = os.path.join(pasta, "etapas.jsonl")
+    with _configuracao(arquivo, True, 1.0, False):
+        asyncio.run(_turnos(turnos, "etapas"))
+    duracoes = defaultdict(list)
+    with open(arquivo, encoding="utf-8") as f:
+        for linha in f:
+            span = json.loads(linha)
+            duracoes[span["nome"]].append(span["duracao_ms"])
+    print(f"\netapas: {turnos} turnos, IA com 50-150 ms\n")
+    print(f"{'span':>14} | {'qtd':>5} | {'p50 (ms)':>8} | {'p99 (ms)':>8}")
+    for nome, valores in sorted(duracoes.items(), key=lambda item: -percentil(item[1], 50)):
+        print(f"{nome:>14} | {len(valores):>5} | {percentil(valores, 50):>8.3f} | {percentil(valores, 99):>8.3f}")
+
+
+def main(turnos: int = 600):
+    with silenciar():
+        db.set_database_file(copiar_banco_temporario())
+    pasta = tempfile.mkdtemp(prefix="clinic_traces_")
+    _custo(turnos, pasta)
+    _etapas(turnos, pasta)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 600)
@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Servidor Falso da Bot API do Telegram ---
+# Servidor HTTP local (keep-alive) que imita o `sendMessage` do Telegram,
+# inclusive os limites de envio: mais de `limite_chat` mensagens por segundo
+# no mesmo chat, ou `limite_global` no total, recebem 429 com `retry_after`.
+# Também imita o `getUpdates` (long polling): `publicar(chat_id, texto)` cria
+# uma atualização, que fica guardada até um getUpdates com offset maior confirmá-la.
+# Use com TELEGRAM_API_BASE=http://127.0.0.1:<porta> ou passando `api_base`.
+
+
+class FakeTelegram:
+    def __init__(self, latencia: float = 0.0, limite_chat: int = 1, limite_global: int = 30, retry_after: int = 1,
+                 primeiro_update_id: int = 1):
+        self.latencia = latencia
+        self.limite_chat = limite_chat
+        self.limite_global = limite_global
+        self.retry_after = retry_after
+        self.recebidas: list[tuple[str, str]] = []  # (chat_id, texto) na ordem de chegada
+        self.recebidas_em: list[float] = []  # time.perf_counter() de cada item de `recebidas`
+        self.chamadas_get_updates = 0
+        self._updates: deque[dict] = deque()  # ainda não confirmadas pelo offset
+        self._proximo_update_id = primeiro_update_id
+        self._novo_update = threading.Condition()
+        self.respostas_429 = 0
+        self.conexoes = 0
+        self._janela_chat: dict[str, deque] = defaultdict(deque)
+        self._janela_global: deque = deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._criar_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def api_base(self) -> str:
+        host, porta = self._server.server_address
+        return f"http://{host}:{porta}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def publicar(self, chat_id, texto: str) -> dict:
+        """Cria uma atualização de mensagem de texto (como se o usuário tivesse escrito)."""
+        with self._novo_update:
+            update = {
+                "update_id": self._proximo_update_id,
+                "message": {"message_id": self._proximo_update_id, "chat": {"id": chat_id, "type": "private"},
+                            "date": int(time.time()), "text": texto},
+            }
+            self._proximo_update_id += 1
+            self._updates.append(update)
+            self._novo_update.notify_all()
+        return update
+
+    def _get_updates(self, offset: int, limit: int, timeout: float) -> list[dict]:
+        prazo = time.monotonic() + timeout
+        with self._novo_update:
+            self.chamadas_get_updates += 1
+            # O offset confirma (e apaga) todas as atualizações anteriores a ele
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates and time.monotonic() < prazo:
+                self._novo_update.wait(prazo - time.monotonic())
+            return list(self._updates)[:limit]
+
+    def _limite_estourado(self, chat_id: str) -> bool:
+        agora = time.monotonic()
+        with self._lock:
+            janelas = (self._janela_chat[chat_id], self._janela_global)
+            for janela in janelas:
+                while janela and janela[0] <= agora - 1.0:
+                    janela.popleft()
+            if len(janelas[0]) >= self.limite_chat or len(janelas[1]) >= self.limite_global:
+                self.respostas_429 += 1
+                return True
+            for janela in janelas:
+                janela.append(agora)
+            return False
+
+    def _criar_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # mantém a conexão aberta (keep-alive)
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.conexoes += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, status: int, corpo: dict):
+                dados = json.dumps(corpo).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def do_POST(self):
+                tamanho = int(self.headers.get("Content-Length", 0))
+                corpo = json.loads(self.rfile.read(tamanho) or b"{}")
+                metodo = self.path.rsplit("/", 1)[-1]
+                if metodo == "getUpdates":
+                    updates = fake._get_updates(int(corpo.get("offset", 0)), int(corpo.get("limit", 100)),
+                                                float(corpo.get("timeout", 0)))
+                    return self._responder(200, {"ok": True, "result": updates})
+                if metodo == "deleteWebhook":
+                    return self._responder(200, {"ok": True, "result": True, "description": "Webhook is already deleted"})
+                if metodo != "sendMessage":
+                    return self._responder(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                if fake.latencia:
+                    time.sleep(fake.latencia)
+                chat_id = str(corpo.get("chat_id"))
+                if fake._limite_estourado(chat_id):
+                    return self._responder(429, {
+                        "ok": False, "error_code": 429,
+                        "description": f"Too Many Requests: retry after {fake.retry_after}",
+                        "parameters": {"retry_after": fake.retry_after},
+                    })
+                with fake._lock:
+                    fake.recebidas.append((chat_id, corpo.get("text", "")))
+                    fake.recebidas_em.append(time.perf_counter())
+                    message_id = len(fake.recebidas)
+                self._responder(200, {"ok": True, "result": {"message_id": message_id, "chat": {"id": chat_id}}})
+
+        return Handler
@@ -0,0 +1,89 @@
+"""
+Fração de turnos respondidos sem chamar a IA (caminho rápido, fast_path.py)
+e Chamadas 2 dispensadas pelos templates (rendering.py). Roda conversas
+roteirizadas pelo agente com o modelo falso e conta as chamadas ao modelo
+sem e com os templates de resposta.
+
+Uso (na raiz do projeto):  python -m benchmarks.fast_path_report
+"""
+import asyncio
+
+import agent
+import cache
+import db
+import fast_path
+import rendering
+from benchmarks._stub_model import StubModel
+from benchmarks._util import copiar_banco_temporario, silenciar
+from llm_usage import USAGE
+
+# "{id}" é trocado pelo primeiro ID da lista que o bot acabou de mostrar
+CONVERSAS = [
+    ["Quero marcar cardiologia", "{id}", "Maria Souza"],
+    ["Quero marcar cardiologia", "ID {id}", "meu nome é João da Silva"],
+    ["Quero marcar cardiologia", "pode ser o 1 ou o 2?", "Olá"],
+    ["Quero marcar exame", "sangue", "quero o horário {id}", "Ana Lima"],
+    ["Quero marcar exame", "Eletrocardiograma", "{id}", "Carlos Dias Pereira"],
+    ["Olá"],
+]
+
+
+def _primeiro_id_mostrado(session_id: str) -> str:
+    estado = agent.CONVERSATION_STATE.get(session_id)
+    if estado and estado.ids:
+        return str(estado.ids[0])
+    return "1"
+
+
+async def _rodar(conversas, prefixo: str) -> int:
+    turnos = 0
+    for indice, conversa in enumerate(conversas):
+        session_id = f"{prefixo}_{indice}"
+        # Cancela o que foi marcado, para exercitar o fluxo de cancelamento também
+        for mensagem in conversa + (["Quero cancelar minha consulta", "{id}"] if indice < 2 else []):
+            if "{id}" in mensagem:
+                mensagem = mensagem.replace("{id}", _primeiro_id_mostrado(session_id))
+            await agent.handle_message_async(session_id, mensagem)
+            turnos += 1
+    return turnos
+
+
+def _chamadas(conversas, templates: bool) -> tuple[int, int]:
+    """Roda as conversas num banco novo e retorna (turnos, chamadas ao modelo)."""
+    db.set_database_file(copiar_banco_temporario())
+    # Banco novo: os caches de outra rodada não valem mais
+    for cache_de_resultados in cache.CACHES.values():
+        cache_de_resultados.clear()
+    sintese_original = set(rendering.LLM_SYNTHESIS_TOOLS)
+    if not templates:
+        rendering.LLM_SYNTHESIS_TOOLS.update(rendering.TEMPLATES)
+    antes = USAGE.summary()["calls"]
+    try:
+        with silenciar():
+            turnos = asyncio.run(_rodar(conversas, "templates" if templates else "sem_templates"))
+    finally:
+        rendering.LLM_SYNTHESIS_TOOLS.clear()
+        rendering.LLM_SYNTHESIS_TOOLS.update(sintese_original)
+    return turnos, USAGE.summary()["calls"] - antes
+
+
+def main():
+    agent.model = StubModel(0.0, 0.0)
+
+    _, chamadas_sem_templates = _chamadas(CONVERSAS, templates=False)
+    fast_path.ESTATISTICAS.update(turnos=0, sem_llm=0, fallbacks=0)
+    rendering.ESTATISTICAS.update(renderizadas=0, sintetizadas=0)
+    turnos, chamadas = _chamadas(CONVERSAS, templates=True)
+
+    stats = fast_path.metrics()
+    render = rendering.metrics()
+    print(f"turnos: {turnos}")
+    print(f"respondidos sem IA: {stats['sem_llm']} ({stats['fracao_sem_llm']:.0%}) | enviados à IA por ambiguidade: {stats['fallbacks']}")
+    print(f"resultados de ferramenta: {render['renderizadas']} por template, {render['sintetizadas']} pela IA "
+          f"({render['chamadas_economizadas']} chamadas economizadas)")
+    print(f"chamadas ao modelo: {chamadas_sem_templates} sem templates ({chamadas_sem_templates / turnos:.2f} por turno) -> "
+          f"{chamadas} com templates ({chamadas / turnos:.2f} por turno)")
+
+
+if __name__ == "__main__":
+    main()
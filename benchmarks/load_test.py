@@ -0,0 +1,49 @@
+"""
+Teste de carga do pipeline async do agente com um modelo falso (sem rede).
+Mede p50/p99 de latência e requisições/s com 1, 10 e 100 sessões concorrentes.
+
+Uso (na raiz do projeto):  python -m benchmarks.load_test [mensagens_por_sessao]
+"""
+import asyncio
+import sys
+import time
+
+import agent
+import db
+from benchmarks._stub_model import StubModel
+from benchmarks._util import copiar_banco_temporario, percentil, silenciar
+
+NIVEIS_CONCORRENCIA = [1, 10, 100]
+MENSAGENS = ["Olá", "Quero marcar cardiologia"]
+
+
+async def _sessao(indice: int, mensagens_por_sessao: int, latencias: list[float]):
+    session_id = f"carga_{indice}"
+    for i in range(mensagens_por_sessao):
+        inicio = time.perf_counter()
+        await agent.handle_message_async(session_id, MENSAGENS[i % len(MENSAGENS)])
+        latencias.append(time.perf_counter() - inicio)
+
+
+async def _rodar_nivel(concorrencia: int, mensagens_por_sessao: int):
+    latencias: list[float] = []
+    inicio = time.perf_counter()
+    await asyncio.gather(*[_sessao(i, mensagens_por_sessao, latencias) for i in range(concorrencia)])
+    duracao = time.perf_counter() - inicio
+    return latencias, duracao
+
+
+def main(mensagens_por_sessao: int = 10):
+    db.set_database_file(copiar_banco_temporario())
+    agent.model = StubModel()
+
+    print(f"{'sessões':>8} | {'p50 (ms)':>9} | {'p99 (ms)':>9} | {'req/s':>8}")
+    for concorrencia in NIVEIS_CONCORRENCIA:
+        with silenciar():
+            latencias, duracao = asyncio.run(_rodar_nivel(concorrencia, mensagens_por_sessao))
+        ms = [l * 1000 for l in latencias]
+        print(f"{concorrencia:>8} | {percentil(ms, 50):>9.1f} | {percentil(ms, 99):>9.1f} | {len(latencias) / duracao:>8.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
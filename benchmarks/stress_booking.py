@@ -0,0 +1,107 @@
+"""
+Teste de estresse do motor de reservas: várias threads disparam milhares de
+reservas (e alguns cancelamentos) contra poucos horários ao mesmo tempo.
+Ao final verifica que nunca houve agendamento duplo.
+
+Uso (na raiz do projeto):  python -m benchmarks.stress_booking [threads] [reservas_por_thread]
+"""
+import random
+import sys
+import threading
+import time
+
+import booking
+import db
+from benchmarks._util import copiar_banco_temporario, silenciar
+from database_setup import setup_database
+
+HORARIOS_ALVO = [1, 2, 3, 4]
+HORARIOS_EXAME_ALVO = [1, 2]
+
+
+def _verificar_invariantes(conn) -> list[str]:
+    """Cada horário 'agendado' tem exatamente 1 agendamento confirmado; os livres, nenhum."""
+    problemas = []
+    for tabela_horarios, tabela_agendamentos, coluna in [
+        ("horarios_disponiveis", "agendamentos", "horario_id"),
+        ("horarios_exames", "agendamentos_exames", "horario_exame_id"),
+    ]:
+        linhas = conn.execute(f"""
+            SELECT h.id, h.status,
+                   (SELECT COUNT(*) FROM {tabela_agendamentos} a
+                    WHERE a.{coluna} = h.id AND a.status = 'confirmado')
+            FROM {tabela_horarios} h
+        """).fetchall()
+        for horario_id, status, confirmados in linhas:
+            esperado = 1 if status == "agendado" else 0
+            if confirmados != esperado:
+                problemas.append(f"{tabela_horarios} ID {horario_id}: status={status}, confirmados={confirmados}")
+    return problemas
+
+
+def main(num_threads: int = 32, reservas_por_thread: int = 100):
+    path = copiar_banco_temporario()
+    db.set_database_file(path)
+    # Garante o índice único na cópia (o setup é idempotente)
+    with silenciar():
+        setup_database(path)
+
+    barreira = threading.Barrier(num_threads)
+    contagem = {"reservado": 0, "recusado": 0, "cancelado": 0, "erro": 0}
+    contagem_lock = threading.Lock()
+
+    def trabalhador(indice: int):
+        chat_id = f"stress_{indice}"
+        meus_agendamentos = []
+        barreira.wait()
+        for _ in range(reservas_por_thread):
+            tipo = random.choice(["consulta", "exame"])
+            alvos = HORARIOS_ALVO if tipo == "consulta" else HORARIOS_EXAME_ALVO
+            try:
+                resultado = booking.reservar_horario(tipo, random.choice(alvos), f"Paciente {indice}", chat_id)
+                chave = "reservado" if resultado == booking.RESERVADO else "recusado"
+                if resultado == booking.RESERVADO:
+                    tabela = booking.RECURSOS[tipo]["tabela_agendamentos"]
+                    ultimo = db.get_connection().execute(
+                        f"SELECT MAX(id) FROM {tabela} WHERE telegram_chat_id = ?", (chat_id,)
+                    ).fetchone()[0]
+                    meus_agendamentos.append((tipo, ultimo))
+                # De vez em quando cancela um agendamento próprio para reabrir o horário
+                if meus_agendamentos and random.random() < 0.3:
+                    tipo_c, agendamento_id = meus_agendamentos.pop(random.randrange(len(meus_agendamentos)))
+                    if booking.cancelar_reserva(tipo_c, agendamento_id, chat_id)[0] == booking.CANCELADO:
+                        with contagem_lock:
+                            contagem["cancelado"] += 1
+            except Exception as e:
+                chave = "erro"
+                print(f"Erro na thread {indice}: {e}")
+            with contagem_lock:
+                contagem[chave] += 1
+
+    threads = [threading.Thread(target=trabalhador, args=(i,)) for i in range(num_threads)]
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    total = num_threads * reservas_por_thread
+    print(f"Banco: {path}")
+    print(f"{total} tentativas de reserva em {num_threads} threads ({duracao:.2f}s, {total / duracao:.0f} ops/s)")
+    print(f"Resultados: {contagem}")
+    print(f"Estatísticas do motor: {booking.ESTATISTICAS}")
+
+    problemas = _verificar_invariantes(db.get_connection())
+    db.close_all()
+    if problemas:
+        print("FALHA: agendamento duplo ou estado inconsistente detectado:")
+        for p in problemas:
+            print(f"  - {p}")
+        sys.exit(1)
+    print("OK: nenhum agendamento duplo encontrado.")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
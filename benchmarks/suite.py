@@ -0,0 +1,294 @@
+"""
+Suíte offline do agente: conversas roteirizadas (benchmarks/corpora/*.json)
+dos fluxos do SYSTEM_PROMPT (marcar e cancelar consulta, marcar e cancelar
+exame) passando por handle_message com a IA falsa, cada rodada numa cópia
+nova do clinic.db. Mede por fluxo:
+  * latência por turno (média, p50, p99; sem latência da IA, só o agente)
+  * chamadas à IA por turno e por operação concluída (reserva ou cancelamento)
+  * comandos SQL por turno (trace callback do sqlite3 nas conexões do pool)
+  * memória em passadas com tracemalloc: pico alocado por turno e blocos
+    que continuaram vivos depois da conversa (sessões, caches...)
+  * resumo (hash) das respostas: só muda se o comportamento do agente mudar
+Os resultados vão em JSON para benchmarks/results/; `comparar` mostra a
+diferença entre duas execuções (ex: dois commits) e sai com erro se algo piorou.
+
+A IA é o modelo falso (benchmarks/_stub_model.py) ou, com --replay, as
+respostas gravadas por `gravar` (do Gemini, se houver GEMINI_API_KEY).
+
+Uso (na raiz do projeto):
+  python -m benchmarks.suite [--replay arquivo] [--saida arquivo.json]
+  python -m benchmarks.suite gravar [arquivo]
+  python -m benchmarks.suite comparar antes.json depois.json
+"""
+import asyncio
+import datetime
+import gc
+import glob
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import agent
+import booking
+import cache
+import db
+import llm_backends
+from benchmarks._stub_model import StubModel
+from benchmarks._util import copiar_banco_temporario, percentil, silenciar
+from benchmarks.fast_path_report import _primeiro_id_mostrado
+from config import create_model
+from llm_backends import GeminiBackend, LatencyDistribution, RecordingBackend, ReplayBackend
+from llm_usage import USAGE
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+PASTA_CORPORA = os.path.join(PASTA, "corpora")
+PASTA_RESULTADOS = os.path.join(PASTA, "results")
+# Rodadas de cada fluxo para a latência (as contagens são iguais em todas);
+# a primeira só aquece (imports tardios, caches do Python) e fica de fora
+REPETICOES = 20
+PASSADAS_DE_MEMORIA = 3
+# Piora tolerada nas medidas de tempo e memória antes de acusar regressão
+TOLERANCIA = 0.20
+# Medidas determinísticas: qualquer aumento é regressão
+MEDIDAS_EXATAS = ("chamadas_ia_por_turno", "chamadas_ia_por_operacao", "sql_por_turno", "sql_max_turno")
+# Com tolerância: a latência comparada é a média, entre os turnos, do menor tempo
+# de cada turno nas rodadas (como no timeit); p50 e p99 variam com a máquina e só são mostrados
+MEDIDAS_COM_TOLERANCIA = ("latencia_media_das_minimas_ms", "memoria_pico_kb", "blocos_retidos_por_turno")
+MEDIDAS_INFORMATIVAS = ("latencia_p50_ms", "latencia_p99_ms")
+
+
+def carregar_corpora(pasta: str = PASTA_CORPORA) -> list[dict]:
+    corpora = []
+    for caminho in sorted(glob.glob(os.path.join(pasta, "*.json"))):
+        with open(caminho, encoding="utf-8") as f:
+            corpora.append(json.load(f))
+    return corpora
+
+
+class SQLCounter:
+    """Conta os comandos SQL de todas as conexões do pool (trace callback do sqlite3)."""
+
+    def __init__(self):
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def _contar(self, _comando: str) -> None:
+        with self._lock:
+            self.total += 1
+
+    def instalar(self) -> None:
+        """Vale para as conexões abertas daqui em diante (o set_database_file renova todas)."""
+        abrir = db._open_connection
+
+        def abrir_com_contador(path):
+            conn = abrir(path)
+            conn.set_trace_callback(self._contar)
+            return conn
+
+        db._open_connection = abrir_com_contador
+
+
+SQL = SQLCounter()
+
+
+def _banco_novo() -> None:
+    db.set_database_file(copiar_banco_temporario())
+    for cache_de_resultados in cache.CACHES.values():
+        cache_de_resultados.clear()
+
+
+async def _rodar_corpus(corpus: dict, prefixo: str, medir_memoria: bool = False) -> list[dict]:
+    """Roda as conversas do corpus em sequência e devolve as medidas de cada turno."""
+    turnos = []
+    for indice, conversa in enumerate(corpus["conversas"]):
+        session_id = f"{prefixo}_{indice}"
+        for mensagem in conversa:
+            if "{id}" in mensagem:
+                mensagem = mensagem.replace("{id}", _primeiro_id_mostrado(session_id))
+            chamadas, sql = USAGE.summary()["calls"], SQL.total
+            operacoes = booking.ESTATISTICAS["reservas"] + booking.ESTATISTICAS["cancelamentos"]
+            if medir_memoria:
+                tracemalloc.reset_peak()
+                memoria_antes, _ = tracemalloc.get_traced_memory()
+            inicio = time.perf_counter()
+            resposta = await agent.handle_message_async(session_id, mensagem)
+            turno = {
+                "latencia": time.perf_counter() - inicio,
+                "resposta": resposta,
+                "chamadas_ia": USAGE.summary()["calls"] - chamadas,
+                "sql": SQL.total - sql,
+                "operacoes": booking.ESTATISTICAS["reservas"] + booking.ESTATISTICAS["cancelamentos"] - operacoes,
+            }
+            if medir_memoria:
+                _, pico = tracemalloc.get_traced_memory()
+                turno["memoria_pico"] = pico - memoria_antes
+            turnos.append(turno)
+    return turnos
+
+
+def medir_fluxo(corpus: dict) -> dict:
+    fluxo = corpus["fluxo"]
+    latencias = []
+    por_turno = []
+    for repeticao in range(REPETICOES + 1):
+        _banco_novo()
+        with silenciar():
+            turnos = asyncio.run(_rodar_corpus(corpus, f"{fluxo}_{repeticao}"))
+        if repeticao == 0:
+            primeira = turnos
+        else:
+            latencias += [turno["latencia"] * 1000 for turno in turnos]
+            por_turno.append([turno["latencia"] * 1000 for turno in turnos])
+
+    # Memória: o menor valor entre algumas passadas (tira o ruído de
+    # redimensionamentos e do GC que caem num turno qualquer)
+    passadas, retidos = [], []
+    tracemalloc.start()
+    try:
+        for passada in range(PASSADAS_DE_MEMORIA):
+            _banco_novo()
+            gc.collect()
+            blocos_antes = sys.getallocatedblocks()
+            with silenciar():
+                passadas.append(asyncio.run(_rodar_corpus(corpus, f"{fluxo}_memoria_{passada}", medir_memoria=True)))
+            gc.collect()
+            retidos.append(sys.getallocatedblocks() - blocos_antes)
+    finally:
+        tracemalloc.stop()
+    picos = [min(turno["memoria_pico"] for turno in turnos) for turnos in zip(*passadas)]
+
+    chamadas = sum(turno["chamadas_ia"] for turno in primeira)
+    operacoes = sum(turno["operacoes"] for turno in primeira)
+    sql = [turno["sql"] for turno in primeira]
+    respostas = "\n".join(str(turno["resposta"]) for turno in primeira)
+    return {
+        "conversas": len(corpus["conversas"]),
+        "turnos": len(primeira),
+        "operacoes_concluidas": operacoes,
+        "latencia_media_das_minimas_ms": round(statistics.fmean(min(tempos) for tempos in zip(*por_turno)), 3),
+        "latencia_media_ms": round(statistics.fmean(latencias), 3),
+        "latencia_p50_ms": round(percentil(latencias, 50), 3),
+        "latencia_p99_ms": round(percentil(latencias, 99), 3),
+        "chamadas_ia": chamadas,
+        "chamadas_ia_por_turno": round(chamadas / len(primeira), 3),
+        "chamadas_ia_por_operacao": round(chamadas / operacoes, 3) if operacoes else None,
+        "sql_por_turno": round(statistics.fmean(sql), 3),
+        "sql_max_turno": max(sql),
+        "memoria_pico_kb": round(statistics.fmean(picos) / 1024, 1),
+        "blocos_retidos_por_turno": round(min(retidos) / len(primeira), 1),
+        "resumo_respostas": hashlib.sha256(respostas.encode("utf-8")).hexdigest()[:16],
+    }
+
+
+def _commit_atual() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=PASTA, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+
+def executar(replay: str | None, saida: str | None) -> str:
+    if replay:
+        with silenciar():
+            agent.model = ReplayBackend(agent.SYSTEM_PROMPT, arquivo=replay, latencia=LatencyDistribution("fixed:0"))
+        if not agent.model.gravacoes:
+            sys.exit(f"ERRO: Nenhuma gravação em {replay}. Rode antes: python -m benchmarks.suite gravar {replay}")
+    else:
+        agent.model = StubModel(0.0, 0.0)
+    SQL.instalar()
+
+    resultado = {
+        "commit": _commit_atual(),
+        "data": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "ia": f"replay:{os.path.basename(replay)}" if replay else "modelo falso",
+        "repeticoes": REPETICOES,
+        "fluxos": {},
+    }
+    print(f"{'fluxo':>22} | {'turnos':>6} | {'média mín.':>10} | {'p50':>8} | {'p99':>8} | {'IA/turno':>8} | {'IA/operação':>11} | "
+          f"{'SQL/turno':>9} | {'pico KB':>7} | {'blocos':>6}")
+    for corpus in carregar_corpora():
+        medidas = resultado["fluxos"][corpus["fluxo"]] = medir_fluxo(corpus)
+        por_operacao = medidas["chamadas_ia_por_operacao"]
+        print(f"{corpus['fluxo']:>22} | {medidas['turnos']:>6} | {medidas['latencia_media_das_minimas_ms']:>8.2f}ms | "
+              f"{medidas['latencia_p50_ms']:>6.2f}ms | "
+              f"{medidas['latencia_p99_ms']:>6.2f}ms | {medidas['chamadas_ia_por_turno']:>8.2f} | "
+              f"{'-' if por_operacao is None else f'{por_operacao:.2f}':>11} | {medidas['sql_por_turno']:>9.1f} | "
+              f"{medidas['memoria_pico_kb']:>7.1f} | {medidas['blocos_retidos_por_turno']:>6.1f}")
+
+    if saida is None:
+        os.makedirs(PASTA_RESULTADOS, exist_ok=True)
+        carimbo = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        saida = os.path.join(PASTA_RESULTADOS, f"{carimbo}_{resultado['commit']}.json")
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\nresultados em {saida}")
+    return saida
+
+
+def gravar(arquivo: str) -> None:
+    gemini = create_model(agent.SYSTEM_PROMPT)
+    origem = "Gemini" if gemini else "modelo falso (sem GEMINI_API_KEY)"
+    if os.path.exists(arquivo):
+        os.remove(arquivo)
+    agent.model = RecordingBackend(GeminiBackend(gemini or StubModel(0.0, 0.0), agent.SYSTEM_PROMPT), arquivo)
+    for corpus in carregar_corpora():
+        _banco_novo()
+        with silenciar():
+            asyncio.run(_rodar_corpus(corpus, corpus["fluxo"]))
+    print(f"{llm_backends.metrics()['gravadas']} respostas do {origem} gravadas em {arquivo}")
+
+
+def comparar(caminho_antes: str, caminho_depois: str) -> bool:
+    """Imprime as diferenças por fluxo; retorna True se houver regressão."""
+    with open(caminho_antes, encoding="utf-8") as f:
+        antes = json.load(f)
+    with open(caminho_depois, encoding="utf-8") as f:
+        depois = json.load(f)
+    print(f"antes: {antes['commit']} ({antes['data']}) | depois: {depois['commit']} ({depois['data']})\n")
+    regressao = False
+    for fluxo, medidas in depois["fluxos"].items():
+        anteriores = antes["fluxos"].get(fluxo)
+        if anteriores is None:
+            print(f"{fluxo}: novo")
+            continue
+        print(fluxo)
+        for medida in MEDIDAS_EXATAS + MEDIDAS_COM_TOLERANCIA + MEDIDAS_INFORMATIVAS:
+            valor_antes, valor_depois = anteriores.get(medida), medidas.get(medida)
+            if valor_antes is None or valor_depois is None:
+                continue
+            variacao = (valor_depois - valor_antes) / valor_antes if valor_antes else 0.0
+            if medida in MEDIDAS_EXATAS:
+                piorou = valor_depois > valor_antes
+            elif medida in MEDIDAS_COM_TOLERANCIA:
+                piorou = variacao > TOLERANCIA
+            else:
+                piorou = False
+            regressao |= piorou
+            print(f"  {medida:>29}: {valor_antes:>10} -> {valor_depois:>10} ({variacao:+.1%})"
+                  f"{'  <-- REGRESSÃO' if piorou else ''}")
+        if anteriores["resumo_respostas"] != medidas["resumo_respostas"]:
+            print(f"  {'resumo_respostas':>29}: {anteriores['resumo_respostas']} -> {medidas['resumo_respostas']}"
+                  f"  (as respostas mudaram)")
+    return regressao
+
+
+if __name__ == "__main__":
+    argumentos = sys.argv[1:]
+    if argumentos and argumentos[0] == "comparar":
+        if len(argumentos) != 3:
+            sys.exit("Uso: python -m benchmarks.suite comparar antes.json depois.json")
+        sys.exit(1 if comparar(argumentos[1], argumentos[2]) else 0)
+    elif argumentos and argumentos[0] == "gravar":
+        gravar(argumentos[1] if len(argumentos) > 1 else llm_backends.LLM_REPLAY_FILE)
+    else:
+        opcoes = dict(zip(argumentos[::2], argumentos[1::2]))
+        executar(opcoes.get("--replay"), opcoes.get("--saida"))
@@ -0,0 +1,223 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+from db import transaction
+from idempotency import guardar_resultado, resultado_anterior
+
+logger = logging.getLogger(__name__)
+
+# --- Motor de Reservas ---
+# Reserva e cancelamento de horários (consultas e exames) de forma atômica:
+# o horário é "tomado" com um único UPDATE condicional dentro de uma transação
+# de escrita (BEGIN IMMEDIATE), e o índice único parcial criado em
+# migrations.py impede dois agendamentos confirmados no mesmo horário.
+
+# Tabelas envolvidas em cada tipo de reserva (nomes fixos, nunca vêm do usuário)
+RECURSOS = {
+    "consulta": {
+        "tabela_horarios": "horarios_disponiveis",
+        "tabela_agendamentos": "agendamentos",
+        "coluna_horario": "horario_id",
+        "coluna_recurso": "medico_id",
+    },
+    "exame": {
+        "tabela_horarios": "horarios_exames",
+        "tabela_agendamentos": "agendamentos_exames",
+        "coluna_horario": "horario_exame_id",
+        "coluna_recurso": "exame_id",
+    },
+}
+
+# --- Resultados possíveis ---
+RESERVADO = "reservado"
+CANCELADO = "cancelado"
+HORARIO_INEXISTENTE = "horario_inexistente"
+HORARIO_INDISPONIVEL = "horario_indisponivel"
+AGENDAMENTO_INEXISTENTE = "agendamento_inexistente"
+AGENDAMENTO_NAO_CONFIRMADO = "agendamento_nao_confirmado"
+
+# --- Retentativas em SQLITE_BUSY ---
+MAX_TENTATIVAS = 6
+BACKOFF_BASE_SECONDS = 0.01
+BACKOFF_MAX_SECONDS = 0.5
+
+# Contadores simples (lidos por benchmarks e métricas)
+ESTATISTICAS = {"reservas": 0, "conflitos": 0, "cancelamentos": 0, "retentativas_busy": 0, "repetidas": 0}
+_estatisticas_lock = threading.Lock()
+
+
+def _contar(chave: str) -> None:
+    with _estatisticas_lock:
+        ESTATISTICAS[chave] += 1
+
+
+def metrics() -> dict:
+    with _estatisticas_lock:
+        return dict(ESTATISTICAS)
+
+
+# --- Avisos de Horário Ocupado/Liberado ---
+# Chamados depois do COMMIT de cada reserva/cancelamento efetivo com
+# (tipo, recurso_id, data_hora_inicio, horario_id, disponivel, versão da tabela
+# de horários). O availability.py se registra aqui para atualizar o índice de
+# horários livres sem reler a tabela; a versão diz se ele perdeu alguma escrita.
+OBSERVADORES = []
+
+
+def _mudanca_no_horario(conn, recurso: dict, horario_id: int) -> tuple | None:
+    """(recurso_id, data_hora_inicio, versão da tabela), lidos na mesma transação da escrita."""
+    if not OBSERVADORES:
+        return None
+    return conn.execute(
+        f"SELECT h.{recurso['coluna_recurso']}, h.data_hora_inicio, v.versao "
+        f"FROM {recurso['tabela_horarios']} h JOIN versoes_tabelas v ON v.tabela = ? WHERE h.id = ?",
+        (recurso["tabela_horarios"], horario_id)
+    ).fetchone()
+
+
+def _avisar(tipo: str, horario_id: int, disponivel: bool, mudanca: tuple | None) -> None:
+    if mudanca is None:
+        return
+    recurso_id, data_hora, versao = mudanca
+    for observador in OBSERVADORES:
+        try:
+            observador(tipo, recurso_id, data_hora, horario_id, disponivel, versao)
+        except Exception:
+            # A reserva já foi gravada: um observador com problema não pode desfazê-la
+            logger.exception("RESERVAS: Falha ao avisar %r", observador)
+
+
+def _is_busy(erro: sqlite3.OperationalError) -> bool:
+    codigo = getattr(erro, "sqlite_errorcode", None)
+    if codigo is not None:
+        return codigo in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(erro) or "busy" in str(erro)
+
+
+def executar_escrita(operacao):
+    """
+    Executa `operacao(conn)` dentro de uma transação BEGIN IMMEDIATE.
+    Se o banco estiver ocupado (SQLITE_BUSY), tenta novamente com backoff
+    exponencial com jitter, até MAX_TENTATIVAS vezes.
+    """
+    for tentativa in range(MAX_TENTATIVAS):
+        try:
+            with transaction(immediate=True) as conn:
+                return operacao(conn)
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or tentativa == MAX_TENTATIVAS - 1:
+                raise
+            _contar("retentativas_busy")
+            espera = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** tentativa))
+            time.sleep(random.uniform(0, espera))
+
+
+def _idempotente(operacao, idempotency_key: str | None):
+    """
+    Envolve a operação de escrita: se a chave já foi usada, devolve o resultado
+    gravado (sem escrever de novo); senão grava o resultado na mesma transação.
+    Retorna (resultado, repetida).
+    """
+    def com_chave(conn):
+        anterior = resultado_anterior(conn, idempotency_key)
+        if anterior is not None:
+            return anterior, True
+        resultado = operacao(conn)
+        guardar_resultado(conn, idempotency_key, resultado)
+        return resultado, False
+    return com_chave
+
+
+def reservar_horario(tipo: str, horario_id: int, nome_paciente: str, telegram_chat_id: str,
+                     idempotency_key: str | None = None) -> str:
+    """
+    Tenta reservar o horário para o paciente.
+    Retorna RESERVADO, HORARIO_INEXISTENTE ou HORARIO_INDISPONIVEL.
+    Com `idempotency_key`, repetir a chamada devolve o mesmo resultado da primeira.
+    """
+    recurso = RECURSOS[tipo]
+    tabela_horarios = recurso["tabela_horarios"]
+    mudancas = []
+
+    def operacao(conn):
+        mudancas.clear()
+        # Etapa 1: "Toma" o horário só se ele ainda estiver disponível (UPDATE condicional)
+        cursor = conn.execute(
+            f"UPDATE {tabela_horarios} SET status = 'agendado' WHERE id = ? AND status = 'disponivel'",
+            (horario_id,)
+        )
+        if cursor.rowcount == 0:
+            existe = conn.execute(f"SELECT 1 FROM {tabela_horarios} WHERE id = ?", (horario_id,)).fetchone()
+            return HORARIO_INDISPONIVEL if existe else HORARIO_INEXISTENTE
+
+        # Etapa 2: Registra o agendamento (o índice único barra duplicidade)
+        conn.execute(
+            f"INSERT INTO {recurso['tabela_agendamentos']} ({recurso['coluna_horario']}, nome_paciente, telegram_chat_id) VALUES (?, ?, ?)",
+            (horario_id, nome_paciente, telegram_chat_id)
+        )
+        mudancas.append(_mudanca_no_horario(conn, recurso, horario_id))
+        return RESERVADO
+
+    try:
+        resultado, repetida = executar_escrita(_idempotente(operacao, idempotency_key))
+    except sqlite3.IntegrityError:
+        # Outro agendamento confirmado já usa este horário: a transação foi desfeita
+        resultado, repetida = HORARIO_INDISPONIVEL, False
+
+    _contar("repetidas" if repetida else "reservas" if resultado == RESERVADO else "conflitos")
+    if resultado == RESERVADO and not repetida:
+        _avisar(tipo, horario_id, False, mudancas[-1])
+    return resultado
+
+
+def cancelar_reserva(tipo: str, agendamento_id: int, telegram_chat_id: str,
+                     idempotency_key: str | None = None) -> tuple[str, str | None]:
+    """
+    Cancela o agendamento do usuário e devolve o horário para 'disponivel'.
+    Retorna (resultado, status_atual), onde resultado é CANCELADO,
+    AGENDAMENTO_INEXISTENTE ou AGENDAMENTO_NAO_CONFIRMADO.
+    Com `idempotency_key`, repetir a chamada devolve o mesmo resultado da primeira.
+    """
+    recurso = RECURSOS[tipo]
+    tabela_agendamentos = recurso["tabela_agendamentos"]
+    mudancas = []
+
+    def operacao(conn):
+        mudancas.clear()
+        # Etapa 1: Verifica se o agendamento existe e pertence ao usuário
+        result = conn.execute(
+            f"SELECT {recurso['coluna_horario']}, status FROM {tabela_agendamentos} WHERE id = ? AND telegram_chat_id = ?",
+            (agendamento_id, telegram_chat_id)
+        ).fetchone()
+        if not result:
+            return AGENDAMENTO_INEXISTENTE, None
+
+        horario_id, status_agendamento = result
+
+        # Etapa 2: Cancela só se ainda estiver confirmado (UPDATE condicional)
+        cursor = conn.execute(
+            f"UPDATE {tabela_agendamentos} SET status = 'cancelado' WHERE id = ? AND status = 'confirmado'",
+            (agendamento_id,)
+        )
+        if cursor.rowcount == 0:
+            return AGENDAMENTO_NAO_CONFIRMADO, status_agendamento
+
+        # Etapa 3: Libera o horário
+        conn.execute(
+            f"UPDATE {recurso['tabela_horarios']} SET status = 'disponivel' WHERE id = ?",
+            (horario_id,)
+        )
+        mudancas.append((horario_id, _mudanca_no_horario(conn, recurso, horario_id)))
+        return CANCELADO, 'cancelado'
+
+    resultado, repetida = executar_escrita(_idempotente(operacao, idempotency_key))
+    if repetida:
+        _contar("repetidas")
+    elif resultado[0] == CANCELADO:
+        _contar("cancelamentos")
+        horario_id, mudanca = mudancas[-1]
+        _avisar(tipo, horario_id, True, mudanca)
+    return tuple(resultado)
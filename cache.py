@@ -0,0 +1,141 @@
+import functools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# --- Cache Versionado de Respostas ---
+# Guarda o resultado das ferramentas só de leitura (e as respostas finais de
+# perguntas frequentes) junto com a versão das tabelas de que ele depende.
+# As versões ficam em `versoes_tabelas` e são incrementadas por triggers
+# (migrações 004 e 006) na mesma transação de quem altera a tabela: quando
+# uma reserva/cancelamento é confirmado, só as entradas que leram aquela
+# tabela deixam de valer, inclusive em outros workers. Os horários criados/
+# apagados em lote (schedules.py) sobem a versão uma vez por lote.
+
+# Limite de entradas por cache (as menos usadas saem primeiro)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+# Validade máxima de uma entrada, mesmo sem escrita nas tabelas
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "600"))
+# Ferramentas/caches que NUNCA usam cache (ex: "tool_obter_info_clinica,respostas_faq")
+CACHE_DISABLED = {nome.strip() for nome in os.getenv("CACHE_DISABLED", "").split(",") if nome.strip()}
+
+# Resultados que indicam falha (não podem ficar guardados)
+PREFIXOS_DE_ERRO = ("Ocorreu um erro", "Erro:")
+
+
+def versoes(tabelas: tuple[str, ...]) -> tuple[int, ...]:
+    """Versão atual de cada tabela (0 se ela não tiver contador)."""
+    atuais = dict(get_connection().execute(
+        f"SELECT tabela, versao FROM versoes_tabelas WHERE tabela IN ({', '.join('?' for _ in tabelas)})",
+        tabelas
+    ).fetchall())
+    return tuple(atuais.get(tabela, 0) for tabela in tabelas)
+
+
+class VersionedCache:
+    """
+    LRU com TTL em que cada entrada guarda as versões das tabelas lidas.
+    Uma entrada só é devolvida se essas versões ainda forem as atuais.
+    """
+
+    def __init__(self, nome: str, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.nome = nome
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: OrderedDict = OrderedDict()  # chave -> (expira_em, versoes, valor)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+        CACHES[nome] = self
+
+    def get(self, chave, tabelas: tuple[str, ...]):
+        """Valor guardado, ou None se não houver, tiver vencido ou as tabelas mudaram."""
+        atuais = versoes(tabelas)
+        with self._lock:
+            entrada = self._data.get(chave)
+            if entrada is None:
+                self._stats["misses"] += 1
+                return None
+            if entrada[0] < time.monotonic() or entrada[1] != atuais:
+                del self._data[chave]
+                self._stats["stale"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._data.move_to_end(chave)
+            self._stats["hits"] += 1
+            return entrada[2]
+
+    def set(self, chave, valor, tabelas: tuple[str, ...], versoes_lidas: tuple[int, ...] | None = None) -> None:
+        """
+        Guarda o valor. `versoes_lidas` deve ser a versão ANTES de calcular o valor:
+        se alguém escreveu no meio tempo, a entrada já nasce inválida (nunca fica velha).
+        """
+        with self._lock:
+            self._data[chave] = (time.monotonic() + self.ttl_seconds, versoes_lidas or versoes(tabelas), valor)
+            self._data.move_to_end(chave)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._data)
+        consultas = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / consultas if consultas else 0.0
+        return stats
+
+
+# Registro de todos os caches (para métricas)
+CACHES: dict[str, VersionedCache] = {}
+
+# Resultados das ferramentas de leitura
+TOOL_RESULTS = VersionedCache("resultados_ferramentas")
+
+
+def enabled(nome: str) -> bool:
+    """False se a ferramenta/cache estiver em CACHE_DISABLED."""
+    return nome not in CACHE_DISABLED
+
+
+def cached_tool(*tabelas: str):
+    """
+    Decorator para ferramentas SÓ DE LEITURA: memoriza o resultado por
+    argumentos enquanto as `tabelas` não mudarem. Respostas de erro não são
+    guardadas. Desative por ferramenta com CACHE_DISABLED=nome_da_ferramenta.
+    """
+    def decorator(tool_function):
+        nome = tool_function.__name__
+
+        @functools.wraps(tool_function)
+        def wrapper(*args, **kwargs):
+            if not enabled(nome):
+                return tool_function(*args, **kwargs)
+            chave = (nome, args, tuple(sorted(kwargs.items())))
+            resultado = TOOL_RESULTS.get(chave, tabelas)
+            if resultado is not None:
+                logger.debug("CACHE: Resultado de %s reaproveitado", nome)
+                return resultado
+            versoes_lidas = versoes(tabelas)
+            resultado = tool_function(*args, **kwargs)
+            if isinstance(resultado, str) and not resultado.startswith(PREFIXOS_DE_ERRO):
+                TOOL_RESULTS.set(chave, resultado, tabelas, versoes_lidas)
+            return resultado
+
+        wrapper.cache_tables = tabelas
+        return wrapper
+    return decorator
+
+
+def metrics() -> dict:
+    """Estatísticas de cada cache registrado."""
+    return {nome: cache.metrics() for nome, cache in CACHES.items()}
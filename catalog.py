@@ -0,0 +1,148 @@
+import logging
+import re
+import threading
+import unicodedata
+
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# --- Índice de Catálogo (especialidades, médicos e exames) ---
+# Resolve o termo digitado pelo usuário ("dermato", "Dermatologia", "cardiologista",
+# "coração", "exame de sangue") para os IDs exatos de medicos/exames, sem
+# LIKE '%x%' no banco. O índice fica em memória (dicionário: busca O(1) por termo)
+# e é reconstruído quando a versão da tabela muda (triggers da migração 004).
+
+# Tamanho mínimo de um prefixo indexado (ex: "card" encontra "cardiologia")
+MIN_PREFIXO = 4
+
+# Palavras que não ajudam a identificar o item
+STOPWORDS = {"de", "da", "do", "das", "dos", "e", "em", "com", "para", "a", "o", "exame", "exames", "consulta", "medico", "medica"}
+
+# Sufixos removidos pelo "radical" (ordem importa: do mais longo para o mais curto)
+SUFIXOS = ["ologista", "ologistas", "ologia", "ologias", "ologo", "ologa", "ologos", "istas", "ista", "ias", "ia", "s"]
+
+# Apelidos comuns -> termo que já existe no catálogo
+ALIASES = {
+    "coracao": "cardiologia",
+    "cardiaco": "cardiologia",
+    "pele": "dermatologia",
+    "hemograma": "sangue",
+    "ecg": "eletrocardiograma",
+    "doutor": "dr",
+    "doutora": "dra",
+}
+
+
+def normalizar(texto: str) -> list[str]:
+    """Minúsculas, sem acentos, só letras/números. Retorna a lista de palavras."""
+    sem_acentos = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return re.findall(r"[a-z0-9]+", sem_acentos.lower())
+
+
+def radical(palavra: str) -> str:
+    """Radical simples em português: 'dermatologista' e 'dermatologia' -> 'dermatolog'."""
+    for sufixo in SUFIXOS:
+        if palavra.endswith(sufixo) and len(palavra) - len(sufixo) >= MIN_PREFIXO:
+            base = palavra[:-len(sufixo)]
+            # Mantém o "olog" para que 'cardiologia' e 'cardiologo' caiam no mesmo radical
+            return base + "olog" if sufixo.startswith("olog") else base
+    return palavra
+
+
+def _chaves_do_termo(termo: str) -> list[str]:
+    """Radicais das palavras relevantes do termo (aplicando os apelidos)."""
+    chaves = []
+    for palavra in normalizar(termo):
+        palavra = ALIASES.get(palavra, palavra)
+        if palavra in STOPWORDS:
+            continue
+        chaves.append(radical(palavra))
+    return chaves
+
+
+class CatalogIndex:
+    """
+    Índice em memória: prefixo do radical -> conjunto de IDs.
+    `resolver()` confere a versão da tabela antes de responder e reconstrói o
+    índice se alguém alterou o catálogo (inclusive outro processo/worker).
+    """
+
+    def __init__(self, tabela: str, sql_itens: str):
+        self.tabela = tabela
+        self.sql_itens = sql_itens
+        self._indice: dict[str, frozenset[int]] = {}
+        self._nomes: dict[int, str] = {}
+        self._versao = None
+        self._lock = threading.Lock()
+
+    def _versao_atual(self, conn) -> int:
+        result = conn.execute("SELECT versao FROM versoes_tabelas WHERE tabela = ?", (self.tabela,)).fetchone()
+        return result[0] if result else 0
+
+    def _reconstruir(self, conn, versao: int) -> None:
+        indice: dict[str, set[int]] = {}
+        nomes = {}
+        for item_id, nome in conn.execute(self.sql_itens):
+            nomes[item_id] = nome
+            chaves = set(_chaves_do_termo(nome))
+            # O nome inteiro "colado" também vale (ex: "checkup" -> "Check-up Geral")
+            chaves.add("".join(normalizar(nome)))
+            for chave in chaves:
+                indice.setdefault(chave, set()).add(item_id)
+                for tamanho in range(MIN_PREFIXO, len(chave)):
+                    indice.setdefault(chave[:tamanho], set()).add(item_id)
+        self._indice = {chave: frozenset(ids) for chave, ids in indice.items()}
+        self._nomes = nomes
+        self._versao = versao
+        logger.info("CATÁLOGO: Índice de '%s' reconstruído (%s chaves, versão %s)", self.tabela, len(self._indice), versao)
+
+    def _atualizar(self) -> None:
+        conn = get_connection()
+        versao = self._versao_atual(conn)
+        if versao != self._versao:
+            with self._lock:
+                if versao != self._versao:
+                    self._reconstruir(conn, versao)
+
+    def resolver(self, termo: str) -> list[int]:
+        """
+        Retorna os IDs que casam com TODAS as palavras relevantes do termo
+        (lista vazia se nada casar).
+        """
+        self._atualizar()
+        indice = self._indice
+        ids = None
+        for chave in _chaves_do_termo(termo):
+            encontrados = indice.get(chave)
+            if encontrados is None:
+                return []
+            ids = encontrados if ids is None else ids & encontrados
+        return sorted(ids) if ids else []
+
+    def nome(self, item_id: int) -> str | None:
+        """
+        Nome do item como está no banco, pelo índice em memória (sem consulta
+        se ele já foi carregado; use depois de `resolver()` para o nome atual).
+        """
+        if self._versao is None:
+            self._atualizar()
+        return self._nomes.get(item_id)
+
+    def ids_dos_nomes(self, nomes: list[str]) -> list[int]:
+        """IDs dos itens com exatamente esses nomes (ex: a lista de exames mostrada), na mesma ordem."""
+        if self._versao is None:
+            self._atualizar()
+        por_nome = {nome: item_id for item_id, nome in self._nomes.items()}
+        return [por_nome[nome] for nome in nomes if nome in por_nome]
+
+    def invalidar(self) -> None:
+        """Força a reconstrução na próxima consulta."""
+        self._versao = None
+
+
+# --- Índices usados pelas ferramentas ---
+MEDICOS_POR_ESPECIALIDADE = CatalogIndex("medicos", "SELECT id, especialidade FROM medicos")
+# Filtro de médico nas listagens de horários ("Ana", "Dra. Ana Silva", "doutora Ana")
+MEDICOS_POR_NOME = CatalogIndex("medicos", "SELECT id, nome FROM medicos")
+EXAMES_POR_NOME = CatalogIndex("exames", "SELECT id, nome_exame FROM exames")
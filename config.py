@@ -1,7 +1,14 @@
+import logging
 import os
+import threading
+import time
+from datetime import timedelta
+
 import google.generativeai as genai
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 # Carrega as variáveis de ambiente do .env
 load_dotenv()
 
@@ -12,22 +19,98 @@ _telegram_token_bruto = os.getenv("TELEGRAM_BOT_TOKEN")
 GEMINI_API_KEY = _gemini_key_bruto.strip() if _gemini_key_bruto else None
 TELEGRAM_BOT_TOKEN = _telegram_token_bruto.strip() if _telegram_token_bruto else None
 
-# --- Inicializa o Modelo da IA (só uma vez) ---
-model = None
+# --- Modelo e Cache de Contexto ---
+MODEL_NAME = os.getenv("GEMINI_MODEL", "models/gemini-flash-latest")
+# O cache de contexto exige um modelo com versão fixa (ex: models/gemini-2.0-flash-001)
+# e um prompt acima do mínimo de tokens do provedor; por isso é opcional.
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "0") == "1"
+CONTEXT_CACHE_MODEL = os.getenv("GEMINI_CONTEXT_CACHE_MODEL", "models/gemini-2.0-flash-001")
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+# Renova o cache este tempo antes de vencer; depois de uma falha, espera isto para tentar de novo
+CONTEXT_CACHE_RENEW_MARGIN_SECONDS = 60
+CONTEXT_CACHE_RETRY_SECONDS = 60
+
+# Configuração de geração do Gemini
+generation_config = { "response_mime_type": "application/json" }
+
 if GEMINI_API_KEY:
     try:
         genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel('models/gemini-flash-latest')
-        print("API do Gemini configurada com sucesso (usando gemini-flash-latest).")
+        logger.info("API do Gemini configurada com sucesso (usando %s).", MODEL_NAME)
     except Exception as e:
-        print(f"ERRO: Falha ao configurar a API do Gemini. Erro: {e}")
+        logger.error("Falha ao configurar a API do Gemini. Erro: %s", e)
 else:
-    print("ERRO: GEMINI_API_KEY não encontrada no .env. A IA não vai funcionar.")
+    logger.error("GEMINI_API_KEY não encontrada no .env. A IA não vai funcionar.")
 
 if not TELEGRAM_BOT_TOKEN:
-    print("ERRO: TELEGRAM_BOT_TOKEN não encontrado no .env. O bot não vai funcionar.")
+    logger.error("TELEGRAM_BOT_TOKEN não encontrado no .env. O bot não vai funcionar.")
 
-# Configuração de geração do Gemini
-generation_config = { "response_mime_type": "application/json" }
 
-print("--------------------------------------------------")
\ No newline at end of file
+class _CachedContextModel:
+    """
+    Modelo criado a partir de um cache de contexto do Gemini (o prompt de
+    sistema fica guardado no provedor). Renova o TTL do cache antes de vencer,
+    numa thread em segundo plano: `start_chat` roda dentro dos turnos async e
+    `cache.update` é uma chamada de rede síncrona.
+    """
+
+    def __init__(self, cache, config_geracao=generation_config):
+        self._cache = cache
+        self._renovar_em = time.time() + CONTEXT_CACHE_TTL_SECONDS - CONTEXT_CACHE_RENEW_MARGIN_SECONDS
+        self._renovando = threading.Lock()
+        self._model = genai.GenerativeModel.from_cached_content(cached_content=cache, generation_config=config_geracao)
+
+    def start_chat(self, **kwargs):
+        # Uma renovação por vez; os turnos não esperam por ela
+        if time.time() > self._renovar_em and self._renovando.acquire(blocking=False):
+            threading.Thread(target=self._renovar, name="renovar-cache-contexto", daemon=True).start()
+        return self._model.start_chat(**kwargs)
+
+    def _renovar(self) -> None:
+        try:
+            self._cache.update(ttl=timedelta(seconds=CONTEXT_CACHE_TTL_SECONDS))
+            self._renovar_em = time.time() + CONTEXT_CACHE_TTL_SECONDS - CONTEXT_CACHE_RENEW_MARGIN_SECONDS
+        except Exception as e:
+            # Sem isso, todo turno seguinte tentaria de novo
+            self._renovar_em = time.time() + CONTEXT_CACHE_RETRY_SECONDS
+            logger.warning("Falha ao renovar o cache de contexto (nova tentativa em %ss): %s",
+                           CONTEXT_CACHE_RETRY_SECONDS, e)
+        finally:
+            self._renovando.release()
+
+
+def create_model(system_instruction: str, tools: list | None = None):
+    """
+    Cria o modelo UMA vez com o prompt de sistema como `system_instruction`
+    (em vez de reenviá-lo no histórico a cada mensagem). Se GEMINI_CONTEXT_CACHE=1,
+    tenta guardar esse prompt no cache de contexto do Gemini; se não der, usa
+    o modelo normal. Retorna None se não houver chave de API.
+    Com `tools` (declarações de função), o modelo usa chamadas de função
+    nativas e responde em texto livre, sem o formato JSON obrigatório.
+    """
+    if not GEMINI_API_KEY:
+        return None
+    config_geracao = {} if tools else generation_config
+
+    if CONTEXT_CACHE_ENABLED:
+        try:
+            from google.generativeai import caching
+            cache = caching.CachedContent.create(
+                model=CONTEXT_CACHE_MODEL,
+                display_name="clinica-system-prompt",
+                system_instruction=system_instruction,
+                tools=tools,
+                ttl=timedelta(seconds=CONTEXT_CACHE_TTL_SECONDS),
+            )
+            logger.info("Cache de contexto criado para o prompt de sistema (%s).", CONTEXT_CACHE_MODEL)
+            return _CachedContextModel(cache, config_geracao)
+        except Exception as e:
+            logger.warning("Cache de contexto indisponível (%s). Usando system_instruction sem cache.", e)
+
+    try:
+        return genai.GenerativeModel(MODEL_NAME, system_instruction=system_instruction, tools=tools,
+                                     generation_config=config_geracao)
+    except Exception as e:
+        logger.error("Falha ao criar o modelo do Gemini. Erro: %s", e)
+        return None
+
@@ -1,17 +1,22 @@
+import datetime
 import sqlite3
 
-def setup_database():
-    conn = sqlite3.connect('clinic.db')
+import db
+from migrations import run_migrations
+from schedules import gerar_horarios
+
+def setup_database(database_file: str | None = None):
+    # Por padrão usa o mesmo arquivo do pool (clinic.db ou CLINIC_DB_PATH)
+    database_file = database_file or db.DATABASE_FILE
+
+    # --- Schema: tabelas e índices vêm das migrações versionadas (migrations.py) ---
+    versao = run_migrations(database_file)
+    print(f"Schema do banco na versão {versao}.")
+
+    conn = sqlite3.connect(database_file)
     cursor = conn.cursor()
 
-    # --- Tabela de Informações (Já existe) ---
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS info (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        topic TEXT NOT NULL UNIQUE,
-        value TEXT NOT NULL
-    )
-    ''')
+    # --- Dados de Informações ---
     info_data = [
         ('endereco', 'Nosso endereço é Rua das Flores, 123 - Centro.'),
         ('horario_funcionamento', 'Atendemos de Segunda a Sexta, das 08:00 às 18:00.'),
@@ -19,14 +24,7 @@ def setup_database():
     ]
     cursor.executemany("INSERT OR IGNORE INTO info (topic, value) VALUES (?, ?)", info_data)
 
-    # --- NOVO: Tabela de Médicos ---
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS medicos (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome TEXT NOT NULL,
-        especialidade TEXT NOT NULL
-    )
-    ''')
+    # --- Médicos de Exemplo ---
     medicos_data = [
         (1, 'Dra. Ana Silva', 'Cardiologia'),
         (2, 'Dr. Bruno Costa', 'Dermatologista'),
@@ -35,38 +33,7 @@ def setup_database():
     cursor.executemany("INSERT OR IGNORE INTO medicos (id, nome, especialidade) VALUES (?, ?, ?)", medicos_data)
     print("Tabela 'medicos' e dados de exemplo inseridos.")
 
-    # --- NOVO: Tabela de Horários Disponíveis (Para Consultas) ---
-    # No futuro, o 'status' mudará para 'agendado'
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS horarios_disponiveis (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        medico_id INTEGER NOT NULL,
-        data_hora_inicio DATETIME NOT NULL,
-        status TEXT NOT NULL DEFAULT 'disponivel',
-        FOREIGN KEY (medico_id) REFERENCES medicos (id)
-    )
-    ''')
-    # Vamos usar datas relativas ao dia que você está testando (23/10/2025)
-    horarios_data = [
-        # Horários para Dra. Ana Silva (Cardiologia)
-        (1, 1, '2025-11-24 09:00:00', 'disponivel'),
-        (2, 1, '2025-11-24 10:00:00', 'disponivel'),
-        # Horários para Dr. Bruno Costa (Dermatologia)
-        (3, 2, '2025-11-24 14:00:00', 'disponivel'),
-        # Horários para Dr. Carlos Dias (Cardiologia)
-        (4, 3, '2025-11-24 09:00:00', 'disponivel')
-    ]
-    cursor.executemany("INSERT OR IGNORE INTO horarios_disponiveis (id, medico_id, data_hora_inicio, status) VALUES (?, ?, ?, ?)", horarios_data)
-    print("Tabela 'horarios_disponiveis' e dados de exemplo inseridos.")
-
-    # --- NOVO: Tabela de Tipos de Exames ---
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS exames (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome_exame TEXT NOT NULL UNIQUE,
-        descricao TEXT 
-    )
-    ''')
+    # --- Tipos de Exames ---
     exames_data = [
         ('Check-up Geral', 'Exames de rotina para avaliação geral da saúde.'),
         ('Exame de Sangue', 'Coleta de sangue para análise laboratorial.'),
@@ -75,65 +42,53 @@ def setup_database():
     cursor.executemany("INSERT OR IGNORE INTO exames (nome_exame, descricao) VALUES (?, ?)", exames_data)
     print("Tabela 'exames' e dados de exemplo inseridos.")
 
-   # --- NOVO: Tabela de Horários Disponíveis para Exames ---
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS horarios_exames (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        exame_id INTEGER NOT NULL,
-        data_hora_inicio DATETIME NOT NULL,
-        status TEXT NOT NULL DEFAULT 'disponivel', 
-        FOREIGN KEY (exame_id) REFERENCES exames (id)
-    )
-    ''')
-    # Exemplo: Check-up (ID 1), Sangue (ID 2), ECG (ID 3)
-    horarios_exames_data = [
-        # Horários para Check-up Geral
-        (1, 1, '2025-11-25 08:00:00', 'disponivel'), 
-        (2, 1, '2025-11-25 08:30:00', 'disponivel'),
-        # Horários para Exame de Sangue (geralmente pela manhã)
-        (3, 2, '2025-11-25 07:00:00', 'disponivel'),
-        (4, 2, '2025-11-25 07:30:00', 'disponivel'),
-        # Horários para ECG
-        (5, 3, '2025-11-25 10:00:00', 'disponivel') 
+    # --- Agendas Semanais (os horários são gerados a partir delas: schedules.py) ---
+    # dia_semana: 0 = segunda ... 4 = sexta
+    agendas_medicos_data = [
+        # Dra. Ana Silva (Cardiologia): segunda e quarta de manhã
+        (1, 1, 0, '09:00', '12:00', 60),
+        (2, 1, 2, '09:00', '12:00', 60),
+        # Dr. Bruno Costa (Dermatologia): terça e quinta à tarde
+        (3, 2, 1, '14:00', '18:00', 60),
+        (4, 2, 3, '14:00', '18:00', 60),
+        # Dr. Carlos Dias (Cardiologia): sexta de manhã
+        (5, 3, 4, '09:00', '12:00', 60)
     ]
-    cursor.executemany("INSERT OR IGNORE INTO horarios_exames (id, exame_id, data_hora_inicio, status) VALUES (?, ?, ?, ?)", horarios_exames_data)
-    print("Tabela 'horarios_exames' e dados de exemplo inseridos.")
+    cursor.executemany("INSERT OR IGNORE INTO agendas_medicos (id, medico_id, dia_semana, hora_inicio, hora_fim, duracao_minutos) VALUES (?, ?, ?, ?, ?, ?)", agendas_medicos_data)
 
-    # --- NOVO: Tabela de Agendamentos de Exames ---
-    # (Poderíamos usar a tabela 'agendamentos', mas separar pode ser mais claro)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS agendamentos_exames (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        horario_exame_id INTEGER NOT NULL,
-        nome_paciente TEXT NOT NULL,
-        telegram_chat_id TEXT NOT NULL,
-        status TEXT NOT NULL DEFAULT 'confirmado',
-        FOREIGN KEY (horario_exame_id) REFERENCES horarios_exames (id)
-    )
-    ''')
-    print("Tabela 'agendamentos_exames' criada.")
+    # Exemplo: Check-up (ID 1), Sangue (ID 2), ECG (ID 3)
+    agendas_exames_data = [
+        # Check-up Geral e Exame de Sangue (coleta pela manhã), de segunda a sexta
+        *[(1 + dia, 1, dia, '08:00', '09:00', 30) for dia in range(5)],
+        *[(6 + dia, 2, dia, '07:00', '08:00', 30) for dia in range(5)],
+        # ECG: terça e quinta
+        (11, 3, 1, '10:00', '11:00', 30),
+        (12, 3, 3, '10:00', '11:00', 30)
+    ]
+    cursor.executemany("INSERT OR IGNORE INTO agendas_exames (id, exame_id, dia_semana, hora_inicio, hora_fim, duracao_minutos) VALUES (?, ?, ?, ?, ?, ?)", agendas_exames_data)
+    print("Tabelas 'agendas_medicos' e 'agendas_exames' e dados de exemplo inseridos.")
 
-    # --- NOVO: Tabela de Agendamentos (Vazia por enquanto) ---
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS agendamentos (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        horario_id INTEGER NOT NULL,
-        nome_paciente TEXT NOT NULL,
-        telegram_chat_id TEXT NOT NULL,
-        status TEXT NOT NULL DEFAULT 'confirmado',
-        FOREIGN KEY (horario_id) REFERENCES horarios_disponiveis (id)
-    )
-    ''')
-    print("Tabela 'agendamentos' criada.")
+    # --- Feriados Nacionais (datas fixas) deste ano e do próximo ---
+    feriados_fixos = [
+        ('01-01', 'Confraternização Universal'), ('04-21', 'Tiradentes'), ('05-01', 'Dia do Trabalho'),
+        ('09-07', 'Independência do Brasil'), ('10-12', 'Nossa Senhora Aparecida'), ('11-02', 'Finados'),
+        ('11-15', 'Proclamação da República'), ('11-20', 'Dia da Consciência Negra'), ('12-25', 'Natal')
+    ]
+    ano = datetime.date.today().year
+    feriados_data = [(f"{a}-{dia}", descricao) for a in (ano, ano + 1) for dia, descricao in feriados_fixos]
+    cursor.executemany("INSERT OR IGNORE INTO feriados (data, descricao) VALUES (?, ?)", feriados_data)
+    print("Tabela 'feriados' e dados de exemplo inseridos.")
 
     conn.commit()
     conn.close()
 
+    # --- Horários Disponíveis (consultas e exames) dos próximos dias ---
+    if database_file != db.DATABASE_FILE:
+        db.set_database_file(database_file)
+    criados = gerar_horarios()
+    print(f"Horários gerados a partir das agendas: {criados}.")
+
 if __name__ == "__main__":
-    print("Iniciando setup do banco de dados (Fase 5 - Exames)...")
-    # --- Certifique-se de que o código das tabelas anteriores está colado acima ---
-    # setup_database() # Removido temporariamente para evitar duplicação se o código acima não foi colado
-    print("ATENÇÃO: Cole o código das tabelas info, medicos, etc., acima antes de rodar.")
-    # Quando o código estiver completo, descomente a linha abaixo:
-    setup_database() 
-    print("Banco de dados 'clinic.db' está pronto com tabelas de exames.")
\ No newline at end of file
+    print("Iniciando setup do banco de dados...")
+    setup_database()
+    print(f"Banco de dados '{db.DATABASE_FILE}' está pronto.")
@@ -1,7 +1,241 @@
-import sqlite3
+import datetime
+import json
+import logging
+import os
+
+import availability
+import booking
+from cache import cached_tool
+from catalog import EXAMES_POR_NOME, MEDICOS_POR_ESPECIALIDADE, MEDICOS_POR_NOME
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# --- Listagens Paginadas de Horários ---
+# Com as agendas gerando meses de horários (schedules.py), listar todos os
+# horários livres de uma especialidade virava milhares de linhas no prompt e
+# no estado da conversa. As ferramentas de horários devolvem uma página por
+# vez (keyset: a partir da data/hora + ID do último mostrado, nunca OFFSET),
+# com filtro opcional de período e de médico. Se houver mais horários, o
+# resultado termina com MARCA_PROXIMA_PAGINA e o cursor da página seguinte.
+
+# Horários por página (a continuação vem pelo cursor)
+HORARIOS_POR_PAGINA = int(os.getenv("HORARIOS_POR_PAGINA", "10"))
+
+# Fim do resultado quando há mais horários: a próxima página é a mesma consulta com esse cursor
+MARCA_PROXIMA_PAGINA = "[MAIS: cursor={}]"
+
+# --- Consultas SQL das Ferramentas ---
+# Ficam no nível do módulo para serem reaproveitadas (statement cache) e para o
+# relatório de EXPLAIN QUERY PLAN (query_plans.py) conseguir inspecioná-las.
+
+SQL_INFO_POR_TOPICO = "SELECT value FROM info WHERE topic = ?"
+
+# Uma página dos horários livres dos médicos já resolvidos pelo índice de
+# catálogo (catalog.py), depois do cursor e antes do fim do período. Os IDs
+# chegam como uma lista JSON ('[1, 3]'), assim o statement é sempre o mesmo
+# (fica no cache). Para cada médico, a subconsulta é uma busca por faixa no
+# índice (medico_id, status, data_hora_inicio) que para no LIMIT: a ordenação
+# final só vê (médicos x página) linhas, nunca o calendário inteiro. O
+# "OR id > ?" só desempata horários na mesma data/hora do último mostrado.
+SQL_HORARIOS_POR_MEDICOS = """
+SELECT h.data_hora_inicio, h.id, m.nome
+FROM json_each(?) AS ids
+CROSS JOIN horarios_disponiveis h ON h.id IN (
+    SELECT p.id FROM horarios_disponiveis p
+    WHERE p.medico_id = ids.value AND p.status = 'disponivel'
+      AND p.data_hora_inicio >= ? AND (p.data_hora_inicio > ? OR p.id > ?) AND p.data_hora_inicio < ?
+    ORDER BY p.data_hora_inicio, p.id
+    LIMIT ?
+)
+JOIN medicos m ON h.medico_id = m.id
+ORDER BY h.data_hora_inicio, h.id
+LIMIT ?;
+"""
+
+# Agendamentos confirmados futuros do usuário, juntando com médicos e horários
+# Nota: o "agora" vem como parâmetro (availability.agora(): hora da clínica,
+# FUSO_HORARIO), não de datetime('now', 'localtime'), que é a do servidor
+SQL_MEUS_AGENDAMENTOS = """
+SELECT a.id, m.nome, h.data_hora_inicio
+FROM agendamentos a
+JOIN horarios_disponiveis h ON a.horario_id = h.id
+JOIN medicos m ON h.medico_id = m.id
+WHERE a.telegram_chat_id = ? AND a.status = 'confirmado' AND h.data_hora_inicio > ?
+ORDER BY h.data_hora_inicio;
+"""
+
+SQL_EXAMES = "SELECT nome_exame FROM exames ORDER BY nome_exame;"
+
+# Mesmo esquema: os IDs de exame vêm resolvidos do catálogo
+SQL_HORARIOS_POR_EXAMES = """
+SELECT h.data_hora_inicio, h.id
+FROM json_each(?) AS ids
+CROSS JOIN horarios_exames h ON h.id IN (
+    SELECT p.id FROM horarios_exames p
+    WHERE p.exame_id = ids.value AND p.status = 'disponivel'
+      AND p.data_hora_inicio >= ? AND (p.data_hora_inicio > ? OR p.id > ?) AND p.data_hora_inicio < ?
+    ORDER BY p.data_hora_inicio, p.id
+    LIMIT ?
+)
+ORDER BY h.data_hora_inicio, h.id
+LIMIT ?;
+"""
+
+# Descrições dos itens de uma lista já mostrada, pelos IDs (o estado da conversa
+# só guarda os IDs, session_state.py): mesmo texto das ferramentas, relido só
+# quando a IA precisa dele ou o usuário escolhe um item. Os IDs chegam como
+# lista JSON; cada um é uma busca pela chave primária.
+SQL_DESCRICOES = {
+    "horarios": """
+        SELECT h.id, m.nome || ' - ' || h.data_hora_inicio
+        FROM json_each(?) AS ids
+        CROSS JOIN horarios_disponiveis h ON h.id = ids.value
+        JOIN medicos m ON h.medico_id = m.id
+    """,
+    "horarios_exames": """
+        SELECT h.id, h.data_hora_inicio
+        FROM json_each(?) AS ids
+        CROSS JOIN horarios_exames h ON h.id = ids.value
+    """,
+    "agendamentos": """
+        SELECT a.id, m.nome || ' - ' || h.data_hora_inicio
+        FROM json_each(?) AS ids
+        CROSS JOIN agendamentos a ON a.id = ids.value
+        JOIN horarios_disponiveis h ON a.horario_id = h.id
+        JOIN medicos m ON h.medico_id = m.id
+    """,
+    "agendamentos_exames": """
+        SELECT ae.id, e.nome_exame || ' - ' || he.data_hora_inicio
+        FROM json_each(?) AS ids
+        CROSS JOIN agendamentos_exames ae ON ae.id = ids.value
+        JOIN horarios_exames he ON ae.horario_exame_id = he.id
+        JOIN exames e ON he.exame_id = e.id
+    """,
+    "exames": """
+        SELECT e.id, e.nome_exame
+        FROM json_each(?) AS ids
+        CROSS JOIN exames e ON e.id = ids.value
+    """,
+}
+
+# Agendamentos de exames confirmados futuros do usuário,
+# juntando com exames (nome) e horários (data/hora)
+SQL_MEUS_EXAMES_AGENDADOS = """
+SELECT ae.id, e.nome_exame, he.data_hora_inicio
+FROM agendamentos_exames ae
+JOIN horarios_exames he ON ae.horario_exame_id = he.id
+JOIN exames e ON he.exame_id = e.id
+WHERE ae.telegram_chat_id = ? AND ae.status = 'confirmado' AND he.data_hora_inicio > ?
+ORDER BY he.data_hora_inicio;
+"""
+
+# As ferramentas de leitura compartilhadas entre usuários usam @cached_tool
+# (cache.py) com as tabelas de que dependem. As listagens "meus agendamentos"
+# ficam fora: são por usuário e dependem da hora atual, como as de próximos
+# horários (availability.py), que já respondem da memória.
+
+# Consulta de cada ferramenta de leitura (e das descrições refeitas pelos IDs
+# do estado) + parâmetros de exemplo (para o EXPLAIN)
+TOOL_QUERIES = {
+    "tool_obter_info_clinica": (SQL_INFO_POR_TOPICO, ("endereco",)),
+    "tool_consultar_horarios_disponiveis": (SQL_HORARIOS_POR_MEDICOS, ("[1, 3]", "2025-10-24 09:00:00", "2025-10-24 09:00:00", 0, "9999-12-31", 11, 11)),
+    "tool_listar_meus_agendamentos": (SQL_MEUS_AGENDAMENTOS, ("123", "2025-10-24 09:00:00")),
+    "tool_consultar_exames_disponiveis": (SQL_EXAMES, ()),
+    "tool_consultar_horarios_exames": (SQL_HORARIOS_POR_EXAMES, ("[2]", "2025-10-24 09:00:00", "2025-10-24 09:00:00", 7, "9999-12-31", 11, 11)),
+    "tool_listar_meus_exames_agendados": (SQL_MEUS_EXAMES_AGENDADOS, ("123", "2025-10-24 09:00:00")),
+    **{f"descrever_itens({lista})": (sql, ("[1, 2]",)) for lista, sql in SQL_DESCRICOES.items()},
+}
+
+
+# --- Paginação (keyset) ---
+
+SEM_FIM = "9999-12-31"
+
+
+class PaginaInvalida(ValueError):
+    """Período ou cursor fora do formato; a mensagem vai para o usuário/IA."""
+
+
+def _periodo(data_inicio: str | None, data_fim: str | None) -> tuple[str, str]:
+    """
+    ('AAAA-MM-DD', 'AAAA-MM-DD') -> faixa [desde, até) de data_hora_inicio (o fim vale o dia inteiro).
+    Sem fim, o limite é uma data e não '9999': a coluna é DATETIME (afinidade
+    numérica) e um texto só de dígitos seria comparado como número.
+    """
+    try:
+        desde = datetime.date.fromisoformat(data_inicio).isoformat() if data_inicio else ""
+        ate = (datetime.date.fromisoformat(data_fim) + datetime.timedelta(days=1)).isoformat() if data_fim else SEM_FIM
+    except ValueError:
+        raise PaginaInvalida("Data inválida: use o formato AAAA-MM-DD (ex: 2025-10-24).") from None
+    return desde, ate
+
+
+def _ler_cursor(cursor: str) -> tuple[str, int]:
+    """'AAAA-MM-DD HH:MM:SS#ID' -> (data_hora, id) do último horário da página anterior."""
+    data_hora, separador, horario_id = cursor.rpartition("#")
+    if not separador or not horario_id.isdigit():
+        raise PaginaInvalida("Cursor de página inválido: refaça a consulta sem o cursor.")
+    return data_hora, int(horario_id)
 
-DATABASE_FILE = 'clinic.db'
 
+def _pagina_de_horarios(sql: str, recurso_ids: list[int], data_inicio: str | None, data_fim: str | None,
+                        cursor: str | None) -> tuple[list[tuple], str | None]:
+    """
+    Até HORARIOS_POR_PAGINA linhas (data_hora, id, ...) dos recursos, em ordem
+    de data/hora, e o cursor da página seguinte (None na última). Lê uma linha
+    a mais só para saber se a próxima página existe. Nunca antes de agora
+    (availability.agora(), como nos próximos horários livres): horários livres
+    que já passaram não ocupam a página.
+    """
+    desde, ate = _periodo(data_inicio, data_fim)
+    desde = max(desde, availability.agora().isoformat(" "))
+    desde_id = 0
+    if cursor:
+        desde, desde_id = max((desde, 0), _ler_cursor(cursor))
+    limite = HORARIOS_POR_PAGINA + 1
+    linhas = get_connection().execute(sql, (json.dumps(recurso_ids), desde, desde, desde_id, ate, limite, limite)).fetchall()
+    if len(linhas) <= HORARIOS_POR_PAGINA:
+        return linhas, None
+    ultima = linhas[HORARIOS_POR_PAGINA - 1]
+    return linhas[:HORARIOS_POR_PAGINA], f"{ultima[0]}#{ultima[1]}"
+
+
+def _com_proxima_pagina(itens: list[str], cursor: str | None) -> str:
+    if cursor:
+        itens.append(MARCA_PROXIMA_PAGINA.format(cursor))
+    return "; ".join(itens)
+
+
+def _medico_ids(especialidade: str, medico: str | None) -> list[int] | None:
+    """
+    IDs dos médicos da especialidade (só os com o nome `medico`, se dado).
+    None se o médico pedido não for dessa especialidade.
+    """
+    # Resolve o termo para os IDs dos médicos (aceita parcial, sem acento,
+    # 'Dermatologia' ou 'Dermatologista', 'Cardio' -> 'Cardiologia'...)
+    medico_ids = MEDICOS_POR_ESPECIALIDADE.resolver(especialidade)
+    if medico_ids and medico:
+        # Só os médicos da especialidade cujo nome casa com o filtro ('Ana', 'Dra. Ana Silva')
+        por_nome = set(MEDICOS_POR_NOME.resolver(medico))
+        medico_ids = [medico_id for medico_id in medico_ids if medico_id in por_nome]
+        if not medico_ids:
+            return None
+    return medico_ids
+
+
+def descrever_itens(lista: str, ids) -> dict[int, str]:
+    """
+    ID -> descrição dos itens de uma lista de SQL_DESCRICOES, na ordem dos
+    `ids` (ex: 'Dra. Ana Silva - 2025-10-24 09:00:00'). IDs que não existem mais ficam de fora.
+    """
+    if not ids:
+        return {}
+    descricoes = dict(get_connection().execute(SQL_DESCRICOES[lista], (json.dumps(list(ids)),)).fetchall())
+    return {item_id: descricoes[item_id] for item_id in ids if item_id in descricoes}
+
+
+@cached_tool("info")
 def tool_obter_info_clinica(topic: str) -> str:
     """
     Busca no banco de dados a informação com base no tópico.
@@ -9,128 +243,106 @@ def tool_obter_info_clinica(topic: str) -> str:
     if not topic:
         return "Tópico não fornecido."
 
-    print(f"--- FERRAMENTA DB: Buscando pelo tópico: {topic} ---")
+    logger.debug("FERRAMENTA DB: Buscando pelo tópico: %s", topic)
 
     try:
-        # Conecta ao DB
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
+        # Usa a conexão do pool (não fechamos: ela é reaproveitada)
+        conn = get_connection()
 
         # Busca o valor (usamos 'topic = ?' para evitar SQL Injection)
-        cursor.execute("SELECT value FROM info WHERE topic = ?", (topic,))
-        result = cursor.fetchone() # Pega o primeiro resultado
-
-        conn.close()
+        result = conn.execute(SQL_INFO_POR_TOPICO, (topic,)).fetchone() # Pega o primeiro resultado
 
         if result:
             # result é uma tupla (ex: ('Rua das Flores...',)), 
             # então pegamos o primeiro item
-            print(f"--- FERRAMENTA DB: Informação encontrada: {result[0]} ---")
+            logger.debug("FERRAMENTA DB: Informação encontrada: %s", result[0])
             return result[0]
         else:
-            print("--- FERRAMENTA DB: Tópico não encontrado no banco. ---")
+            logger.debug("FERRAMENTA DB: Tópico não encontrado no banco.")
             return f"Informação sobre '{topic}' não encontrada."
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao acessar o SQLite: {e} ---")
+        logger.error("FERRAMENTA DB: ERRO ao acessar o SQLite: %s", e)
         return "Ocorreu um erro ao consultar o banco de dados."
     
-def tool_consultar_horarios_disponiveis(especialidade: str) -> str:
+@cached_tool("medicos", "horarios_disponiveis")
+def tool_consultar_horarios_disponiveis(especialidade: str, medico: str | None = None, data_inicio: str | None = None,
+                                        data_fim: str | None = None, cursor: str | None = None) -> str:
     """
-    Busca horários disponíveis por especialidade, juntando com os nomes dos médicos.
+    Busca uma página de horários disponíveis por especialidade, juntando com os nomes dos médicos.
+    Filtros opcionais: nome do médico e período (data_inicio/data_fim, 'AAAA-MM-DD').
+    `cursor` vem da marca [MAIS: cursor=...] da página anterior e traz a próxima página.
     Retorna uma string formatada ou uma mensagem de "não encontrado".
     """
     if not especialidade:
         return "Especialidade não fornecida."
 
-    print(f"--- FERRAMENTA DB: Buscando horários para: {especialidade} ---")
+    logger.debug("FERRAMENTA DB: Buscando horários para: %s (médico=%s, %s a %s, cursor=%s)",
+                 especialidade, medico, data_inicio, data_fim, cursor)
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
+        medico_ids = _medico_ids(especialidade, medico)
+        if medico_ids is None:
+            return f"Desculpe, não encontramos o médico '{medico}' na especialidade '{especialidade}'."
 
-        # Query SQL que junta medicos e horarios, filtrando por especialidade e status
-        query = """
-        SELECT h.id, m.nome, h.data_hora_inicio
-        FROM horarios_disponiveis h
-        JOIN medicos m ON h.medico_id = m.id
-        WHERE LOWER(m.especialidade) LIKE LOWER(?) AND h.status = 'disponivel'
-        ORDER BY h.data_hora_inicio;
-        """
-        # Prepara o parâmetro com wildcards
-        search_term = '%' + especialidade + '%'
-
-        # Usamos '%' para permitir buscas parciais (ex: 'Cardio' encontra 'Cardiologia')
-        cursor.execute(query, (search_term,))
-        resultados = cursor.fetchall()
-        conn.close()
+        resultados, proximo_cursor = [], None
+        if medico_ids:
+            resultados, proximo_cursor = _pagina_de_horarios(SQL_HORARIOS_POR_MEDICOS, medico_ids,
+                                                             data_inicio, data_fim, cursor)
 
         if not resultados:
-            print("--- FERRAMENTA DB: Nenhum horário encontrado. ---")
+            logger.debug("FERRAMENTA DB: Nenhum horário encontrado.")
+            if cursor:
+                return f"Desculpe, não há mais horários disponíveis para a especialidade '{especialidade}'."
             return f"Desculpe, não encontramos horários disponíveis para a especialidade '{especialidade}'."
 
         # Formata a saída para a IA ler
-        # Ex: "ID 1: Dra. Ana Silva - 2025-10-24 09:00:00; ID 2: ..."
+        # Ex: "[ID 1: Dra. Ana Silva - 2025-10-24 09:00:00]; [ID 2: ...]; [MAIS: cursor=...]"
         horarios_formatados = []
-        for (id, nome, data_hora) in resultados:
+        for (data_hora, id, nome) in resultados:
             horarios_formatados.append(f"[ID {id}: {nome} - {data_hora}]")
 
-        resposta = "; ".join(horarios_formatados)
-        print(f"--- FERRAMENTA DB: Horários encontrados: {resposta} ---")
+        resposta = _com_proxima_pagina(horarios_formatados, proximo_cursor)
+        logger.debug("FERRAMENTA DB: Horários encontrados: %s", resposta)
         return resposta
 
+    except PaginaInvalida as e:
+        return str(e)
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao consultar horários: {e} ---")
+        logger.error("FERRAMENTA DB: ERRO ao consultar horários: %s", e)
         return "Ocorreu um erro ao consultar os horários."
     
 
-def tool_marcar_agendamento(horario_id: int, nome_paciente: str, telegram_chat_id: str) -> str:
+def tool_marcar_agendamento(horario_id: int, nome_paciente: str, telegram_chat_id: str, idempotency_key: str | None = None) -> str:
     """
     Marca um agendamento.
     1. Atualiza o status do horário para 'agendado'.
     2. Insere o agendamento na tabela 'agendamentos'.
     Retorna uma mensagem de sucesso ou erro.
+    `idempotency_key` (opcional): se o mesmo turno for reprocessado, não repete a escrita.
     """
     if not horario_id or not nome_paciente or not telegram_chat_id:
         return "Erro: ID do horário, nome do paciente e ID do chat são obrigatórios."
 
-    print(f"--- FERRAMENTA DB: Tentando agendar ID {horario_id} para {nome_paciente} ---")
+    logger.debug("FERRAMENTA DB: Tentando agendar ID %s para %s", horario_id, nome_paciente)
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Etapa 1: Verificar se o horário ainda está 'disponivel'
-        cursor.execute("SELECT status FROM horarios_disponiveis WHERE id = ?", (horario_id,))
-        result = cursor.fetchone()
+        # Reserva atômica: UPDATE condicional + INSERT numa única transação de escrita
+        resultado = booking.reservar_horario("consulta", horario_id, nome_paciente, telegram_chat_id, idempotency_key)
 
-        if not result:
-            conn.close()
-            print("--- FERRAMENTA DB: Erro - Horário ID não encontrado. ---")
+        if resultado == booking.HORARIO_INEXISTENTE:
+            logger.warning("FERRAMENTA DB: Erro - Horário ID não encontrado.")
             return f"Erro: O ID de horário {horario_id} não existe."
 
-        if result[0] != 'disponivel':
-            conn.close()
-            print("--- FERRAMENTA DB: Erro - Horário não está mais disponível. ---")
+        if resultado == booking.HORARIO_INDISPONIVEL:
+            logger.warning("FERRAMENTA DB: Erro - Horário não está mais disponível.")
             return f"Desculpe, o horário {horario_id} não está mais disponível. Alguém pode ter agendado."
 
-        # Etapa 2: Atualizar o status do horário
-        cursor.execute("UPDATE horarios_disponiveis SET status = 'agendado' WHERE id = ?", (horario_id,))
-
-        # Etapa 3: Inserir na tabela de agendamentos
-        cursor.execute(
-            "INSERT INTO agendamentos (horario_id, nome_paciente, telegram_chat_id) VALUES (?, ?, ?)",
-            (horario_id, nome_paciente, telegram_chat_id)
-        )
-
-        conn.commit()
-        conn.close()
-
-        print("--- FERRAMENTA DB: Agendamento realizado com sucesso. ---")
+        logger.info("FERRAMENTA DB: Agendamento realizado com sucesso.")
         return "Agendamento confirmado com sucesso!"
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao marcar agendamento: {e} ---")
+        logger.error("FERRAMENTA DB: ERRO ao marcar agendamento: %s", e)
         return f"Ocorreu um erro de banco de dados ao tentar marcar o agendamento: {e}"
     
  
@@ -143,30 +355,14 @@ def tool_listar_meus_agendamentos(telegram_chat_id: str) -> str:
     if not telegram_chat_id:
         return "Erro: ID do chat do Telegram não fornecido."
 
-    print(f"--- FERRAMENTA DB: Listando agendamentos para Chat ID: {telegram_chat_id} ---")
+    logger.debug("FERRAMENTA DB: Listando agendamentos para Chat ID: %s", telegram_chat_id)
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Query que busca agendamentos confirmados futuros do usuário,
-        # juntando com médicos e horários
-        query = """
-        SELECT a.id, m.nome, h.data_hora_inicio
-        FROM agendamentos a
-        JOIN horarios_disponiveis h ON a.horario_id = h.id
-        JOIN medicos m ON h.medico_id = m.id
-        WHERE a.telegram_chat_id = ? AND a.status = 'confirmado' AND h.data_hora_inicio > datetime('now', 'localtime')
-        ORDER BY h.data_hora_inicio;
-        """
-        # Nota: datetime('now', 'localtime') pega a data/hora atual no fuso horário do servidor
-
-        cursor.execute(query, (telegram_chat_id,))
-        resultados = cursor.fetchall()
-        conn.close()
+        conn = get_connection()
+        resultados = conn.execute(SQL_MEUS_AGENDAMENTOS, (telegram_chat_id, availability.agora().isoformat(" "))).fetchall()
 
         if not resultados:
-            print("--- FERRAMENTA DB: Nenhum agendamento futuro encontrado. ---")
+            logger.debug("FERRAMENTA DB: Nenhum agendamento futuro encontrado.")
             return "Você não possui agendamentos futuros confirmados."
 
         # Formata a saída para a IA ler, incluindo o ID do AGENDAMENTO (a.id)
@@ -175,177 +371,141 @@ def tool_listar_meus_agendamentos(telegram_chat_id: str) -> str:
             agendamentos_formatados.append(f"[ID {id_agendamento}: {nome_medico} - {data_hora}]")
 
         resposta = "; ".join(agendamentos_formatados)
-        print(f"--- FERRAMENTA DB: Agendamentos encontrados: {resposta} ---")
+        logger.debug("FERRAMENTA DB: Agendamentos encontrados: %s", resposta)
         return resposta
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao listar agendamentos: {e} ---")
+        logger.error("FERRAMENTA DB: ERRO ao listar agendamentos: %s", e)
         return f"Ocorreu um erro ao consultar seus agendamentos: {e}"
 
-def tool_cancelar_agendamento(agendamento_id: int, telegram_chat_id: str) -> str:
+def tool_cancelar_agendamento(agendamento_id: int, telegram_chat_id: str, idempotency_key: str | None = None) -> str:
     """
     Cancela um agendamento específico do usuário.
     1. Verifica se o agendamento pertence ao usuário.
     2. Atualiza o status do agendamento para 'cancelado'.
     3. Atualiza o status do horário correspondente de volta para 'disponivel'.
     Retorna uma mensagem de sucesso ou erro.
+    `idempotency_key` (opcional): se o mesmo turno for reprocessado, não repete a escrita.
     """
     if not agendamento_id or not telegram_chat_id:
         return "Erro: ID do agendamento e ID do chat são obrigatórios."
 
-    print(f"--- FERRAMENTA DB: Tentando cancelar agendamento ID {agendamento_id} para Chat ID {telegram_chat_id} ---")
+    logger.debug("FERRAMENTA DB: Tentando cancelar agendamento ID %s para Chat ID %s", agendamento_id, telegram_chat_id)
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Etapa 1: Verificar se o agendamento existe, pertence ao usuário e está confirmado
-        cursor.execute(
-            "SELECT horario_id, status FROM agendamentos WHERE id = ? AND telegram_chat_id = ?",
-            (agendamento_id, telegram_chat_id)
-        )
-        result = cursor.fetchone()
-
-        if not result:
-            conn.close()
-            print("--- FERRAMENTA DB: Erro - Agendamento não encontrado ou não pertence ao usuário. ---")
-            return f"Erro: Agendamento com ID {agendamento_id} não encontrado ou não pertence a você."
+        # Cancelamento atômico: verifica o dono, cancela e libera o horário na mesma transação
+        resultado, status_agendamento = booking.cancelar_reserva("consulta", agendamento_id, telegram_chat_id, idempotency_key)
 
-        horario_id, status_agendamento = result
+        if resultado == booking.AGENDAMENTO_INEXISTENTE:
+            logger.warning("FERRAMENTA DB: Erro - Agendamento não encontrado ou não pertence ao usuário.")
+            return f"Erro: Agendamento com ID {agendamento_id} não encontrado ou não pertence a você."
 
-        if status_agendamento != 'confirmado':
-            conn.close()
-            print(f"--- FERRAMENTA DB: Erro - Agendamento já está '{status_agendamento}'. ---")
+        if resultado == booking.AGENDAMENTO_NAO_CONFIRMADO:
+            logger.warning("FERRAMENTA DB: Erro - Agendamento já está '%s'.", status_agendamento)
             return f"Este agendamento (ID {agendamento_id}) não está confirmado (status atual: {status_agendamento}), portanto não pode ser cancelado."
 
-        # Etapa 2: Atualizar o status do agendamento para 'cancelado'
-        cursor.execute("UPDATE agendamentos SET status = 'cancelado' WHERE id = ?", (agendamento_id,))
-
-        # Etapa 3: Atualizar o status do horário de volta para 'disponivel'
-        cursor.execute("UPDATE horarios_disponiveis SET status = 'disponivel' WHERE id = ?", (horario_id,))
-
-        conn.commit()
-        conn.close()
-
-        print("--- FERRAMENTA DB: Agendamento cancelado com sucesso. Horário liberado. ---")
+        logger.info("FERRAMENTA DB: Agendamento cancelado com sucesso. Horário liberado.")
         return "Agendamento cancelado com sucesso!"
 
     except Exception as e:
-        conn.rollback() # Desfaz as alterações se der erro
-        conn.close()
-        print(f"--- FERRAMENTA DB: ERRO ao cancelar agendamento: {e} ---")
+        # transaction() já desfez as alterações (ROLLBACK)
+        logger.error("FERRAMENTA DB: ERRO ao cancelar agendamento: %s", e)
         return f"Ocorreu um erro de banco de dados ao tentar cancelar o agendamento: {e}"
     
+@cached_tool("exames")
 def tool_consultar_exames_disponiveis() -> str:
     """
     Lista os tipos de exames simples disponíveis para agendamento.
     """
-    print(f"--- FERRAMENTA DB: Listando tipos de exames disponíveis ---")
+    logger.debug("FERRAMENTA DB: Listando tipos de exames disponíveis")
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT nome_exame FROM exames ORDER BY nome_exame;")
-        resultados = cursor.fetchall()
-        conn.close()
+        conn = get_connection()
+        resultados = conn.execute(SQL_EXAMES).fetchall()
 
         if not resultados:
             return "Não há tipos de exames cadastrados no momento."
 
         nomes_exames = [r[0] for r in resultados]
         resposta = "; ".join(nomes_exames)
-        print(f"--- FERRAMENTA DB: Exames encontrados: {resposta} ---")
+        logger.debug("FERRAMENTA DB: Exames encontrados: %s", resposta)
         return resposta
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao listar exames: {e} ---")
+        logger.error("FERRAMENTA DB: ERRO ao listar exames: %s", e)
         return f"Ocorreu um erro ao consultar os tipos de exames: {e}"
 
-def tool_consultar_horarios_exames(tipo_exame: str) -> str:
+@cached_tool("exames", "horarios_exames")
+def tool_consultar_horarios_exames(tipo_exame: str, data_inicio: str | None = None, data_fim: str | None = None,
+                                   cursor: str | None = None) -> str:
     """
-    Busca horários disponíveis para um tipo específico de exame.
+    Busca uma página de horários disponíveis para um tipo específico de exame.
+    Período opcional (data_inicio/data_fim, 'AAAA-MM-DD'); `cursor` traz a próxima página.
     Retorna uma string formatada com IDs ou "não encontrado".
     """
     if not tipo_exame:
         return "Tipo de exame não fornecido."
 
-    print(f"--- FERRAMENTA DB: Buscando horários para exame: {tipo_exame} ---")
+    logger.debug("FERRAMENTA DB: Buscando horários para exame: %s (%s a %s, cursor=%s)",
+                 tipo_exame, data_inicio, data_fim, cursor)
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
+        # Resolve o nome do exame para IDs (ex: 'sangue', 'checkup', 'ECG')
+        exame_ids = EXAMES_POR_NOME.resolver(tipo_exame)
 
-        query = """
-        SELECT h.id, h.data_hora_inicio
-        FROM horarios_exames h
-        JOIN exames e ON h.exame_id = e.id
-        WHERE e.nome_exame LIKE ? AND h.status = 'disponivel'
-        ORDER BY h.data_hora_inicio;
-        """
-        cursor.execute(query, ('%' + tipo_exame + '%',))
-        resultados = cursor.fetchall()
-        conn.close()
+        resultados, proximo_cursor = [], None
+        if exame_ids:
+            resultados, proximo_cursor = _pagina_de_horarios(SQL_HORARIOS_POR_EXAMES, exame_ids,
+                                                             data_inicio, data_fim, cursor)
 
         if not resultados:
-            print("--- FERRAMENTA DB: Nenhum horário encontrado para este exame. ---")
+            logger.debug("FERRAMENTA DB: Nenhum horário encontrado para este exame.")
+            if cursor:
+                return f"Desculpe, não há mais horários disponíveis para '{tipo_exame}'."
             return f"Desculpe, não encontramos horários disponíveis para '{tipo_exame}'."
 
         horarios_formatados = []
-        for (id_horario, data_hora) in resultados:
+        for (data_hora, id_horario) in resultados:
             horarios_formatados.append(f"[ID {id_horario}: {data_hora}]")
 
-        resposta = "; ".join(horarios_formatados)
-        print(f"--- FERRAMENTA DB: Horários de exame encontrados: {resposta} ---")
+        resposta = _com_proxima_pagina(horarios_formatados, proximo_cursor)
+        logger.debug("FERRAMENTA DB: Horários de exame encontrados: %s", resposta)
         return resposta
 
+    except PaginaInvalida as e:
+        return str(e)
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao consultar horários de exame: {e} ---")
+        logger.error("FERRAMENTA DB: ERRO ao consultar horários de exame: %s", e)
         return f"Ocorreu um erro ao consultar os horários para '{tipo_exame}': {e}"
 
-def tool_marcar_exame(horario_exame_id: int, nome_paciente: str, telegram_chat_id: str) -> str:
+def tool_marcar_exame(horario_exame_id: int, nome_paciente: str, telegram_chat_id: str, idempotency_key: str | None = None) -> str:
     """
     Marca um agendamento de exame.
     1. Verifica se o horário está disponível.
     2. Atualiza o status do horário para 'agendado'.
     3. Insere o agendamento na tabela 'agendamentos_exames'.
     Retorna uma mensagem de sucesso ou erro.
+    `idempotency_key` (opcional): se o mesmo turno for reprocessado, não repete a escrita.
     """
     if not horario_exame_id or not nome_paciente or not telegram_chat_id:
         return "Erro: ID do horário do exame, nome do paciente e ID do chat são obrigatórios."
 
-    print(f"--- FERRAMENTA DB: Tentando agendar exame (Horário ID {horario_exame_id}) para {nome_paciente} ---")
+    logger.debug("FERRAMENTA DB: Tentando agendar exame (Horário ID %s) para %s", horario_exame_id, nome_paciente)
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Etapa 1: Verificar disponibilidade
-        cursor.execute("SELECT status FROM horarios_exames WHERE id = ?", (horario_exame_id,))
-        result = cursor.fetchone()
+        # Reserva atômica: UPDATE condicional + INSERT numa única transação de escrita
+        resultado = booking.reservar_horario("exame", horario_exame_id, nome_paciente, telegram_chat_id, idempotency_key)
 
-        if not result:
-            conn.close(); return f"Erro: O ID de horário de exame {horario_exame_id} não existe."
-        if result[0] != 'disponivel':
-            conn.close(); return f"Desculpe, o horário {horario_exame_id} não está mais disponível."
+        if resultado == booking.HORARIO_INEXISTENTE:
+            return f"Erro: O ID de horário de exame {horario_exame_id} não existe."
+        if resultado == booking.HORARIO_INDISPONIVEL:
+            return f"Desculpe, o horário {horario_exame_id} não está mais disponível."
 
-        # Etapa 2: Atualizar status do horário
-        cursor.execute("UPDATE horarios_exames SET status = 'agendado' WHERE id = ?", (horario_exame_id,))
-
-        # Etapa 3: Inserir na tabela de agendamentos de exames
-        cursor.execute(
-            "INSERT INTO agendamentos_exames (horario_exame_id, nome_paciente, telegram_chat_id) VALUES (?, ?, ?)",
-            (horario_exame_id, nome_paciente, telegram_chat_id)
-        )
-
-        conn.commit()
-        conn.close()
-
-        print("--- FERRAMENTA DB: Agendamento de exame realizado com sucesso. ---")
+        logger.info("FERRAMENTA DB: Agendamento de exame realizado com sucesso.")
         return "Agendamento de exame confirmado com sucesso!"
 
     except Exception as e:
-        conn.rollback()
-        conn.close()
-        print(f"--- FERRAMENTA DB: ERRO ao marcar agendamento de exame: {e} ---")
+        # transaction() já desfez as alterações (ROLLBACK)
+        logger.error("FERRAMENTA DB: ERRO ao marcar agendamento de exame: %s", e)
         return f"Ocorreu um erro de banco de dados ao tentar marcar o exame: {e}"
     
 def tool_listar_meus_exames_agendados(telegram_chat_id: str) -> str:
@@ -356,29 +516,14 @@ def tool_listar_meus_exames_agendados(telegram_chat_id: str) -> str:
     if not telegram_chat_id:
         return "Erro: ID do chat do Telegram não fornecido."
 
-    print(f"--- FERRAMENTA DB: Listando agendamentos de EXAMES para Chat ID: {telegram_chat_id} ---")
+    logger.debug("FERRAMENTA DB: Listando agendamentos de EXAMES para Chat ID: %s", telegram_chat_id)
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Query que busca agendamentos de exames confirmados futuros do usuário,
-        # juntando com exames (nome) e horários (data/hora)
-        query = """
-        SELECT ae.id, e.nome_exame, he.data_hora_inicio
-        FROM agendamentos_exames ae
-        JOIN horarios_exames he ON ae.horario_exame_id = he.id
-        JOIN exames e ON he.exame_id = e.id
-        WHERE ae.telegram_chat_id = ? AND ae.status = 'confirmado' AND he.data_hora_inicio > datetime('now', 'localtime')
-        ORDER BY he.data_hora_inicio;
-        """
-
-        cursor.execute(query, (telegram_chat_id,))
-        resultados = cursor.fetchall()
-        conn.close()
+        conn = get_connection()
+        resultados = conn.execute(SQL_MEUS_EXAMES_AGENDADOS, (telegram_chat_id, availability.agora().isoformat(" "))).fetchall()
 
         if not resultados:
-            print("--- FERRAMENTA DB: Nenhum agendamento de exame futuro encontrado. ---")
+            logger.debug("FERRAMENTA DB: Nenhum agendamento de exame futuro encontrado.")
             return "Você não possui agendamentos de exames futuros confirmados."
 
         # Formata a saída para a IA ler, incluindo o ID do AGENDAMENTO DE EXAME (ae.id)
@@ -387,64 +532,160 @@ def tool_listar_meus_exames_agendados(telegram_chat_id: str) -> str:
             agendamentos_formatados.append(f"[ID {id_agendamento_exame}: {nome_exame} - {data_hora}]")
 
         resposta = "; ".join(agendamentos_formatados)
-        print(f"--- FERRAMENTA DB: Agendamentos de exame encontrados: {resposta} ---")
+        logger.debug("FERRAMENTA DB: Agendamentos de exame encontrados: %s", resposta)
         return resposta
 
     except Exception as e:
-        print(f"--- FERRAMENTA DB: ERRO ao listar agendamentos de exames: {e} ---")
+        logger.error("FERRAMENTA DB: ERRO ao listar agendamentos de exames: %s", e)
         return f"Ocorreu um erro ao consultar seus agendamentos de exames: {e}"
 
-def tool_cancelar_exame(agendamento_exame_id: int, telegram_chat_id: str) -> str:
+def tool_cancelar_exame(agendamento_exame_id: int, telegram_chat_id: str, idempotency_key: str | None = None) -> str:
     """
     Cancela um agendamento de exame específico do usuário.
     1. Verifica se o agendamento de exame pertence ao usuário.
     2. Atualiza o status do agendamento de exame para 'cancelado'.
     3. Atualiza o status do horário de exame correspondente de volta para 'disponivel'.
     Retorna uma mensagem de sucesso ou erro.
+    `idempotency_key` (opcional): se o mesmo turno for reprocessado, não repete a escrita.
     """
     if not agendamento_exame_id or not telegram_chat_id:
         return "Erro: ID do agendamento de exame e ID do chat são obrigatórios."
 
-    print(f"--- FERRAMENTA DB: Tentando cancelar agendamento de EXAME ID {agendamento_exame_id} para Chat ID {telegram_chat_id} ---")
+    logger.debug("FERRAMENTA DB: Tentando cancelar agendamento de EXAME ID %s para Chat ID %s", agendamento_exame_id, telegram_chat_id)
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Etapa 1: Verificar se o agendamento existe, pertence ao usuário e está confirmado
-        cursor.execute(
-            "SELECT horario_exame_id, status FROM agendamentos_exames WHERE id = ? AND telegram_chat_id = ?",
-            (agendamento_exame_id, telegram_chat_id)
-        )
-        result = cursor.fetchone()
-
-        if not result:
-            conn.close()
-            print("--- FERRAMENTA DB: Erro - Agendamento de exame não encontrado ou não pertence ao usuário. ---")
-            return f"Erro: Agendamento de exame com ID {agendamento_exame_id} não encontrado ou não pertence a você."
+        # Cancelamento atômico: verifica o dono, cancela e libera o horário na mesma transação
+        resultado, status_agendamento = booking.cancelar_reserva("exame", agendamento_exame_id, telegram_chat_id, idempotency_key)
 
-        horario_exame_id, status_agendamento = result
+        if resultado == booking.AGENDAMENTO_INEXISTENTE:
+            logger.warning("FERRAMENTA DB: Erro - Agendamento de exame não encontrado ou não pertence ao usuário.")
+            return f"Erro: Agendamento de exame com ID {agendamento_exame_id} não encontrado ou não pertence a você."
 
-        if status_agendamento != 'confirmado':
-            conn.close()
-            print(f"--- FERRAMENTA DB: Erro - Agendamento de exame já está '{status_agendamento}'. ---")
+        if resultado == booking.AGENDAMENTO_NAO_CONFIRMADO:
+            logger.warning("FERRAMENTA DB: Erro - Agendamento de exame já está '%s'.", status_agendamento)
             return f"Este agendamento de exame (ID {agendamento_exame_id}) não está confirmado (status atual: {status_agendamento}), portanto não pode ser cancelado."
 
-        # Etapa 2: Atualizar o status do agendamento de exame para 'cancelado'
-        cursor.execute("UPDATE agendamentos_exames SET status = 'cancelado' WHERE id = ?", (agendamento_exame_id,))
+        logger.info("FERRAMENTA DB: Agendamento de exame cancelado com sucesso. Horário liberado.")
+        return "Agendamento de exame cancelado com sucesso!"
 
-        # Etapa 3: Atualizar o status do horário de exame de volta para 'disponivel'
-        # (Certifique-se que a tabela é horarios_exames)
-        cursor.execute("UPDATE horarios_exames SET status = 'disponivel' WHERE id = ?", (horario_exame_id,))
+    except Exception as e:
+        # transaction() já desfez as alterações (ROLLBACK)
+        logger.error("FERRAMENTA DB: ERRO ao cancelar agendamento de exame: %s", e)
+        return f"Ocorreu um erro de banco de dados ao tentar cancelar o agendamento do exame: {e}"
 
-        conn.commit()
-        conn.close()
 
-        print("--- FERRAMENTA DB: Agendamento de exame cancelado com sucesso. Horário liberado. ---")
-        return "Agendamento de exame cancelado com sucesso!"
+# --- Próximos Horários Livres (motor de disponibilidade) ---
+# Respondem do índice em memória (availability.py), sempre a partir de agora na
+# clínica: o primeiro horário livre, os próximos N depois de uma data/hora ou os
+# de um período. Mesmo formato das listagens paginadas; se houver mais, a marca
+# [MAIS: cursor=...] continua pela ferramenta paginada correspondente.
+
+def _instante(texto: str | None) -> datetime.datetime | None:
+    """'AAAA-MM-DD' ou 'AAAA-MM-DD HH:MM' -> datetime (None se vazio)."""
+    if not texto:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(texto)
+    except ValueError:
+        raise PaginaInvalida("Data inválida: use AAAA-MM-DD ou AAAA-MM-DD HH:MM (ex: 2025-10-24 14:00).") from None
+
+
+def _proximos_horarios(indice: availability.AvailabilityIndex, recurso_ids: list[int], a_partir_de: str | None,
+                       data_fim: str | None, quantidade: int | None) -> tuple[list[int], str | None]:
+    """
+    IDs dos próximos `quantidade` horários livres (padrão 1, no máximo
+    HORARIOS_POR_PAGINA) e o cursor para continuar na listagem paginada.
+    """
+    try:
+        # No motor JSON os argumentos chegam como a IA mandou (ex: "3")
+        quantidade = int(quantidade or 1)
+    except (TypeError, ValueError):
+        quantidade = 1
+    quantidade = max(1, min(quantidade, HORARIOS_POR_PAGINA))
+    _, ate = _periodo(None, data_fim)
+    horarios = indice.buscar(recurso_ids, _instante(a_partir_de),
+                             datetime.datetime.fromisoformat(ate) if data_fim else None, quantidade + 1)
+    cursor = None
+    if len(horarios) > quantidade:
+        data_hora, horario_id = horarios[quantidade - 1]
+        cursor = f"{data_hora.isoformat(' ')}#{horario_id}"
+    return [horario_id for _, horario_id in horarios[:quantidade]], cursor
+
+
+def tool_proximos_horarios(especialidade: str, medico: str | None = None, a_partir_de: str | None = None,
+                           data_fim: str | None = None, quantidade: int | None = None) -> str:
+    """
+    Busca os próximos horários livres de uma especialidade, de qualquer médico dela (ou só do `medico`).
+    A partir de agora ou de `a_partir_de` ('AAAA-MM-DD' ou 'AAAA-MM-DD HH:MM'), até o fim do dia `data_fim`.
+    `quantidade`: quantos horários (padrão 1, o primeiro livre).
+    Ex: primeiro horário com qualquer cardiologista esta semana -> quantidade=1, data_fim=domingo.
+    """
+    if not especialidade:
+        return "Especialidade não fornecida."
+
+    logger.debug("FERRAMENTA DB: Próximos horários para: %s (médico=%s, a partir de %s até %s, quantidade=%s)",
+                 especialidade, medico, a_partir_de, data_fim, quantidade)
+
+    try:
+        medico_ids = _medico_ids(especialidade, medico)
+        if medico_ids is None:
+            return f"Desculpe, não encontramos o médico '{medico}' na especialidade '{especialidade}'."
+
+        horario_ids, proximo_cursor = [], None
+        if medico_ids:
+            horario_ids, proximo_cursor = _proximos_horarios(availability.CONSULTAS, medico_ids,
+                                                             a_partir_de, data_fim, quantidade)
+
+        descricoes = descrever_itens("horarios", horario_ids)
+        if not descricoes:
+            logger.debug("FERRAMENTA DB: Nenhum horário livre encontrado.")
+            return f"Desculpe, não encontramos horários disponíveis para a especialidade '{especialidade}'."
 
+        horarios_formatados = [f"[ID {horario_id}: {descricao}]" for horario_id, descricao in descricoes.items()]
+        resposta = _com_proxima_pagina(horarios_formatados, proximo_cursor)
+        logger.debug("FERRAMENTA DB: Próximos horários: %s", resposta)
+        return resposta
+
+    except PaginaInvalida as e:
+        return str(e)
+    except Exception as e:
+        logger.error("FERRAMENTA DB: ERRO ao buscar os próximos horários: %s", e)
+        return "Ocorreu um erro ao consultar os horários."
+
+
+def tool_proximos_horarios_exame(tipo_exame: str, a_partir_de: str | None = None, data_fim: str | None = None,
+                                 quantidade: int | None = None) -> str:
+    """
+    Busca os próximos horários livres de um tipo de exame.
+    A partir de agora ou de `a_partir_de` ('AAAA-MM-DD' ou 'AAAA-MM-DD HH:MM'), até o fim do dia `data_fim`.
+    `quantidade`: quantos horários (padrão 1, o primeiro livre).
+    """
+    if not tipo_exame:
+        return "Tipo de exame não fornecido."
+
+    logger.debug("FERRAMENTA DB: Próximos horários para exame: %s (a partir de %s até %s, quantidade=%s)",
+                 tipo_exame, a_partir_de, data_fim, quantidade)
+
+    try:
+        exame_ids = EXAMES_POR_NOME.resolver(tipo_exame)
+
+        horario_ids, proximo_cursor = [], None
+        if exame_ids:
+            horario_ids, proximo_cursor = _proximos_horarios(availability.EXAMES, exame_ids,
+                                                             a_partir_de, data_fim, quantidade)
+
+        descricoes = descrever_itens("horarios_exames", horario_ids)
+        if not descricoes:
+            logger.debug("FERRAMENTA DB: Nenhum horário livre encontrado para este exame.")
+            return f"Desculpe, não encontramos horários disponíveis para '{tipo_exame}'."
+
+        horarios_formatados = [f"[ID {horario_id}: {descricao}]" for horario_id, descricao in descricoes.items()]
+        resposta = _com_proxima_pagina(horarios_formatados, proximo_cursor)
+        logger.debug("FERRAMENTA DB: Próximos horários de exame: %s", resposta)
+        return resposta
+
+    except PaginaInvalida as e:
+        return str(e)
     except Exception as e:
-        conn.rollback() # Desfaz as alterações se der erro
-        conn.close()
-        print(f"--- FERRAMENTA DB: ERRO ao cancelar agendamento de exame: {e} ---")
-        return f"Ocorreu um erro de banco de dados ao tentar cancelar o agendamento do exame: {e}"
\ No newline at end of file
+        logger.error("FERRAMENTA DB: ERRO ao buscar os próximos horários de exame: %s", e)
+        return f"Ocorreu um erro ao consultar os horários para '{tipo_exame}': {e}"
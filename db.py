@@ -0,0 +1,143 @@
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import DB_CALL_SECONDS, DB_POOL_WAIT_SECONDS
+
+# --- Configuração do Banco ---
+# O caminho pode ser sobrescrito por variável de ambiente (útil para benchmarks/cópias do banco)
+DATABASE_FILE = os.getenv("CLINIC_DB_PATH", "clinic.db")
+
+# --- Ajustes de Desempenho (PRAGMAs) ---
+# cache_size negativo = tamanho em KiB (aqui ~16 MiB de page cache por conexão)
+CACHE_SIZE_KIB = 16 * 1024
+# Mapeia até 64 MiB do arquivo em memória (leituras sem cópia extra)
+MMAP_SIZE_BYTES = 64 * 1024 * 1024
+# Quantos statements preparados o sqlite3 mantém em cache por conexão
+STATEMENT_CACHE_SIZE = 256
+# Quanto tempo (segundos) uma conexão espera por um lock antes de dar SQLITE_BUSY
+BUSY_TIMEOUT_SECONDS = 5.0
+
+# Máximo de threads que executam ferramentas de banco para o código async
+# (cada thread mantém a sua conexão do pool)
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "8"))
+
+# --- Pool de Conexões (uma conexão por thread) ---
+_local = threading.local()
+_registry_lock = threading.Lock()
+_open_connections: list[sqlite3.Connection] = []
+# Incrementado por close_all(): invalida as conexões guardadas nas outras threads
+_generation = 0
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    """
+    Abre uma conexão já configurada com WAL, synchronous=NORMAL, cache e mmap.
+    A conexão fica em modo autocommit (isolation_level=None): as transações
+    são controladas explicitamente por `transaction()`.
+    """
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_SECONDS,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE_BYTES}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA foreign_keys=ON")
+
+    with _registry_lock:
+        _open_connections.append(conn)
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Retorna a conexão da thread atual, abrindo (e configurando) só na primeira vez.
+    Não feche a conexão retornada: ela é reaproveitada pelas próximas chamadas.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "generation", None) != _generation or _local.path != DATABASE_FILE:
+        conn = _open_connection(DATABASE_FILE)
+        _local.conn = conn
+        _local.path = DATABASE_FILE
+        _local.generation = _generation
+    return conn
+
+
+@contextmanager
+def transaction(immediate: bool = False):
+    """
+    Abre uma transação na conexão da thread atual.
+    Faz COMMIT ao sair do bloco e ROLLBACK se houver exceção.
+    Com immediate=True o lock de escrita é obtido já no BEGIN.
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+def set_database_file(path: str) -> None:
+    """
+    Aponta o pool para outro arquivo de banco (ex: cópia temporária em benchmarks).
+    As conexões antigas são fechadas.
+    """
+    global DATABASE_FILE
+    close_all()
+    DATABASE_FILE = path
+
+
+def close_all() -> None:
+    """Fecha todas as conexões abertas pelo pool (em todas as threads)."""
+    global _generation
+    with _registry_lock:
+        _generation += 1
+        connections = list(_open_connections)
+        _open_connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+# --- Execução a partir de código async ---
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="db")
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """
+    Roda uma função bloqueante de banco (ex: uma tool_*) num pool limitado de
+    threads, sem travar o event loop do servidor. O contexto (span e
+    amostragem de logs do turno, tracing.py) vai junto para a thread, e a
+    espera pelo pool e a execução entram nos histogramas do /metrics.
+    """
+    loop = asyncio.get_running_loop()
+    contexto = contextvars.copy_context()
+    operacao = getattr(func, "__name__", "desconhecida")
+    enviada_em = time.perf_counter()
+
+    def executar():
+        inicio = time.perf_counter()
+        DB_POOL_WAIT_SECONDS.observe(inicio - enviada_em)
+        try:
+            return contexto.run(func, *args, **kwargs)
+        finally:
+            DB_CALL_SECONDS.observe(time.perf_counter() - inicio, operacao)
+
+    return await loop.run_in_executor(_executor, executar)
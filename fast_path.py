@@ -0,0 +1,389 @@
+import logging
+import re
+import threading
+
+from catalog import EXAMES_POR_NOME, MEDICOS_POR_ESPECIALIDADE, MIN_PREFIXO, STOPWORDS, normalizar
+from db import run_in_db_thread
+from database_tools import (
+    descrever_itens,
+    tool_cancelar_agendamento,
+    tool_cancelar_exame,
+    tool_consultar_horarios_disponiveis,
+    tool_consultar_horarios_exames,
+    tool_marcar_agendamento,
+    tool_marcar_exame,
+)
+from session_state import SessionState, Step
+
+logger = logging.getLogger(__name__)
+
+# --- Caminho Rápido (sem IA) ---
+# Boa parte das mensagens no meio de um fluxo é só "2", "ID 2" ou um nome.
+# Para esses casos o estado atual da conversa já diz o que fazer: um pequeno
+# motor de regras (uma função por estado) extrai o dado com regex, chama a
+# ferramenta direto e monta a resposta por template, sem nenhuma chamada ao
+# Gemini. Se a mensagem for ambígua (ex: "o 2 ou o 3?", "quero outro médico"),
+# a regra devolve None e o agent.py segue o caminho normal com a IA.
+
+# Palavras que podem acompanhar a escolha de um ID ("quero o horário 2", "cancelar o nº 5")
+PALAVRAS_DE_ESCOLHA = {
+    "id", "n", "no", "numero", "num", "o", "a", "de", "do", "da", "quero", "escolho", "prefiro",
+    "pode", "ser", "vou", "querer", "fico", "com", "esse", "este", "opcao", "horario", "agendamento",
+    "consulta", "exame", "cancelar", "cancela", "cancele", "desmarcar", "marcar", "agendar", "por",
+    "favor", "pf", "pfv", "ok", "sim", "eu",
+}
+
+# Palavras que indicam que a mensagem NÃO é um nome (é um pedido, pergunta, etc.)
+PALAVRAS_QUE_NAO_SAO_NOME = {
+    "quero", "queria", "gostaria", "marcar", "agendar", "cancelar", "desmarcar", "horario", "horarios",
+    "consulta", "exame", "exames", "nao", "sim", "ok", "obrigado", "obrigada", "ola", "oi", "bom", "boa",
+    "dia", "tarde", "noite", "qual", "quais", "onde", "quando", "como", "outro", "outra", "mudar",
+    "trocar", "voltar", "desisto", "ajuda", "id", "medico", "medica", "doutor", "doutora", "convenio",
+    "endereco", "tchau",
+}
+
+# Pedido da próxima página de horários ("mais", "ver mais horários", "próximos")
+PALAVRAS_DE_PROXIMA_PAGINA = {"mais", "proximos", "proximas", "proxima", "seguintes", "outros", "outras"}
+PALAVRAS_DO_PEDIDO_DE_PAGINA = {
+    "ver", "me", "mostre", "mostra", "mostrar", "quero", "tem", "ha", "horarios", "opcoes", "pagina", "os", "as",
+    "por", "favor", "pf", "pfv", "e",
+}
+
+# Preposições aceitas no meio de um nome ("Maria da Silva")
+CONECTORES_NOME = {"de", "da", "do", "das", "dos", "e"}
+
+# "[ID 2: Dra. Ana Silva - 2025-10-24 09:00:00]" -> (2, "Dra. Ana Silva - 2025-10-24 09:00:00")
+ITEM_LISTADO_RE = re.compile(r"\[ID (\d+): ([^\]]*)\]")
+# "[MAIS: cursor=2025-10-24 09:00:00#12]" no fim de uma página de horários (database_tools.MARCA_PROXIMA_PAGINA)
+PROXIMA_PAGINA_RE = re.compile(r"\[MAIS: cursor=([^\]]+)\]")
+NOME_RE = re.compile(r"^[^\W\d_]+(?:['’-][^\W\d_]+)*$")
+PREFIXO_NOME_RE = re.compile(r"^\s*(?:(?:o\s+)?meu\s+nome\s+(?:é|e)|nome\s*:|(?:eu\s+)?sou(?:\s+(?:o|a))?)\s+", re.IGNORECASE)
+
+# Limites para uma mensagem ser tratada como nome completo
+MIN_PALAVRAS_NOME = 2
+MAX_PALAVRAS_NOME = 6
+# Mensagens mais longas que isso na escolha de exame vão para a IA
+MAX_PALAVRAS_TIPO_EXAME = 4
+
+# Contadores (lidos por benchmarks e métricas)
+ESTATISTICAS = {"turnos": 0, "sem_llm": 0, "fallbacks": 0}
+_estatisticas_lock = threading.Lock()
+
+
+def _contar(chave: str) -> None:
+    with _estatisticas_lock:
+        ESTATISTICAS[chave] += 1
+
+
+def registrar_turno() -> None:
+    """Conta um turno (mensagem do usuário), com ou sem IA."""
+    _contar("turnos")
+
+
+def metrics() -> dict:
+    """Contadores e fração de turnos respondidos sem chamar a IA."""
+    with _estatisticas_lock:
+        stats = dict(ESTATISTICAS)
+    stats["fracao_sem_llm"] = stats["sem_llm"] / stats["turnos"] if stats["turnos"] else 0.0
+    return stats
+
+
+# --- Extração de Entidades ---
+
+def itens_listados(texto: str | None) -> dict[int, str]:
+    """IDs (e descrições) da lista mostrada ao usuário, no formato das ferramentas."""
+    return {int(item_id): descricao for item_id, descricao in ITEM_LISTADO_RE.findall(texto or "")}
+
+
+def proximo_cursor(texto: str | None) -> str | None:
+    """Cursor da próxima página de uma listagem de horários (None na última página)."""
+    encontrado = PROXIMA_PAGINA_RE.search(texto or "")
+    return encontrado.group(1) if encontrado else None
+
+
+def pede_proxima_pagina(mensagem: str) -> bool:
+    """True se a mensagem for só um pedido de mais horários ("mais", "ver os próximos")."""
+    palavras = set(normalizar(mensagem))
+    return bool(palavras & PALAVRAS_DE_PROXIMA_PAGINA) and palavras <= PALAVRAS_DE_PROXIMA_PAGINA | PALAVRAS_DO_PEDIDO_DE_PAGINA
+
+
+def extrair_id(mensagem: str) -> int | None:
+    """
+    Retorna o ID se a mensagem for só uma escolha ("2", "ID 2", "quero o horário 2").
+    Mais de um número ou qualquer palavra fora de PALAVRAS_DE_ESCOLHA -> None (ambíguo).
+    """
+    numeros = []
+    for palavra in normalizar(mensagem):
+        if palavra.isdigit():
+            numeros.append(int(palavra))
+        elif palavra not in PALAVRAS_DE_ESCOLHA:
+            return None
+    return numeros[0] if len(numeros) == 1 else None
+
+
+def extrair_nome(mensagem: str) -> str | None:
+    """Retorna o nome completo se a mensagem for só um nome ("Maria Souza", "meu nome é Ana Lima")."""
+    texto = PREFIXO_NOME_RE.sub("", mensagem.strip()).strip(" .!")
+    palavras = texto.split()
+    if not MIN_PALAVRAS_NOME <= len(palavras) <= MAX_PALAVRAS_NOME:
+        return None
+    if any(not NOME_RE.match(p) for p in palavras):
+        return None
+    if any(p in PALAVRAS_QUE_NAO_SAO_NOME for p in normalizar(texto)):
+        return None
+    if palavras[0].lower() in CONECTORES_NOME or palavras[-1].lower() in CONECTORES_NOME:
+        return None
+    return " ".join(p.lower() if p.lower() in CONECTORES_NOME else p[:1].upper() + p[1:] for p in palavras)
+
+
+# --- Páginas de Horários ---
+# O estado da conversa guarda só os IDs da página mostrada e os parâmetros da
+# próxima (filtros + cursor), nunca o texto da lista (session_state.py): a
+# sessão ocupa o mesmo tanto com 10 ou 10 mil horários no calendário.
+
+AVISO_MAIS_HORARIOS = "Para ver mais horários, responda \"mais\"."
+
+
+def estado_da_lista(step: Step, resultado: str, parametros: dict | None = None,
+                    tipo_exame: str | None = None) -> SessionState:
+    """Estado depois de mostrar uma lista: os IDs do resultado e, numa página de horários, os parâmetros da próxima."""
+    proxima_pagina = None
+    cursor = proximo_cursor(resultado)
+    if cursor:
+        filtros = {nome: valor for nome, valor in (parametros or {}).items() if valor is not None and nome != "cursor"}
+        proxima_pagina = {**filtros, "cursor": cursor}
+    return SessionState(step, itens_listados(resultado), tipo_exame=tipo_exame, proxima_pagina=proxima_pagina)
+
+
+def texto_da_lista(introducao: str, resultado: str, pergunta: str) -> str | None:
+    """Lista do resultado (uma linha por ID) com introdução, aviso de mais páginas e pergunta; None se não for lista."""
+    itens = itens_listados(resultado)
+    if not itens:
+        return None
+    linhas = "\n".join(f"ID {item_id}: {descricao}" for item_id, descricao in itens.items())
+    if proximo_cursor(resultado):
+        pergunta = f"{AVISO_MAIS_HORARIOS} {pergunta}"
+    return f"{introducao}:\n{linhas}\n{pergunta}"
+
+
+# --- Regras por Estado ---
+# Cada regra recebe (store, state_key, estado, mensagem, escopo) e devolve a
+# resposta para o usuário, ou None para deixar a IA decidir. `estado` é o
+# SessionState atual e `escopo` identifica o turno (ex: a update_id do
+# Telegram), que vira a chave de idempotência das escritas.
+
+def _chave(escopo: str | None, tool_function) -> str | None:
+    return f"{escopo}:{tool_function.__name__}" if escopo else None
+
+def _escolha_fora_da_lista(escolhido: int, listados, o_que: str) -> str:
+    opcoes = ", ".join(str(i) for i in listados)
+    return f"O ID {escolhido} não está na lista de {o_que} que mostrei. Por favor, escolha um destes IDs: {opcoes}."
+
+
+async def _proxima_pagina(store, state_key, estado: SessionState, tool_function, introducao, pergunta):
+    pagina = estado.parametros_da_proxima_pagina()
+    if not pagina:
+        return f"Esses são todos os horários disponíveis no momento. {pergunta}"
+    resultado = await run_in_db_thread(tool_function, **pagina)
+    resposta = texto_da_lista(introducao.format(**pagina), resultado, pergunta)
+    if resposta is None:
+        # Acabaram (alguém reservou os restantes): a página atual continua valendo
+        novo_estado, resposta = estado.sem_proxima_pagina(), resultado
+    else:
+        novo_estado = estado_da_lista(estado.step, resultado, pagina, estado.tipo_exame)
+    await store.set_async(state_key, novo_estado)
+    logger.debug("MEMÓRIA: Próxima página de horários salva no estado '%s'", estado.step.name)
+    return resposta
+
+
+async def _escolher_horario_consulta(store, state_key, estado, mensagem, escopo):
+    if estado.ids and pede_proxima_pagina(mensagem):
+        return await _proxima_pagina(store, state_key, estado, tool_consultar_horarios_disponiveis,
+                                     "Mais horários disponíveis para {especialidade}", "Qual ID do horário você deseja?")
+    horario_id = extrair_id(mensagem)
+    if horario_id is None or not estado.ids:
+        return None
+    if horario_id not in estado.ids:
+        return _escolha_fora_da_lista(horario_id, estado.ids, "horários")
+    descricoes = await run_in_db_thread(descrever_itens, estado.lista, [horario_id])
+    await store.set_async(state_key, SessionState(Step.AWAITING_NAME, escolhido=horario_id))
+    logger.debug("MEMÓRIA: Salvo estado 'AWAITING_NAME' para ID Consulta: %s", horario_id)
+    return (f"Ótimo! Você escolheu o horário ID {horario_id} ({descricoes.get(horario_id)}). "
+            "Agora, por favor, informe o nome completo do paciente.")
+
+
+async def _escolher_horario_exame(store, state_key, estado, mensagem, escopo):
+    if estado.ids and pede_proxima_pagina(mensagem):
+        return await _proxima_pagina(store, state_key, estado, tool_consultar_horarios_exames,
+                                     "Mais horários disponíveis para {tipo_exame}", "Qual ID do horário de exame você deseja?")
+    horario_exame_id = extrair_id(mensagem)
+    if horario_exame_id is None or not estado.ids:
+        return None
+    if horario_exame_id not in estado.ids:
+        return _escolha_fora_da_lista(horario_exame_id, estado.ids, "horários de exame")
+    descricoes = await run_in_db_thread(descrever_itens, estado.lista, [horario_exame_id])
+    tipo_exame = estado.tipo_exame
+    await store.set_async(state_key, SessionState(Step.AWAITING_NAME_FOR_EXAM, escolhido=horario_exame_id, tipo_exame=tipo_exame))
+    logger.debug("MEMÓRIA: Salvo estado 'AWAITING_NAME_FOR_EXAM' para ID Exame: %s", horario_exame_id)
+    return (f"Ótimo! Você escolheu o horário ID {horario_exame_id} ({descricoes.get(horario_exame_id)}) para {tipo_exame}. "
+            "Agora, por favor, informe o nome completo do paciente.")
+
+
+async def _cancelar(store, state_key, estado, mensagem, escopo, tool_function, parametro, sucesso, o_que):
+    agendamento_id = extrair_id(mensagem)
+    if agendamento_id is None or not estado.ids:
+        return None
+    if agendamento_id not in estado.ids:
+        return _escolha_fora_da_lista(agendamento_id, estado.ids, o_que)
+    await store.delete_async(state_key)
+    resultado = await run_in_db_thread(tool_function, **{parametro: agendamento_id, "telegram_chat_id": state_key,
+                                                         "idempotency_key": _chave(escopo, tool_function)})
+    if resultado != sucesso:
+        return resultado
+    # Mesma resposta do template (rendering.py): a descrição não fica no estado
+    return f"Pronto! O agendamento ID {agendamento_id} foi cancelado com sucesso."
+
+
+async def _escolher_cancelamento_consulta(store, state_key, estado, mensagem, escopo):
+    return await _cancelar(store, state_key, estado, mensagem, escopo, tool_cancelar_agendamento,
+                           "agendamento_id", "Agendamento cancelado com sucesso!", "agendamentos")
+
+
+async def _escolher_cancelamento_exame(store, state_key, estado, mensagem, escopo):
+    return await _cancelar(store, state_key, estado, mensagem, escopo, tool_cancelar_exame,
+                           "agendamento_exame_id", "Agendamento de exame cancelado com sucesso!", "agendamentos de exame")
+
+
+async def _informar_nome(store, state_key, estado, mensagem, escopo, tool_function, sucesso, descricao):
+    horario_id = estado.escolhido
+    nome_paciente = extrair_nome(mensagem)
+    if not horario_id or nome_paciente is None:
+        return None
+    await store.delete_async(state_key)
+    resultado = await run_in_db_thread(tool_function, horario_id, nome_paciente, state_key, _chave(escopo, tool_function))
+    if resultado != sucesso:
+        return resultado
+    return f"{descricao} confirmado com sucesso para {nome_paciente} (horário ID {horario_id}). Até breve!"
+
+
+async def _nome_consulta(store, state_key, estado, mensagem, escopo):
+    return await _informar_nome(store, state_key, estado, mensagem, escopo, tool_marcar_agendamento,
+                                "Agendamento confirmado com sucesso!", "Agendamento")
+
+
+async def _nome_exame(store, state_key, estado, mensagem, escopo):
+    descricao = f"Agendamento do exame {estado.tipo_exame}" if estado.tipo_exame else "Agendamento do exame"
+    return await _informar_nome(store, state_key, estado, mensagem, escopo, tool_marcar_exame,
+                                "Agendamento de exame confirmado com sucesso!", descricao)
+
+
+def _resolver_exame(mensagem: str, exame_ids) -> str | None:
+    """Nome do exame da lista se a mensagem apontar para exatamente um deles."""
+    ids = EXAMES_POR_NOME.resolver(mensagem)
+    if len(ids) != 1 or ids[0] not in exame_ids:
+        return None
+    return EXAMES_POR_NOME.nome(ids[0])
+
+
+async def _escolher_tipo_exame(store, state_key, estado, mensagem, escopo):
+    if len(normalizar(mensagem)) > MAX_PALAVRAS_TIPO_EXAME:
+        return None
+    tipo_exame = await run_in_db_thread(_resolver_exame, mensagem, estado.ids)
+    if tipo_exame is None:
+        return None
+    resultado = await run_in_db_thread(tool_consultar_horarios_exames, tipo_exame)
+    resposta = texto_da_lista(f"Estes são os horários disponíveis para {tipo_exame}", resultado,
+                              "Qual ID do horário de exame você deseja?")
+    if resposta is None:
+        await store.delete_async(state_key)
+        return resultado
+    await store.set_async(state_key, estado_da_lista(Step.AWAITING_EXAM_SLOT_CHOICE, resultado, {"tipo_exame": tipo_exame}, tipo_exame))
+    logger.debug("MEMÓRIA: Salvo estado 'AWAITING_EXAM_SLOT_CHOICE' para o exame '%s'", tipo_exame)
+    return resposta
+
+
+REGRAS = {
+    Step.AWAITING_SLOT_CHOICE: _escolher_horario_consulta,
+    Step.AWAITING_NAME: _nome_consulta,
+    Step.AWAITING_CANCELLATION_CHOICE: _escolher_cancelamento_consulta,
+    Step.AWAITING_EXAM_TYPE: _escolher_tipo_exame,
+    Step.AWAITING_EXAM_SLOT_CHOICE: _escolher_horario_exame,
+    Step.AWAITING_NAME_FOR_EXAM: _nome_exame,
+    Step.AWAITING_EXAM_CANCELLATION_CHOICE: _escolher_cancelamento_exame,
+}
+
+
+async def try_fast_path(store, state_key: str, current_state: SessionState | None, user_message: str,
+                        idempotency_scope: str | None = None) -> str | None:
+    """
+    Tenta responder sem a IA usando a regra do estado atual.
+    Retorna a resposta, ou None se a IA precisar decidir (sem estado, sem regra
+    ou mensagem ambígua). Deve ser chamada com o lock do chat já adquirido.
+    """
+    if not current_state:
+        return None
+    regra = REGRAS.get(current_state.step)
+    if regra is None:
+        return None
+
+    resposta = await regra(store, state_key, current_state, user_message, idempotency_scope)
+    if resposta is None:
+        _contar("fallbacks")
+        logger.debug("FAST PATH: Mensagem ambígua no estado %s. Usando a IA.", current_state.step.name)
+        return None
+
+    _contar("sem_llm")
+    logger.debug("FAST PATH: Respondido sem IA no estado %s", current_state.step.name)
+    return resposta
+
+
+# --- Modo Degradado (IA indisponível) ---
+# Com o circuito da IA aberto (llm_resilience.py), pedidos simples ainda são
+# atendidos por palavras-chave: informações da clínica, horários de uma
+# especialidade e lista de exames. Daí em diante o fluxo segue pelas regras
+# acima (ID, nome...), que não dependem da IA.
+
+PALAVRAS_POR_TOPICO = {
+    "endereco": {"endereco", "onde", "localizacao", "local", "chegar", "rua"},
+    "horario_funcionamento": {"funcionamento", "funciona", "abre", "abrem", "fecha", "fecham", "aberto", "aberta"},
+    "convenios_aceitos": {"convenio", "convenios", "plano", "planos", "unimed", "amil", "bradesco", "sulamerica"},
+}
+PALAVRAS_DE_EXAME = {"exame", "exames"}
+
+# Como responder, em cada estado, para o caminho rápido entender sem a IA
+DICAS_POR_ESTADO = {
+    Step.AWAITING_SLOT_CHOICE: "Por favor, responda só com o número do ID do horário escolhido.",
+    Step.AWAITING_EXAM_SLOT_CHOICE: "Por favor, responda só com o número do ID do horário de exame escolhido.",
+    Step.AWAITING_CANCELLATION_CHOICE: "Por favor, responda só com o número do ID do agendamento a cancelar.",
+    Step.AWAITING_EXAM_CANCELLATION_CHOICE: "Por favor, responda só com o número do ID do agendamento de exame a cancelar.",
+    Step.AWAITING_NAME: "Por favor, informe só o nome completo do paciente (nome e sobrenome).",
+    Step.AWAITING_NAME_FOR_EXAM: "Por favor, informe só o nome completo do paciente (nome e sobrenome).",
+    Step.AWAITING_EXAM_TYPE: "Por favor, responda só com o nome de um dos exames da lista.",
+}
+RESPOSTA_SEM_IA = ("No momento estou com instabilidade para entender pedidos livres. Posso informar o endereço, "
+                   "o horário de funcionamento e os convênios, mostrar horários de uma especialidade "
+                   "(ex: \"Cardiologia\") ou os exames disponíveis. Para outros pedidos, tente novamente em alguns minutos.")
+AVISO_SEM_IA = "Estou com instabilidade no momento e não entendi sua resposta."
+
+
+def rota_sem_ia(mensagem: str) -> tuple[str, dict] | None:
+    """
+    (ferramenta, parâmetros) para um pedido simples sem a IA, ou None.
+    Consulta o catálogo de especialidades (chame numa thread de banco).
+    """
+    palavras = normalizar(mensagem)
+    for topico, chaves in PALAVRAS_POR_TOPICO.items():
+        if chaves & set(palavras):
+            return "tool_obter_info_clinica", {"topic": topico}
+    for palavra in palavras:
+        if len(palavra) >= MIN_PREFIXO and palavra not in STOPWORDS and MEDICOS_POR_ESPECIALIDADE.resolver(palavra):
+            return "tool_consultar_horarios_disponiveis", {"especialidade": palavra.capitalize()}
+    if PALAVRAS_DE_EXAME & set(palavras):
+        return "tool_consultar_exames_disponiveis", {}
+    return None
+
+
+def resposta_sem_ia_no_estado(current_state: SessionState | None) -> str | None:
+    """Dica de como responder no passo atual do fluxo (None fora de um fluxo)."""
+    dica = DICAS_POR_ESTADO.get(current_state.step) if current_state else None
+    return f"{AVISO_SEM_IA} {dica}" if dica else None
@@ -0,0 +1,252 @@
+import asyncio
+import inspect
+import logging
+import threading
+import time
+import typing
+
+import rendering
+import tracing
+from llm_resilience import LLMUnavailableError, contar as contar_resiliencia
+from llm_usage import usage_of
+from metrics import LLM_CALL_ERRORS, observe_llm_call
+
+logger = logging.getLogger(__name__)
+
+# --- Motor de Funções Nativas (AGENT_ENGINE=functions) ---
+# Alternativa ao envelope JSON do SYSTEM_PROMPT: as ferramentas viram
+# declarações nativas de função do Gemini, geradas das assinaturas Python.
+#   * a IA devolve `function_call` estruturado (sem json.loads de texto livre)
+#     ou texto puro para o usuário: não há mais envelope com status, entidades e log
+#   * várias chamadas de função na mesma resposta rodam em paralelo
+#   * resultados com template (rendering.py) dispensam a volta à IA, como no motor JSON
+# O estado da conversa, o caminho rápido e os caches continuam no agent.py.
+
+# Parâmetros preenchidos pelo sistema (nunca aparecem para a IA)
+SYSTEM_PARAMS = {"telegram_chat_id", "idempotency_key"}
+# Voltas máximas IA -> ferramentas -> IA num mesmo turno
+MAX_RODADAS = 3
+RESPOSTA_INVALIDA = "Desculpe, a resposta da IA veio em um formato inválido."
+
+TIPOS_JSON = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+# Descrições extras dos parâmetros (o que a assinatura não diz)
+PARAM_DESCRIPTIONS = {
+    "topic": "Um de: 'endereco', 'horario_funcionamento', 'convenios_aceitos'.",
+    "especialidade": "Especialidade médica, como o usuário escreveu (ex: 'Cardiologia').",
+    "tipo_exame": "Nome do exame escolhido (ex: 'Exame de Sangue').",
+    "nome_paciente": "Nome completo do paciente.",
+    "horario_id": "ID do horário de consulta mostrado na lista ([ID n: ...]).",
+    "horario_exame_id": "ID do horário de exame mostrado na lista ([ID n: ...]).",
+    "agendamento_id": "ID do agendamento mostrado na lista ([ID n: ...]).",
+    "agendamento_exame_id": "ID do agendamento de exame mostrado na lista ([ID n: ...]).",
+    "medico": "Opcional: nome do médico para filtrar os horários (ex: 'Dra. Ana').",
+    "data_inicio": "Opcional: primeiro dia dos horários, 'AAAA-MM-DD'.",
+    "data_fim": "Opcional: último dia dos horários, 'AAAA-MM-DD'.",
+    "cursor": "Opcional: só para a próxima página; o valor de [MAIS: cursor=...] do resultado anterior.",
+    "a_partir_de": "Opcional: buscar a partir desta data/hora, 'AAAA-MM-DD' ou 'AAAA-MM-DD HH:MM' (padrão: agora).",
+    "quantidade": "Opcional: quantos horários trazer (padrão 1, o primeiro livre).",
+}
+
+SYSTEM_PROMPT = """
+Você é a atendente virtual da Clínica Saúde. Fale em português, de forma profissional, clara, concisa e amigável.
+Seu único foco é a administração da clínica: agendar e cancelar consultas e exames, mostrar horários e informar endereço, horário de funcionamento e convênios. Para qualquer outro assunto, diga educadamente que só pode ajudar com a clínica.
+
+Use as funções para consultar e alterar dados; nunca invente horários, IDs ou informações. Se faltar um dado para chamar uma função (ex: a especialidade), pergunte ao usuário. Pode chamar mais de uma função de uma vez quando o pedido envolver mais de uma consulta.
+
+Fluxos:
+- Consulta: tool_consultar_horarios_disponiveis -> o usuário escolhe um ID -> tool_registrar_escolha_horario -> o usuário informa o nome completo -> tool_marcar_agendamento.
+- Exame: se o exame não foi dito, tool_consultar_exames_disponiveis -> tool_consultar_horarios_exames -> o usuário escolhe um ID -> tool_registrar_escolha_horario_exame -> o usuário informa o nome completo -> tool_marcar_exame.
+- Cancelamento: tool_listar_meus_agendamentos (ou tool_listar_meus_exames_agendados) -> o usuário escolhe um ID -> tool_cancelar_agendamento (ou tool_cancelar_exame).
+Mensagens podem vir com [CONTEXTO: ...] indicando o que o usuário já escolheu; use esses IDs.
+Ao responder com base no resultado de uma função, use apenas esse resultado e liste os IDs exatamente como vieram.
+As listas de horários vêm em páginas: se o resultado terminar com [MAIS: cursor=...], diga que há mais horários (sem mostrar o cursor); se o usuário pedir mais, chame a mesma função com os mesmos parâmetros e esse cursor.
+Para "primeiro horário livre", "próximo horário depois das 14h" ou "algum cardiologista esta semana?", use tool_proximos_horarios (ou tool_proximos_horarios_exame); o [MAIS: cursor=...] delas continua em tool_consultar_horarios_disponiveis (ou tool_consultar_horarios_exames) com os mesmos filtros, sem a_partir_de e quantidade.
+"""
+
+
+# --- Ferramentas de Escolha ---
+# No motor JSON a escolha do horário vinha em `entidades_extraidas`; aqui ela
+# é uma função, e o agent.py guarda o próximo estado do fluxo quando ela roda.
+
+def tool_registrar_escolha_horario(horario_id: int) -> str:
+    """Registra o ID do horário de consulta escolhido pelo usuário, antes de pedir o nome completo."""
+    return f"Horário de consulta ID {horario_id} selecionado."
+
+
+def tool_registrar_escolha_horario_exame(horario_exame_id: int) -> str:
+    """Registra o ID do horário de exame escolhido pelo usuário, antes de pedir o nome completo."""
+    return f"Horário de exame ID {horario_exame_id} selecionado."
+
+
+SELECTION_TOOLS = {
+    "tool_registrar_escolha_horario": tool_registrar_escolha_horario,
+    "tool_registrar_escolha_horario_exame": tool_registrar_escolha_horario_exame,
+}
+
+# Contadores (lidos por benchmarks e métricas)
+ESTATISTICAS = {"turnos": 0, "chamadas_de_funcao": 0, "respostas_paralelas": 0, "respostas_invalidas": 0}
+_estatisticas_lock = threading.Lock()
+
+
+def _contar(chave: str, n: int = 1) -> None:
+    with _estatisticas_lock:
+        ESTATISTICAS[chave] += n
+
+
+def metrics() -> dict:
+    with _estatisticas_lock:
+        return dict(ESTATISTICAS)
+
+
+# --- Declarações Geradas das Assinaturas ---
+
+def _parametros_visiveis(tool_function) -> list[inspect.Parameter]:
+    return [p for p in inspect.signature(tool_function).parameters.values() if p.name not in SYSTEM_PARAMS]
+
+
+def _tipo(parametro: inspect.Parameter):
+    tipo = parametro.annotation
+    # `int | None` -> int
+    argumentos = [a for a in typing.get_args(tipo) if a is not type(None)]
+    return argumentos[0] if argumentos else tipo
+
+
+def tool_declarations(tools: dict) -> list[dict]:
+    """Declarações de função (formato da API do Gemini) para cada ferramenta do dicionário."""
+    declaracoes = []
+    for nome, tool_function in tools.items():
+        propriedades, obrigatorios = {}, []
+        for parametro in _parametros_visiveis(tool_function):
+            propriedades[parametro.name] = {"type": TIPOS_JSON.get(_tipo(parametro), "string")}
+            if parametro.name in PARAM_DESCRIPTIONS:
+                propriedades[parametro.name]["description"] = PARAM_DESCRIPTIONS[parametro.name]
+            if parametro.default is inspect.Parameter.empty:
+                obrigatorios.append(parametro.name)
+        declaracao = {"name": nome, "description": (inspect.getdoc(tool_function) or nome).split("\n")[0]}
+        if propriedades:
+            declaracao["parameters"] = {"type": "object", "properties": propriedades, "required": obrigatorios}
+        declaracoes.append(declaracao)
+    return [{"function_declarations": declaracoes}]
+
+
+def converter_argumentos(tool_function, args: dict) -> dict:
+    """
+    Argumentos da IA -> parâmetros da função: só os declarados, convertidos
+    para o tipo da assinatura (a API manda números como float). Um parâmetro
+    que faltar vai como None e a ferramenta responde "não fornecido".
+    """
+    convertidos = {}
+    for parametro in _parametros_visiveis(tool_function):
+        valor = args.get(parametro.name)
+        tipo = _tipo(parametro)
+        if valor is not None and tipo in TIPOS_JSON:
+            try:
+                valor = tipo(valor)
+            except (TypeError, ValueError):
+                pass
+        if valor is not None or parametro.default is inspect.Parameter.empty:
+            convertidos[parametro.name] = valor
+    return convertidos
+
+
+# --- Turno com Funções ---
+
+def _partes(resposta) -> list:
+    try:
+        return list(resposta.parts)
+    except (AttributeError, ValueError):
+        return []
+
+
+async def _enviar(chat, conteudo, uso, on_delta=None, etapa: str = "llm.call_1") -> tuple[str, list[tuple[str, dict]]]:
+    """Envia ao modelo e separa a resposta em (texto, chamadas de função). `etapa` nomeia o span."""
+    textos, chamadas = [], []
+
+    def separar(partes):
+        novos = []
+        for parte in partes:
+            chamada = getattr(parte, "function_call", None)
+            if chamada and chamada.name:
+                chamadas.append((chamada.name, dict(chamada.args or {})))
+            elif getattr(parte, "text", ""):
+                novos.append(parte.text)
+        textos.extend(novos)
+        return "".join(novos)
+
+    inicio = time.perf_counter()
+    with tracing.span(etapa, streaming=on_delta is not None) as registro:
+        try:
+            if on_delta is None:
+                resposta = await chat.send_message_async(conteudo)
+                separar(_partes(resposta))
+            else:
+                resposta = await chat.send_message_async(conteudo, stream=True)
+                async for pedaco in resposta:
+                    novo = separar(_partes(pedaco))
+                    # Texto que acompanha chamadas de função não é a resposta final
+                    if novo and not chamadas:
+                        await on_delta(novo)
+        except Exception as e:
+            LLM_CALL_ERRORS.inc(etapa, type(e).__name__)
+            raise
+        uso_da_chamada = usage_of(resposta)
+        registro.set(funcoes=[nome for nome, _ in chamadas], **uso_da_chamada)
+        observe_llm_call(etapa, time.perf_counter() - inicio, uso_da_chamada)
+    uso.add(resposta)
+    return "".join(textos).strip(), chamadas
+
+
+async def run_turn(model, mensagem: str, uso, tools: dict, executar, concluir, on_delta=None) -> str:
+    """
+    Conduz um turno: a IA responde em texto ou pede funções de `tools`.
+    `executar(nome, args)` (coroutine) roda a ferramenta e retorna
+    (parâmetros usados, resultado); `concluir(nome, parâmetros, resultado)`
+    (coroutine) atualiza o estado e retorna a resposta por template ou None (precisa da IA).
+    """
+    _contar("turnos")
+    chat = model.start_chat()
+    conteudo = mensagem
+    pendentes = []  # (nome, parâmetros, resultado) das funções já executadas, aguardando a IA
+    for rodada in range(MAX_RODADAS):
+        try:
+            texto, chamadas = await _enviar(chat, conteudo, uso, on_delta, etapa=f"llm.call_{rodada + 1}")
+        except LLMUnavailableError as e:
+            if not pendentes:
+                raise
+            # As funções já rodaram: responde com os resultados, sem a IA
+            logger.warning("IA INDISPONÍVEL após as funções (%s): resposta por template", e)
+            contar_resiliencia("respostas_degradadas")
+            return "\n\n".join(rendering.render_without_llm(nome, params, resultado) for nome, params, resultado in pendentes)
+        if not chamadas:
+            if texto:
+                return texto
+            _contar("respostas_invalidas")
+            logger.error("A IA não devolveu texto nem chamada de função.")
+            return RESPOSTA_INVALIDA
+
+        desconhecidas = [nome for nome, _ in chamadas if nome not in tools]
+        if desconhecidas:
+            _contar("respostas_invalidas")
+            logger.error("A IA solicitou funções desconhecidas: %s", desconhecidas)
+            return "Desculpe, a IA pediu uma ferramenta que eu não conheço."
+
+        _contar("chamadas_de_funcao", len(chamadas))
+        if len(chamadas) > 1:
+            _contar("respostas_paralelas")
+        logger.debug("FUNÇÕES: %s", [nome for nome, _ in chamadas])
+        resultados = await asyncio.gather(*(
+            executar(nome, converter_argumentos(tools[nome], args)) for nome, args in chamadas
+        ))
+        # Estado e templates na ordem em que a IA pediu
+        respostas_locais = [await concluir(nome, params, resultado) for (nome, _), (params, resultado) in zip(chamadas, resultados)]
+        if all(resposta is not None for resposta in respostas_locais):
+            return "\n\n".join(respostas_locais)
+
+        pendentes = [(nome, params, resultado) for (nome, _), (params, resultado) in zip(chamadas, resultados)]
+        conteudo = [
+            {"function_response": {"name": nome, "response": {"resultado": resultado}}}
+            for nome, _, resultado in pendentes
+        ]
+    logger.error("A IA passou de %s rodadas de funções no mesmo turno.", MAX_RODADAS)
+    return "Desculpe, tive um problema ao processar sua solicitação após consultar os dados."
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from db import get_connection
+
+# --- Idempotência ---
+# Duas camadas contra processamento repetido:
+#   1. UpdateDeduplicator: o Telegram reenvia a atualização quando o webhook
+#      demora; o reenvio é descartado em O(1) (conjunto + ring buffer em memória
+#      e a maior update_id aceita, persistida por bot em `telegram_offsets`)
+#      antes de qualquer chamada à IA ou ao banco.
+#   2. Chaves de idempotência nas escritas (reserva/cancelamento): se o mesmo
+#      turno for reprocessado (ex: job retomado depois de uma queda), a escrita
+#      devolve o resultado gravado na primeira vez em vez de repetir.
+
+# Quantas update_ids recentes ficam na memória
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "4096"))
+# Por quanto tempo uma chave de idempotência é lembrada
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# A cada quantas gravações as chaves vencidas são apagadas
+PURGE_EVERY = 500
+
+
+class UpdateDeduplicator:
+    """
+    Conjunto limitado das update_ids já aceitas de um bot.
+    Regras de `reservar(update_id)`:
+      * já está na janela recente -> repetida
+      * maior que a marca d'água -> nova
+      * menor ou igual à marca d'água carregada na inicialização -> repetida
+        (foi aceita antes do reinício)
+      * caiu para fora da janela (mais velha que DEDUP_WINDOW) -> repetida
+      * senão (chegou fora de ordem depois do reinício) -> nova
+    """
+
+    def __init__(self, bot_id: str, window: int = DEDUP_WINDOW):
+        self.bot_id = bot_id
+        self.window = window
+        self._recentes: deque[int] = deque()
+        self._vistos: set[int] = set()
+        self._marca = None
+        self._marca_inicial = None
+        self._lock = threading.Lock()
+        self._stats = {"aceitas": 0, "repetidas": 0}
+
+    def _carregar(self) -> None:
+        result = get_connection().execute(
+            "SELECT ultimo_update_id FROM telegram_offsets WHERE bot_id = ?", (self.bot_id,)
+        ).fetchone()
+        self._marca = self._marca_inicial = result[0] if result else -1
+
+    @property
+    def high_water_mark(self) -> int:
+        if self._marca is None:
+            self._carregar()
+        return self._marca
+
+    def reservar(self, update_id: int) -> bool:
+        """
+        Marca a update_id como vista e retorna True se ela for nova (False = repetida).
+        Se o processamento não puder seguir, chame `liberar` para aceitar o reenvio.
+        """
+        if self._marca is None:
+            self._carregar()
+        with self._lock:
+            repetida = (
+                update_id in self._vistos
+                or update_id <= self._marca_inicial
+                or update_id <= self._marca - self.window
+            )
+            if repetida:
+                self._stats["repetidas"] += 1
+                return False
+            self._vistos.add(update_id)
+            self._recentes.append(update_id)
+            if len(self._recentes) > self.window:
+                self._vistos.discard(self._recentes.popleft())
+            self._marca = max(self._marca, update_id)
+            self._stats["aceitas"] += 1
+            return True
+
+    def liberar(self, update_id: int) -> None:
+        """Esquece uma update_id reservada (ex: fila cheia), para o reenvio ser aceito."""
+        with self._lock:
+            self._vistos.discard(update_id)
+
+    def persistir(self, conn, update_id: int) -> None:
+        """Grava a marca d'água (chamar dentro da transação que guardou a atualização)."""
+        conn.execute(
+            "INSERT INTO telegram_offsets (bot_id, ultimo_update_id) VALUES (?, ?) "
+            "ON CONFLICT (bot_id) DO UPDATE SET ultimo_update_id = MAX(ultimo_update_id, excluded.ultimo_update_id)",
+            (self.bot_id, update_id)
+        )
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["janela"] = len(self._recentes)
+        stats["marca_dagua"] = self._marca
+        return stats
+
+
+def bot_id_from_token(token: str | None) -> str:
+    """O ID numérico do bot é a parte do token antes do ':'."""
+    return token.split(":", 1)[0] if token else "default"
+
+
+# --- Chaves de Idempotência das Escritas ---
+_gravacoes = 0
+_gravacoes_lock = threading.Lock()
+
+
+def resultado_anterior(conn, chave: str | None):
+    """Resultado já gravado para a chave (None se for a primeira vez)."""
+    if not chave:
+        return None
+    result = conn.execute(
+        "SELECT resultado FROM idempotency_keys WHERE chave = ? AND criado_em > ?",
+        (chave, time.time() - IDEMPOTENCY_TTL_SECONDS)
+    ).fetchone()
+    return json.loads(result[0]) if result else None
+
+
+def guardar_resultado(conn, chave: str | None, resultado) -> None:
+    """Grava o resultado da escrita (na mesma transação dela)."""
+    global _gravacoes
+    if not chave:
+        return
+    agora = time.time()
+    conn.execute(
+        "INSERT OR REPLACE INTO idempotency_keys (chave, resultado, criado_em) VALUES (?, ?, ?)",
+        (chave, json.dumps(resultado), agora)
+    )
+    with _gravacoes_lock:
+        _gravacoes += 1
+        limpar = _gravacoes % PURGE_EVERY == 0
+    if limpar:
+        conn.execute("DELETE FROM idempotency_keys WHERE criado_em < ?", (agora - IDEMPOTENCY_TTL_SECONDS,))
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from booking import executar_escrita
+from db import get_connection, run_in_db_thread
+
+logger = logging.getLogger(__name__)
+
+# --- Fila Durável do Webhook ---
+# Cada atualização do Telegram é gravada na tabela `webhook_jobs` (migração 007)
+# ANTES de o webhook responder; um pool de workers assíncronos processa os jobs.
+#   * ordem por chat: um job só é pego quando não há job anterior do mesmo chat
+#     pendente ou em processamento (chats diferentes andam em paralelo)
+#   * retentativas com backoff; depois de JOB_MAX_ATTEMPTS o job vira 'morto' (dead-letter)
+#   * lease: um job 'processando' cujo worker morreu volta a ser pego quando o lease vence
+#   * backpressure: com JOB_MAX_PENDING jobs na fila o webhook recusa (o Telegram reenvia depois)
+
+# Workers processando jobs ao mesmo tempo (cada um atende um chat por vez)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Limite de jobs pendentes/em processamento antes de recusar novas atualizações
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "5000"))
+# Tentativas antes de mover o job para a dead-letter ('morto')
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# Tempo máximo que um worker pode segurar um job antes de outro poder pegá-lo
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+# Intervalo de consulta à fila quando não há aviso de job novo (outros processos)
+JOB_POLL_SECONDS = 1.0
+JOB_BACKOFF_BASE_SECONDS = 1.0
+JOB_BACKOFF_MAX_SECONDS = 60.0
+
+# Próximo job que pode ser processado: disponível (ou com lease vencido) e sem
+# nenhum job anterior do mesmo chat ainda na fila
+SQL_PROXIMO_JOB = """
+SELECT j.id FROM webhook_jobs j
+WHERE ((j.status = 'pendente' AND j.disponivel_em <= :agora)
+       OR (j.status = 'processando' AND j.lease_ate < :agora))
+  AND NOT EXISTS (
+      SELECT 1 FROM webhook_jobs a
+      WHERE a.chat_id = j.chat_id AND a.id < j.id AND a.status != 'morto'
+  )
+ORDER BY j.id
+LIMIT 1
+"""
+
+SQL_PENDENTES = "SELECT COUNT(*) FROM webhook_jobs WHERE status IN ('pendente', 'processando')"
+
+
+class JobQueue:
+    """
+    Fila durável com workers. `handler(chat_id, payload)` é a coroutine que
+    processa uma atualização; se ela levantar exceção o job é retentado.
+    """
+
+    def __init__(self, handler, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING):
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self._tasks: list[asyncio.Task] = []
+        self._stats = {"enfileirados": 0, "concluidos": 0, "retentativas": 0, "mortos": 0, "recusados": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, chave: str) -> None:
+        with self._stats_lock:
+            self._stats[chave] += 1
+
+    # --- Operações no banco (rodam no pool de threads do db.py) ---
+
+    def _inserir(self, jobs: list[tuple[str, dict]], na_transacao=None) -> int:
+        """Grava os jobs que couberem na fila (em ordem) numa única transação; retorna quantos."""
+        def operacao(conn):
+            vagas = max(0, self.max_pending - conn.execute(SQL_PENDENTES).fetchone()[0])
+            aceitos = jobs[:vagas]
+            agora = time.time()
+            conn.executemany(
+                "INSERT INTO webhook_jobs (chat_id, payload, disponivel_em, criado_em) VALUES (?, ?, ?, ?)",
+                [(chat_id, json.dumps(payload, ensure_ascii=False), agora, agora) for chat_id, payload in aceitos]
+            )
+            if na_transacao:
+                na_transacao(conn, len(aceitos))
+            return len(aceitos)
+        return executar_escrita(operacao)
+
+    def _pegar_proximo(self) -> tuple[int, str, dict, int] | None:
+        def operacao(conn):
+            agora = time.time()
+            job = conn.execute(SQL_PROXIMO_JOB, {"agora": agora}).fetchone()
+            if job is None:
+                return None
+            return conn.execute(
+                "UPDATE webhook_jobs SET status = 'processando', tentativas = tentativas + 1, lease_ate = ? "
+                "WHERE id = ? RETURNING id, chat_id, payload, tentativas",
+                (agora + JOB_LEASE_SECONDS, job[0])
+            ).fetchone()
+        job = executar_escrita(operacao)
+        if job is None:
+            return None
+        return job[0], job[1], json.loads(job[2]), job[3]
+
+    def _concluir(self, job_id: int) -> None:
+        executar_escrita(lambda conn: conn.execute("DELETE FROM webhook_jobs WHERE id = ?", (job_id,)))
+
+    def _falhar(self, job_id: int, tentativas: int, erro: str) -> bool:
+        """Agenda nova tentativa com backoff ou move para a dead-letter. Retorna True se morreu."""
+        morto = tentativas >= JOB_MAX_ATTEMPTS
+        espera = min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * (2 ** (tentativas - 1)))
+        executar_escrita(lambda conn: conn.execute(
+            "UPDATE webhook_jobs SET status = ?, disponivel_em = ?, lease_ate = NULL, erro = ? WHERE id = ?",
+            ("morto" if morto else "pendente", time.time() + random.uniform(espera / 2, espera), erro[:1000], job_id)
+        ))
+        return morto
+
+    def _devolver(self, job_id: int) -> None:
+        """Devolve um job interrompido (desligamento) sem gastar a tentativa."""
+        executar_escrita(lambda conn: conn.execute(
+            "UPDATE webhook_jobs SET status = 'pendente', tentativas = tentativas - 1, lease_ate = NULL WHERE id = ?",
+            (job_id,)
+        ))
+
+    # --- API ---
+
+    async def enqueue(self, chat_id, payload: dict, na_transacao=None) -> bool:
+        """
+        Grava a atualização na fila (durável ao retornar True). Retorna False se
+        a fila estiver cheia (backpressure): quem chamou deve recusar a atualização.
+        `na_transacao(conn)`, se informado, roda na mesma transação do INSERT.
+        """
+        def so_se_aceito(conn, aceitos):
+            if aceitos and na_transacao:
+                na_transacao(conn)
+        return await self.enqueue_many([(chat_id, payload)], so_se_aceito) == 1
+
+    async def enqueue_many(self, jobs: list[tuple], na_transacao=None) -> int:
+        """
+        Grava um lote de atualizações `(chat_id, payload)` numa única transação.
+        Se a fila não comportar todas, grava só as primeiras que couberem e
+        retorna quantas foram aceitas. `na_transacao(conn, aceitos)`, se
+        informado, roda na mesma transação (mesmo quando nenhuma coube).
+        """
+        jobs = [(str(chat_id), payload) for chat_id, payload in jobs]
+        aceitos = await run_in_db_thread(self._inserir, jobs, na_transacao)
+        recusados = len(jobs) - aceitos
+        with self._stats_lock:
+            self._stats["enfileirados"] += aceitos
+            self._stats["recusados"] += recusados
+        if recusados:
+            logger.warning("Fila do webhook cheia (%s). %s atualização(ões) recusada(s).", self.max_pending, recusados)
+        if aceitos:
+            self._acordar()
+        return aceitos
+
+    def start(self) -> None:
+        """Inicia os workers no event loop atual."""
+        if self._tasks:
+            return
+        self._novo_job = asyncio.Event()
+        self._parando = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info("FILA: %s workers processando a fila do webhook", self.workers)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Deixa os workers terminarem o job atual (até `timeout`) e os encerra."""
+        if not self._tasks:
+            return
+        self._parando = True
+        self._acordar()
+        _, ainda_rodando = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in ainda_rodando:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _acordar(self) -> None:
+        if self._tasks:
+            self._novo_job.set()
+
+    async def _worker(self) -> None:
+        while not self._parando:
+            self._novo_job.clear()
+            job = await run_in_db_thread(self._pegar_proximo)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._novo_job.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._processar(*job)
+
+    async def _processar(self, job_id: int, chat_id: str, payload: dict, tentativas: int) -> None:
+        try:
+            await self.handler(chat_id, payload)
+        except asyncio.CancelledError:
+            # Desligamento no meio do job: volta para a fila para o próximo processo
+            self._devolver(job_id)
+            raise
+        except Exception as e:
+            morto = await run_in_db_thread(self._falhar, job_id, tentativas, f"{type(e).__name__}: {e}")
+            self._count("mortos" if morto else "retentativas")
+            logger.error("Job %s (Chat ID %s) falhou na tentativa %s: %s%s", job_id, chat_id, tentativas, e,
+                         " - movido para a dead-letter" if morto else "")
+        else:
+            await run_in_db_thread(self._concluir, job_id)
+            self._count("concluidos")
+        # O job terminou: o próximo do mesmo chat já pode ser pego
+        self._acordar()
+
+    def metrics(self) -> dict:
+        """Contadores do processo + situação atual da tabela."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        por_status = dict(get_connection().execute(
+            "SELECT status, COUNT(*) FROM webhook_jobs GROUP BY status"
+        ).fetchall())
+        stats.update({f"fila_{status}": por_status.get(status, 0) for status in ("pendente", "processando", "morto")})
+        return stats
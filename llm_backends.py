@@ -0,0 +1,333 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import threading
+
+from config import create_model
+from llm_resilience import LLM_RESILIENCE_ENABLED, ResilientBackend
+
+logger = logging.getLogger(__name__)
+
+# --- Backends de IA Plugáveis ---
+# O agente só usa uma parte pequena da interface do Gemini, e é ela que todo
+# backend implementa:
+#   backend.start_chat() -> chat
+#   await chat.send_message_async(conteudo, stream=False, **kwargs) -> resposta
+#   resposta.text / resposta.parts (text, function_call) / resposta.usage_metadata
+#   com stream=True: `async for pedaco in resposta` antes de ler o uso
+# LLM_BACKEND escolhe a implementação:
+#   "gemini" (padrão): a API de verdade (config.create_model)
+#   "record": o Gemini, gravando cada resposta em LLM_REPLAY_FILE
+#   "replay": sem rede nem chave; devolve as respostas gravadas, achadas pelo
+#             hash do prompt, com latência sorteada de LLM_REPLAY_LATENCY
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").strip().lower()
+LLM_REPLAY_FILE = os.getenv("LLM_REPLAY_FILE", "llm_replay.jsonl")
+# "fixed:S", "uniform:MIN,MAX" ou "lognormal:MEDIANA,SIGMA" (segundos até a resposta)
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "lognormal:0.6,0.4")
+# Ritmo do texto no streaming (0 = tudo de uma vez)
+LLM_REPLAY_TOKENS_PER_SECOND = float(os.getenv("LLM_REPLAY_TOKENS_PER_SECOND", "0"))
+# Semente das latências (vazio = aleatória): a mesma semente repete a mesma sequência
+LLM_REPLAY_SEED = os.getenv("LLM_REPLAY_SEED", "")
+
+CARACTERES_POR_TOKEN = 4
+
+# Resposta de um prompt sem gravação (o agente segue como se a IA respondesse isso)
+RESPOSTA_NAO_GRAVADA = "Desculpe, não tenho uma resposta gravada para esta mensagem."
+
+# Contadores do replay/gravação (lidos por benchmarks e métricas)
+ESTATISTICAS = {"acertos": 0, "faltas": 0, "gravadas": 0}
+_estatisticas_lock = threading.Lock()
+
+
+def _contar(chave: str) -> None:
+    with _estatisticas_lock:
+        ESTATISTICAS[chave] += 1
+
+
+def metrics() -> dict:
+    """Acertos x faltas do replay (faltas = prompts que mudaram desde a gravação)."""
+    with _estatisticas_lock:
+        stats = dict(ESTATISTICAS)
+    consultas = stats["acertos"] + stats["faltas"]
+    stats["taxa_de_acerto"] = stats["acertos"] / consultas if consultas else 0.0
+    return stats
+
+
+def chave_do_prompt(system_instruction: str, tools, historico: list, conteudo) -> str:
+    """Hash de tudo que o modelo vê numa chamada: prompt de sistema, funções, histórico do chat e mensagem."""
+    prompt = json.dumps([system_instruction, tools, historico, conteudo], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+# --- Distribuição de Latência ---
+
+class LatencyDistribution:
+    """Latência (segundos) sorteada a cada chamada do backend de replay."""
+
+    def __init__(self, especificacao: str, seed: str = ""):
+        tipo, _, valores = especificacao.partition(":")
+        self.tipo = tipo.strip().lower()
+        self.valores = [float(v) for v in valores.split(",") if v.strip()]
+        esperado = {"fixed": 1, "uniform": 2, "lognormal": 2}.get(self.tipo)
+        if esperado is None or len(self.valores) != esperado:
+            raise ValueError(f"Latência inválida: '{especificacao}' (use fixed:S, uniform:MIN,MAX ou lognormal:MEDIANA,SIGMA)")
+        self._random = random.Random(seed or None)
+        self._lock = threading.Lock()
+
+    def sortear(self) -> float:
+        with self._lock:
+            if self.tipo == "fixed":
+                return self.valores[0]
+            if self.tipo == "uniform":
+                return self._random.uniform(*self.valores)
+            mediana, sigma = self.valores
+            return self._random.lognormvariate(math.log(mediana), sigma) if mediana > 0 else 0.0
+
+
+# --- Respostas Gravadas ---
+# Uma gravação é {"texto", "chamadas": [{"name", "args"}], "uso": {...}}: o
+# suficiente para remontar a resposta, com texto, chamadas de função e tokens.
+
+class _ChamadaDeFuncao:
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+
+class _Parte:
+    def __init__(self, text: str = "", function_call: _ChamadaDeFuncao | None = None):
+        self.text = text
+        self.function_call = function_call
+
+
+class _Uso:
+    def __init__(self, uso: dict):
+        self.prompt_token_count = uso.get("prompt_token_count", 0)
+        self.cached_content_token_count = uso.get("cached_content_token_count", 0)
+        self.candidates_token_count = uso.get("candidates_token_count", 0)
+
+
+class ReplayResponse:
+    def __init__(self, gravacao: dict):
+        self.text = gravacao.get("texto", "")
+        self.parts = [_Parte(function_call=_ChamadaDeFuncao(c["name"], dict(c["args"])))
+                      for c in gravacao.get("chamadas", [])]
+        if self.text:
+            self.parts.insert(0, _Parte(self.text))
+        self.usage_metadata = _Uso(gravacao.get("uso", {}))
+
+
+class _ReplayStream(ReplayResponse):
+    """Resposta com stream=True: o texto sai em pedaços no ritmo LLM_REPLAY_TOKENS_PER_SECOND."""
+
+    def __init__(self, gravacao: dict, latencia: float, tokens_por_segundo: float):
+        super().__init__(gravacao)
+        self._gravacao = gravacao
+        self._latencia = latencia
+        self._tokens_por_segundo = tokens_por_segundo
+
+    async def __aiter__(self):
+        await asyncio.sleep(self._latencia)
+        if self._gravacao.get("chamadas") or not self._tokens_por_segundo:
+            yield ReplayResponse(self._gravacao)
+            return
+        for inicio in range(0, len(self.text), CARACTERES_POR_TOKEN):
+            await asyncio.sleep(1 / self._tokens_por_segundo)
+            yield ReplayResponse({"texto": self.text[inicio:inicio + CARACTERES_POR_TOKEN]})
+
+
+def gravacao_da_resposta(resposta) -> dict:
+    """Resposta do Gemini -> gravação (texto, chamadas de função e uso de tokens)."""
+    textos, chamadas = [], []
+    try:
+        partes = list(resposta.parts)
+    except (AttributeError, ValueError):
+        partes = []
+    for parte in partes:
+        chamada = getattr(parte, "function_call", None)
+        if chamada and chamada.name:
+            chamadas.append({"name": chamada.name, "args": json.loads(json.dumps(dict(chamada.args or {}), default=str))})
+        elif getattr(parte, "text", ""):
+            textos.append(parte.text)
+    uso = getattr(resposta, "usage_metadata", None)
+    return {
+        "texto": "".join(textos),
+        "chamadas": chamadas,
+        "uso": {campo: getattr(uso, campo, 0) or 0 for campo in
+                ("prompt_token_count", "cached_content_token_count", "candidates_token_count")},
+    }
+
+
+# --- Backends ---
+
+class GeminiBackend:
+    """Adaptador do modelo do Gemini (com ou sem cache de contexto) para a interface de backend."""
+
+    nome = "gemini"
+
+    def __init__(self, model, system_instruction: str, tools: list | None = None):
+        self.model = model
+        self.system_instruction = system_instruction
+        self.tools = tools
+
+    def start_chat(self, **kwargs):
+        return self.model.start_chat(**kwargs)
+
+
+class _ReplayChat:
+    def __init__(self, backend: "ReplayBackend"):
+        self.backend = backend
+        self._historico = []
+
+    async def send_message_async(self, conteudo, stream: bool = False, **kwargs):
+        backend = self.backend
+        chave = chave_do_prompt(backend.system_instruction, backend.tools, self._historico, conteudo)
+        gravacao = backend.gravacoes.get(chave)
+        if gravacao is None:
+            _contar("faltas")
+            logger.warning("Replay sem gravação para o prompt %s; usando a resposta padrão.", chave[:12])
+            gravacao = backend.resposta_padrao()
+        else:
+            _contar("acertos")
+        latencia = backend.latencia.sortear()
+        if stream:
+            self._historico.append([conteudo, gravacao])
+            return _ReplayStream(gravacao, latencia, backend.tokens_por_segundo)
+        await asyncio.sleep(latencia)
+        # Como no Gemini, o histórico só muda quando a resposta chega (uma chamada
+        # cancelada por prazo ou hedge não deixa rastro)
+        self._historico.append([conteudo, gravacao])
+        return ReplayResponse(gravacao)
+
+
+class ReplayBackend:
+    """
+    Backend local e determinístico: devolve as respostas gravadas em `arquivo`
+    (JSON lines com "chave" e a gravação), achadas pelo hash do prompt.
+    """
+
+    nome = "replay"
+
+    def __init__(self, system_instruction: str, tools: list | None = None, arquivo: str = LLM_REPLAY_FILE,
+                 latencia: LatencyDistribution | None = None, tokens_por_segundo: float = LLM_REPLAY_TOKENS_PER_SECOND):
+        self.system_instruction = system_instruction
+        self.tools = tools
+        self.arquivo = arquivo
+        self.latencia = latencia or LatencyDistribution(LLM_REPLAY_LATENCY, LLM_REPLAY_SEED)
+        self.tokens_por_segundo = tokens_por_segundo
+        self.gravacoes = carregar_gravacoes(arquivo)
+        logger.info("LLM: Replay com %s respostas gravadas (%s)", len(self.gravacoes), arquivo)
+
+    def resposta_padrao(self) -> dict:
+        # Com funções a IA responde texto puro; no motor JSON, o envelope do SYSTEM_PROMPT
+        if self.tools:
+            return {"texto": RESPOSTA_NAO_GRAVADA, "chamadas": [], "uso": {}}
+        envelope = {
+            "status_processamento": "sucesso",
+            "acao_requerida": "RESPONDER_AO_USUARIO",
+            "payload_acao": {"resposta_para_usuario": RESPOSTA_NAO_GRAVADA},
+        }
+        return {"texto": json.dumps(envelope, ensure_ascii=False), "chamadas": [], "uso": {}}
+
+    def start_chat(self, **kwargs):
+        return _ReplayChat(self)
+
+
+def carregar_gravacoes(arquivo: str) -> dict:
+    """Lê o arquivo de gravações (uma por linha); a última gravação de uma chave vale."""
+    gravacoes = {}
+    if not os.path.exists(arquivo):
+        logger.warning("Arquivo de gravações '%s' não encontrado; todas as respostas serão a padrão.", arquivo)
+        return gravacoes
+    with open(arquivo, encoding="utf-8") as f:
+        for linha in f:
+            if linha.strip():
+                registro = json.loads(linha)
+                gravacoes[registro.pop("chave")] = registro
+    return gravacoes
+
+
+class _RecordingStream:
+    """Repassa o stream do modelo e grava a resposta quando ele termina."""
+
+    def __init__(self, resposta, gravar):
+        self._resposta = resposta
+        self._gravar = gravar
+
+    def __getattr__(self, nome):
+        return getattr(self._resposta, nome)
+
+    async def __aiter__(self):
+        async for pedaco in self._resposta:
+            yield pedaco
+        self._gravar(self._resposta)
+
+
+class _RecordingChat:
+    def __init__(self, backend: "RecordingBackend", chat):
+        self.backend = backend
+        self._chat = chat
+        self._historico = []
+
+    async def send_message_async(self, conteudo, stream: bool = False, **kwargs):
+        chave = chave_do_prompt(self.backend.system_instruction, self.backend.tools, self._historico, conteudo)
+
+        def gravar(resposta):
+            gravacao = gravacao_da_resposta(resposta)
+            self._historico.append([conteudo, gravacao])
+            self.backend.gravar(chave, gravacao)
+
+        resposta = await self._chat.send_message_async(conteudo, stream=stream, **kwargs)
+        if stream:
+            return _RecordingStream(resposta, gravar)
+        gravar(resposta)
+        return resposta
+
+
+class RecordingBackend:
+    """Usa outro backend (o Gemini) e grava cada resposta para o replay."""
+
+    nome = "record"
+
+    def __init__(self, backend, arquivo: str = LLM_REPLAY_FILE):
+        self.backend = backend
+        self.system_instruction = backend.system_instruction
+        self.tools = backend.tools
+        self.arquivo = arquivo
+        self._lock = threading.Lock()
+
+    def gravar(self, chave: str, gravacao: dict) -> None:
+        linha = json.dumps({"chave": chave, **gravacao}, ensure_ascii=False)
+        with self._lock, open(self.arquivo, "a", encoding="utf-8") as f:
+            f.write(linha + "\n")
+        _contar("gravadas")
+
+    def start_chat(self, **kwargs):
+        return _RecordingChat(self, self.backend.start_chat(**kwargs))
+
+
+def create_backend(system_instruction: str, tools: list | None = None, backend: str = LLM_BACKEND):
+    """
+    Cria o backend de IA configurado em LLM_BACKEND para este prompt de sistema
+    (e declarações de função), envolvido pelo ResilientBackend. Retorna None
+    se o Gemini for necessário e não houver chave de API.
+    """
+    if backend == "replay":
+        escolhido = ReplayBackend(system_instruction, tools)
+    else:
+        if backend not in ("gemini", "record"):
+            logger.warning("LLM_BACKEND '%s' desconhecido; usando o Gemini.", backend)
+        model = create_model(system_instruction, tools=tools)
+        if model is None:
+            return None
+        escolhido = GeminiBackend(model, system_instruction, tools)
+        if backend == "record":
+            logger.info("LLM: Gravando as respostas do Gemini em %s", LLM_REPLAY_FILE)
+            escolhido = RecordingBackend(escolhido)
+    # Prazos, retentativas, hedge e circuit breaker (llm_resilience.py)
+    return ResilientBackend(escolhido) if LLM_RESILIENCE_ENABLED else escolhido
@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+# --- Resiliência das Chamadas à IA ---
+# Envolve qualquer backend de llm_backends.py (mesma interface) com:
+#   * prazo por tentativa (LLM_CALL_TIMEOUT) e prazo total da chamada (LLM_CALL_DEADLINE)
+#   * retentativas com backoff e jitter só para erros transitórios (timeout,
+#     503, 429, 500, conexão); erros do pedido (ex: 400) sobem na hora
+#   * hedge opcional (LLM_HEDGE=1): se a resposta passar do p95 recente, uma
+#     2ª requisição igual é enviada e vale a que chegar primeiro
+#   * circuit breaker: depois de LLM_BREAKER_FAILURES falhas seguidas, as
+#     chamadas falham na hora (LLMUnavailableError) por LLM_BREAKER_COOLDOWN
+#     segundos e o agent.py responde sem a IA (caminho rápido / respostas prontas);
+#     depois, uma chamada de teste decide se o circuito fecha de novo
+#   * com stream=True, cada pedaço também tem prazo (LLM_CALL_TIMEOUT, dentro
+#     do prazo total) e o sucesso só conta quando o stream termina; uma falha
+#     no meio vira LLMUnavailableError (sem retentativa: parte do texto já saiu)
+
+LLM_RESILIENCE_ENABLED = os.getenv("LLM_RESILIENCE", "1") == "1"
+LLM_CALL_TIMEOUT_SECONDS = float(os.getenv("LLM_CALL_TIMEOUT", "20"))
+LLM_CALL_DEADLINE_SECONDS = float(os.getenv("LLM_CALL_DEADLINE", "45"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_SECONDS = 0.5
+LLM_RETRY_MAX_SECONDS = 4.0
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = 95
+# Antes de ter amostras suficientes para o p95, o hedge sai depois deste tempo
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER", "5"))
+LLM_HEDGE_MIN_SAMPLES = 20
+JANELA_DE_LATENCIAS = 200
+
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Erros transitórios do provedor (vale tentar de novo)
+ERROS_RETENTAVEIS = (
+    asyncio.TimeoutError,
+    ConnectionError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.RetryError,
+)
+
+
+class LLMUnavailableError(Exception):
+    """A IA não respondeu (circuito aberto, prazo esgotado ou falhas transitórias seguidas)."""
+
+
+# Contadores (lidos por benchmarks e métricas)
+ESTATISTICAS = {
+    "chamadas": 0, "sucessos": 0, "falhas": 0, "timeouts": 0, "retentativas": 0,
+    "hedges": 0, "hedges_vencedores": 0, "rejeitadas_pelo_circuito": 0, "respostas_degradadas": 0,
+}
+_estatisticas_lock = threading.Lock()
+
+
+def contar(chave: str) -> None:
+    with _estatisticas_lock:
+        ESTATISTICAS[chave] += 1
+
+
+# --- Circuit Breaker ---
+
+class CircuitBreaker:
+    """
+    fechado -> (N falhas seguidas) -> aberto -> (cooldown) -> meio_aberto
+    -> 1 chamada de teste: sucesso fecha, falha abre de novo.
+    """
+
+    def __init__(self, limite_falhas: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN_SECONDS):
+        self.limite_falhas = limite_falhas
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._estado = "fechado"
+        self._falhas_seguidas = 0
+        self._aberto_em = 0.0
+        self._teste_em_andamento = False
+        self.aberturas = 0
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            if self._estado == "aberto" and time.monotonic() - self._aberto_em >= self.cooldown:
+                return "meio_aberto"
+            return self._estado
+
+    def permitir(self) -> bool:
+        """True se a chamada pode ir ao provedor (no meio aberto, só uma de teste por vez)."""
+        with self._lock:
+            if self._estado == "fechado":
+                return True
+            if self._estado == "aberto":
+                if time.monotonic() - self._aberto_em < self.cooldown:
+                    return False
+                self._estado = "meio_aberto"
+            if self._teste_em_andamento:
+                return False
+            self._teste_em_andamento = True
+            return True
+
+    def registrar_sucesso(self) -> None:
+        with self._lock:
+            if self._estado != "fechado":
+                logger.info("IA: Circuito fechado (provedor respondeu)")
+            self._estado = "fechado"
+            self._falhas_seguidas = 0
+            self._teste_em_andamento = False
+
+    def registrar_falha(self) -> None:
+        with self._lock:
+            self._falhas_seguidas += 1
+            self._teste_em_andamento = False
+            if self._estado == "meio_aberto" or self._falhas_seguidas >= self.limite_falhas:
+                if self._estado != "aberto":
+                    self.aberturas += 1
+                    logger.warning("IA: Circuito ABERTO após %s falhas; respostas sem IA por %.0fs",
+                                   self._falhas_seguidas, self.cooldown)
+                self._estado = "aberto"
+                self._aberto_em = time.monotonic()
+
+    def liberar_teste(self) -> None:
+        """Chamada de teste que terminou sem dizer nada do provedor (ex: erro do pedido)."""
+        with self._lock:
+            self._teste_em_andamento = False
+
+    def metrics(self) -> dict:
+        estado = self.estado
+        with self._lock:
+            return {"estado": estado, "falhas_seguidas": self._falhas_seguidas, "aberturas": self.aberturas}
+
+
+class LatencyWindow:
+    """Latências das últimas respostas bem-sucedidas (para o limite do hedge)."""
+
+    def __init__(self, tamanho: int = JANELA_DE_LATENCIAS):
+        self._amostras = deque(maxlen=tamanho)
+        self._lock = threading.Lock()
+
+    def registrar(self, segundos: float) -> None:
+        with self._lock:
+            self._amostras.append(segundos)
+
+    def percentil(self, p: float) -> float | None:
+        with self._lock:
+            if len(self._amostras) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            ordenadas = sorted(self._amostras)
+        return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p / 100))]
+
+
+BREAKER = CircuitBreaker()
+LATENCIAS = LatencyWindow()
+
+
+def metrics() -> dict:
+    """Contadores das chamadas, estado do circuito e limite atual do hedge."""
+    with _estatisticas_lock:
+        stats = dict(ESTATISTICAS)
+    stats["circuito"] = BREAKER.metrics()
+    stats["p95_segundos"] = LATENCIAS.percentil(LLM_HEDGE_PERCENTILE)
+    return stats
+
+
+# --- Backend Resiliente ---
+
+class _ResilientStream:
+    """Repassa o stream do modelo com prazo por pedaço e avisa o circuito quando ele termina."""
+
+    def __init__(self, resposta, breaker: CircuitBreaker, fim: float):
+        self._resposta = resposta
+        self._breaker = breaker
+        self._fim = fim
+
+    def __getattr__(self, nome):
+        return getattr(self._resposta, nome)
+
+    async def __aiter__(self):
+        pedacos = aiter(self._resposta)
+        resolvido = False
+        try:
+            while True:
+                restante = self._fim - time.monotonic()
+                if restante <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    pedaco = await asyncio.wait_for(anext(pedacos), min(LLM_CALL_TIMEOUT_SECONDS, restante))
+                except StopAsyncIteration:
+                    break
+                yield pedaco
+            resolvido = True
+            self._breaker.registrar_sucesso()
+            contar("sucessos")
+        except ERROS_RETENTAVEIS as e:
+            resolvido = True
+            contar("timeouts" if isinstance(e, asyncio.TimeoutError) else "falhas")
+            logger.warning("IA: Stream interrompido (%s: %s)", type(e).__name__, e)
+            self._breaker.registrar_falha()
+            raise LLMUnavailableError(f"IA indisponível no meio da resposta: {type(e).__name__}") from e
+        finally:
+            if not resolvido:
+                # Erro do pedido, cancelamento ou stream abandonado: não diz nada do provedor
+                self._breaker.liberar_teste()
+
+
+class _ResilientChat:
+    def __init__(self, backend: "ResilientBackend", chat):
+        self.backend = backend
+        self._chat = chat
+
+    async def _hedge(self, conteudo, kwargs, prazo: float):
+        """Envia; se passar do p95, envia de novo e fica com a primeira resposta bem-sucedida."""
+        fim = time.monotonic() + prazo
+        limite = LATENCIAS.percentil(LLM_HEDGE_PERCENTILE) or LLM_HEDGE_AFTER_SECONDS
+        original = asyncio.ensure_future(self._chat.send_message_async(conteudo, **kwargs))
+        pendentes = {original}
+        try:
+            await asyncio.wait(pendentes, timeout=min(limite, prazo))
+            if not original.done():
+                contar("hedges")
+                logger.info("IA: Sem resposta em %.2fs (p%s); enviando requisição de hedge", limite, LLM_HEDGE_PERCENTILE)
+                pendentes.add(asyncio.ensure_future(self._chat.send_message_async(conteudo, **kwargs)))
+            erro = None
+            while pendentes:
+                restante = fim - time.monotonic()
+                if restante <= 0:
+                    break
+                feitas, pendentes = await asyncio.wait(pendentes, timeout=restante, return_when=asyncio.FIRST_COMPLETED)
+                for tarefa in feitas:
+                    if tarefa.exception() is None:
+                        if tarefa is not original:
+                            contar("hedges_vencedores")
+                        return tarefa.result()
+                    erro = tarefa.exception()
+            raise erro or asyncio.TimeoutError()
+        finally:
+            for tarefa in pendentes:
+                tarefa.cancel()
+
+    async def _tentativa(self, conteudo, stream: bool, kwargs, prazo: float):
+        inicio = time.monotonic()
+        if stream or not LLM_HEDGE_ENABLED:
+            # Com stream, aqui o prazo vale até o início da resposta (os pedaços: _ResilientStream)
+            resposta = await asyncio.wait_for(self._chat.send_message_async(conteudo, stream=stream, **kwargs), prazo)
+        else:
+            resposta = await self._hedge(conteudo, kwargs, prazo)
+        if not stream:
+            LATENCIAS.registrar(time.monotonic() - inicio)
+        return resposta
+
+    async def send_message_async(self, conteudo, stream: bool = False, **kwargs):
+        breaker = self.backend.breaker
+        contar("chamadas")
+        if not breaker.permitir():
+            contar("rejeitadas_pelo_circuito")
+            raise LLMUnavailableError("circuito aberto")
+
+        fim = time.monotonic() + LLM_CALL_DEADLINE_SECONDS
+        ultimo_erro = None
+        for tentativa in range(LLM_MAX_RETRIES + 1):
+            restante = fim - time.monotonic()
+            if restante <= 0:
+                break
+            if tentativa:
+                contar("retentativas")
+            try:
+                resposta = await self._tentativa(conteudo, stream, kwargs, min(LLM_CALL_TIMEOUT_SECONDS, restante))
+            except ERROS_RETENTAVEIS as e:
+                ultimo_erro = e
+                contar("timeouts" if isinstance(e, asyncio.TimeoutError) else "falhas")
+                logger.warning("IA: Tentativa %s falhou (%s: %s)", tentativa + 1, type(e).__name__, e)
+                breaker.registrar_falha()
+                if not breaker.permitir():
+                    break
+                espera = min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * (2 ** tentativa))
+                await asyncio.sleep(min(random.uniform(espera / 2, espera), max(0.0, fim - time.monotonic())))
+                continue
+            except BaseException:
+                # Erro do pedido (não do provedor) ou chamada cancelada: não conta para o
+                # circuito, mas libera a chamada de teste do meio aberto
+                breaker.liberar_teste()
+                raise
+            if stream:
+                # Sucesso ou falha só quando o stream terminar
+                return _ResilientStream(resposta, breaker, fim)
+            breaker.registrar_sucesso()
+            contar("sucessos")
+            return resposta
+        raise LLMUnavailableError(f"IA indisponível: {type(ultimo_erro).__name__ if ultimo_erro else 'prazo esgotado'}")
+
+
+class ResilientBackend:
+    """Mesmo backend, com prazos, retentativas, hedge e circuit breaker em cada chamada."""
+
+    def __init__(self, backend, breaker: CircuitBreaker = BREAKER):
+        self.backend = backend
+        self.breaker = breaker
+        self.nome = getattr(backend, "nome", "llm")
+        self.system_instruction = getattr(backend, "system_instruction", None)
+        self.tools = getattr(backend, "tools", None)
+
+    def start_chat(self, **kwargs):
+        return _ResilientChat(self, self.backend.start_chat(**kwargs))
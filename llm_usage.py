@@ -0,0 +1,69 @@
+import threading
+
+# --- Contabilidade de Tokens ---
+# Soma o `usage_metadata` de cada resposta do Gemini por turno (uma mensagem do
+# usuário = 1 ou 2 chamadas) e no total do processo. `cached_tokens` é a parte
+# do prompt servida pelo cache de contexto (o SYSTEM_PROMPT), que não é
+# reenviada nem cobrada como prompt normal.
+
+
+def usage_of(response) -> dict:
+    """Tokens de uma resposta do modelo (zeros se ela não trouxer usage_metadata)."""
+    uso = getattr(response, "usage_metadata", None)
+    return {
+        "prompt_tokens": getattr(uso, "prompt_token_count", 0) or 0,
+        "cached_tokens": getattr(uso, "cached_content_token_count", 0) or 0,
+        "output_tokens": getattr(uso, "candidates_token_count", 0) or 0,
+    }
+
+
+class TurnUsage:
+    """Tokens gastos em um turno da conversa."""
+
+    __slots__ = ("calls", "prompt_tokens", "cached_tokens", "output_tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+
+    def add(self, response) -> None:
+        """Soma o uso de uma resposta do modelo (respostas sem usage_metadata contam só a chamada)."""
+        self.calls += 1
+        uso = usage_of(response)
+        self.prompt_tokens += uso["prompt_tokens"]
+        self.cached_tokens += uso["cached_tokens"]
+        self.output_tokens += uso["output_tokens"]
+
+    def as_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class UsageTotals:
+    """Totais do processo (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.totals = TurnUsage()
+
+    def record(self, turno: TurnUsage) -> None:
+        with self._lock:
+            self.turns += 1
+            for slot in TurnUsage.__slots__:
+                setattr(self.totals, slot, getattr(self.totals, slot) + getattr(turno, slot))
+
+    def summary(self) -> dict:
+        """Totais, médias por turno e fração do prompt que veio do cache."""
+        with self._lock:
+            resumo = self.totals.as_dict()
+            turnos = self.turns
+        resumo["turns"] = turnos
+        resumo["prompt_tokens_per_turn"] = resumo["prompt_tokens"] / turnos if turnos else 0.0
+        resumo["output_tokens_per_turn"] = resumo["output_tokens"] / turnos if turnos else 0.0
+        resumo["cached_fraction"] = resumo["cached_tokens"] / resumo["prompt_tokens"] if resumo["prompt_tokens"] else 0.0
+        return resumo
+
+
+USAGE = UsageTotals()
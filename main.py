@@ -1,15 +1,103 @@
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field # Importa Field
 import json
+import logging
+import time
 import uuid # <-- NOVO: Para gerar IDs únicos
 
+# Logs do servidor: nível LOG_LEVEL, com os DEBUG só nos turnos amostrados (tracing.py).
+# Configurados antes dos outros módulos, que já logam ao serem importados (config.py)
+import tracing
+tracing.configure_logging()
+
 # Importa nossas funções refatoradas
-from agent import handle_message
-from telegram_utils import parse_webhook_data, send_telegram_message
+import agent
+import availability
+import booking
+import cache
+import fast_path
+import function_calling
+import llm_backends
+import llm_resilience
+import metrics
+import rendering
+import schedules
+from agent import handle_message_async
+from config import TELEGRAM_BOT_TOKEN
+from db import get_connection, run_in_db_thread
+from idempotency import UpdateDeduplicator, bot_id_from_token
+from job_queue import JobQueue
+from llm_usage import USAGE
+from migrations import MIGRATIONS, current_version, run_migrations
+from polling import TELEGRAM_MODE, TelegramPoller
+from telegram_dispatcher import DISPATCHER
+from telegram_utils import parse_update_id, parse_webhook_data, send_telegram_message_async
+
+logger = logging.getLogger(__name__)
+
+# --- Processamento das Atualizações do Telegram ---
+async def process_telegram_update(chat_id: str, update: dict):
+    """
+    Processa uma atualização guardada na fila durável (job_queue.py): roda o
+    agente e entrega a resposta ao despachante. Exceções fazem o job ser retentado.
+    """
+    _, user_message = parse_webhook_data(update)
+    update_id = parse_update_id(update)
+    # A update_id vira a chave de idempotência das reservas/cancelamentos do turno
+    escopo = f"tg:{BOT_ID}:{update_id}" if update_id is not None else None
+    inicio = time.perf_counter()
+    # Um trace por atualização: o turno do agente e o envio ao Telegram ficam abaixo dele
+    try:
+        with tracing.start_trace("telegram.update", chat_id=chat_id, update_id=update_id):
+            bot_reply = await handle_message_async(chat_id, user_message, escopo)
+            if bot_reply:
+                # Depois que o agente rodou o job não é repetido (o turno já mudou o estado
+                # da conversa); se a fila de envio estiver cheia, o despachante registra o descarte
+                await send_telegram_message_async(chat_id, bot_reply)
+            else:
+                logger.warning("handle_message não retornou resposta para enviar (Telegram).")
+    finally:
+        metrics.TELEGRAM_UPDATE_SECONDS.observe(time.perf_counter() - inicio)
+
+BOT_ID = bot_id_from_token(TELEGRAM_BOT_TOKEN)
+WEBHOOK_QUEUE = JobQueue(process_telegram_update)
+# Reenvios do Telegram (mesma update_id) são descartados antes de qualquer trabalho
+UPDATE_DEDUP = UpdateDeduplicator(BOT_ID)
+# Com TELEGRAM_MODE=polling as atualizações chegam por getUpdates (mesma fila e dedup)
+POLLER = TelegramPoller(WEBHOOK_QUEUE, UPDATE_DEDUP) if TELEGRAM_MODE == "polling" else None
+
+# --- Ciclo de Vida do Servidor ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Garante que o schema (tabelas e índices) está na última versão antes de atender
+    versao = run_migrations()
+    logger.info("Banco de dados na versão de schema %s", versao)
+    DISPATCHER.start()
+    WEBHOOK_QUEUE.start()
+    if POLLER:
+        POLLER.start()
+    # Regeneração diária dos horários a partir das agendas (schedules.py), se ligada
+    regeneracao = asyncio.create_task(schedules.regenerar_todo_dia()) if schedules.AGENDA_HORA_NOTURNA else None
+    yield
+    if regeneracao:
+        regeneracao.cancel()
+        await asyncio.gather(regeneracao, return_exceptions=True)
+    if POLLER:
+        await POLLER.stop()
+    # Termina os jobs em andamento e entrega as respostas que ainda estão na fila
+    await WEBHOOK_QUEUE.stop()
+    await DISPATCHER.stop()
+    # Exporta os spans que ainda estão na fila
+    tracing.flush()
 
 # Inicializa o FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+# Histograma de latência das rotas de conversa (metrics.py)
+app.add_middleware(metrics.MetricsMiddleware, rotas=("/chat", "/chat/stream", "/webhook/telegram"))
 
 # --- Configuração do CORS (Idêntica) ---
 origins = ["*"] 
@@ -32,37 +120,48 @@ class ChatResponse(BaseModel):
 
 # --- ROTA DE WEBHOOK TELEGRAM (Idêntica à anterior) ---
 @app.post("/webhook/telegram")
-async def webhook_telegram(request: Request, background_tasks: BackgroundTasks):
+async def webhook_telegram(request: Request):
     request_data = {}
+    update_id = None
     try:
         request_data = await request.json()
         # print("--- Telegram Webhook Recebido (Payload Bruto) ---") 
         # print(json.dumps(request_data, indent=2, ensure_ascii=False))
 
+        update_id = parse_update_id(request_data)
+        if update_id is not None and not UPDATE_DEDUP.reservar(update_id):
+            logger.info("DEDUP: Atualização %s repetida (reenvio do Telegram). Ignorando.", update_id)
+            return {"status": "ok, repetido"}
+
         user_chat_id, user_message = parse_webhook_data(request_data)
 
         if user_chat_id and user_message:
-            print(f"--- Delegando para o Agente (Telegram) em Segundo Plano (Chat ID: {user_chat_id}) ---")
-
-            def process_and_send(chat_id, message):
-                bot_reply = handle_message(chat_id, message)
-                if bot_reply:
-                    send_telegram_message(chat_id, bot_reply)
-                else:
-                    print("handle_message não retornou resposta para enviar (Telegram).")
-
-            background_tasks.add_task(process_and_send, user_chat_id, user_message)
-            return {"status": "ok, processando em segundo plano"}
+            # Grava a atualização na fila durável e responde logo; os workers
+            # processam na ordem de cada chat (e nada se perde se o servidor reiniciar).
+            # A marca d'água da update_id é gravada na mesma transação.
+            marcar_update = (lambda conn: UPDATE_DEDUP.persistir(conn, update_id)) if update_id is not None else None
+            if not await WEBHOOK_QUEUE.enqueue(user_chat_id, request_data, marcar_update):
+                # Fila cheia: 503 faz o Telegram reenviar a atualização mais tarde
+                if update_id is not None:
+                    UPDATE_DEDUP.liberar(update_id)
+                raise HTTPException(status_code=503, detail="Fila cheia, tente novamente.")
+            logger.debug("Atualização enfileirada para o Agente (Telegram) (Chat ID: %s)", user_chat_id)
+            return {"status": "ok, enfileirado"}
         else:
-            print("Webhook recebido (Telegram), mas não é uma mensagem de texto. Ignorando.")
+            logger.debug("Webhook recebido (Telegram), mas não é uma mensagem de texto. Ignorando.")
             return {"status": "ok, ignorado"}
 
     except json.JSONDecodeError:
-        print("Erro: Não foi possível decodificar o JSON recebido (Telegram).")
+        logger.error("Não foi possível decodificar o JSON recebido (Telegram).")
         raise HTTPException(status_code=400, detail="Payload inválido.")
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Erro inesperado na Rota Telegram: {e}")
-        return {"status": "ok, erro interno no processamento"}
+        logger.exception("Erro inesperado na Rota Telegram: %s", e)
+        # A atualização não foi guardada: esquece a update_id e responde 500 para o Telegram reenviar
+        if update_id is not None:
+            UPDATE_DEDUP.liberar(update_id)
+        raise HTTPException(status_code=500, detail="Erro interno, tente novamente.")
 
 # --- ROTA PARA O FRONTEND WEB (ATUALIZADA COM SESSÕES) ---
 @app.post("/chat", response_model=ChatResponse)
@@ -77,26 +176,146 @@ async def chat_endpoint(request_data: ChatRequest):
     if not session_id:
         # Se o frontend não enviou um ID, gera um novo
         session_id = str(uuid.uuid4()) # Gera um ID único universal
-        print(f"--- Nova Sessão Web Iniciada --- ID: {session_id}")
+        logger.debug("Nova Sessão Web Iniciada - ID: %s", session_id)
     else:
-        print(f"--- Sessão Web Existente --- ID: {session_id}")
+        logger.debug("Sessão Web Existente - ID: %s", session_id)
 
-    print(f"Mensagem Recebida (Web): {user_message}")
+    logger.debug("Mensagem Recebida (Web): %s", user_message)
 
     # Chama a lógica do agente USANDO o session_id como chave da memória
-    bot_reply = handle_message(session_id, user_message)
+    # (await: enquanto a IA responde, o servidor continua atendendo outros usuários)
+    bot_reply = await handle_message_async(session_id, user_message)
 
     if bot_reply is None:
         bot_reply = "Desculpe, ocorreu um erro ao processar sua mensagem."
 
-    print(f"--- Resposta /chat enviada (Sessão: {session_id}) ---")
-    print(f"Reply: {bot_reply}")
+    logger.debug("Resposta /chat enviada (Sessão: %s): %s", session_id, bot_reply)
 
     # Retorna a resposta E o session_id para o frontend
     return ChatResponse(reply=bot_reply, session_id=session_id)
 
 
+# --- ROTA DE STREAMING PARA O FRONTEND WEB (Server-Sent Events) ---
+def _evento_sse(evento: str, dados: dict) -> str:
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request_data: ChatRequest):
+    """
+    Igual ao /chat, mas responde em Server-Sent Events enquanto a IA gera:
+      * `sessao`: {"session_id"} logo de início
+      * `delta`:  {"texto"} cada pedaço novo da resposta
+      * `fim`:    {"reply", "session_id"} a resposta completa (é ela que vale;
+                  respostas sem IA, como o caminho rápido, só chegam aqui)
+    """
+    user_message = request_data.message
+    session_id = request_data.session_id or str(uuid.uuid4())
+    logger.debug("Mensagem Recebida (Web, streaming): %s (Sessão: %s)", user_message, session_id)
+
+    async def eventos():
+        pedacos: asyncio.Queue = asyncio.Queue()
+        # O turno roda numa task própria: se o navegador desconectar, ele
+        # termina mesmo assim (o estado da conversa fica consistente)
+        turno = asyncio.create_task(handle_message_async(session_id, user_message, on_delta=pedacos.put))
+        turno.add_done_callback(lambda _: pedacos.put_nowait(None))
+        yield _evento_sse("sessao", {"session_id": session_id})
+        while (pedaco := await pedacos.get()) is not None:
+            yield _evento_sse("delta", {"texto": pedaco})
+        try:
+            bot_reply = turno.result()
+        except Exception as e:
+            logger.exception("Erro inesperado na Rota /chat/stream: %s", e)
+            bot_reply = None
+        if bot_reply is None:
+            bot_reply = "Desculpe, ocorreu um erro ao processar sua mensagem."
+        logger.debug("Resposta /chat/stream enviada (Sessão: %s)", session_id)
+        yield _evento_sse("fim", {"reply": bot_reply, "session_id": session_id})
+
+    # X-Accel-Buffering: evita que proxies (nginx/Render) segurem os eventos
+    return StreamingResponse(eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # --- ROTA HEALTH CHECK (Idêntica) ---
 @app.get("/")
 async def root():
-    return {"status": "Servidor do Chatbot (Refatorado v2) está rodando!"}
\ No newline at end of file
+    return {"status": "Servidor do Chatbot (Refatorado v2) está rodando!"}
+
+
+# --- Métricas (Prometheus) e Prontidão ---
+ESTADOS_DO_CIRCUITO = {"fechado": 0, "meio_aberto": 1, "aberto": 2}
+PRONTIDAO_TIMEOUT_SECONDS = 2.0
+
+
+def _coletar_metricas_do_servidor():
+    """Lê, a cada /metrics, os números que os módulos já mantêm (sem custo no caminho quente)."""
+    fila = WEBHOOK_QUEUE.metrics()
+    # Com STATE_BACKEND=sqlite o tamanho é um COUNT(*): lido uma vez só
+    estado = agent.CONVERSATION_STATE.metrics()
+    envio = DISPATCHER.metrics()
+    reservas = booking.metrics()
+    ia = llm_resilience.metrics()
+    tokens = USAGE.summary()
+    yield ("conversation_state_sessions", "gauge", "Conversas guardadas em CONVERSATION_STATE",
+           [({}, estado["size"])])
+    yield ("webhook_queue_jobs", "gauge", "Jobs da fila durável do webhook por status",
+           [({"status": status}, fila[f"fila_{status}"]) for status in ("pendente", "processando", "morto")])
+    yield ("telegram_pending_messages", "gauge", "Mensagens esperando envio no despachante", [({}, envio["pendentes"])])
+    yield ("telegram_send_failures_total", "counter", "Mensagens que o Telegram recusou ou que esgotaram as tentativas",
+           [({}, envio["falhas"])])
+    yield ("telegram_dropped_messages_total", "counter", "Mensagens descartadas com a fila de envio cheia",
+           [({}, envio["descartadas"])])
+    yield ("booking_conflicts_total", "counter", "Reservas recusadas porque o horário já estava tomado",
+           [({}, reservas["conflitos"])])
+    yield ("llm_circuit_state", "gauge", "Circuito da IA: 0 fechado, 1 meio aberto, 2 aberto",
+           [({}, ESTADOS_DO_CIRCUITO[ia["circuito"]["estado"]])])
+    yield ("llm_tokens_total", "counter", "Tokens gastos pela IA desde a subida do servidor",
+           [({"tipo": tipo}, tokens[f"{tipo}_tokens"]) for tipo in ("prompt", "cached", "output")])
+    # O resto dos contadores de cada módulo, como estão nos seus metrics()
+    fontes = {
+        "fast_path": fast_path.metrics(), "rendering": rendering.metrics(), "cache": cache.metrics(),
+        "function_calling": function_calling.metrics(), "llm_backends": llm_backends.metrics(),
+        "llm_resilience": ia, "booking": reservas, "conversation_state": estado,
+        "webhook_queue": fila, "telegram": envio, "dedup": UPDATE_DEDUP.metrics(), "tracing": tracing.metrics(),
+        "schedules": schedules.metrics(), "availability": availability.metrics(),
+    }
+    if POLLER:
+        fontes["polling"] = POLLER.metrics()
+    yield ("stats", "untyped", "Contadores internos de cada módulo (fonte = módulo)",
+           [amostra for fonte, stats in fontes.items() for amostra in metrics.stats_samples(fonte, stats)])
+
+
+metrics.register_collector(_coletar_metricas_do_servidor)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métricas no formato de texto do Prometheus (os coletores leem o banco: fora do event loop)."""
+    return PlainTextResponse(await run_in_db_thread(metrics.render), media_type="text/plain; version=0.0.4")
+
+
+def _versao_do_banco() -> int:
+    return current_version(get_connection())
+
+
+@app.get("/healthz/ready")
+async def readiness():
+    """
+    Pronto para receber tráfego: banco acessível e no schema mais recente, e o
+    modelo do motor configurado. O circuito da IA aberto não reprova (o agente
+    responde sem a IA nesse caso); ele só aparece no resultado.
+    """
+    verificacoes = {}
+    try:
+        versao = await asyncio.wait_for(run_in_db_thread(_versao_do_banco), PRONTIDAO_TIMEOUT_SECONDS)
+        esperada = MIGRATIONS[-1][0]
+        verificacoes["banco"] = "ok" if versao >= esperada else f"schema na versão {versao}, esperada {esperada}"
+    except Exception as e:
+        verificacoes["banco"] = f"erro: {type(e).__name__}: {e}"
+    modelo = agent.model_funcoes if agent.AGENT_ENGINE == "functions" else agent.model
+    verificacoes["modelo"] = "ok" if modelo is not None else "não carregado (GEMINI_API_KEY?)"
+    pronto = all(resultado == "ok" for resultado in verificacoes.values())
+    return JSONResponse(
+        {"pronto": pronto, "verificacoes": verificacoes, "circuito_da_ia": llm_resilience.BREAKER.estado},
+        status_code=200 if pronto else 503,
+    )
\ No newline at end of file
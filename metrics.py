@@ -0,0 +1,220 @@
+import bisect
+import logging
+import math
+import threading
+import time
+
+# --- Métricas no Formato do Prometheus ---
+# Histogramas e contadores para o /metrics (main.py), feitos para ficar no
+# caminho quente: cada thread soma na sua própria cópia dos valores, sem lock
+# (só a dona escreve nela), e a leitura do /metrics soma as cópias de todas as
+# threads. O lock só é usado uma vez por thread, para registrar a cópia nova.
+# Números que outros módulos já contam (tamanho do estado, fila, envios,
+# reservas...) não são duplicados aqui: coletores registrados com
+# register_collector() os leem na hora da leitura.
+
+PREFIXO = "clinica"
+# Segundos: do acesso ao banco (sub-ms) até uma chamada lenta à IA
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+logger = logging.getLogger(__name__)
+
+METRICAS: list["_PorThread"] = []
+COLETORES = []
+
+
+class _PorThread:
+    """Base das métricas registradas: uma cópia dos valores por thread, somadas na leitura."""
+
+    tipo = "untyped"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: tuple[str, ...] = ()):
+        self.nome = f"{PREFIXO}_{nome}"
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self._local = threading.local()
+        self._copias: list[dict] = []
+        self._lock = threading.Lock()
+        METRICAS.append(self)
+
+    def _copia(self) -> dict:
+        try:
+            return self._local.valores
+        except AttributeError:
+            valores = self._local.valores = {}
+            with self._lock:
+                self._copias.append(valores)
+            return valores
+
+    def _somar(self) -> dict[tuple, list]:
+        total: dict[tuple, list] = {}
+        with self._lock:
+            copias = list(self._copias)
+        for copia in copias:
+            # list() copia os itens de uma vez (a thread dona pode estar criando uma série nova)
+            for rotulos, serie in list(copia.items()):
+                acumulada = total.get(rotulos)
+                if acumulada is None:
+                    total[rotulos] = list(serie)
+                else:
+                    for i, valor in enumerate(serie):
+                        acumulada[i] += valor
+        return total
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_PorThread):
+    """Contador só crescente, com rótulos opcionais."""
+
+    tipo = "counter"
+
+    def inc(self, *rotulos: str, n: float = 1) -> None:
+        valores = self._copia()
+        serie = valores.get(rotulos)
+        if serie is None:
+            serie = valores[rotulos] = [0]
+        serie[0] += n
+
+    def render(self) -> list[str]:
+        return [f"{self.nome}{_rotulos(self.rotulos, valores)} {_numero(serie[0])}"
+                for valores, serie in sorted(self._somar().items())]
+
+
+class Histogram(_PorThread):
+    """Histograma com buckets fixos (limite superior inclusivo, como no Prometheus)."""
+
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: tuple[str, ...] = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(buckets)
+
+    def observe(self, valor: float, *rotulos: str) -> None:
+        valores = self._copia()
+        serie = valores.get(rotulos)
+        if serie is None:
+            # Um contador por bucket, +Inf e a soma
+            serie = valores[rotulos] = [0] * (len(self.buckets) + 1) + [0.0]
+        serie[bisect.bisect_left(self.buckets, valor)] += 1
+        serie[-1] += valor
+
+    def render(self) -> list[str]:
+        linhas = []
+        for valores, serie in sorted(self._somar().items()):
+            acumulado = 0
+            for limite, quantidade in zip(self.buckets + (math.inf,), serie):
+                acumulado += quantidade
+                le = "+Inf" if limite == math.inf else _numero(limite)
+                linhas.append(f"{self.nome}_bucket{_rotulos(self.rotulos + ('le',), valores + (le,))} {acumulado}")
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, valores)} {_numero(serie[-1])}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, valores)} {acumulado}")
+        return linhas
+
+
+def _numero(valor: float) -> str:
+    if isinstance(valor, bool):
+        return "1" if valor else "0"
+    if isinstance(valor, int) or float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _rotulos(nomes: tuple, valores: tuple) -> str:
+    if not nomes:
+        return ""
+    return "{" + ",".join(f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)) + "}"
+
+
+# --- Métricas do Servidor ---
+
+HTTP_REQUEST_SECONDS = Histogram("http_request_seconds", "Duração das requisições HTTP (até o fim da resposta)", ("rota", "status"))
+TELEGRAM_UPDATE_SECONDS = Histogram("telegram_update_seconds", "Processamento de uma atualização do Telegram (agente + entrega ao despachante)")
+LLM_CALL_SECONDS = Histogram("llm_call_seconds", "Duração de cada chamada à IA", ("etapa",))
+LLM_CALL_ERRORS = Counter("llm_call_errors_total", "Chamadas à IA que terminaram em erro", ("etapa", "erro"))
+LLM_CALL_TOKENS = Histogram("llm_call_tokens", "Tokens de cada chamada à IA", ("etapa", "tipo"), buckets=TOKEN_BUCKETS)
+DB_CALL_SECONDS = Histogram("db_call_seconds", "Execução no pool do banco, por função (ferramentas, fila...)", ("operacao",))
+DB_POOL_WAIT_SECONDS = Histogram("db_pool_wait_seconds", "Espera por uma thread livre no pool do banco")
+
+
+def observe_llm_call(etapa: str, segundos: float, uso: dict) -> None:
+    """Registra uma chamada à IA: duração e tokens (`uso` como em llm_usage.usage_of)."""
+    LLM_CALL_SECONDS.observe(segundos, etapa)
+    LLM_CALL_TOKENS.observe(uso["prompt_tokens"], etapa, "prompt")
+    LLM_CALL_TOKENS.observe(uso["output_tokens"], etapa, "saida")
+
+
+# --- Coletores e Exposição ---
+
+def register_collector(coletor) -> None:
+    """
+    `coletor()` é chamado a cada leitura do /metrics e devolve tuplas
+    (nome, tipo, ajuda, amostras), com amostras = [(rótulos: dict, valor), ...].
+    """
+    COLETORES.append(coletor)
+
+
+def stats_samples(fonte: str, stats: dict) -> list[tuple[dict, float]]:
+    """Achata um dicionário de metrics() (com subdicionários) em amostras numéricas."""
+    amostras = []
+    for chave, valor in stats.items():
+        if isinstance(valor, dict):
+            amostras.extend(stats_samples(f"{fonte}.{chave}", valor))
+        elif isinstance(valor, (int, float)):
+            amostras.append(({"fonte": fonte, "nome": chave}, valor))
+    return amostras
+
+
+def render() -> str:
+    """Todas as métricas no formato de texto do Prometheus (0.0.4)."""
+    linhas = []
+    for metrica in METRICAS:
+        linhas += [f"# HELP {metrica.nome} {metrica.ajuda}", f"# TYPE {metrica.nome} {metrica.tipo}"]
+        linhas += metrica.render()
+    for coletor in COLETORES:
+        try:
+            familias = list(coletor())
+        except Exception as e:
+            # Uma fonte com problema não derruba o /metrics inteiro
+            logger.warning("Coletor de métricas %s falhou: %s", getattr(coletor, "__name__", coletor), e)
+            continue
+        for nome, tipo, ajuda, amostras in familias:
+            nome = f"{PREFIXO}_{nome}"
+            linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"]
+            for rotulos, valor in amostras:
+                linhas.append(f"{nome}{_rotulos(tuple(rotulos), tuple(rotulos.values()))} {_numero(valor)}")
+    return "\n".join(linhas) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI (sem o custo do BaseHTTPMiddleware): mede as requisições
+    das `rotas` até o fim do corpo da resposta (no streaming, o turno inteiro).
+    """
+
+    def __init__(self, app, rotas: tuple[str, ...]):
+        self.app = app
+        self.rotas = frozenset(rotas)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.rotas:
+            await self.app(scope, receive, send)
+            return
+        inicio = time.perf_counter()
+        status = ["500"]
+
+        async def enviar(mensagem):
+            if mensagem["type"] == "http.response.start":
+                status[0] = str(mensagem["status"])
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - inicio, scope["path"], status[0])
@@ -0,0 +1,265 @@
+import logging
+import sqlite3
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# --- Migrações Versionadas do Banco ---
+# Cada migração é (versão, nome, lista de comandos SQL). A versão aplicada fica
+# guardada em `PRAGMA user_version`, então rodar de novo só aplica o que falta.
+# Regra: nunca edite uma migração já publicada; crie uma nova no fim da lista.
+
+MIGRATIONS = [
+    (1, "schema_inicial", [
+        '''
+        CREATE TABLE IF NOT EXISTS info (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL UNIQUE,
+            value TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS medicos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            especialidade TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS horarios_disponiveis (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            medico_id INTEGER NOT NULL,
+            data_hora_inicio DATETIME NOT NULL,
+            status TEXT NOT NULL DEFAULT 'disponivel',
+            FOREIGN KEY (medico_id) REFERENCES medicos (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS exames (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome_exame TEXT NOT NULL UNIQUE,
+            descricao TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS horarios_exames (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            exame_id INTEGER NOT NULL,
+            data_hora_inicio DATETIME NOT NULL,
+            status TEXT NOT NULL DEFAULT 'disponivel',
+            FOREIGN KEY (exame_id) REFERENCES exames (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS agendamentos_exames (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            horario_exame_id INTEGER NOT NULL,
+            nome_paciente TEXT NOT NULL,
+            telegram_chat_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'confirmado',
+            FOREIGN KEY (horario_exame_id) REFERENCES horarios_exames (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS agendamentos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            horario_id INTEGER NOT NULL,
+            nome_paciente TEXT NOT NULL,
+            telegram_chat_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'confirmado',
+            FOREIGN KEY (horario_id) REFERENCES horarios_disponiveis (id)
+        )
+        ''',
+    ]),
+    (2, "indices_unicos_agendamento", [
+        # Só pode existir UM agendamento 'confirmado' por horário (cancelados não contam)
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_agendamentos_horario_confirmado
+        ON agendamentos (horario_id) WHERE status = 'confirmado'
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_agendamentos_exames_horario_confirmado
+        ON agendamentos_exames (horario_exame_id) WHERE status = 'confirmado'
+        ''',
+    ]),
+    (3, "indices_consultas_ferramentas", [
+        # Horários livres em ordem de data (listagens gerais)
+        "CREATE INDEX IF NOT EXISTS ix_horarios_status_data ON horarios_disponiveis (status, data_hora_inicio)",
+        # Horários livres de um médico específico (join com medicos)
+        "CREATE INDEX IF NOT EXISTS ix_horarios_medico_status ON horarios_disponiveis (medico_id, status, data_hora_inicio)",
+        "CREATE INDEX IF NOT EXISTS ix_horarios_exames_status_data ON horarios_exames (status, data_hora_inicio)",
+        "CREATE INDEX IF NOT EXISTS ix_horarios_exames_exame_status ON horarios_exames (exame_id, status, data_hora_inicio)",
+        # "Meus agendamentos" de um chat
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_chat_status ON agendamentos (telegram_chat_id, status)",
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_exames_chat_status ON agendamentos_exames (telegram_chat_id, status)",
+    ]),
+    (4, "versoes_catalogo", [
+        # Contador de versão por tabela: os índices em memória (catalog.py) comparam
+        # esse número para saber quando precisam ser reconstruídos
+        '''
+        CREATE TABLE IF NOT EXISTS versoes_tabelas (
+            tabela TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        "INSERT OR IGNORE INTO versoes_tabelas (tabela, versao) VALUES ('medicos', 1), ('exames', 1)",
+        "CREATE TRIGGER IF NOT EXISTS tg_medicos_ins_versao AFTER INSERT ON medicos BEGIN UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = 'medicos'; END",
+        "CREATE TRIGGER IF NOT EXISTS tg_medicos_upd_versao AFTER UPDATE ON medicos BEGIN UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = 'medicos'; END",
+        "CREATE TRIGGER IF NOT EXISTS tg_medicos_del_versao AFTER DELETE ON medicos BEGIN UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = 'medicos'; END",
+        "CREATE TRIGGER IF NOT EXISTS tg_exames_ins_versao AFTER INSERT ON exames BEGIN UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = 'exames'; END",
+        "CREATE TRIGGER IF NOT EXISTS tg_exames_upd_versao AFTER UPDATE ON exames BEGIN UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = 'exames'; END",
+        "CREATE TRIGGER IF NOT EXISTS tg_exames_del_versao AFTER DELETE ON exames BEGIN UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = 'exames'; END",
+    ]),
+    (5, "estado_conversas", [
+        # Estado das conversas (state_store.SQLiteStateStore), compartilhado entre workers
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            chave TEXT PRIMARY KEY,
+            valor TEXT NOT NULL,
+            expira_em REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS ix_conversation_state_expira ON conversation_state (expira_em)",
+    ]),
+    (6, "versoes_cache_ferramentas", [
+        # Mesmas versões por tabela, agora para as tabelas lidas pelas ferramentas
+        # em cache (cache.py). Os triggers rodam dentro da transação da reserva ou
+        # do cancelamento, então a versão muda exatamente quando ela é confirmada.
+        "INSERT OR IGNORE INTO versoes_tabelas (tabela, versao) VALUES ('info', 1), ('horarios_disponiveis', 1), ('horarios_exames', 1)",
+        *[
+            f"CREATE TRIGGER IF NOT EXISTS tg_{tabela}_{sufixo}_versao AFTER {evento} ON {tabela} "
+            f"BEGIN UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = '{tabela}'; END"
+            for tabela in ("info", "horarios_disponiveis", "horarios_exames")
+            for sufixo, evento in (("ins", "INSERT"), ("upd", "UPDATE"), ("del", "DELETE"))
+        ],
+    ]),
+    (7, "fila_webhook", [
+        # Fila durável das atualizações do Telegram (job_queue.py). Jobs concluídos
+        # são apagados; os que esgotam as tentativas ficam como 'morto' (dead-letter).
+        '''
+        CREATE TABLE IF NOT EXISTS webhook_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pendente' CHECK(status IN ('pendente', 'processando', 'morto')),
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            disponivel_em REAL NOT NULL,
+            lease_ate REAL,
+            criado_em REAL NOT NULL,
+            erro TEXT
+        )
+        ''',
+        # Próximo job a pegar (por status/ordem) e o "há job anterior deste chat?"
+        "CREATE INDEX IF NOT EXISTS ix_webhook_jobs_status ON webhook_jobs (status, id)",
+        "CREATE INDEX IF NOT EXISTS ix_webhook_jobs_chat ON webhook_jobs (chat_id, id)",
+    ]),
+    (8, "idempotencia", [
+        # Maior update_id já aceito de cada bot (marca d'água para descartar reenvios)
+        '''
+        CREATE TABLE IF NOT EXISTS telegram_offsets (
+            bot_id TEXT PRIMARY KEY,
+            ultimo_update_id INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        # Resultado de cada escrita (reserva/cancelamento) por chave de idempotência
+        '''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            chave TEXT PRIMARY KEY,
+            resultado TEXT NOT NULL,
+            criado_em REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS ix_idempotency_keys_criado ON idempotency_keys (criado_em)",
+    ]),
+    (9, "agendas_e_feriados", [
+        # Agenda semanal de cada médico/exame (schedules.py gera os horários a partir dela).
+        # dia_semana: 0 = segunda ... 6 = domingo (como date.weekday()); horas em 'HH:MM'
+        '''
+        CREATE TABLE IF NOT EXISTS agendas_medicos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            medico_id INTEGER NOT NULL,
+            dia_semana INTEGER NOT NULL CHECK(dia_semana BETWEEN 0 AND 6),
+            hora_inicio TEXT NOT NULL,
+            hora_fim TEXT NOT NULL,
+            duracao_minutos INTEGER NOT NULL CHECK(duracao_minutos > 0),
+            FOREIGN KEY (medico_id) REFERENCES medicos (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS agendas_exames (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            exame_id INTEGER NOT NULL,
+            dia_semana INTEGER NOT NULL CHECK(dia_semana BETWEEN 0 AND 6),
+            hora_inicio TEXT NOT NULL,
+            hora_fim TEXT NOT NULL,
+            duracao_minutos INTEGER NOT NULL CHECK(duracao_minutos > 0),
+            FOREIGN KEY (exame_id) REFERENCES exames (id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS ix_agendas_medicos_medico ON agendas_medicos (medico_id)",
+        "CREATE INDEX IF NOT EXISTS ix_agendas_exames_exame ON agendas_exames (exame_id)",
+        # Dias sem atendimento ('AAAA-MM-DD'): o gerador pula e a limpeza remove os horários livres
+        '''
+        CREATE TABLE IF NOT EXISTS feriados (
+            data TEXT PRIMARY KEY,
+            descricao TEXT NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        # Um horário por médico/exame e instante: gerar de novo não duplica (INSERT OR IGNORE)
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_horarios_medico_data ON horarios_disponiveis (medico_id, data_hora_inicio)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_horarios_exames_exame_data ON horarios_exames (exame_id, data_hora_inicio)",
+        # Agendamentos (de qualquer status) de um horário: a limpeza só apaga horários
+        # sem nenhum, e a chave estrangeira checa isso a cada DELETE
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_horario ON agendamentos (horario_id)",
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_exames_horario ON agendamentos_exames (horario_exame_id)",
+        # Horários só são criados/apagados em lote pelo schedules.py, que sobe a versão
+        # uma vez por lote (na mesma transação). O trigger por linha custava ~40% da geração;
+        # os de UPDATE (reservas e cancelamentos) continuam.
+        *[
+            f"DROP TRIGGER IF EXISTS tg_{tabela}_{sufixo}_versao"
+            for tabela in ("horarios_disponiveis", "horarios_exames")
+            for sufixo in ("ins", "del")
+        ],
+    ]),
+]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Versão do schema já aplicada neste banco."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(database_file: str | None = None) -> int:
+    """
+    Aplica, em ordem, as migrações que ainda não rodaram neste banco.
+    Cada migração roda na sua própria transação (tudo ou nada).
+    Retorna a versão final do schema.
+    """
+    conn = sqlite3.connect(database_file or db.DATABASE_FILE, isolation_level=None)
+    try:
+        versao = current_version(conn)
+        for numero, nome, comandos in MIGRATIONS:
+            if numero <= versao:
+                continue
+            logger.info("MIGRAÇÃO: Aplicando %03d_%s", numero, nome)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for comando in comandos:
+                    conn.execute(comando)
+                # PRAGMA não aceita parâmetro (?), mas 'numero' é um int da nossa lista
+                conn.execute(f"PRAGMA user_version = {int(numero)}")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            versao = numero
+        return versao
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    versao_final = run_migrations()
+    print(f"Banco '{db.DATABASE_FILE}' na versão de schema {versao_final}.")
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+
+import requests
+
+import tracing
+from config import TELEGRAM_BOT_TOKEN
+from telegram_dispatcher import CONNECT_TIMEOUT_SECONDS, TELEGRAM_API_BASE
+from telegram_utils import parse_update_id, parse_webhook_data
+
+logger = logging.getLogger(__name__)
+
+# --- Long Polling (getUpdates) ---
+# Alternativa ao webhook: o bot busca as atualizações no Telegram em vez de
+# recebê-las. Útil sem URL pública (sem ngrok) e para absorver picos, já que
+# cada chamada traz um lote de até POLL_LIMIT atualizações.
+#   * cada lote é gravado na mesma fila durável do webhook (job_queue.py) numa
+#     única transação, junto com a maior update_id aceita (`telegram_offsets`)
+#   * o próximo `offset` só avança depois dessa gravação: é ele que confirma ao
+#     Telegram que as atualizações anteriores podem ser esquecidas
+#   * depois de uma queda, o runner retoma da marca gravada (nada se perde nem repete)
+#   * os workers da fila processam chats diferentes em paralelo e cada chat em ordem
+# Ative com TELEGRAM_MODE=polling (no servidor) ou rode `python polling.py`.
+
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "webhook").strip().lower()
+# Quanto tempo o Telegram segura cada getUpdates esperando atualizações (long polling)
+POLL_TIMEOUT_SECONDS = int(os.getenv("TELEGRAM_POLL_TIMEOUT", "30"))
+# Máximo de atualizações por chamada (o Telegram aceita de 1 a 100)
+POLL_LIMIT = int(os.getenv("TELEGRAM_POLL_LIMIT", "100"))
+# Espera entre tentativas quando o getUpdates falha (cresce até o máximo)
+POLL_BACKOFF_BASE_SECONDS = 1.0
+POLL_BACKOFF_MAX_SECONDS = 30.0
+# Espera antes de buscar de novo quando a fila está cheia (backpressure)
+POLL_FILA_CHEIA_SECONDS = 1.0
+
+
+class TelegramPoller:
+    """
+    Busca atualizações com getUpdates e as grava em `queue` (JobQueue).
+    `dedup` (UpdateDeduplicator) guarda a marca d'água: o offset inicial é
+    a marca + 1, e ela avança na mesma transação que grava cada lote.
+    """
+
+    def __init__(self, queue, dedup, token: str | None = TELEGRAM_BOT_TOKEN, api_base: str = TELEGRAM_API_BASE,
+                 timeout: int = POLL_TIMEOUT_SECONDS, limit: int = POLL_LIMIT):
+        self.queue = queue
+        self.dedup = dedup
+        self.token = token
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        self.limit = limit
+        # Sessão própria: a conexão do long polling fica presa até `timeout`
+        # e não pode ocupar o pool de envio do despachante
+        self.session = requests.Session()
+        self._task: asyncio.Task | None = None
+        self._stats = {"chamadas": 0, "atualizacoes": 0, "enfileiradas": 0, "repetidas": 0,
+                       "ignoradas": 0, "erros": 0, "fila_cheia": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, chave: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[chave] += n
+
+    def _chamar(self, metodo: str, **parametros) -> list | bool:
+        """Chama um método da Bot API e retorna o `result` (levanta exceção em erro)."""
+        response = self.session.post(
+            f"{self.api_base}/bot{self.token}/{metodo}", json=parametros,
+            timeout=(CONNECT_TIMEOUT_SECONDS, self.timeout + 10)
+        )
+        dados = response.json()
+        if not dados.get("ok"):
+            raise RuntimeError(f"{metodo} falhou ({response.status_code}): {dados.get('description')}")
+        return dados["result"]
+
+    def _buscar(self, offset: int) -> list[dict]:
+        return self._chamar("getUpdates", offset=offset, timeout=self.timeout, limit=self.limit,
+                            allowed_updates=["message"])
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> None:
+        """Inicia o loop de polling no event loop atual."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Interrompe o getUpdates em andamento; o offset já gravado continua valendo."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self.session.close()
+
+    async def _loop(self) -> None:
+        # Com webhook configurado o Telegram recusa o getUpdates (409)
+        try:
+            await asyncio.to_thread(self._chamar, "deleteWebhook")
+        except Exception as e:
+            logger.warning("Não foi possível remover o webhook: %s", e)
+
+        offset = await asyncio.to_thread(lambda: self.dedup.high_water_mark + 1)
+        logger.info("POLLING: Buscando atualizações do Telegram a partir da update_id %s", offset)
+        falhas = 0
+        while True:
+            try:
+                updates = await asyncio.to_thread(self._buscar, offset)
+                self._count("chamadas")
+            except Exception as e:
+                falhas += 1
+                self._count("erros")
+                espera = min(POLL_BACKOFF_MAX_SECONDS, POLL_BACKOFF_BASE_SECONDS * (2 ** (falhas - 1)))
+                logger.error("getUpdates falhou (%s). Nova tentativa em %.0fs.", e, espera)
+                await asyncio.sleep(random.uniform(espera / 2, espera))
+                continue
+            falhas = 0
+            if updates:
+                offset, completo = await self.processar_lote(updates, offset)
+                if not completo:
+                    await asyncio.sleep(POLL_FILA_CHEIA_SECONDS)
+
+    async def processar_lote(self, updates: list[dict], offset: int) -> tuple[int, bool]:
+        """
+        Grava um lote na fila e retorna `(próximo offset, lote inteiro aceito?)`.
+        Se a fila encher no meio do lote, o offset para na primeira atualização
+        recusada: ela (e as seguintes) voltam no próximo getUpdates.
+        """
+        self._count("atualizacoes", len(updates))
+        jobs, ids_dos_jobs = [], []
+        maior_id = offset - 1
+        for update in sorted(updates, key=lambda u: u.get("update_id", -1)):
+            update_id = parse_update_id(update)
+            if update_id is None:
+                continue
+            maior_id = max(maior_id, update_id)
+            if not self.dedup.reservar(update_id):
+                self._count("repetidas")
+                continue
+            chat_id, mensagem = parse_webhook_data(update)
+            if chat_id and mensagem:
+                jobs.append((chat_id, update))
+                ids_dos_jobs.append(update_id)
+            else:
+                self._count("ignoradas")
+
+        marca = {"valor": maior_id}
+
+        def gravar_marca(conn, aceitos):
+            # Tudo antes do primeiro job recusado já está salvo (ou foi descartado)
+            if aceitos < len(jobs):
+                marca["valor"] = ids_dos_jobs[aceitos] - 1
+            if marca["valor"] >= offset:
+                self.dedup.persistir(conn, marca["valor"])
+
+        aceitos = await self.queue.enqueue_many(jobs, gravar_marca)
+        self._count("enfileiradas", aceitos)
+        for update_id in ids_dos_jobs[aceitos:]:
+            self.dedup.liberar(update_id)
+        if aceitos < len(jobs):
+            self._count("fila_cheia")
+        return marca["valor"] + 1, aceitos == len(jobs)
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+# --- Execução Avulsa (sem servidor web) ---
+async def _rodar() -> None:
+    # Importado aqui: o main.py monta a fila, o deduplicador e o handler do Telegram
+    from main import UPDATE_DEDUP, WEBHOOK_QUEUE
+    from migrations import run_migrations
+    from telegram_dispatcher import DISPATCHER
+
+    versao = run_migrations()
+    logger.info("Banco de dados na versão de schema %s", versao)
+    poller = TelegramPoller(WEBHOOK_QUEUE, UPDATE_DEDUP)
+    DISPATCHER.start()
+    WEBHOOK_QUEUE.start()
+    poller.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await poller.stop()
+        await WEBHOOK_QUEUE.stop()
+        await DISPATCHER.stop()
+        tracing.flush()
+
+
+if __name__ == "__main__":
+    tracing.configure_logging()
+    if not TELEGRAM_BOT_TOKEN:
+        logger.error("TELEGRAM_BOT_TOKEN não encontrado no arquivo .env")
+    else:
+        try:
+            asyncio.run(_rodar())
+        except KeyboardInterrupt:
+            logger.info("POLLING: Encerrado")
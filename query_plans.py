@@ -0,0 +1,62 @@
+import re
+import sqlite3
+import sys
+
+import db
+from database_tools import TOOL_QUERIES
+
+# --- Relatório de EXPLAIN QUERY PLAN das Ferramentas ---
+# Mostra o plano de cada consulta das ferramentas e acusa "full scan" nas
+# tabelas que crescem com o tempo. Útil para pegar regressões quando uma
+# consulta ou um índice muda (sai com código 1 se encontrar algum scan).
+
+# Tabelas que crescem todo dia (catálogos pequenos como medicos/exames/info podem ser varridos)
+TABELAS_GRANDES = {"horarios_disponiveis", "horarios_exames", "agendamentos", "agendamentos_exames"}
+
+_ALIAS_RE = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?!ON\b|WHERE\b|JOIN\b)(\w+))?", re.IGNORECASE)
+
+
+def _aliases(sql: str) -> dict[str, str]:
+    """Mapeia alias -> nome da tabela (ex: 'h' -> 'horarios_disponiveis')."""
+    mapa = {}
+    for tabela, alias in _ALIAS_RE.findall(sql):
+        mapa[alias or tabela] = tabela
+    return mapa
+
+
+def explain(conn: sqlite3.Connection, sql: str, params: tuple) -> list[str]:
+    """Retorna as linhas de detalhe do EXPLAIN QUERY PLAN da consulta."""
+    return [linha[3] for linha in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+
+def full_scans(sql: str, plano: list[str]) -> list[str]:
+    """Linhas do plano que varrem uma tabela grande sem usar índice."""
+    aliases = _aliases(sql)
+    problemas = []
+    for detalhe in plano:
+        match = re.match(r"SCAN (\w+)(.*)", detalhe)
+        if match and "USING" not in match.group(2) and aliases.get(match.group(1), match.group(1)) in TABELAS_GRANDES:
+            problemas.append(detalhe)
+    return problemas
+
+
+def report(conn: sqlite3.Connection | None = None) -> int:
+    """Imprime o plano de todas as consultas e retorna quantos full scans foram achados."""
+    conn = conn or db.get_connection()
+    total_scans = 0
+    for nome_ferramenta, (sql, params) in TOOL_QUERIES.items():
+        plano = explain(conn, sql, params)
+        scans = full_scans(sql, plano)
+        total_scans += len(scans)
+        print(f"--- {nome_ferramenta} {'(FULL SCAN!)' if scans else ''}---")
+        for detalhe in plano:
+            print(f"    {detalhe}")
+    return total_scans
+
+
+if __name__ == "__main__":
+    scans = report()
+    if scans:
+        print(f"\nATENÇÃO: {scans} full scan(s) em tabelas grandes.")
+        sys.exit(1)
+    print("\nOK: nenhuma consulta faz full scan em tabelas grandes.")
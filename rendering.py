@@ -0,0 +1,147 @@
+import os
+import threading
+
+from fast_path import texto_da_lista
+
+# --- Renderização Local das Respostas das Ferramentas ---
+# Depois de executar uma ferramenta, o agente fazia sempre uma 2ª chamada ao
+# Gemini só para reescrever o resultado ("Chamada 2 - RAG"). Para resultados
+# determinísticos (confirmação, lista de horários, lista vazia, erro) um
+# template por ferramenta dá a mesma resposta sem a chamada. Só as ferramentas
+# em LLM_SYNTHESIS_TOOLS (ou sem template) ainda passam pela IA.
+
+# Ferramentas cuja resposta precisa de linguagem natural. A de informações da
+# clínica fica aqui: a pergunta pode ser "aceitam Unimed?", e não só "quais
+# convênios?" (as respostas repetidas já saem do cache de FAQ do agent.py).
+LLM_SYNTHESIS_TOOLS = {
+    nome.strip() for nome in os.getenv("LLM_SYNTHESIS_TOOLS", "tool_obter_info_clinica").split(",") if nome.strip()
+}
+
+# Resposta no lugar de erros internos (a mensagem técnica fica só no log)
+ERRO_INTERNO = "Desculpe, tive um problema ao consultar os dados. Por favor, tente novamente em instantes."
+
+# Contadores (lidos por benchmarks e métricas)
+ESTATISTICAS = {"renderizadas": 0, "sintetizadas": 0}
+_estatisticas_lock = threading.Lock()
+
+
+def _contar(chave: str) -> None:
+    with _estatisticas_lock:
+        ESTATISTICAS[chave] += 1
+
+
+def metrics() -> dict:
+    """Respostas por template x pela IA; cada renderizada é uma chamada ao modelo economizada."""
+    with _estatisticas_lock:
+        stats = dict(ESTATISTICAS)
+    stats["chamadas_economizadas"] = stats["renderizadas"]
+    return stats
+
+
+# --- Templates por Ferramenta ---
+# Cada template recebe (parâmetros da ferramenta, resultado) e devolve a
+# resposta para o usuário, ou None se o resultado tiver um formato inesperado
+# (aí a IA reescreve, como antes). Mensagens que as ferramentas já escrevem
+# para o usuário (lista vazia, horário indisponível...) são repassadas como estão.
+
+def _lista(introducao: str, pergunta: str):
+    def template(params: dict, resultado: str) -> str | None:
+        # '[ID 1: a]; [ID 2: b]' -> 'ID 1: a\nID 2: b' (+ aviso se houver mais páginas de horários)
+        resposta = texto_da_lista(introducao.format(**params), resultado, pergunta)
+        if resposta is None:
+            return resultado if resultado.startswith(("Desculpe", "Você não possui", "Data inválida", "Cursor")) else None
+        return resposta
+    return template
+
+
+def _confirmacao(sucesso: str, resposta: str):
+    def template(params: dict, resultado: str) -> str | None:
+        if resultado == sucesso:
+            return resposta.format(**params)
+        return resultado
+    return template
+
+
+def _escolha(chave_id: str):
+    def template(params: dict, resultado: str) -> str | None:
+        return f"Ótimo! Você escolheu o horário ID {params[chave_id]}. Agora, por favor, informe o nome completo do paciente."
+    return template
+
+
+def _exames(params: dict, resultado: str) -> str | None:
+    if resultado.startswith("Não há"):
+        return resultado
+    return f"Estes são os exames disponíveis: {', '.join(resultado.split('; '))}. Qual deles você deseja agendar?"
+
+
+def _info(params: dict, resultado: str) -> str | None:
+    return resultado
+
+
+TEMPLATES = {
+    "tool_obter_info_clinica": _info,
+    "tool_consultar_horarios_disponiveis": _lista(
+        "Estes são os horários disponíveis para {especialidade}", "Qual ID do horário você deseja?"),
+    "tool_consultar_horarios_exames": _lista(
+        "Estes são os horários disponíveis para {tipo_exame}", "Qual ID do horário de exame você deseja?"),
+    "tool_proximos_horarios": _lista(
+        "Estes são os próximos horários livres para {especialidade}", "Qual ID do horário você deseja?"),
+    "tool_proximos_horarios_exame": _lista(
+        "Estes são os próximos horários livres para {tipo_exame}", "Qual ID do horário de exame você deseja?"),
+    "tool_listar_meus_agendamentos": _lista(
+        "Estes são os seus agendamentos", "Se quiser cancelar algum, me diga o ID do agendamento."),
+    "tool_listar_meus_exames_agendados": _lista(
+        "Estes são os seus exames agendados", "Se quiser cancelar algum, me diga o ID do agendamento de exame."),
+    "tool_consultar_exames_disponiveis": _exames,
+    "tool_marcar_agendamento": _confirmacao(
+        "Agendamento confirmado com sucesso!",
+        "Agendamento confirmado com sucesso para {nome_paciente} (horário ID {horario_id}). Até breve!"),
+    "tool_marcar_exame": _confirmacao(
+        "Agendamento de exame confirmado com sucesso!",
+        "Agendamento do exame confirmado com sucesso para {nome_paciente} (horário ID {horario_exame_id}). Até breve!"),
+    "tool_cancelar_agendamento": _confirmacao(
+        "Agendamento cancelado com sucesso!", "Pronto! O agendamento ID {agendamento_id} foi cancelado com sucesso."),
+    "tool_cancelar_exame": _confirmacao(
+        "Agendamento de exame cancelado com sucesso!",
+        "Pronto! O agendamento de exame ID {agendamento_exame_id} foi cancelado com sucesso."),
+    # Escolhas de horário do motor de funções (function_calling.py)
+    "tool_registrar_escolha_horario": _escolha("horario_id"),
+    "tool_registrar_escolha_horario_exame": _escolha("horario_exame_id"),
+}
+
+
+def render_tool_result(tool_name: str, params: dict, resultado) -> str | None:
+    """
+    Monta a resposta final a partir do resultado da ferramenta, sem a IA.
+    Retorna None quando a IA deve escrever a resposta (ferramenta marcada
+    para síntese, sem template ou resultado fora do formato esperado).
+    """
+    template = TEMPLATES.get(tool_name)
+    if tool_name in LLM_SYNTHESIS_TOOLS or template is None or not isinstance(resultado, str):
+        _contar("sintetizadas")
+        return None
+    if resultado.startswith("Ocorreu um erro"):
+        resposta = ERRO_INTERNO
+    else:
+        try:
+            resposta = template(params, resultado)
+        except (KeyError, IndexError, ValueError):
+            resposta = None
+    _contar("sintetizadas" if resposta is None else "renderizadas")
+    return resposta
+
+
+def render_without_llm(tool_name: str, params: dict, resultado) -> str:
+    """
+    Resposta quando a IA está indisponível (llm_resilience.py): usa o template
+    mesmo das ferramentas em LLM_SYNTHESIS_TOOLS e, sem template, o próprio
+    resultado da ferramenta.
+    """
+    if not isinstance(resultado, str) or resultado.startswith("Ocorreu um erro"):
+        return ERRO_INTERNO
+    template = TEMPLATES.get(tool_name)
+    try:
+        resposta = template(params, resultado) if template else None
+    except (KeyError, IndexError, ValueError):
+        resposta = None
+    return resposta or resultado
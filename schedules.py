@@ -0,0 +1,234 @@
+import asyncio
+import datetime
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+
+import availability
+import db
+from booking import RECURSOS, executar_escrita
+from db import get_connection, run_in_db_thread
+
+logger = logging.getLogger(__name__)
+
+# --- Geração de Horários a partir das Agendas ---
+# Os horários livres (horarios_disponiveis / horarios_exames) não são mais
+# inseridos à mão: cada médico/exame tem uma agenda semanal (dia da semana,
+# início, fim e duração de cada atendimento, migração 009) e o gerador cria os
+# horários dos próximos AGENDA_DIAS dias, pulando os feriados.
+#   * em lotes: cada transação grava até AGENDA_LOTE horários (uma reserva no
+#     meio da geração espera no máximo um lote, não a geração inteira)
+#   * idempotente: o índice único (recurso, data_hora_inicio) + INSERT OR IGNORE
+#     fazem a segunda execução não duplicar nada (só completa o que falta)
+#   * limpeza: horários livres que já passaram (ou que caíram num feriado
+#     cadastrado depois) são apagados, exceto os que têm algum agendamento
+#     no histórico (cancelados ainda apontam para eles)
+#   * cache: as tabelas de horários não têm trigger de INSERT/DELETE (migração
+#     009); cada lote sobe a versão da tabela na própria transação (cache.py)
+# Rode todo dia (cron) com `python schedules.py`, ou ligue AGENDA_HORA_NOTURNA no servidor.
+# "Hoje", "já passou" e a hora noturna seguem a hora da clínica (availability.agora(),
+# FUSO_HORARIO), a mesma do índice de horários livres e das listagens.
+
+# Quantos dias à frente ficam com horários gerados
+AGENDA_DIAS = int(os.getenv("AGENDA_DIAS", "90"))
+# Horários gravados por transação (cada lote segura o lock de escrita: reservas esperam por ele)
+AGENDA_LOTE = int(os.getenv("AGENDA_LOTE", "5000"))
+# Hora ('HH:MM') em que o servidor regenera os horários todo dia (vazio: desligado)
+AGENDA_HORA_NOTURNA = os.getenv("AGENDA_HORA_NOTURNA", "").strip()
+
+# Tabela da agenda de cada tipo (as demais tabelas e a coluna do recurso vêm do booking.RECURSOS)
+AGENDAS = {
+    "consulta": {"tabela_agenda": "agendas_medicos"},
+    "exame": {"tabela_agenda": "agendas_exames"},
+}
+
+ESTATISTICAS = {"execucoes": 0, "gerados": 0, "lotes": 0, "removidos": 0, "ultima_execucao_s": 0.0}
+_estatisticas_lock = threading.Lock()
+
+
+def _contar(**valores) -> None:
+    with _estatisticas_lock:
+        for chave, valor in valores.items():
+            ESTATISTICAS[chave] += valor
+
+
+def metrics() -> dict:
+    with _estatisticas_lock:
+        return dict(ESTATISTICAS)
+
+
+def _minutos(hora: str) -> int:
+    horas, minutos = hora.split(":")[:2]
+    return int(horas) * 60 + int(minutos)
+
+
+def _horas_do_dia(hora_inicio: str, hora_fim: str, duracao_minutos: int) -> list[str]:
+    """Início de cada atendimento que cabe inteiro entre hora_inicio e hora_fim ('HH:MM:SS')."""
+    fim = _minutos(hora_fim)
+    return [f"{m // 60:02d}:{m % 60:02d}:00"
+            for m in range(_minutos(hora_inicio), fim - duracao_minutos + 1, duracao_minutos)]
+
+
+def _agenda_por_dia_da_semana(conn, tipo: str) -> dict[int, list[tuple[int, list[str]]]]:
+    """dia_semana -> [(recurso_id, horas do dia), ...], montado uma vez por execução."""
+    agenda = AGENDAS[tipo]
+    coluna_recurso = RECURSOS[tipo]["coluna_recurso"]
+    por_dia: dict[int, list[tuple[int, list[str]]]] = {}
+    for recurso_id, dia_semana, hora_inicio, hora_fim, duracao in conn.execute(
+        f"SELECT {coluna_recurso}, dia_semana, hora_inicio, hora_fim, duracao_minutos "
+        f"FROM {agenda['tabela_agenda']} ORDER BY {coluna_recurso}, dia_semana, hora_inicio"
+    ):
+        horas = _horas_do_dia(hora_inicio, hora_fim, duracao)
+        if horas:
+            por_dia.setdefault(dia_semana, []).append((recurso_id, horas))
+    return por_dia
+
+
+def _gravar_lote(tabela: str, comando: str, parametros) -> int:
+    """Executa o comando do lote e sobe a versão da tabela na mesma transação (se algo mudou)."""
+    def operacao(conn):
+        if isinstance(parametros, list):
+            alterados = conn.executemany(comando, parametros).rowcount
+        else:
+            alterados = conn.execute(comando, parametros).rowcount
+        if alterados:
+            conn.execute("UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = ?", (tabela,))
+        return alterados
+    return executar_escrita(operacao)
+
+
+def _feriados(conn, inicio: datetime.date, fim: datetime.date) -> set[str]:
+    return {data for (data,) in conn.execute(
+        "SELECT data FROM feriados WHERE data >= ? AND data < ?", (inicio.isoformat(), fim.isoformat())
+    )}
+
+
+def _horarios(por_dia: dict, feriados: set[str], inicio: datetime.date, dias: int, agora: str):
+    """Gera (recurso_id, 'AAAA-MM-DD HH:MM:SS') de cada dia, em ordem, sem os feriados e o que já passou."""
+    for deslocamento in range(dias):
+        dia = inicio + datetime.timedelta(days=deslocamento)
+        data = dia.isoformat()
+        if data in feriados:
+            continue
+        for recurso_id, horas in por_dia.get(dia.weekday(), ()):
+            for hora in horas:
+                data_hora = f"{data} {hora}"
+                if data_hora > agora:
+                    yield recurso_id, data_hora
+
+
+def gerar_horarios(dias: int = AGENDA_DIAS, inicio: datetime.date | None = None,
+                   lote: int = AGENDA_LOTE, tipos: tuple[str, ...] = tuple(AGENDAS)) -> dict[str, int]:
+    """
+    Cria os horários livres de `dias` dias a partir de `inicio` (hoje) seguindo
+    as agendas semanais, em transações de até `lote` horários. Horários que já
+    existem são mantidos como estão (livres ou agendados).
+    Retorna quantos horários novos foram criados por tipo.
+    """
+    agora = availability.agora()
+    inicio = inicio or agora.date()
+    fim = inicio + datetime.timedelta(days=dias)
+    agora_texto = agora.strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_connection()
+    feriados = _feriados(conn, inicio, fim)
+    criados = {}
+    for tipo in tipos:
+        tabela = RECURSOS[tipo]["tabela_horarios"]
+        comando = f"INSERT OR IGNORE INTO {tabela} ({RECURSOS[tipo]['coluna_recurso']}, data_hora_inicio) VALUES (?, ?)"
+        horarios = _horarios(_agenda_por_dia_da_semana(conn, tipo), feriados, inicio, dias, agora_texto)
+        criados[tipo] = lotes = 0
+        while True:
+            pedaco = list(itertools.islice(horarios, lote))
+            if not pedaco:
+                break
+            criados[tipo] += _gravar_lote(tabela, comando, pedaco)
+            lotes += 1
+        _contar(gerados=criados[tipo], lotes=lotes)
+        logger.info("AGENDA: %s horário(s) de %s criado(s) até %s (%s lote(s))", criados[tipo], tipo, fim, lotes)
+    return criados
+
+
+def _apagar_em_lotes(tipo: str, filtro: str, parametros: tuple, lote: int) -> int:
+    recurso = RECURSOS[tipo]
+    tabela = recurso["tabela_horarios"]
+    # Só horários livres e sem nenhum agendamento (nem cancelado) apontando para eles
+    comando = f"""
+        DELETE FROM {tabela} WHERE id IN (
+            SELECT h.id FROM {tabela} h
+            WHERE h.status = 'disponivel' AND {filtro}
+              AND NOT EXISTS (SELECT 1 FROM {recurso['tabela_agendamentos']} a WHERE a.{recurso['coluna_horario']} = h.id)
+            LIMIT ?
+        )
+    """
+    removidos = 0
+    while True:
+        apagados = _gravar_lote(tabela, comando, (*parametros, lote))
+        removidos += apagados
+        if apagados < lote:
+            return removidos
+
+
+def limpar_horarios(agora: datetime.datetime | None = None, lote: int = AGENDA_LOTE,
+                    tipos: tuple[str, ...] = tuple(AGENDAS)) -> dict[str, int]:
+    """
+    Apaga os horários livres que já passaram e os que caem num feriado, em
+    transações de até `lote` horários. Retorna quantos foram removidos por tipo.
+    """
+    agora_texto = (agora or availability.agora()).strftime("%Y-%m-%d %H:%M:%S")
+    feriados = [data for (data,) in get_connection().execute(
+        "SELECT data FROM feriados WHERE data >= ? ORDER BY data", (agora_texto[:10],)
+    )]
+    removidos = {}
+    for tipo in tipos:
+        removidos[tipo] = _apagar_em_lotes(tipo, "h.data_hora_inicio < ?", (agora_texto,), lote)
+        for data in feriados:
+            # Faixa do dia inteiro: usa o índice (status, data_hora_inicio)
+            dia_seguinte = (datetime.date.fromisoformat(data) + datetime.timedelta(days=1)).isoformat()
+            removidos[tipo] += _apagar_em_lotes(
+                tipo, "h.data_hora_inicio >= ? AND h.data_hora_inicio < ?", (data, dia_seguinte), lote
+            )
+        _contar(removidos=removidos[tipo])
+        logger.info("AGENDA: %s horário(s) de %s vencido(s) ou em feriado removido(s)", removidos[tipo], tipo)
+    return removidos
+
+
+def regenerar(dias: int = AGENDA_DIAS) -> dict[str, dict[str, int]]:
+    """A rotina diária: limpa o que venceu e completa a janela de `dias` dias."""
+    inicio = time.perf_counter()
+    resultado = {"removidos": limpar_horarios(), "criados": gerar_horarios(dias)}
+    _contar(execucoes=1)
+    with _estatisticas_lock:
+        ESTATISTICAS["ultima_execucao_s"] = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+
+# --- Regeneração Noturna no Servidor ---
+
+def _segundos_ate(hora: str, agora: datetime.datetime) -> float:
+    horas, minutos = (int(parte) for parte in hora.split(":"))
+    proxima = agora.replace(hour=horas, minute=minutos, second=0, microsecond=0)
+    if proxima <= agora:
+        proxima += datetime.timedelta(days=1)
+    return (proxima - agora).total_seconds()
+
+
+async def regenerar_todo_dia(hora: str = AGENDA_HORA_NOTURNA) -> None:
+    """Roda `regenerar()` todo dia na `hora` ('HH:MM'), no pool de threads do banco."""
+    while True:
+        await asyncio.sleep(_segundos_ate(hora, availability.agora()))
+        try:
+            await run_in_db_thread(regenerar)
+        except Exception as e:
+            # Um dia com falha não para a rotina: os horários ainda cobrem os próximos dias
+            logger.error("AGENDA: Falha ao regenerar os horários: %s", e)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    dias_pedidos = int(sys.argv[1]) if len(sys.argv) > 1 else AGENDA_DIAS
+    resumo = regenerar(dias_pedidos)
+    print(f"Banco '{db.DATABASE_FILE}': {resumo['criados']} horário(s) criado(s), "
+          f"{resumo['removidos']} removido(s) em {metrics()['ultima_execucao_s']}s.")
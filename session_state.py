@@ -0,0 +1,98 @@
+import enum
+import json
+import sys
+from array import array
+
+# --- Estado Tipado da Conversa ---
+# O que o CONVERSATION_STATE guarda por sessão: a etapa do fluxo e IDs, nunca
+# o texto que o bot mostrou. Antes cada sessão era um dicionário com o
+# resultado inteiro da ferramenta ("[ID 1: Dra. Ana Silva - 2025-10-24 ...]; ...")
+# reenviado à IA no turno seguinte. Agora:
+#   * `step`: a etapa (Step, um IntEnum com os nomes AWAITING_* de sempre)
+#   * `ids`: os IDs da lista mostrada (horários, agendamentos ou exames),
+#     num array de inteiros de 8 bytes cada
+#   * `escolhido`: o ID do horário já escolhido (etapas de nome)
+#   * `tipo_exame`: o exame do fluxo de exame (texto internado: as sessões
+#     no mesmo exame compartilham a mesma string)
+#   * `proxima_pagina`: parâmetros da próxima página de horários (filtros + cursor)
+# Com __slots__ não há __dict__ por sessão. As descrições ("Dra. Ana - 10:00")
+# são relidas do banco pelos IDs só quando a IA precisa delas (agent.py).
+# `to_json()`/`from_json()` dão a forma compacta gravada pelo SQLiteStateStore.
+
+
+class Step(enum.IntEnum):
+    AWAITING_SLOT_CHOICE = 1
+    AWAITING_NAME = 2
+    AWAITING_CANCELLATION_CHOICE = 3
+    AWAITING_EXAM_TYPE = 4
+    AWAITING_EXAM_SLOT_CHOICE = 5
+    AWAITING_NAME_FOR_EXAM = 6
+    AWAITING_EXAM_CANCELLATION_CHOICE = 7
+
+
+# De que são os `ids` em cada etapa de escolha (chave de database_tools.descrever_itens)
+LISTA_POR_ETAPA = {
+    Step.AWAITING_SLOT_CHOICE: "horarios",
+    Step.AWAITING_EXAM_SLOT_CHOICE: "horarios_exames",
+    Step.AWAITING_CANCELLATION_CHOICE: "agendamentos",
+    Step.AWAITING_EXAM_CANCELLATION_CHOICE: "agendamentos_exames",
+    Step.AWAITING_EXAM_TYPE: "exames",
+}
+
+# Etapas sem lista: um só objeto vazio compartilhado por todas as sessões
+SEM_IDS = ()
+
+
+class SessionState:
+    """Etapa do fluxo + IDs de uma sessão (imutável na prática: cada passo grava um novo)."""
+
+    __slots__ = ("step", "ids", "escolhido", "tipo_exame", "proxima_pagina")
+
+    def __init__(self, step: Step, ids=SEM_IDS, escolhido: int | None = None, tipo_exame: str | None = None,
+                 proxima_pagina: dict | None = None):
+        self.step = Step(step)
+        self.ids = array("q", ids) if ids else SEM_IDS
+        self.escolhido = escolhido
+        self.tipo_exame = sys.intern(tipo_exame) if tipo_exame else None
+        # Tupla de pares (nome, valor), com os filtros internados (o cursor muda a cada página)
+        self.proxima_pagina = tuple(
+            (sys.intern(nome), valor if nome == "cursor" or not isinstance(valor, str) else sys.intern(valor))
+            for nome, valor in sorted(proxima_pagina.items())
+        ) if proxima_pagina else None
+
+    @property
+    def lista(self) -> str | None:
+        """De que são os `ids` nesta etapa (None nas etapas sem lista)."""
+        return LISTA_POR_ETAPA.get(self.step)
+
+    def parametros_da_proxima_pagina(self) -> dict | None:
+        """Parâmetros da ferramenta de horários para a próxima página (None na última)."""
+        return dict(self.proxima_pagina) if self.proxima_pagina else None
+
+    def sem_proxima_pagina(self) -> "SessionState":
+        return SessionState(self.step, self.ids, self.escolhido, self.tipo_exame)
+
+    def to_json(self) -> str:
+        """Forma compacta: [etapa, [ids], escolhido, tipo_exame, {próxima página}], sem os campos vazios do fim."""
+        campos = [int(self.step), list(self.ids), self.escolhido, self.tipo_exame, self.parametros_da_proxima_pagina()]
+        while campos[-1] in (None, []):
+            campos.pop()
+        return json.dumps(campos, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, texto: str) -> "SessionState":
+        campos = json.loads(texto)
+        if not isinstance(campos, list) or not campos:
+            raise ValueError("Estado de sessão fora do formato")
+        campos += [None] * (5 - len(campos))
+        step, ids, escolhido, tipo_exame, proxima_pagina = campos
+        return cls(step, ids or SEM_IDS, escolhido, tipo_exame, proxima_pagina)
+
+    def __eq__(self, outro) -> bool:
+        if not isinstance(outro, SessionState):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(outro, slot) for slot in self.__slots__)
+
+    def __repr__(self) -> str:
+        campos = ", ".join(f"{slot}={getattr(self, slot)!r}" for slot in self.__slots__[1:] if getattr(self, slot))
+        return f"SessionState({self.step.name}{', ' if campos else ''}{campos})"
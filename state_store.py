@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from db import get_connection, run_in_db_thread
+from session_state import SessionState
+
+logger = logging.getLogger(__name__)
+
+# --- Armazenamento do Estado das Conversas ---
+# Substitui o dicionário solto CONVERSATION_STATE. Duas implementações com a
+# mesma interface:
+#   * MemoryStateStore: em processo, LRU + TTL (padrão, mais rápido)
+#   * SQLiteStateStore: tabela `conversation_state` no clinic.db; sobrevive a
+#     reinícios e é compartilhado entre workers do uvicorn (--workers N)
+# Escolha com STATE_BACKEND=memory|sqlite. Os valores são SessionState
+# (session_state.py): etapa + IDs, gravados no SQLite na forma compacta to_json().
+# Dentro do event loop use get_async/set_async/delete_async: no SQLite elas
+# rodam no pool de threads do db.py (a gravação disputa o lock de escrita do
+# WAL com as reservas, a fila e a geração de horários e pode esperar o
+# busy_timeout). get/set/delete continuam síncronas para scripts e benchmarks.
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+# Sessões sem mensagem há mais tempo que isso são descartadas
+STATE_TTL_SECONDS = float(os.getenv("STATE_TTL_SECONDS", "1800"))
+# Limite de sessões guardadas em memória (as menos usadas saem primeiro)
+STATE_MAX_SESSIONS = int(os.getenv("STATE_MAX_SESSIONS", "10000"))
+
+
+class KeyedLock:
+    """
+    Um asyncio.Lock por chave (chat), criado sob demanda e descartado quando
+    ninguém mais está usando. Serializa mensagens simultâneas do mesmo chat.
+    """
+
+    def __init__(self):
+        self._locks: dict[str, list] = {}  # chave -> [lock, usuarios]
+
+    @asynccontextmanager
+    async def __call__(self, key: str):
+        entrada = self._locks.get(key)
+        if entrada is None:
+            entrada = self._locks[key] = [asyncio.Lock(), 0]
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                yield
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                self._locks.pop(key, None)
+
+
+class StateStore:
+    """Interface comum dos armazenamentos de estado."""
+
+    def __init__(self):
+        self.lock = KeyedLock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, chave: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[chave] += n
+
+    def get(self, key: str) -> SessionState | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: SessionState) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    # Versões para o event loop; os armazenamentos que fazem I/O sobrescrevem
+    async def get_async(self, key: str) -> SessionState | None:
+        return self.get(key)
+
+    async def set_async(self, key: str, value: SessionState) -> None:
+        self.set(key, value)
+
+    async def delete_async(self, key: str) -> None:
+        self.delete(key)
+
+    def metrics(self) -> dict:
+        """Tamanho, acertos/erros, taxa de acerto e evicções."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        consultas = stats["hits"] + stats["misses"]
+        stats["size"] = len(self)
+        stats["hit_rate"] = stats["hits"] / consultas if consultas else 0.0
+        return stats
+
+
+class MemoryStateStore(StateStore):
+    """LRU com TTL em memória (por processo)."""
+
+    # A cada quantas gravações as sessões vencidas são varridas
+    PURGE_EVERY = 500
+
+    def __init__(self, max_entries: int = STATE_MAX_SESSIONS, ttl_seconds: float = STATE_TTL_SECONDS):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: OrderedDict[str, tuple[float, SessionState]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key: str) -> SessionState | None:
+        with self._lock:
+            entrada = self._data.get(key)
+            if entrada is not None and entrada[0] < time.monotonic():
+                del self._data[key]
+                entrada = None
+                self._count("evictions")
+            if entrada is None:
+                self._count("misses")
+                return None
+            # Expiração deslizante: cada acesso renova o TTL e move a sessão para o fim do LRU
+            # (assim o começo do OrderedDict tem sempre as sessões que vencem primeiro)
+            self._data[key] = (time.monotonic() + self.ttl_seconds, entrada[1])
+            self._data.move_to_end(key)
+        self._count("hits")
+        return entrada[1]
+
+    def set(self, key: str, value: SessionState) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            excedente = len(self._data) - self.max_entries
+            for _ in range(max(0, excedente)):
+                self._data.popitem(last=False)
+            self._writes += 1
+        if excedente > 0:
+            self._count("evictions", excedente)
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def purge_expired(self) -> int:
+        """Remove as sessões vencidas (as mais antigas ficam no começo do LRU)."""
+        agora = time.monotonic()
+        removidas = 0
+        with self._lock:
+            for key in list(self._data):
+                if self._data[key][0] >= agora:
+                    break
+                del self._data[key]
+                removidas += 1
+        self._count("evictions", removidas)
+        return removidas
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Estado persistido na tabela `conversation_state` (migração 005).
+    As versões async rodam no pool de threads do banco (a gravação pode
+    esperar o lock de escrita e a limpeza dos vencidos varre a tabela).
+    Limite com vários workers: o lock por chat é por processo. As mensagens
+    do Telegram chegam em ordem pela fila durável (job_queue.py só entrega um
+    job por chat de cada vez, em qualquer processo), mas duas mensagens
+    simultâneas do mesmo chat pelo /chat em workers diferentes podem ler o
+    mesmo estado e a última gravação vence.
+    """
+
+    # A cada quantas gravações os registros vencidos são apagados
+    PURGE_EVERY = 500
+
+    def __init__(self, ttl_seconds: float = STATE_TTL_SECONDS):
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        self._writes = 0
+
+    def get(self, key: str) -> SessionState | None:
+        result = get_connection().execute(
+            "SELECT valor, expira_em FROM conversation_state WHERE chave = ?", (key,)
+        ).fetchone()
+        if result and result[1] < time.time():
+            self.delete(key)
+            self._count("evictions")
+            result = None
+        if not result:
+            self._count("misses")
+            return None
+        try:
+            estado = SessionState.from_json(result[0])
+        except ValueError:
+            # Registro no formato antigo (dicionário com o texto mostrado): a conversa recomeça
+            logger.warning("ESTADO: Registro de '%s' em formato antigo descartado", key)
+            self.delete(key)
+            self._count("misses")
+            return None
+        self._count("hits")
+        return estado
+
+    def set(self, key: str, value: SessionState) -> None:
+        get_connection().execute(
+            "INSERT OR REPLACE INTO conversation_state (chave, valor, expira_em) VALUES (?, ?, ?)",
+            (key, value.to_json(), time.time() + self.ttl_seconds)
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def delete(self, key: str) -> None:
+        get_connection().execute("DELETE FROM conversation_state WHERE chave = ?", (key,))
+
+    def purge_expired(self) -> int:
+        removidas = get_connection().execute(
+            "DELETE FROM conversation_state WHERE expira_em < ?", (time.time(),)
+        ).rowcount
+        self._count("evictions", removidas)
+        return removidas
+
+    def __len__(self) -> int:
+        return get_connection().execute("SELECT COUNT(*) FROM conversation_state").fetchone()[0]
+
+    async def get_async(self, key: str) -> SessionState | None:
+        return await run_in_db_thread(self.get, key)
+
+    async def set_async(self, key: str, value: SessionState) -> None:
+        await run_in_db_thread(self.set, key, value)
+
+    async def delete_async(self, key: str) -> None:
+        await run_in_db_thread(self.delete, key)
+
+
+def create_state_store(backend: str = STATE_BACKEND) -> StateStore:
+    """Cria o armazenamento configurado em STATE_BACKEND."""
+    if backend == "sqlite":
+        return SQLiteStateStore()
+    if backend != "memory":
+        logger.warning("STATE_BACKEND '%s' desconhecido. Usando 'memory'.", backend)
+    return MemoryStateStore()
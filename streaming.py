@@ -0,0 +1,93 @@
+import re
+
+# --- Streaming da Resposta da IA ---
+# O Gemini devolve um JSON (response_mime_type="application/json"); com
+# stream=True ele chega em pedaços. O ReplyFieldStreamer lê esses pedaços e
+# libera, assim que chegam, só os caracteres de `resposta_para_usuario` — e só
+# quando `acao_requerida` é RESPONDER_AO_USUARIO (o texto de uma chamada que
+# pede ferramenta nunca vai para o usuário). O JSON completo continua sendo
+# lido no final, como antes.
+
+CAMPO_RESPOSTA = "resposta_para_usuario"
+ACAO_RESPOSTA = "RESPONDER_AO_USUARIO"
+ACAO_RE = re.compile(r'"acao_requerida"\s*:\s*"([A-Z_]*)"')
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class ReplyFieldStreamer:
+    """
+    Decodifica incrementalmente o valor string de `campo` num JSON que chega
+    em pedaços. `feed(pedaco)` retorna o texto novo que pode ir para o usuário.
+    """
+
+    def __init__(self, campo: str = CAMPO_RESPOSTA):
+        self.texto = ""  # JSON bruto recebido até agora
+        self._campo_re = re.compile(r'"' + re.escape(campo) + r'"\s*:\s*"')
+        self._pos = None  # posição do próximo caractere do valor no `texto`
+        self._fim = False
+        self._acao = None
+        self._decodificado = ""  # valor do campo decodificado até agora
+        self._liberado = 0  # quanto de `_decodificado` já foi devolvido
+
+    def feed(self, pedaco: str) -> str:
+        self.texto += pedaco
+        if self._acao is None:
+            achou = ACAO_RE.search(self.texto)
+            if achou:
+                self._acao = achou.group(1)
+        if self._pos is None:
+            achou = self._campo_re.search(self.texto)
+            if achou:
+                self._pos = achou.end()
+        if self._pos is not None and not self._fim:
+            self._decodificar()
+        # Sem saber a ação ainda, o texto fica guardado até ela aparecer
+        if self._acao != ACAO_RESPOSTA:
+            return ""
+        novo = self._decodificado[self._liberado:]
+        self._liberado = len(self._decodificado)
+        return novo
+
+    def _decodificar(self) -> None:
+        texto, i, partes = self.texto, self._pos, []
+        while i < len(texto):
+            c = texto[i]
+            if c == '"':
+                self._fim = True
+                i += 1
+                break
+            if c != "\\":
+                partes.append(c)
+                i += 1
+                continue
+            # Escape incompleto no fim do pedaço: espera o próximo
+            if i + 1 >= len(texto):
+                break
+            marcador = texto[i + 1]
+            if marcador != "u":
+                partes.append(ESCAPES.get(marcador, marcador))
+                i += 2
+                continue
+            if i + 6 > len(texto):
+                break
+            codigo = int(texto[i + 2:i + 6], 16)
+            if 0xD800 <= codigo < 0xDC00:
+                # Par substituto (emoji etc.): precisa das duas metades
+                if i + 12 > len(texto):
+                    break
+                baixo = int(texto[i + 8:i + 12], 16)
+                partes.append(chr(0x10000 + ((codigo - 0xD800) << 10) + (baixo - 0xDC00)))
+                i += 12
+            else:
+                partes.append(chr(codigo))
+                i += 6
+        self._pos = i
+        self._decodificado += "".join(partes)
+
+
+def texto_do_pedaco(pedaco) -> str:
+    """Texto de um pedaço do stream (pedaços sem texto, como o de fim, viram "")."""
+    try:
+        return pedaco.text or ""
+    except ValueError:
+        return ""
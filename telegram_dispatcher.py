@@ -0,0 +1,313 @@
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import tracing
+from config import TELEGRAM_BOT_TOKEN
+
+logger = logging.getLogger(__name__)
+
+# --- Despachante de Mensagens do Telegram ---
+# Todas as respostas do bot saem por aqui:
+#   * uma requests.Session com pool de conexões keep-alive (sem novo TCP+TLS a cada envio)
+#   * timeouts explícitos de conexão e leitura
+#   * limite de envio por chat e global (token bucket), respeitando os limites do Telegram
+#   * 429 "Too Many Requests": espera o `retry_after` informado e tenta de novo
+#   * fila limitada: se encher, quem enfileira espera (backpressure) até ENQUEUE_TIMEOUT
+#   * mensagens pendentes do mesmo chat são agrupadas num único envio (até 4096 caracteres)
+# A ordem das mensagens de um mesmo chat é sempre preservada.
+
+# Base da API (troque para apontar para um servidor falso nos testes/benchmarks)
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+# Timeouts (segundos) de conexão e de leitura de cada chamada HTTP
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT_SECONDS = float(os.getenv("TELEGRAM_READ_TIMEOUT", "10"))
+# Limites do Telegram: ~30 mensagens/s no total e ~1 mensagem/s por chat
+GLOBAL_RATE_PER_SECOND = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+CHAT_RATE_PER_SECOND = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "1"))
+# Envios simultâneos (tamanho do pool HTTP) e tamanho máximo da fila
+SENDER_WORKERS = int(os.getenv("TELEGRAM_SENDER_WORKERS", "8"))
+MAX_PENDING = int(os.getenv("TELEGRAM_MAX_PENDING", "1000"))
+ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("TELEGRAM_ENQUEUE_TIMEOUT", "5"))
+# Tentativas por envio (429, 5xx e erros de rede)
+MAX_TENTATIVAS = 5
+BACKOFF_BASE_SECONDS = 0.5
+# Tamanho máximo de uma mensagem no Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+
+def dividir_texto(texto: str, limite: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Quebra textos maiores que o limite do Telegram, de preferência em quebras de linha."""
+    partes = []
+    while len(texto) > limite:
+        corte = texto.rfind("\n", 0, limite)
+        if corte <= 0:
+            corte = limite
+        partes.append(texto[:corte])
+        texto = texto[corte:].lstrip("\n")
+    partes.append(texto)
+    return partes
+
+
+class TokenBucket:
+    """Balde de fichas: `rate` fichas por segundo, acumulando no máximo `capacity`."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _repor(self, agora: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (agora - self.updated) * self.rate)
+        self.updated = agora
+
+    def reservar(self) -> float:
+        """Consome uma ficha e retorna quantos segundos esperar até ela valer (0 se já valia)."""
+        agora = time.monotonic()
+        self._repor(agora)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pausar(self, segundos: float) -> None:
+        """Bloqueia o balde por `segundos` (usado quando o Telegram responde 429)."""
+        agora = time.monotonic()
+        self._repor(agora)
+        self.tokens = min(self.tokens, 0) - segundos * self.rate
+
+
+class TelegramDispatcher:
+    """
+    Fila de envio com workers assíncronos. Use `await send(chat_id, texto)` de
+    dentro do event loop; `start()`/`stop()` ficam no ciclo de vida do servidor
+    (o primeiro `send` também inicia os workers, se preciso).
+    """
+
+    def __init__(self, token: str | None = TELEGRAM_BOT_TOKEN, api_base: str = TELEGRAM_API_BASE,
+                 workers: int = SENDER_WORKERS, max_pending: int = MAX_PENDING):
+        self.token = token
+        self.api_base = api_base.rstrip("/")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+        self._http_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="telegram")
+        self._global_bucket = TokenBucket(GLOBAL_RATE_PER_SECOND, GLOBAL_RATE_PER_SECOND)
+        self._chat_buckets: dict[str, TokenBucket] = {}
+        self._pendentes: dict[str, deque] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._stats = {"mensagens": 0, "envios": 0, "agrupadas": 0, "retentativas_429": 0,
+                       "retentativas_erro": 0, "falhas": 0, "descartadas": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, chave: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[chave] += n
+
+    @property
+    def url(self) -> str:
+        return f"{self.api_base}/bot{self.token}/sendMessage"
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> None:
+        """Cria a fila e os workers no event loop atual."""
+        if self._tasks:
+            return
+        self._prontos: asyncio.Queue = asyncio.Queue()  # chats com mensagens esperando
+        self._vagas = asyncio.Semaphore(self.max_pending)
+        self._pendentes.clear()
+        # Contexto vazio: os workers não herdam o span do turno que chamou start()
+        self._tasks = [contextvars.Context().run(asyncio.create_task, self._worker()) for _ in range(self.workers)]
+        logger.info("TELEGRAM: Despachante iniciado (%s workers, fila de %s)", self.workers, self.max_pending)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Espera a fila esvaziar (até `timeout`) e encerra os workers."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._prontos.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%s mensagem(ns) do Telegram não enviadas no desligamento.", self.pending())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def pending(self) -> int:
+        return sum(len(fila) for fila in self._pendentes.values())
+
+    # --- Enfileiramento ---
+
+    async def send(self, chat_id, texto: str) -> bool:
+        """
+        Enfileira a mensagem. Se a fila estiver cheia, espera por uma vaga até
+        ENQUEUE_TIMEOUT_SECONDS; depois disso a mensagem é descartada (retorna False).
+        """
+        if not self._tasks:
+            self.start()
+        chave = str(chat_id)
+        partes = dividir_texto(texto)
+        # O span do turno vai junto para o envio virar filho dele no trace
+        span_do_turno = tracing.current_span()
+        for parte in partes:
+            try:
+                await asyncio.wait_for(self._vagas.acquire(), ENQUEUE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                self._count("descartadas")
+                logger.error("Fila do Telegram cheia. Mensagem para o Chat ID %s descartada.", chave)
+                return False
+            fila = self._pendentes.get(chave)
+            if fila is None:
+                # Chat sem mensagens pendentes: entra na fila de prontos
+                fila = self._pendentes[chave] = deque()
+                self._prontos.put_nowait(chave)
+            fila.append((parte, span_do_turno, time.monotonic()))
+            self._count("mensagens")
+        return True
+
+    # --- Envio ---
+
+    def _bucket_do_chat(self, chave: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chave)
+        if bucket is None:
+            bucket = self._chat_buckets[chave] = TokenBucket(CHAT_RATE_PER_SECOND, CHAT_BURST)
+            # Os baldes cheios (sem uso recente) não guardam estado útil: limpa de vez em quando
+            if len(self._chat_buckets) > 10 * self.max_pending:
+                self._limpar_buckets()
+        return bucket
+
+    def _limpar_buckets(self) -> None:
+        agora = time.monotonic()
+        for chave, bucket in list(self._chat_buckets.items()):
+            if chave not in self._pendentes and bucket.tokens + (agora - bucket.updated) * bucket.rate >= bucket.capacity:
+                del self._chat_buckets[chave]
+
+    def _agrupar(self, fila: deque) -> tuple[str, int, object, float]:
+        """
+        Junta as mensagens pendentes do chat num só envio, sem passar do limite.
+        Retorna também o span e a hora de entrada da primeira (para o trace).
+        """
+        texto, span_do_turno, enfileirada_em = fila.popleft()
+        quantidade = 1
+        while fila and len(texto) + 2 + len(fila[0][0]) <= MAX_MESSAGE_LENGTH:
+            texto += "\n\n" + fila.popleft()[0]
+            quantidade += 1
+        return texto, quantidade, span_do_turno, enfileirada_em
+
+    async def _worker(self) -> None:
+        while True:
+            chave = await self._prontos.get()
+            try:
+                await self._atender_chat(chave)
+            except Exception as e:
+                logger.error("Falha inesperada no despachante do Telegram (Chat ID %s): %s", chave, e)
+            finally:
+                self._prontos.task_done()
+
+    async def _atender_chat(self, chave: str) -> None:
+        # Respeita o limite do chat e o global antes de montar o envio (enquanto
+        # espera, novas mensagens do mesmo chat ainda podem entrar no grupo)
+        for bucket in (self._bucket_do_chat(chave), self._global_bucket):
+            espera = bucket.reservar()
+            if espera > 0:
+                await asyncio.sleep(espera)
+
+        fila = self._pendentes[chave]
+        texto, quantidade, span_do_turno, enfileirada_em = self._agrupar(fila)
+        if quantidade > 1:
+            self._count("agrupadas", quantidade - 1)
+        espera_fila_ms = round((time.monotonic() - enfileirada_em) * 1000, 3)
+        try:
+            with tracing.span("telegram.send", pai=span_do_turno, chat_id=chave, agrupadas=quantidade,
+                              espera_fila_ms=espera_fila_ms) as span_envio:
+                resultado, tentativas = await self._enviar_com_retentativas(chave, texto)
+                span_envio.set(resultado=resultado, tentativas=tentativas)
+        finally:
+            for _ in range(quantidade):
+                self._vagas.release()
+            # Ainda sobrou mensagem? O chat volta para o fim da fila (justiça entre chats)
+            if fila:
+                self._prontos.put_nowait(chave)
+            else:
+                del self._pendentes[chave]
+
+    async def _enviar_com_retentativas(self, chave: str, texto: str) -> tuple[str, int]:
+        """Envia com retentativas; retorna o resultado ("enviada", "recusada" ou "falhou") e as tentativas."""
+        loop = asyncio.get_running_loop()
+        for tentativa in range(MAX_TENTATIVAS):
+            self._count("envios")
+            try:
+                response = await loop.run_in_executor(self._http_executor, self._post, chave, texto)
+            except requests.exceptions.RequestException as e:
+                logger.warning("TELEGRAM: Erro de rede ao enviar para %s (tentativa %s): %s", chave, tentativa + 1, e)
+                self._count("retentativas_erro")
+                await asyncio.sleep(random.uniform(0, BACKOFF_BASE_SECONDS * (2 ** tentativa)))
+                continue
+
+            if response.status_code == 429:
+                retry_after = self._retry_after(response)
+                logger.warning("TELEGRAM: 429 para o Chat ID %s. Aguardando %ss", chave, retry_after)
+                self._count("retentativas_429")
+                # Sem saber se o limite estourado foi o do chat ou o global, pausa os dois
+                self._bucket_do_chat(chave).pausar(retry_after)
+                self._global_bucket.pausar(retry_after)
+                await asyncio.sleep(retry_after)
+                continue
+
+            if response.status_code >= 500:
+                self._count("retentativas_erro")
+                await asyncio.sleep(random.uniform(0, BACKOFF_BASE_SECONDS * (2 ** tentativa)))
+                continue
+
+            if response.status_code >= 400:
+                # Erro definitivo (chat inexistente, bot bloqueado...): não adianta repetir
+                self._count("falhas")
+                logger.error("Telegram recusou a mensagem para o Chat ID %s: %s %s", chave, response.status_code, response.text)
+                return "recusada", tentativa + 1
+
+            logger.debug("Mensagem enviada para o Chat ID %s", chave)
+            return "enviada", tentativa + 1
+
+        self._count("falhas")
+        logger.error("Mensagem para o Chat ID %s não foi enviada após %s tentativas.", chave, MAX_TENTATIVAS)
+        return "falhou", MAX_TENTATIVAS
+
+    def _post(self, chave: str, texto: str) -> requests.Response:
+        return self.session.post(
+            self.url,
+            json={"chat_id": chave, "text": texto},
+            timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+        )
+
+    @staticmethod
+    def _retry_after(response: requests.Response) -> float:
+        try:
+            return float(response.json().get("parameters", {}).get("retry_after", 1))
+        except ValueError:
+            return float(response.headers.get("Retry-After", 1))
+
+    def metrics(self) -> dict:
+        """Contadores de envio e tamanho atual da fila."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pendentes"] = self.pending()
+        return stats
+
+
+# Despachante padrão usado pelo servidor
+DISPATCHER = TelegramDispatcher()
@@ -1,28 +1,34 @@
+import logging
+
 import requests
-from config import TELEGRAM_BOT_TOKEN # Importa o token do nosso novo config
+from telegram_dispatcher import CONNECT_TIMEOUT_SECONDS, DISPATCHER, READ_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
 
 def send_telegram_message(chat_id, message_text):
     """
     Envia uma mensagem de texto simples para o usuário via API do Telegram.
-    (Esta é a mesma função que estava no main.py)
+    Versão síncrona e direta (para scripts): reaproveita a sessão HTTP do
+    despachante e tem timeout, mas não passa pela fila nem pelo limite de envio.
     """
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    headers = {"Content-Type": "application/json"}
+    url = DISPATCHER.url
     payload = {"chat_id": chat_id, "text": message_text}
 
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = DISPATCHER.session.post(url, json=payload, timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS))
         response.raise_for_status() 
-        print(f"--- Mensagem enviada para o Chat ID {chat_id} ---")
-        print(f"Conteúdo: {message_text}")
-        print(f"Resposta do Telegram: {response.json()}")
-        print("-----------------------------------------")
+        logger.info("Mensagem enviada para o Chat ID %s", chat_id)
+        logger.debug("Conteúdo: %s | Resposta do Telegram: %s", message_text, response.json())
     except requests.exceptions.RequestException as e:
-        print(f"================================================================")
-        print(f"ERRO FATAL AO TENTAR ENVIAR MENSAGEM (Telegram):")
-        print(f"Tipo exato do Erro: {type(e)}")
-        print(f"Mensagem de Erro completa: {e}")
-        print(f"================================================================")
+        logger.error("Falha ao enviar mensagem (Telegram) - %s: %s", type(e).__name__, e)
+
+async def send_telegram_message_async(chat_id, message_text) -> bool:
+    """
+    Envio usado pelo servidor: entrega a mensagem ao despachante
+    (telegram_dispatcher.py), que cuida do pool HTTP, dos limites de envio do
+    Telegram e das retentativas. Retorna False se a fila estiver cheia.
+    """
+    return await DISPATCHER.send(chat_id, message_text)
 
 def parse_webhook_data(request_data: dict) -> tuple[str | None, str | None]:
     """
@@ -36,4 +42,9 @@ def parse_webhook_data(request_data: dict) -> tuple[str | None, str | None]:
         user_message = request_data["message"]["text"]
         user_chat_id = request_data["message"]["chat"]["id"]
 
-    return user_chat_id, user_message
\ No newline at end of file
+    return user_chat_id, user_message
+
+def parse_update_id(request_data: dict) -> int | None:
+    """Retorna a `update_id` da atualização (None se não vier)."""
+    update_id = request_data.get("update_id")
+    return update_id if isinstance(update_id, int) else None
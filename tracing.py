@@ -0,0 +1,261 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+# --- Rastreamento por Turno (spans) e Logs Amostrados ---
+# Cada turno vira um trace com um span por etapa (leitura do estado, Chamada 1
+# ao Gemini, ferramenta, Chamada 2, envio ao Telegram), com duração e
+# atributos como tokens. Os spans terminados vão para uma fila e uma thread
+# os exporta em lote, fora do caminho da requisição:
+#   TRACE_EXPORTER=jsonl -> uma linha JSON por span em TRACE_FILE
+#   TRACE_EXPORTER=http  -> POST de listas de spans em TRACE_COLLECTOR_URL
+#   vazio (padrão)       -> sem rastreamento (os spans não são nem criados)
+# O span atual fica num contextvar, então tarefas asyncio criadas dentro do
+# turno herdam o pai certo. Os logs DEBUG (payloads completos) só saem para
+# a fração LOG_SAMPLE_RATE dos turnos, sorteada junto com o trace.
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "").strip().lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_MAX_PENDING = 10000
+TRACE_BATCH_SIZE = 200
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+logger = logging.getLogger(__name__)
+
+_span_atual = contextvars.ContextVar("span_atual", default=None)
+_logs_verbosos = contextvars.ContextVar("logs_verbosos", default=True)
+
+
+def _novo_id(bits: int) -> str:
+    # IDs só precisam ser únicos, não secretos: evita um os.urandom por span
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """Uma etapa do turno: nome, pai, início, duração e atributos."""
+
+    __slots__ = ("nome", "trace_id", "span_id", "parent_id", "inicio", "_t0", "duracao_ms", "status", "atributos")
+
+    def __init__(self, nome: str, trace_id: str, parent_id: str | None, atributos: dict):
+        self.nome = nome
+        self.trace_id = trace_id
+        self.span_id = _novo_id(64)
+        self.parent_id = parent_id
+        self.inicio = time.time()
+        self._t0 = time.perf_counter()
+        self.duracao_ms = None
+        self.status = "ok"
+        self.atributos = atributos
+
+    def set(self, **atributos) -> None:
+        self.atributos.update(atributos)
+
+    def _terminar(self) -> None:
+        self.duracao_ms = round((time.perf_counter() - self._t0) * 1000, 3)
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, "nome": self.nome,
+            "inicio": self.inicio, "duracao_ms": self.duracao_ms, "status": self.status, "atributos": self.atributos,
+        }
+
+
+class _SpanNulo:
+    """Span de um turno não amostrado: aceita atributos e não registra nada."""
+
+    def set(self, **atributos) -> None:
+        pass
+
+
+NULL_SPAN = _SpanNulo()
+
+
+# --- Exportação ---
+
+class _Exportador:
+    """Fila limitada + thread que grava os spans em lote (JSON lines ou coletor HTTP)."""
+
+    def __init__(self, destino: str):
+        self.destino = destino
+        self._fila = queue.Queue(maxsize=TRACE_MAX_PENDING)
+        self._stats = {"exportados": 0, "descartados": 0, "erros": 0}
+        self._stats_lock = threading.Lock()
+        self._session = requests.Session() if destino == "http" else None
+        threading.Thread(target=self._loop, name="trace-exporter", daemon=True).start()
+
+    def _count(self, chave: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[chave] += n
+
+    def exportar(self, span: Span) -> None:
+        try:
+            self._fila.put_nowait(span.as_dict())
+        except queue.Full:
+            # Melhor perder spans do que segurar o turno
+            self._count("descartados")
+
+    def _loop(self) -> None:
+        while True:
+            lote = [self._fila.get()]
+            while len(lote) < TRACE_BATCH_SIZE:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._gravar(lote)
+                self._count("exportados", len(lote))
+            except Exception as e:
+                self._count("erros")
+                logger.warning("Falha ao exportar %d spans: %s", len(lote), e)
+            finally:
+                for _ in lote:
+                    self._fila.task_done()
+
+    def _gravar(self, lote: list[dict]) -> None:
+        if self.destino == "http":
+            self._session.post(TRACE_COLLECTOR_URL, json=lote, timeout=(2, 5)).raise_for_status()
+            return
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(span, ensure_ascii=False, default=str) + "\n" for span in lote))
+
+    def flush(self) -> None:
+        self._fila.join()
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pendentes"] = self._fila.qsize()
+        return stats
+
+
+def _criar_exportador():
+    if TRACE_EXPORTER not in ("jsonl", "http"):
+        if TRACE_EXPORTER:
+            logger.warning("TRACE_EXPORTER '%s' desconhecido; rastreamento desligado.", TRACE_EXPORTER)
+        return None
+    if TRACE_EXPORTER == "http" and not TRACE_COLLECTOR_URL:
+        logger.warning("TRACE_EXPORTER=http sem TRACE_COLLECTOR_URL; rastreamento desligado.")
+        return None
+    return _Exportador(TRACE_EXPORTER)
+
+
+EXPORTER = _criar_exportador()
+
+
+# --- API de Spans ---
+
+def current_span():
+    """Span atual (para passar como pai a trabalho que roda fora do contexto, ex: o despachante)."""
+    return _span_atual.get()
+
+
+@contextmanager
+def span(nome: str, pai=None, **atributos):
+    """
+    Span filho do span atual (ou de `pai`). Fora de um trace amostrado devolve
+    NULL_SPAN e não custa nada além da checagem.
+    """
+    pai = pai if pai is not None else _span_atual.get()
+    if pai is None or pai is NULL_SPAN or EXPORTER is None:
+        yield NULL_SPAN
+        return
+    atual = Span(nome, pai.trace_id, pai.span_id, atributos)
+    token = _span_atual.set(atual)
+    try:
+        yield atual
+    except BaseException as e:
+        atual.status = "erro"
+        atual.atributos["erro"] = type(e).__name__
+        raise
+    finally:
+        _span_atual.reset(token)
+        atual._terminar()
+        EXPORTER.exportar(atual)
+
+
+@contextmanager
+def start_trace(nome: str, **atributos):
+    """
+    Começa o trace de um turno (ou vira um span filho, se já houver um trace
+    em andamento). Sorteia aqui se o turno é rastreado (TRACE_SAMPLE_RATE) e
+    se os seus logs DEBUG saem (LOG_SAMPLE_RATE).
+    """
+    if _span_atual.get() is not None:
+        with span(nome, **atributos) as atual:
+            yield atual
+        return
+
+    token_logs = _logs_verbosos.set(LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE)
+    if EXPORTER is None or random.random() >= TRACE_SAMPLE_RATE:
+        token = _span_atual.set(NULL_SPAN)
+        try:
+            yield NULL_SPAN
+        finally:
+            _span_atual.reset(token)
+            _logs_verbosos.reset(token_logs)
+        return
+
+    raiz = Span(nome, _novo_id(128), None, atributos)
+    token = _span_atual.set(raiz)
+    try:
+        yield raiz
+    except BaseException as e:
+        raiz.status = "erro"
+        raiz.atributos["erro"] = type(e).__name__
+        raise
+    finally:
+        _span_atual.reset(token)
+        _logs_verbosos.reset(token_logs)
+        raiz._terminar()
+        EXPORTER.exportar(raiz)
+
+
+def flush() -> None:
+    """Espera os spans pendentes serem exportados (desligamento, benchmarks)."""
+    if EXPORTER:
+        EXPORTER.flush()
+
+
+def metrics() -> dict:
+    if EXPORTER is None:
+        return {"exportador": None}
+    return {"exportador": EXPORTER.destino, "taxa_de_amostragem": TRACE_SAMPLE_RATE, **EXPORTER.metrics()}
+
+
+# --- Logs ---
+
+class _LogsAmostrados(logging.Filter):
+    """Deixa passar DEBUG só nos turnos sorteados para logs verbosos."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or _logs_verbosos.get()
+
+
+def configure_logging() -> None:
+    """
+    Configura os logs do servidor: nível LOG_LEVEL na saída padrão, com os
+    DEBUG limitados aos turnos amostrados. Chamar uma vez na subida.
+    """
+    raiz = logging.getLogger()
+    if any(isinstance(f, _LogsAmostrados) for h in raiz.handlers for f in h.filters):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(_LogsAmostrados())
+    raiz.addHandler(handler)
+    raiz.setLevel(LOG_LEVEL)